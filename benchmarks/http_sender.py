@@ -0,0 +1,66 @@
+"""
+Benchmark sending the verification codes via an HTTP gateway.
+
+Compares opening a new connection for each code to reusing the pooled
+keep-alive connections.  The gateway is the local stub server of the
+tests, which can simulate the connection setup latency of a remote
+gateway with ``--latency``.
+
+Run from the repository root with:
+
+    python benchmarks/http_sender.py [--number N] [--latency SECONDS]
+"""
+
+import argparse
+import datetime
+import os
+import sys
+import time
+
+import django
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_settings")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.005)
+    args = parser.parse_args()
+
+    django.setup()
+    from django.contrib.auth import get_user_model
+
+    from drf_jwt_2fa.sending import (
+        close_http_connection_pools,
+        send_verification_code_via_http,
+    )
+    from drf_jwt_2fa.tests.stub_gateway import StubGateway
+    from drf_jwt_2fa.tests.utils import OverrideJwt2faSettings
+
+    # An unsaved user, whose e-mail address is the recipient
+    user = get_user_model()(email="user@example.com")
+    for name, pool_size in [("new connections", 0), ("pooled", 4)]:
+        with (
+            StubGateway(connect_delay=args.latency) as gateway,
+            OverrideJwt2faSettings(
+                HTTP_SENDER_URL=gateway.url,
+                HTTP_SENDER_POOL_SIZE=pool_size,
+                HTTP_SENDER_RECIPIENT_FIELD="email",
+                HTTP_SENDER_READ_TIMEOUT=datetime.timedelta(seconds=10),
+            ),
+        ):
+            start = time.perf_counter()
+            for _i in range(args.number):
+                send_verification_code_via_http(user, "1234567")
+            duration = time.perf_counter() - start
+            close_http_connection_pools()
+        print(
+            f"{name:16s} {duration / args.number * 1e3:6.2f} ms per code,"
+            f" {gateway.connection_count} connections"
+        )
+
+
+if __name__ == "__main__":
+    main()
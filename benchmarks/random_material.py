@@ -0,0 +1,55 @@
+"""
+Benchmark the generation of the random values of a code token.
+
+Compares drawing the verification code, the nonce and the jti with
+separate ``get_random_string`` and ``secrets.token_urlsafe`` calls to
+deriving them from a single block of ``RandomMaterial``.
+
+Run from the repository root with:
+
+    python benchmarks/random_material.py [--number N]
+"""
+
+import argparse
+import os
+import secrets
+import sys
+import timeit
+
+import django
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_settings")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=100_000)
+    args = parser.parse_args()
+
+    django.setup()
+    from django.utils.crypto import get_random_string
+
+    from drf_jwt_2fa.random_material import RandomMaterial
+
+    def separate_calls() -> None:
+        get_random_string(7, "0123456789")
+        get_random_string(10)
+        secrets.token_urlsafe(16)
+
+    def random_material() -> None:
+        material = RandomMaterial()
+        material.get_string(7, "0123456789")
+        material.get_string(10)
+        material.get_token_urlsafe(16)
+
+    for name, func in [
+        ("separate calls", separate_calls),
+        ("random material", random_material),
+    ]:
+        duration = min(timeit.repeat(func, number=args.number, repeat=5))
+        print(f"{name:16s} {duration / args.number * 1e6:6.2f} us per token")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Benchmark the cache memory used for the used code token markers.
+
+Compares the default scheme, which stores a cache key per used code
+token, to the Bloom filter based scheme enabled with the
+``USED_TOKEN_FILTER_CAPACITY`` setting.  The logins are simulated by
+reserving code tokens, which all expire within the same
+``CODE_EXPIRATION_TIME``, and the results are scaled to a million
+logins.
+
+The memory is estimated as the size of the keys and the pickled values
+stored to a local memory cache plus a fixed per-key overhead, which
+depends on the cache server (e.g. Redis uses roughly 50-100 bytes for
+the bookkeeping of each key).
+
+Run from the repository root with:
+
+    python benchmarks/used_token_memory.py [--logins N]
+"""
+
+import argparse
+import os
+import secrets
+import sys
+import time
+
+import django
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_settings")
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "used-token-memory-benchmark",
+        "OPTIONS": {"MAX_ENTRIES": 10**9},
+    },
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=100_000)
+    parser.add_argument("--per-key-overhead", type=int, default=64)
+    args = parser.parse_args()
+
+    django.setup()
+    from django.core.cache import cache
+    from django.test import override_settings
+
+    from drf_jwt_2fa.settings import api_settings
+
+    scale = 1_000_000 / args.logins
+    print(f"Simulating {args.logins} logins")
+    print(f"Assumed per-key overhead: {args.per_key_overhead} bytes")
+    print()
+    schemes = [
+        ("per-key markers", {}),
+        ("bloom, error rate 1e-9", {"USED_TOKEN_FILTER_ERROR_RATE": 1e-9}),
+        ("bloom, error rate 1e-6", {"USED_TOKEN_FILTER_ERROR_RATE": 1e-6}),
+    ]
+    for name, extra_settings in schemes:
+        if extra_settings:
+            extra_settings["USED_TOKEN_FILTER_CAPACITY"] = args.logins
+        with override_settings(CACHES=CACHES, JWT2FA_AUTH=extra_settings):
+            api_settings.reload()
+            cache.clear()
+            start = time.perf_counter()
+            rejected = reserve_tokens(args.logins)
+            duration = time.perf_counter() - start
+            (num_keys, num_bytes) = get_cache_usage(cache)
+            cache.clear()
+        api_settings.reload()
+        total = num_bytes + num_keys * args.per_key_overhead
+        print(
+            f"{name:24s}"
+            f" keys: {num_keys:>7d}"
+            f"  memory per 1M logins: {total * scale / 2**20:6.1f} MiB"
+            f"  time per login: {duration / args.logins * 1e6:5.1f} us"
+            f"  false rejections: {rejected}"
+        )
+
+
+def reserve_tokens(count: int) -> int:
+    from drf_jwt_2fa.exceptions import TokenAlreadyUsedError
+    from drf_jwt_2fa.token_manager import CodeTokenManager
+
+    manager = CodeTokenManager()
+    expires_at = int(time.time()) + 300
+    rejected = 0
+    for _ in range(count):
+        payload = {"jti": secrets.token_urlsafe(16), "exp": expires_at}
+        try:
+            manager._reserve_token(payload)  # type: ignore[arg-type]
+        except TokenAlreadyUsedError:
+            rejected += 1
+    return rejected
+
+
+def get_cache_usage(cache: object) -> tuple[int, int]:
+    stored = cache._cache  # type: ignore[attr-defined]
+    num_bytes = sum(len(key) + len(value) for (key, value) in stored.items())
+    return (len(stored), num_bytes)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.utils.translation import gettext_lazy as _
 
-from .models import UserTwoFactorAuthData
+from .models import AuditEvent, RecoveryCode, UserTwoFactorAuthData
 
 
 @admin.register(UserTwoFactorAuthData)
@@ -26,3 +26,41 @@ class UserTwoFactorAuthDataAdmin(admin.ModelAdmin):
     @admin.display(boolean=True, description=_("TOTP configured"))
     def has_totp_secret(self, obj):
         return bool(obj.encrypted_totp_secret)
+
+
+@admin.register(RecoveryCode)
+class RecoveryCodeAdmin(admin.ModelAdmin):
+    """
+    Admin interface for RecoveryCode.
+
+    Only the digests of the codes are stored, so the codes cannot be
+    shown or edited here.  Deleting the codes of a user is allowed.
+    """
+
+    list_display = ("user", "created_at", "used_at")
+    list_filter = ("used_at",)
+    search_fields = ("user__username", "user__email")
+    readonly_fields = ("user", "digest", "created_at", "used_at")
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(AuditEvent)
+class AuditEventAdmin(admin.ModelAdmin):
+    """
+    Admin interface for AuditEvent.
+
+    The audit events are read-only.
+    """
+
+    list_display = ("created_at", "event_type", "user_pk", "client_ident")
+    list_filter = ("event_type",)
+    search_fields = ("user_pk", "client_ident")
+    date_hierarchy = "created_at"
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
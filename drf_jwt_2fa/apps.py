@@ -6,3 +6,11 @@ class DrfJwt2faConfig(AppConfig):
     name = "drf_jwt_2fa"
     verbose_name = _("Django Rest Framework JWT 2FA")
     default_auto_field = "django.db.models.BigAutoField"
+
+    def ready(self) -> None:
+        from .user_cache import connect_signals
+        from .warmup import is_warm_up_on_ready_enabled, warm_up
+
+        connect_signals()
+        if is_warm_up_on_ready_enabled():
+            warm_up()
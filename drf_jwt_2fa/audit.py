@@ -0,0 +1,237 @@
+"""
+Buffered security audit log of the 2FA flow.
+
+When the ``AUDIT_LOG_SINK`` setting is set, the security events of the
+2FA flow, e.g. issued code tokens, failed verification attempts,
+lockouts, TOTP enrollments and changes of the 2FA method, are emitted
+with :func:`emit_audit_event`.  Emitting an event only appends it to an
+in-memory buffer of the process, so that the request is not slowed down
+by a write per event.  A background thread passes the buffered events
+to the sink in batches of ``AUDIT_LOG_BATCH_SIZE`` when a batch is full
+or after ``AUDIT_LOG_FLUSH_INTERVAL``, and the remaining events are
+flushed when the process exits.
+
+The sink is a callable taking a list of :class:`AuditRecord` objects.
+:func:`write_to_database` inserts them to the :class:`AuditEvent` model
+with a single bulk insert per batch, falling back to inserting the
+events one by one when the batch fails, and :func:`write_to_file` appends
+them as JSON lines to ``AUDIT_LOG_FILE``.
+
+The buffer holds at most ``AUDIT_LOG_BUFFER_SIZE`` events.  When it is
+full, e.g. because the sink is down, either the oldest or the new
+events are dropped depending on ``AUDIT_LOG_DROP_POLICY``, and the
+dropped events are counted to the ``jwt2fa_audit_events_dropped``
+metric.  The events of a process which is killed are lost.
+"""
+
+import atexit
+import datetime
+import json
+import logging
+import os
+import threading
+from collections import deque
+from collections.abc import Mapping
+from typing import NamedTuple
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .metrics import AUDIT_EVENTS_DROPPED
+from .models import AuditEvent
+from .settings import api_settings
+
+LOG = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop-oldest"
+DROP_NEWEST = "drop-newest"
+
+_CLIENT_IDENT_MAX_LENGTH = 64  # The max_length of AuditEvent.client_ident
+
+
+class AuditRecord(NamedTuple):
+    event_type: str
+    created_at: datetime.datetime
+    user_pk: str
+    client_ident: str
+    data: Mapping[str, object]
+
+    @classmethod
+    def from_model(cls, event: AuditEvent) -> "AuditRecord":
+        return cls(
+            event_type=event.event_type,
+            created_at=event.created_at,
+            user_pk=event.user_pk,
+            client_ident=event.client_ident,
+            data=event.data,
+        )
+
+    def to_model(self) -> AuditEvent:
+        # The client ident can be e.g. a whole X-Forwarded-For header
+        client_ident = self.client_ident[:_CLIENT_IDENT_MAX_LENGTH]
+        return AuditEvent(
+            event_type=self.event_type,
+            created_at=self.created_at,
+            user_pk=self.user_pk,
+            client_ident=client_ident,
+            data=dict(self.data),
+        )
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "event_type": self.event_type,
+                "created_at": self.created_at.isoformat(),
+                "user_pk": self.user_pk,
+                "client_ident": self.client_ident,
+                "data": self.data,
+            },
+            sort_keys=True,
+        )
+
+
+def emit_audit_event(
+    event_type: str,
+    user_pk: object = None,
+    client_ident: str | None = None,
+    **data: object,
+) -> None:
+    """
+    Emit an audit event, if the audit log is enabled.
+
+    The keyword arguments are stored as the data of the event, so they
+    must be serializable to JSON.  Never pass codes or secrets.
+    """
+    if api_settings.AUDIT_LOG_SINK is None:
+        return
+    record = AuditRecord(
+        event_type=str(event_type),
+        created_at=timezone.now(),
+        user_pk="" if user_pk is None else str(user_pk),
+        client_ident=client_ident or "",
+        data=data,
+    )
+    _buffer.add(record)
+    _buffer.start_flusher()
+
+
+def flush_audit_log() -> None:
+    """
+    Write the buffered audit events of this process to the sink.
+    """
+    _buffer.flush()
+
+
+def write_to_database(records: list[AuditRecord]) -> None:
+    """
+    Audit log sink which inserts the events to the database.
+
+    When the bulk insert of the batch fails, the events are inserted
+    one by one, so that a single bad event does not lose the batch.
+    """
+    events = [x.to_model() for x in records]
+    try:
+        with transaction.atomic():
+            AuditEvent.objects.bulk_create(events)
+    except Exception:
+        LOG.exception("Bulk insert of %d audit events failed", len(events))
+        _insert_one_by_one(events)
+
+
+def _insert_one_by_one(events: list[AuditEvent]) -> None:
+    for event in events:
+        try:
+            with transaction.atomic():
+                event.save(force_insert=True)
+        except Exception:
+            LOG.exception("Inserting audit event %s failed", event)
+
+
+def write_to_file(records: list[AuditRecord]) -> None:
+    """
+    Audit log sink which appends the events to AUDIT_LOG_FILE.
+
+    The file has an event per line as JSON.  Each batch is appended
+    with a single write, so the file can be shared by the processes.
+    """
+    path = api_settings.AUDIT_LOG_FILE
+    if not path:
+        raise ImproperlyConfigured("AUDIT_LOG_FILE is not set")
+    lines = "".join(f"{x.to_json()}\n" for x in records)
+    with open(path, "a", encoding="utf-8") as file:
+        file.write(lines)
+
+
+class _AuditBuffer:
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._records: deque[AuditRecord] = deque()
+        self._thread: threading.Thread | None = None
+        self._exit_handler_registered = False
+        os.register_at_fork(after_in_child=self._reset)
+
+    def add(self, record: AuditRecord) -> None:
+        with self._condition:
+            if len(self._records) >= api_settings.AUDIT_LOG_BUFFER_SIZE:
+                AUDIT_EVENTS_DROPPED.inc()
+                if api_settings.AUDIT_LOG_DROP_POLICY == DROP_NEWEST:
+                    return
+                self._records.popleft()
+            self._records.append(record)
+            if len(self._records) >= api_settings.AUDIT_LOG_BATCH_SIZE:
+                self._condition.notify()
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            while batch := self._take_batch():
+                self._write(batch)
+
+    def _take_batch(self) -> list[AuditRecord]:
+        with self._condition:
+            size = min(len(self._records), api_settings.AUDIT_LOG_BATCH_SIZE)
+            return [self._records.popleft() for _i in range(size)]
+
+    def _write(self, batch: list[AuditRecord]) -> None:
+        sink = api_settings.AUDIT_LOG_SINK
+        if sink is None:
+            return
+        try:
+            sink(batch)
+        except Exception:
+            LOG.exception("Writing %d audit events failed", len(batch))
+
+    def start_flusher(self) -> None:
+        if self._thread is not None:
+            return
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="jwt2fa-audit", daemon=True
+            )
+            self._thread.start()
+            if not self._exit_handler_registered:
+                atexit.register(self.flush)
+                self._exit_handler_registered = True
+
+    def _run(self) -> None:
+        while True:
+            interval = api_settings.AUDIT_LOG_FLUSH_INTERVAL
+            with self._condition:
+                if len(self._records) < api_settings.AUDIT_LOG_BATCH_SIZE:
+                    self._condition.wait(timeout=interval.total_seconds())
+            self.flush()
+            # Do not leave the database connections of the thread open
+            connections.close_all()
+
+    def _reset(self) -> None:
+        # The child process must not write the events of its parent
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._records = deque()
+        self._thread = None
+
+
+_buffer = _AuditBuffer()
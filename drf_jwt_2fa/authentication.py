@@ -1,5 +1,126 @@
+import jwt
+from django.contrib.auth.models import AbstractBaseUser
+from django.utils.translation import gettext as _
 from rest_framework_simplejwt import authentication as jwt_auth
+from rest_framework_simplejwt.exceptions import (
+    AuthenticationFailed,
+    InvalidToken,
+    TokenError,
+)
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import Token
+
+from .enrollment_token import EnrollmentToken
+from .revocation import is_token_revoked
+from .settings import api_settings
+from .tracing import start_span
+from .user_cache import get_cached_user, get_password_hash_digest
 
 
 class Jwt2faAuthentication(jwt_auth.JWTAuthentication):
-    pass
+    """
+    JWT authentication of the auth tokens.
+
+    Works like ``JWTAuthentication`` of Simple JWT, but when the
+    ``USER_CACHE_TIMEOUT`` setting is set, the user is served from the
+    cache of :mod:`drf_jwt_2fa.user_cache` instead of the database.  The
+    checks for an inactive user and for a changed password are done
+    for the cached user too.
+
+    The tokens revoked with :mod:`drf_jwt_2fa.revocation` are rejected.
+    """
+
+    def get_validated_token(self, raw_token: bytes) -> Token:
+        validated_token = super().get_validated_token(raw_token)
+        self.check_not_revoked(validated_token)
+        return validated_token
+
+    def check_not_revoked(self, validated_token: Token) -> None:
+        if is_token_revoked(validated_token):
+            raise InvalidToken(_("Token has been revoked"))
+
+    # Simple JWT types the user as a type variable, which is never bound
+    def get_user(  # type: ignore[override]
+        self, validated_token: Token
+    ) -> AbstractBaseUser:
+        if api_settings.USER_CACHE_TIMEOUT is None:
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(
+                _("Token contained no recognizable user identification")
+            ) from None
+        user = get_cached_user(user_id, self._load_user)
+        if user is None:
+            raise AuthenticationFailed(
+                _("User not found"), code="user_not_found"
+            )
+        self._check_user(user, validated_token)
+        return user
+
+    def _load_user(self, user_id: str) -> AbstractBaseUser | None:
+        lookup = {jwt_settings.USER_ID_FIELD: user_id}
+        with start_span("jwt2fa.user_lookup"):
+            return self.user_model.objects.filter(**lookup).first()
+
+    def _check_user(
+        self, user: AbstractBaseUser, validated_token: Token
+    ) -> None:
+        if jwt_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(
+                _("User is inactive"), code="user_inactive"
+            )
+        if jwt_settings.CHECK_REVOKE_TOKEN:
+            password_digest = get_password_hash_digest(user)
+            claim = validated_token.get(jwt_settings.REVOKE_TOKEN_CLAIM)
+            if claim != password_digest:
+                raise AuthenticationFailed(
+                    _("The user's password has been changed."),
+                    code="password_changed",
+                )
+
+
+class EnrollmentOrJwt2faAuthentication(Jwt2faAuthentication):
+    """
+    JWT authentication that accepts enrollment tokens and auth tokens.
+
+    Works like listing ``EnrollmentTokenAuthentication`` and
+    ``Jwt2faAuthentication`` in ``authentication_classes``, but verifies
+    the signature of the token only once.  The token class is selected
+    by the token type claim of the unverified payload from
+    ``EnrollmentToken`` and the ``AUTH_TOKEN_CLASSES`` of Simple JWT.
+    Only that class then decodes and verifies the token, with its own
+    token backend.
+    """
+
+    def get_validated_token(self, raw_token: bytes) -> Token:
+        try:
+            unverified = jwt.decode(
+                raw_token, options={"verify_signature": False}
+            )
+        except jwt.InvalidTokenError:
+            raise InvalidToken(_("Token is invalid")) from None
+        token_type = unverified.get(jwt_settings.TOKEN_TYPE_CLAIM)
+        token_class = self._get_token_class(token_type)
+        if token_class is None:
+            raise InvalidToken(_("Given token not valid for any token type"))
+        token = self._make_validated_token(token_class, raw_token)
+        self.check_not_revoked(token)
+        return token
+
+    def _get_token_class(self, token_type: object) -> type[Token] | None:
+        token_classes = [EnrollmentToken, *jwt_settings.AUTH_TOKEN_CLASSES]
+        for token_class in token_classes:
+            if token_class.token_type == token_type:
+                return token_class
+        return None
+
+    def _make_validated_token(
+        self, token_class: type[Token], raw_token: bytes
+    ) -> Token:
+        try:
+            # Simple JWT annotates the encoded token as a Token
+            return token_class(raw_token)  # type: ignore[arg-type]
+        except TokenError as error:
+            raise InvalidToken(error.args[0]) from None
@@ -0,0 +1,97 @@
+"""
+Bloom filter for compact set membership tests.
+"""
+
+import hashlib
+import math
+
+
+class BloomFilter:
+    """
+    Bloom filter with a fixed number of bits and hash functions.
+
+    A Bloom filter can tell for sure that an item has not been added,
+    but may give a false positive for an item that has not been added.
+    The probability of a false positive depends on the number of bits
+    per added item and is controlled by sizing the filter with
+    :meth:`for_capacity`.
+
+    The bits are stored in a ``bytearray``, which can be serialized with
+    :meth:`to_bytes` and restored by passing the bytes to the
+    constructor.
+    """
+
+    def __init__(
+        self, num_bits: int, num_hashes: int, data: bytes | None = None
+    ) -> None:
+        if num_bits < 1 or num_hashes < 1:
+            raise ValueError("Bloom filter must have bits and hashes")
+        num_bytes = (num_bits + 7) // 8
+        if data is not None and len(data) != num_bytes:
+            raise ValueError("Bloom filter data has wrong size")
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self._bits = (
+            bytearray(data) if data is not None else bytearray(num_bytes)
+        )
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float) -> "BloomFilter":
+        """
+        Create a filter for given number of items and false positive rate.
+        """
+        (num_bits, num_hashes) = get_optimal_size(capacity, error_rate)
+        return cls(num_bits, num_hashes)
+
+    def add(self, item: bytes) -> bool:
+        """
+        Add an item to the filter.
+
+        Return True if the item was possibly already in the filter, i.e.
+        if all of its bits were already set.
+        """
+        was_present = True
+        for position in self._get_positions(item):
+            (index, mask) = (position >> 3, 1 << (position & 7))
+            if not self._bits[index] & mask:
+                was_present = False
+                self._bits[index] |= mask
+        return was_present
+
+    def __contains__(self, item: bytes) -> bool:
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._get_positions(item)
+        )
+
+    def to_bytes(self) -> bytes:
+        return bytes(self._bits)
+
+    def _get_positions(self, item: bytes) -> list[int]:
+        # Enhanced double hashing (Dillinger & Manolios).  Plain double
+        # hashing, h1 + i * h2, would map all the positions of an item
+        # to the same bit when h2 happens to be divisible by num_bits.
+        digest = hashlib.blake2b(item, digest_size=16).digest()
+        x = int.from_bytes(digest[:8], "little") % self.num_bits
+        y = int.from_bytes(digest[8:], "little") % self.num_bits
+        positions = []
+        for i in range(self.num_hashes):
+            positions.append(x)
+            x = (x + y) % self.num_bits
+            y = (y + i) % self.num_bits
+        return positions
+
+
+def get_optimal_size(capacity: int, error_rate: float) -> tuple[int, int]:
+    """
+    Get the number of bits and hashes for a Bloom filter.
+
+    Return the optimal number of bits and hash functions for storing
+    ``capacity`` items with a false positive probability of at most
+    ``error_rate``.
+    """
+    if capacity < 1 or not 0 < error_rate < 1:
+        raise ValueError("Invalid Bloom filter capacity or error rate")
+    num_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    num_hashes = max(round(num_bits / capacity * math.log(2)), 1)
+    return (num_bits, num_hashes)
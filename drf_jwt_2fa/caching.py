@@ -0,0 +1,137 @@
+"""
+Cache access for the 2FA state.
+
+The token state (authentication attempts, active code tokens and used
+code tokens) and the throttle state are stored to the cache aliases
+configured by the ``TOKEN_STATE_CACHE`` and ``THROTTLE_CACHE`` settings.
+All keys are namespaced with ``CACHE_KEY_PREFIX`` and, when set,
+``CACHE_KEY_VERSION``.
+
+The token state can also be sharded over several cache aliases with the
+``TOKEN_STATE_CACHE_SHARDS`` setting.  The shard of each piece of state
+is then selected with a consistent-hash ring, so that adding a shard
+moves only about 1/N of the keys to the new shard.
+"""
+
+import bisect
+import contextlib
+import functools
+import hashlib
+import secrets
+import time
+from collections.abc import Iterator, Sequence
+
+from django.core.cache import BaseCache, caches
+
+from .settings import api_settings
+
+
+def get_token_state_cache(routing_key: str) -> BaseCache:
+    """
+    Get the cache used for storing the code token state.
+
+    The routing key selects the shard, when the token state is sharded
+    with the ``TOKEN_STATE_CACHE_SHARDS`` setting.  It should be the
+    user id for per-user state and the jti for per-token state.
+    """
+    shards = api_settings.TOKEN_STATE_CACHE_SHARDS
+    if not shards:
+        return caches[api_settings.TOKEN_STATE_CACHE]
+    ring = _get_hash_ring(tuple(shards))
+    return caches[ring.get_node(routing_key)]
+
+
+def get_throttle_cache() -> BaseCache:
+    """
+    Get the cache used for storing the throttle state.
+    """
+    return caches[api_settings.THROTTLE_CACHE]
+
+
+def get_cache_key_prefix() -> str:
+    """
+    Get the prefix for the cache keys.
+
+    The prefix is the ``CACHE_KEY_PREFIX`` setting, followed by
+    ``:v<N>`` when the ``CACHE_KEY_VERSION`` setting is set.  Bumping
+    the version thus makes all previously stored 2FA state unreachable.
+    """
+    prefix = api_settings.CACHE_KEY_PREFIX
+    version = api_settings.CACHE_KEY_VERSION
+    return f"{prefix}:v{version}" if version is not None else prefix
+
+
+def make_cache_key(*parts: str) -> str:
+    """
+    Make a namespaced cache key from the given parts.
+    """
+    return ":".join((get_cache_key_prefix(), *parts))
+
+
+class CacheLockTimeoutError(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def cache_lock(
+    cache: BaseCache,
+    key: str,
+    timeout: int = 2,
+    poll_interval: float = 0.005,
+) -> Iterator[None]:
+    """
+    Hold a lock stored to the cache for the duration of the block.
+
+    The lock is acquired with the atomic ``cache.add`` and expires after
+    ``timeout`` seconds, so a crashed holder cannot block the others
+    forever.  Waiting for the lock is therefore given up after twice the
+    timeout by raising :class:`CacheLockTimeoutError`.
+    """
+    owner = secrets.token_hex(8)
+    give_up_at = time.monotonic() + 2 * timeout
+    while not cache.add(key, owner, timeout=timeout):
+        if time.monotonic() > give_up_at:
+            raise CacheLockTimeoutError(key)
+        time.sleep(poll_interval)
+    try:
+        yield
+    finally:
+        if cache.get(key) == owner:
+            cache.delete(key)
+
+
+class ConsistentHashRing:
+    """
+    Consistent-hash ring mapping keys to nodes.
+
+    Each node is placed to the ring at ``replicas`` pseudo-random points
+    and a key is mapped to the node owning the first point at or after
+    the hash of the key.  The virtual points make the distribution of
+    keys even and adding a node takes over only the keys of the ring
+    segments that precede its points.
+    """
+
+    def __init__(self, nodes: Sequence[str], replicas: int = 128) -> None:
+        if not nodes:
+            raise ValueError("Hash ring must have at least one node")
+        points = sorted(
+            (_hash_to_int(f"{node}#{i}"), node)
+            for node in nodes
+            for i in range(replicas)
+        )
+        self._hashes = [point_hash for (point_hash, _node) in points]
+        self._nodes = [node for (_point_hash, node) in points]
+
+    def get_node(self, key: str) -> str:
+        index = bisect.bisect_left(self._hashes, _hash_to_int(key))
+        return self._nodes[index % len(self._nodes)]
+
+
+@functools.lru_cache(maxsize=8)
+def _get_hash_ring(nodes: tuple[str, ...]) -> ConsistentHashRing:
+    return ConsistentHashRing(nodes)
+
+
+def _hash_to_int(value: str) -> int:
+    digest = hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
@@ -0,0 +1,194 @@
+"""
+Circuit breakers for the code sending channels.
+
+A circuit breaker counts the calls and the failed calls of a channel in
+fixed time windows.  A call that takes longer than a threshold counts
+as failed even if it succeeds, since a slow channel holds the workers
+as much as a failing one.  When the share of failed calls exceeds the
+failure rate, the breaker *opens* and the calls are rejected instantly
+with ``CircuitOpenError`` for the open time.
+
+After the open time the breaker is *half-open*: a single call is let
+through as a probe, while the other calls are still rejected.  If the
+probe succeeds the breaker closes, otherwise it opens again.
+
+The state is stored to the token state cache, so that it is shared by
+all worker processes.
+"""
+
+import math
+import time
+from collections.abc import Callable
+from typing import Any, TypeVar
+
+from django.core.cache import BaseCache
+
+from .caching import get_cache_key_prefix, get_token_state_cache
+from .settings import api_settings
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker with its state in the cache.
+
+    :param name:
+      Name of the protected channel.  Breakers with the same name share
+      their state.
+    :param failure_rate:
+      Share of failed calls within a window that opens the breaker.
+    :param min_calls:
+      Minimum number of calls within a window before the breaker may
+      open.
+    :param slow_call_seconds:
+      Duration in seconds after which a call counts as failed.
+    :param window_seconds:
+      Length of the counting windows in seconds.
+    :param open_seconds:
+      How long the breaker stays open before letting a probe through.
+    """
+
+    key_template = "{prefix}:breaker:{name}:{part}"
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float,
+        min_calls: int,
+        slow_call_seconds: float,
+        window_seconds: int,
+        open_seconds: float,
+    ) -> None:
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = max(min_calls, 1)
+        self.slow_call_seconds = slow_call_seconds
+        self.window_seconds = max(window_seconds, 1)
+        self.open_seconds = open_seconds
+
+    def call(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Call given function through the breaker.
+
+        :raises CircuitOpenError: if the breaker is open
+        """
+        probe = self._acquire()
+        start = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self._record(failed=True, probe=probe)
+            raise
+        duration = time.monotonic() - start
+        self._record(failed=duration >= self.slow_call_seconds, probe=probe)
+        return result
+
+    def get_state(self) -> str:
+        """
+        Get the state of the breaker: "closed", "open" or "half-open".
+        """
+        opened_until = self._get_cache().get(self._get_key("open"))
+        if opened_until is None:
+            return "closed"
+        return "open" if time.time() < opened_until else "half-open"
+
+    def reset(self) -> None:
+        """
+        Close the breaker and forget the counted calls.
+        """
+        window = int(time.time()) // self.window_seconds
+        self._get_cache().delete_many([
+            self._get_key("open"),
+            self._get_key("probe"),
+            *self._get_counter_keys(window),
+            *self._get_counter_keys(window - 1),
+        ])
+
+    def _acquire(self) -> bool:
+        cache = self._get_cache()
+        opened_until = cache.get(self._get_key("open"))
+        if opened_until is None:
+            return False
+        if time.time() < opened_until:
+            raise CircuitOpenError(self.name)
+        # Half-open: let only one probe through at a time.  The probe
+        # lock expires, so that a lost probe does not block the channel.
+        probe_timeout = math.ceil(self.slow_call_seconds) + 1
+        if not cache.add(self._get_key("probe"), 1, timeout=probe_timeout):
+            raise CircuitOpenError(self.name)
+        return True
+
+    def _record(self, failed: bool, probe: bool) -> None:
+        cache = self._get_cache()
+        if probe:
+            if failed:
+                self._open()
+                cache.delete(self._get_key("probe"))
+            else:
+                self.reset()
+            return
+        now = time.time()
+        window = int(now) // self.window_seconds
+        (calls_key, failures_key) = self._get_counter_keys(window)
+        keys = [calls_key, failures_key] if failed else [calls_key]
+        timeout = 2 * self.window_seconds
+        for key in keys:
+            if not cache.add(key, 1, timeout=timeout):
+                cache.incr(key)
+        if failed and self._is_failure_rate_exceeded(now, window):
+            self._open()
+
+    def _is_failure_rate_exceeded(self, now: float, window: int) -> bool:
+        current_keys = self._get_counter_keys(window)
+        previous_keys = self._get_counter_keys(window - 1)
+        values = self._get_cache().get_many(current_keys + previous_keys)
+        # Weight the previous window by its share of the sliding window
+        weight = 1 - (now % self.window_seconds) / self.window_seconds
+        (calls, failures) = (
+            values.get(current, 0) + values.get(previous, 0) * weight
+            for (current, previous) in zip(
+                current_keys, previous_keys, strict=True
+            )
+        )
+        return calls >= self.min_calls and failures >= (
+            self.failure_rate * calls
+        )
+
+    def _open(self) -> None:
+        opened_until = time.time() + self.open_seconds
+        self._get_cache().set(self._get_key("open"), opened_until, None)
+
+    def _get_counter_keys(self, window: int) -> list[str]:
+        return [
+            self._get_key(f"calls:{window}"),
+            self._get_key(f"failures:{window}"),
+        ]
+
+    def _get_key(self, part: str) -> str:
+        return self.key_template.format(
+            prefix=get_cache_key_prefix(), name=self.name, part=part
+        )
+
+    def _get_cache(self) -> BaseCache:
+        return get_token_state_cache(f"breaker:{self.name}")
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """
+    Get the circuit breaker of the named channel.
+
+    The breaker is configured with the ``CIRCUIT_BREAKER_*`` settings.
+    """
+    return CircuitBreaker(
+        name,
+        api_settings.CIRCUIT_BREAKER_FAILURE_RATE,
+        api_settings.CIRCUIT_BREAKER_MIN_CALLS,
+        api_settings.CIRCUIT_BREAKER_SLOW_CALL_TIME.total_seconds(),
+        int(api_settings.CIRCUIT_BREAKER_WINDOW.total_seconds()),
+        api_settings.CIRCUIT_BREAKER_OPEN_TIME.total_seconds(),
+    )
@@ -0,0 +1,170 @@
+"""
+Time budgets for sending the verification codes.
+
+When the ``CODE_SENDING_TIMEOUT`` setting is set, each code sending gets
+a :class:`Deadline`.  A code sender that accepts a ``deadline`` keyword
+argument is passed the deadline and is expected to keep within it, e.g.
+by capping its own timeouts with :meth:`Deadline.get_timeout`.  Other
+senders are run in a bounded thread pool and waited for until the
+deadline, so that a hanging sender does not hold the request worker.
+
+Note that a sender that has timed out may still be running in the pool
+and may still deliver the code.
+"""
+
+import concurrent.futures
+import contextvars
+import functools
+import inspect
+import os
+import threading
+import time
+from collections.abc import Callable
+from typing import Any, TypeVar
+
+from django.db import connections
+
+T = TypeVar("T")
+
+
+class Deadline:
+    """
+    Point of time by which an operation should be completed.
+
+    :param seconds: Number of seconds from now
+    """
+
+    def __init__(self, seconds: float) -> None:
+        self.expires_at = time.monotonic() + seconds
+
+    def get_remaining(self) -> float:
+        """
+        Get the remaining number of seconds, or zero if expired.
+        """
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def get_timeout(self, timeout: float) -> float:
+        """
+        Get given timeout capped to the remaining time.
+        """
+        return min(timeout, self.get_remaining())
+
+    @property
+    def expired(self) -> bool:
+        return self.get_remaining() <= 0
+
+
+class DeadlineExceededError(TimeoutError):
+    pass
+
+
+def accepts_deadline(func: Callable[..., object]) -> bool:
+    """
+    Check if given callable accepts a ``deadline`` keyword argument.
+
+    Only an explicit ``deadline`` parameter counts: a callable taking
+    ``**kwargs`` may just pass them on to something that does not know
+    about deadlines.
+    """
+    try:
+        return _accepts_deadline(func)
+    except TypeError:  # Unhashable callable
+        return _inspect_accepts_deadline(func)
+
+
+@functools.lru_cache(maxsize=128)
+def _accepts_deadline(func: Callable[..., object]) -> bool:
+    return _inspect_accepts_deadline(func)
+
+
+def _inspect_accepts_deadline(func: Callable[..., object]) -> bool:
+    try:
+        parameters = inspect.signature(func).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    return any(
+        x.name == "deadline" and x.kind != x.POSITIONAL_ONLY
+        for x in parameters
+    )
+
+
+def call_with_deadline(  # noqa: UP047
+    func: Callable[..., T],
+    deadline: Deadline | None,
+    *args: Any,
+    max_threads: int,
+) -> T:
+    """
+    Call given function within the deadline.
+
+    If the function accepts a ``deadline`` keyword argument, it is
+    called directly with the deadline.  Otherwise it is run in a thread
+    pool of at most ``max_threads`` threads and waited for until the
+    deadline.
+
+    :raises DeadlineExceededError:
+      if the deadline is exceeded before the function returns
+    """
+    if deadline is None:
+        return func(*args)
+    if accepts_deadline(func):
+        return func(*args, deadline=deadline)
+    future = submit_to_thread_pool("sender", max_threads, func, *args)
+    try:
+        return future.result(timeout=deadline.get_remaining())
+    except concurrent.futures.TimeoutError:
+        future.cancel()  # In case it is still queued
+        raise DeadlineExceededError() from None
+
+
+def submit_to_thread_pool(  # noqa: UP047
+    name: str, max_threads: int, func: Callable[..., T], *args: Any
+) -> "concurrent.futures.Future[T]":
+    """
+    Submit a call to the named thread pool of this process.
+
+    The pool is created on the first call with at most ``max_threads``
+    threads.  The call is run in a copy of the current context, so that
+    e.g. the tracing spans of the call have the current span as their
+    parent.  The database connections opened by the call are closed
+    after it.
+    """
+    pool = _get_thread_pool(name, max_threads)
+    context = contextvars.copy_context()
+    return pool.submit(context.run, _call_and_close_connections, func, *args)
+
+
+def _call_and_close_connections(  # noqa: UP047
+    func: Callable[..., T], *args: Any
+) -> T:
+    try:
+        return func(*args)
+    finally:
+        # Do not leave the database connections of the thread open
+        connections.close_all()
+
+
+_thread_pools: dict[
+    str, tuple[int, int, concurrent.futures.ThreadPoolExecutor]
+] = {}
+_thread_pools_lock = threading.Lock()
+
+
+def _get_thread_pool(
+    name: str, max_threads: int
+) -> concurrent.futures.ThreadPoolExecutor:
+    with _thread_pools_lock:
+        if name in _thread_pools:
+            (pid, threads, pool) = _thread_pools[name]
+            # The pool is created again in a forked child process, since
+            # the threads of the parent do not exist there
+            if pid == os.getpid() and threads == max_threads:
+                return pool
+            if pid == os.getpid():
+                pool.shutdown(wait=False)
+        pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(max_threads, 1),
+            thread_name_prefix=f"jwt2fa-{name}",
+        )
+        _thread_pools[name] = (os.getpid(), max_threads, pool)
+        return pool
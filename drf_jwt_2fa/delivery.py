@@ -0,0 +1,170 @@
+"""
+Background delivery of the verification codes.
+
+When the ``ASYNC_CODE_SENDING`` setting is enabled, the code token is
+returned as soon as the code is generated and the code is sent in a
+background thread of the same process.  The delivery status of each code
+token is stored to the token state cache by the jti of the token, so
+that the client can poll it while the user is already shown the code
+input.
+
+At most ``ASYNC_CODE_SENDING_MAX_QUEUED`` deliveries are queued or
+running per process.  A delivery over the limit fails at once, so that
+a slow code sender cannot grow the queue without bounds.  A delivery
+whose code token has expired while it was queued is not sent at all.
+
+Note that the queued deliveries are lost if the process exits before
+they are sent.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections.abc import Callable
+
+from django.contrib.auth.models import AbstractBaseUser
+
+from .caching import get_cache_key_prefix, get_token_state_cache
+from .deadlines import submit_to_thread_pool
+from .sending import CodeSendingError, CodeSendingTimeoutError
+from .settings import api_settings
+
+LOG = logging.getLogger(__name__)
+
+QUEUED = "queued"
+SENT = "sent"
+FAILED = "failed"
+TIMED_OUT = "timed-out"
+EXPIRED = "expired"
+
+_delivery_status_cache_key_template = "{prefix}:delivery:{jti}"
+
+
+def deliver_code_in_background(
+    send: Callable[[AbstractBaseUser, str], None],
+    user: AbstractBaseUser,
+    code: str,
+    jti: str,
+    expires_at: int,
+) -> None:
+    """
+    Send the code of the code token with given jti in the background.
+
+    The status is "queued" until ``send`` returns, and then "sent",
+    "failed", or "timed-out" if it raised ``CodeSendingTimeoutError``.
+    It is "failed" at once if too many deliveries are queued already,
+    and "expired" if the code token expired before the code was sent.
+    The status is kept until the code token expires.
+    """
+    if not _queue_slots.acquire(api_settings.ASYNC_CODE_SENDING_MAX_QUEUED):
+        LOG.warning("Verification code sending failed: Too many queued")
+        _set_delivery_status(jti, FAILED, expires_at)
+        return
+    try:
+        _set_delivery_status(jti, QUEUED, expires_at)
+        submit_to_thread_pool(
+            "delivery",
+            api_settings.CODE_SENDING_MAX_THREADS,
+            _deliver,
+            send,
+            user,
+            code,
+            jti,
+            expires_at,
+        )
+    except BaseException:
+        # Not queued, so the slot would never be released by _deliver
+        _queue_slots.release()
+        raise
+
+
+def _deliver(
+    send: Callable[[AbstractBaseUser, str], None],
+    user: AbstractBaseUser,
+    code: str,
+    jti: str,
+    expires_at: int,
+) -> None:
+    try:
+        status = _send_unless_expired(send, user, code, expires_at)
+    finally:
+        _queue_slots.release()
+    _set_delivery_status(jti, status, expires_at)
+
+
+def _send_unless_expired(
+    send: Callable[[AbstractBaseUser, str], None],
+    user: AbstractBaseUser,
+    code: str,
+    expires_at: int,
+) -> str:
+    if time.time() >= expires_at:
+        LOG.warning("Verification code expired before it was sent")
+        return EXPIRED
+    try:
+        send(user, code)
+    except CodeSendingTimeoutError:
+        LOG.warning("Verification code sending timed out")
+        status = TIMED_OUT
+    except CodeSendingError as error:
+        LOG.warning("Verification code sending failed: %s", error)
+        status = FAILED
+    except Exception:
+        LOG.exception("Verification code sending failed")
+        status = FAILED
+    else:
+        status = SENT
+    return status
+
+
+class _QueueSlots:
+    """
+    Counter of the deliveries queued or running in this process.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._count = 0
+        self._pid = os.getpid()
+
+    def acquire(self, limit: int) -> bool:
+        """
+        Take a slot if less than ``limit`` are taken.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked: the deliveries of the parent are not run here
+                self._count = 0
+                self._pid = os.getpid()
+            if self._count >= limit:
+                return False
+            self._count += 1
+            return True
+
+    def release(self) -> None:
+        with self._lock:
+            self._count -= 1
+
+
+_queue_slots = _QueueSlots()
+
+
+def get_delivery_status(jti: str) -> str | None:
+    """
+    Get the delivery status of the code token with given jti.
+
+    Return None if the token is unknown or expired.
+    """
+    return get_token_state_cache(jti).get(_get_cache_key(jti))
+
+
+def _set_delivery_status(jti: str, status: str, expires_at: int) -> None:
+    timeout = max(expires_at - int(time.time()), 1)
+    get_token_state_cache(jti).set(_get_cache_key(jti), status, timeout)
+
+
+def _get_cache_key(jti: str) -> str:
+    return _delivery_status_cache_key_template.format(
+        prefix=get_cache_key_prefix(), jti=jti
+    )
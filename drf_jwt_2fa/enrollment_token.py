@@ -14,14 +14,14 @@ from rest_framework_simplejwt.authentication import AuthUser, JWTAuthentication
 from rest_framework_simplejwt.exceptions import TokenError
 from rest_framework_simplejwt.tokens import Token
 
-from .settings import api_settings
+from .settings import SettingValue
 
 
 class EnrollmentToken(Token):
     """A token granting access only to TOTP enrollment endpoints."""
 
     token_type = "enrollment"  # noqa: S105
-    lifetime = api_settings.ENROLLMENT_TOKEN_EXPIRATION_TIME
+    lifetime = SettingValue("ENROLLMENT_TOKEN_EXPIRATION_TIME")
 
 
 class EnrollmentTokenAuthentication(JWTAuthentication):
@@ -14,6 +14,11 @@ class TooManyCodeTokensError(exceptions.Throttled):
     )
 
 
+class TokenStateBusyError(exceptions.Throttled):
+    default_code = "token_state_busy"
+    default_detail = _("Too many concurrent requests. Please try again.")
+
+
 class TokenAlreadyUsedError(exceptions.AuthenticationFailed):
     default_code = "token_already_used"
     default_detail = _(
@@ -41,6 +46,20 @@ class VerificationCodeSendingError(exceptions.APIException):
         )
 
 
+class TokenRevocationNotEnabledError(exceptions.APIException):
+    status_code = status.HTTP_501_NOT_IMPLEMENTED
+    default_code = "token_revocation_not_enabled"
+    default_detail = _("Token revocation is not enabled.")
+
+
+class TotpEnrollmentConflictError(exceptions.APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_code = "totp_enrollment_conflict"
+    default_detail = _(
+        "The pending TOTP setup was changed or already confirmed."
+    )
+
+
 class TwoFactorAuthNotConfiguredError(exceptions.PermissionDenied):
     default_code = "2fa_not_configured"
     default_detail = _(
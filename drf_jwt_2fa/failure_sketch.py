@@ -0,0 +1,93 @@
+"""
+Aggregate counters of failed authentication attempts.
+
+The failed attempts are counted per user and per client over all code
+tokens, so that minting several code tokens in parallel does not give an
+attacker more guesses.  The counters are kept in a count-min sketch:
+each counted item increments one cell in each row of a fixed size table
+of cache keys, and the count of an item is estimated as the minimum of
+its cells.  The number of cache keys is thus bounded by the size of the
+sketch, no matter how many users, clients or tokens are seen.
+
+A count-min sketch never underestimates a count, but it may
+overestimate it when other items hit the same cells.  The cells are
+selected with a keyed hash, so that the colliding items cannot be
+chosen by an attacker.
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+
+from .caching import get_cache_key_prefix, get_token_state_cache
+from .utils import derive_key_bytes
+
+
+class FailedAttemptSketch:
+    """
+    Count-min sketch of failed attempts in fixed time windows.
+
+    The count of an item is estimated over a sliding window by adding
+    the count of the current window and a share of the previous window
+    that is proportional to the part of it still within the sliding
+    window.
+
+    :param width:
+      Number of cells in each row of the sketch.
+    :param window_seconds:
+      Length of the time window in seconds.
+    """
+
+    depth = 4
+    cell_key_template = "{prefix}:failures:{window}:{row}:{column}"
+
+    def __init__(self, width: int, window_seconds: int) -> None:
+        self.width = width
+        self.window_seconds = max(window_seconds, 1)
+
+    def add(self, item: str) -> None:
+        """
+        Count a failed attempt for the given item.
+        """
+        window = int(time.time()) // self.window_seconds
+        cache = get_token_state_cache(item)
+        timeout = 2 * self.window_seconds
+        for key in self._get_cell_keys(item, window):
+            if not cache.add(key, 1, timeout=timeout):
+                cache.incr(key)
+
+    def estimate(self, item: str) -> float:
+        """
+        Estimate the number of failed attempts for the given item.
+        """
+        now = time.time()
+        window = int(now) // self.window_seconds
+        current_keys = self._get_cell_keys(item, window)
+        previous_keys = self._get_cell_keys(item, window - 1)
+        cache = get_token_state_cache(item)
+        values = cache.get_many(current_keys + previous_keys)
+        current = min(values.get(key, 0) for key in current_keys)
+        previous = min(values.get(key, 0) for key in previous_keys)
+        elapsed = (now % self.window_seconds) / self.window_seconds
+        return current + previous * (1 - elapsed)
+
+    def _get_cell_keys(self, item: str, window: int) -> list[str]:
+        prefix = get_cache_key_prefix()
+        return [
+            self.cell_key_template.format(
+                prefix=prefix, window=window, row=row, column=column
+            )
+            for (row, column) in enumerate(self._get_columns(item))
+        ]
+
+    def _get_columns(self, item: str) -> list[int]:
+        key = derive_key_bytes("2fa-failure-sketch", settings.SECRET_KEY)
+        digest = hashlib.blake2b(
+            item.encode("utf-8"), digest_size=4 * self.depth, key=key
+        ).digest()
+        return [
+            int.from_bytes(digest[4 * row : 4 * row + 4], "little")
+            % self.width
+            for row in range(self.depth)
+        ]
@@ -2,9 +2,12 @@
 Getter functions used by the default settings.
 """
 
+from collections.abc import Sequence
+
 from django.contrib.auth.base_user import AbstractBaseUser
 
 from .models import UserTwoFactorAuthData
+from .settings import api_settings
 
 
 def get_totp_secret_of_user(user: AbstractBaseUser) -> str | None:
@@ -19,3 +22,12 @@ def get_preferred_2fa_method_of_user(user: AbstractBaseUser) -> str:
     Get preferred 2FA method of user.
     """
     return UserTwoFactorAuthData.get_preferred_2fa_method_of_user(user)
+
+
+def get_code_sender_channels_of_user(user: AbstractBaseUser) -> Sequence[str]:
+    """
+    Get the code sending channels of user in order of preference.
+
+    Return all the configured ``CODE_SENDER_CHANNELS`` in their order.
+    """
+    return list(api_settings.CODE_SENDER_CHANNELS)
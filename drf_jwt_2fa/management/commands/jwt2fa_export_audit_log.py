@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from ...audit import AuditRecord
+from ...models import AuditEvent, AuditEventType
+
+
+class Command(BaseCommand):
+    help = (
+        "Print the audit events stored to the database as JSON lines, "
+        "in the order of their creation."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--since",
+            type=_parse_time,
+            help="Export only events created at or after this ISO 8601 time",
+        )
+        parser.add_argument(
+            "--until",
+            type=_parse_time,
+            help="Export only events created before this ISO 8601 time",
+        )
+        parser.add_argument(
+            "--event-type",
+            action="append",
+            choices=AuditEventType.values,
+            dest="event_types",
+            help="Export only events of this type (can be repeated)",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=2000,
+            help="Number of events fetched from the database at a time",
+        )
+
+    def handle(self, *args, **options):
+        events = AuditEvent.objects.order_by("created_at", "pk")
+        if options["since"]:
+            events = events.filter(created_at__gte=options["since"])
+        if options["until"]:
+            events = events.filter(created_at__lt=options["until"])
+        if options["event_types"]:
+            events = events.filter(event_type__in=options["event_types"])
+        for event in events.iterator(chunk_size=options["chunk_size"]):
+            self.stdout.write(AuditRecord.from_model(event).to_json())
+
+
+def _parse_time(value):
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise CommandError(f"Invalid time: {value!r}")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
@@ -0,0 +1,78 @@
+import os
+import pstats
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...profiling import iter_profile_files
+from ...settings import api_settings
+
+
+class Command(BaseCommand):
+    help = (
+        "Merge the sampled profiles of the 2FA endpoints and print a "
+        "report per endpoint and 2FA method."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--directory",
+            help="Directory of the profiles (default: PROFILING_DIRECTORY)",
+        )
+        parser.add_argument(
+            "--endpoint", help="Report only this endpoint, e.g. get-code"
+        )
+        parser.add_argument(
+            "--method", help="Report only this 2FA method, e.g. totp"
+        )
+        parser.add_argument(
+            "--sort",
+            default="cumulative",
+            choices=sorted(pstats.Stats.sort_arg_dict_default),
+            help="Sort order of the functions (default: cumulative)",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=25,
+            help="Number of functions to print per report (default: 25)",
+        )
+        parser.add_argument(
+            "--dump-directory",
+            help="Also write the merged profiles to this directory",
+        )
+
+    def handle(self, *args, **options):
+        directory = options["directory"] or api_settings.PROFILING_DIRECTORY
+        if not directory or not os.path.isdir(directory):
+            raise CommandError("No profile directory found")
+        groups = self._group_profiles(directory, options)
+        if not groups:
+            self.stdout.write("No profiles found")
+            return
+        for (endpoint, method), paths in sorted(groups.items()):
+            stats = pstats.Stats(*paths, stream=self.stdout)
+            self.stdout.write(
+                f"=== {endpoint} ({method}): {len(paths)} requests, "
+                f"{stats.total_tt / len(paths) * 1000:.2f} ms per request"
+            )
+            if options["dump_directory"]:
+                self._dump(stats, options["dump_directory"], endpoint, method)
+            stats.strip_dirs().sort_stats(options["sort"])
+            stats.print_stats(options["limit"])
+
+    def _group_profiles(self, directory, options):
+        groups = {}
+        for profile in iter_profile_files(directory):
+            if options["endpoint"] not in {None, profile.endpoint}:
+                continue
+            if options["method"] not in {None, profile.method}:
+                continue
+            key = (profile.endpoint, profile.method)
+            groups.setdefault(key, []).append(profile.path)
+        return groups
+
+    def _dump(self, stats, dump_directory, endpoint, method):
+        os.makedirs(dump_directory, exist_ok=True)
+        path = os.path.join(dump_directory, f"{endpoint}.{method}.prof")
+        stats.dump_stats(path)
+        self.stdout.write(f"Merged profile written to {path}")
@@ -0,0 +1,21 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from ...stats import get_2fa_stats
+
+
+class Command(BaseCommand):
+    help = "Print the number of users per 2FA method as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--no-cache",
+            action="store_false",
+            dest="use_cache",
+            help="Recompute the statistics instead of using cached ones",
+        )
+
+    def handle(self, *args, **options):
+        stats = get_2fa_stats(use_cache=options["use_cache"])
+        self.stdout.write(json.dumps(stats, sort_keys=True))
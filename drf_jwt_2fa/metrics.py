@@ -0,0 +1,388 @@
+"""
+Prometheus metrics of the 2FA flow.
+
+The metrics are recorded when the ``METRICS_ENABLED`` setting is true,
+and they are rendered in the Prometheus text exposition format by
+:func:`render_metrics` for the ``metrics/`` endpoint.
+
+Each process stores its values to its own file of float64 values, which
+is memory-mapped, so that recording a value is a dictionary lookup and
+a write to the mapped memory under an uncontended lock.  When the
+``METRICS_DIRECTORY`` setting is set, the files are created to that
+directory and the values of all processes, including the exited ones,
+are summed when rendering.  This makes the metrics work with
+multi-process servers like gunicorn without an external agent.  The
+directory should be emptied when the server is (re)started.  Without a
+directory the values are kept in anonymous memory of the process.
+"""
+
+import bisect
+import contextlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from collections.abc import Iterator, Sequence
+
+from .settings import api_settings
+
+_HEADER = struct.Struct("<II")  # Used bytes, reserved
+_KEY_LENGTH = struct.Struct("<I")
+_VALUE = struct.Struct("<d")
+_INITIAL_SIZE = 64 * 1024
+
+
+class ValueFile:
+    """
+    Memory-mapped file of named float64 values.
+
+    The file starts with the number of used bytes, followed by entries
+    of a key length, a UTF-8 key padded to 8 bytes and a value.  A new
+    entry is written before the used bytes are updated, so a reader
+    never sees a partial entry.  Only a single process writes to a file.
+
+    An existing file is continued, so that the values are kept when a
+    new process reuses the process id, and thus the file, of an exited
+    one.
+
+    :param path: Path of the file, or None for anonymous memory
+    """
+
+    def __init__(self, path: str | None) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._positions: dict[str, int] = {}
+        self._open(_INITIAL_SIZE)
+        self._load_entries()
+
+    def increment(self, key: str, amount: float = 1.0) -> None:
+        """
+        Increment the value of given key.
+        """
+        with self._lock:
+            position = self._positions.get(key)
+            if position is None:
+                position = self._add_entry(key)
+            (value,) = _VALUE.unpack_from(self._mmap, position)
+            _VALUE.pack_into(self._mmap, position, value + amount)
+
+    def read_values(self) -> dict[str, float]:
+        """
+        Read all the values of the file.
+        """
+        return read_values(self._mmap)
+
+    def close(self) -> None:
+        self._mmap.close()
+
+    def _open(self, size: int) -> None:
+        if self.path is None:
+            self._mmap = mmap.mmap(-1, size)
+        else:
+            with open(self.path, "a+b") as file:
+                size = max(size, os.fstat(file.fileno()).st_size)
+                file.truncate(size)
+                self._mmap = mmap.mmap(file.fileno(), size)
+
+    def _load_entries(self) -> None:
+        (used, _reserved) = _HEADER.unpack_from(self._mmap, 0)
+        if not _HEADER.size <= used <= len(self._mmap):
+            used = _HEADER.size  # New or truncated file
+        for key, value_position in _iter_entries(self._mmap, used):
+            self._positions[key] = value_position
+        self._used = used
+        _HEADER.pack_into(self._mmap, 0, self._used, 0)
+
+    def _add_entry(self, key: str) -> int:
+        encoded = key.encode("utf-8")
+        padding = -(_KEY_LENGTH.size + len(encoded)) % 8
+        entry_size = _KEY_LENGTH.size + len(encoded) + padding + _VALUE.size
+        if self._used + entry_size > len(self._mmap):
+            self._grow(self._used + entry_size)
+        position = self._used
+        _KEY_LENGTH.pack_into(self._mmap, position, len(encoded))
+        key_position = position + _KEY_LENGTH.size
+        self._mmap[key_position : key_position + len(encoded)] = encoded
+        value_position = position + entry_size - _VALUE.size
+        _VALUE.pack_into(self._mmap, value_position, 0.0)
+        self._used += entry_size
+        _HEADER.pack_into(self._mmap, 0, self._used, 0)
+        self._positions[key] = value_position
+        return value_position
+
+    def _grow(self, needed: int) -> None:
+        size = len(self._mmap)
+        while size < needed:
+            size *= 2
+        if self.path is None:
+            old = self._mmap
+            self._mmap = mmap.mmap(-1, size)
+            self._mmap[: self._used] = old[: self._used]
+            old.close()
+        else:
+            self._mmap.close()
+            self._open(size)
+
+
+def read_values(data: bytes | mmap.mmap) -> dict[str, float]:
+    """
+    Read the values from the contents of a value file.
+    """
+    if len(data) < _HEADER.size:
+        return {}
+    (used, _reserved) = _HEADER.unpack_from(data, 0)
+    return {
+        key: _VALUE.unpack_from(data, value_position)[0]
+        for key, value_position in _iter_entries(data, used)
+    }
+
+
+def _iter_entries(
+    data: bytes | mmap.mmap, used: int
+) -> Iterator[tuple[str, int]]:
+    # Yield the keys and the value positions of the used bytes
+    position = _HEADER.size
+    while position < min(used, len(data)):
+        (key_length,) = _KEY_LENGTH.unpack_from(data, position)
+        key_position = position + _KEY_LENGTH.size
+        key = bytes(data[key_position : key_position + key_length])
+        padding = -(_KEY_LENGTH.size + key_length) % 8
+        value_position = key_position + key_length + padding
+        yield (key.decode("utf-8"), value_position)
+        position = value_position + _VALUE.size
+
+
+class _Storage:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._file: ValueFile | None = None
+        self._directory: str | None = None
+        os.register_at_fork(after_in_child=self._reset)
+
+    def get_file(self) -> ValueFile:
+        directory = api_settings.METRICS_DIRECTORY
+        value_file = self._file
+        if value_file is not None and self._directory == directory:
+            return value_file
+        with self._lock:
+            if self._file is None or self._directory != directory:
+                self._file = self._open(directory)
+                self._directory = directory
+            return self._file
+
+    def collect(self) -> dict[str, float]:
+        directory = api_settings.METRICS_DIRECTORY
+        if directory is None:
+            return self.get_file().read_values()
+        totals: dict[str, float] = {}
+        for name in sorted(os.listdir(directory)):
+            if not (name.startswith("jwt2fa_") and name.endswith(".db")):
+                continue
+            with open(os.path.join(directory, name), "rb") as file:
+                values = read_values(file.read())
+            for key, value in values.items():
+                totals[key] = totals.get(key, 0.0) + value
+        return totals
+
+    def _open(self, directory: str | None) -> ValueFile:
+        if directory is None:
+            return ValueFile(None)
+        os.makedirs(directory, exist_ok=True)
+        return ValueFile(os.path.join(directory, f"jwt2fa_{os.getpid()}.db"))
+
+    def _reset(self) -> None:
+        # The child process must not write to the file of its parent
+        self._lock = threading.Lock()
+        self._file = None
+
+
+_storage = _Storage()
+
+
+class Metric:
+    """
+    Base class of the metrics.
+
+    :param name: Name of the metric
+    :param documentation: Help text of the metric
+    :param label_names: Names of the labels of the metric
+    """
+
+    type_name = ""
+
+    def __init__(
+        self, name: str, documentation: str, label_names: Sequence[str]
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._keys: dict[tuple[object, ...], str] = {}
+        _registry.append(self)
+
+    def get_family_name(self) -> str:
+        return self.name
+
+    def render_samples(
+        self, labels: list[tuple[str, str]], values: dict[str, float]
+    ) -> Iterator[str]:  # pragma: no cover
+        raise NotImplementedError
+
+    def _get_key(self, suffix: str, labels: dict[str, str]) -> str:
+        cache_key = (suffix, *labels.items())
+        key = self._keys.get(cache_key)
+        if key is None:
+            if set(labels) != set(self.label_names):
+                raise ValueError(f"Labels must be {self.label_names}")
+            label_values = [str(labels[x]) for x in self.label_names]
+            key = json.dumps([self.name, suffix, label_values])
+            self._keys[cache_key] = key
+        return key
+
+
+class Counter(Metric):
+    """
+    Counter metric.
+    """
+
+    type_name = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        if not api_settings.METRICS_ENABLED:
+            return
+        key = self._get_key("total", labels)
+        _storage.get_file().increment(key, amount)
+
+    def get_family_name(self) -> str:
+        return f"{self.name}_total"
+
+    def render_samples(
+        self, labels: list[tuple[str, str]], values: dict[str, float]
+    ) -> Iterator[str]:
+        yield _render_line(f"{self.name}_total", labels, values["total"])
+
+
+class Histogram(Metric):
+    """
+    Histogram metric.
+
+    Each observation increments only the count of its own bucket, and
+    the buckets are made cumulative when rendering.
+
+    :param buckets: Upper bounds of the buckets, in increasing order
+    """
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str],
+        buckets: Sequence[float],
+    ) -> None:
+        super().__init__(name, documentation, label_names)
+        self.buckets = (*sorted(map(float, buckets)), float("inf"))
+
+    def observe(self, value: float, **labels: str) -> None:
+        if not api_settings.METRICS_ENABLED:
+            return
+        bucket = self.buckets[bisect.bisect_left(self.buckets, value)]
+        value_file = _storage.get_file()
+        value_file.increment(self._get_key(f"bucket:{bucket}", labels))
+        value_file.increment(self._get_key("sum", labels), value)
+
+    def render_samples(
+        self, labels: list[tuple[str, str]], values: dict[str, float]
+    ) -> Iterator[str]:
+        count = 0.0
+        for bucket in self.buckets:
+            count += values.get(f"bucket:{bucket}", 0.0)
+            le = "+Inf" if bucket == float("inf") else repr(bucket)
+            bucket_labels = [*labels, ("le", le)]
+            yield _render_line(f"{self.name}_bucket", bucket_labels, count)
+        yield _render_line(f"{self.name}_sum", labels, values.get("sum", 0.0))
+        yield _render_line(f"{self.name}_count", labels, count)
+
+    @contextlib.contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """
+        Observe the duration of the block in seconds.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+_registry: list[Metric] = []
+
+
+def render_metrics() -> str:
+    """
+    Render the metrics in the Prometheus text exposition format.
+    """
+    samples: dict[str, dict[tuple[str, ...], dict[str, float]]] = {}
+    for key, value in _storage.collect().items():
+        (name, suffix, label_values) = json.loads(key)
+        by_labels = samples.setdefault(name, {})
+        by_labels.setdefault(tuple(label_values), {})[suffix] = value
+    lines = []
+    for metric in _registry:
+        family = metric.get_family_name()
+        lines.append(f"# HELP {family} {metric.documentation}")
+        lines.append(f"# TYPE {family} {metric.type_name}")
+        for label_values, values in sorted(
+            samples.get(metric.name, {}).items()
+        ):
+            labels = list(zip(metric.label_names, label_values, strict=True))
+            lines.extend(metric.render_samples(labels, values))
+    return "\n".join(lines) + "\n"
+
+
+def _render_line(
+    name: str, labels: list[tuple[str, str]], value: float
+) -> str:
+    if labels:
+        label_text = ",".join(f'{k}="{_escape(v)}"' for (k, v) in labels)
+        name = f"{name}{{{label_text}}}"
+    return f"{name} {value!r}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+CODE_TOKENS_ISSUED = Counter(
+    "jwt2fa_code_tokens_issued",
+    "Number of issued code tokens by 2FA method.",
+    ["method"],
+)
+CODE_SENDS = Counter(
+    "jwt2fa_code_sends",
+    "Number of verification code sends by outcome.",
+    ["outcome"],
+)
+AUTH_ERRORS = Counter(
+    "jwt2fa_auth_errors",
+    "Number of rejected 2FA requests by error code.",
+    ["error"],
+)
+THROTTLED_REQUESTS = Counter(
+    "jwt2fa_throttled_requests",
+    "Number of throttled 2FA requests by throttle.",
+    ["throttle"],
+)
+AUDIT_EVENTS_DROPPED = Counter(
+    "jwt2fa_audit_events_dropped",
+    "Number of audit events dropped because of a full buffer.",
+    [],
+)
+PHASE_DURATION = Histogram(
+    "jwt2fa_phase_duration_seconds",
+    "Duration of the phases of the 2FA flow in seconds.",
+    ["phase"],
+    buckets=[0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10],
+)
@@ -0,0 +1,69 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("drf_jwt_2fa", "0002_recoverycode"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AuditEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "event_type",
+                    models.CharField(
+                        choices=[
+                            ("code-issued", "Code token issued"),
+                            ("auth-failed", "Verification failed"),
+                            ("locked-out", "Verification attempts locked out"),
+                            ("totp-enrolled", "TOTP enrolled"),
+                            ("method-changed", "Preferred 2FA method changed"),
+                        ],
+                        max_length=32,
+                        verbose_name="event type",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        db_index=True, verbose_name="created at"
+                    ),
+                ),
+                (
+                    "user_pk",
+                    models.CharField(
+                        blank=True,
+                        db_index=True,
+                        max_length=64,
+                        verbose_name="user",
+                    ),
+                ),
+                (
+                    "client_ident",
+                    models.CharField(
+                        blank=True, max_length=64, verbose_name="client"
+                    ),
+                ),
+                (
+                    "data",
+                    models.JSONField(
+                        blank=True, default=dict, verbose_name="data"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "audit event",
+                "verbose_name_plural": "audit events",
+            },
+        ),
+    ]
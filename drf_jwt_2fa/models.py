@@ -1,11 +1,14 @@
 from django.conf import settings
 from django.contrib.auth.base_user import AbstractBaseUser
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from .recovery_codes import get_recovery_code_digest
 from .settings import api_settings
 from .totp import make_sure_is_valid_totp_secret
 from .totp_encryption import decrypt_totp_secret, encrypt_totp_secret
+from .user_cache import invalidate_cached_user
 
 
 class TwoFactorAuthMethod(models.TextChoices):
@@ -13,6 +16,7 @@ class TwoFactorAuthMethod(models.TextChoices):
     NO_2FA = "no-2fa", _("No 2FA in use")
     CODE_SENDER = "code-sender", _("Code via sender (e.g. e-mail or SMS)")
     TOTP = "totp", _("TOTP (Time-based One-Time Password)")
+    RECOVERY_CODE = "recovery-code", _("Recovery code")
 
 
 class UserTwoFactorAuthData(models.Model):
@@ -42,6 +46,11 @@ class UserTwoFactorAuthData(models.Model):
     :meth:`get_pending_totp_secret`, and :meth:`set_pending_totp_secret`
     to read and write the secrets; they handle encryption and decryption
     transparently.
+
+    The enrollment endpoints write the record with the ``*_of_user``
+    class methods instead, which do each change with a single
+    conditional UPDATE statement, so that concurrent requests cannot
+    overwrite each other's changes.
     """
 
     user = models.OneToOneField(
@@ -105,6 +114,154 @@ class UserTwoFactorAuthData(models.Model):
             return TwoFactorAuthMethod(api_settings.FALLBACK_2FA_METHOD)
         return TwoFactorAuthMethod(d.preferred_2fa_auth)
 
+    @classmethod
+    def set_pending_totp_secret_of_user(
+        cls, user: AbstractBaseUser, secret: str
+    ) -> None:
+        """
+        Store a new pending TOTP secret for user.
+
+        Create the record if the user has none.
+        """
+        data = cls()  # Only for encrypting the secret
+        data.set_pending_totp_secret(secret)
+        pending = data.encrypted_totp_secret_pending
+        cls._upsert(user, encrypted_totp_secret_pending=pending)
+
+    @classmethod
+    def get_encrypted_totp_secret_of_user(cls, user: AbstractBaseUser) -> str:
+        """
+        Get the encrypted active TOTP secret of user.
+
+        Return an empty string if there is no active TOTP secret.
+        """
+        values = cls.objects.filter(user=user).values_list(
+            "encrypted_totp_secret", flat=True
+        )
+        return values.first() or ""
+
+    @classmethod
+    def get_encrypted_pending_totp_secret_of_user(
+        cls, user: AbstractBaseUser
+    ) -> str:
+        """
+        Get the encrypted pending TOTP secret of user.
+
+        Return an empty string if there is no pending TOTP secret.
+        """
+        values = cls.objects.filter(user=user).values_list(
+            "encrypted_totp_secret_pending", flat=True
+        )
+        return values.first() or ""
+
+    @classmethod
+    def activate_pending_totp_secret_of_user(
+        cls, user: AbstractBaseUser, encrypted_pending_secret: str
+    ) -> bool:
+        """
+        Activate the pending TOTP secret of user and switch to TOTP.
+
+        The pending secret is activated only if it is still the given
+        encrypted value, i.e. it was not replaced or activated since it
+        was read.  Return whether the secret was activated.
+        """
+        if not encrypted_pending_secret:
+            return False
+        updated = cls.objects.filter(
+            user=user,
+            encrypted_totp_secret_pending=encrypted_pending_secret,
+        ).update(
+            encrypted_totp_secret=encrypted_pending_secret,
+            encrypted_totp_secret_pending="",
+            preferred_2fa_auth=TwoFactorAuthMethod.TOTP,
+        )
+        if updated:
+            invalidate_cached_user(user)
+        return bool(updated)
+
+    @classmethod
+    def activate_totp_secret_of_user(
+        cls,
+        user: AbstractBaseUser,
+        secret: str,
+        replaced_encrypted_secret: str,
+    ) -> bool:
+        """
+        Activate given TOTP secret for user and switch to TOTP.
+
+        Used when the pending secret is not stored, but carried in an
+        enrollment ticket.  The secret is activated only if the active
+        secret is still the given encrypted value, i.e. no other secret
+        was activated since it was read.  Any stored pending secret is
+        cleared.  Return whether the secret was activated.
+        """
+        data = cls()  # Only for encrypting the secret
+        data.set_totp_secret(secret)
+        values = {
+            "encrypted_totp_secret": data.encrypted_totp_secret,
+            "encrypted_totp_secret_pending": "",
+            "preferred_2fa_auth": TwoFactorAuthMethod.TOTP,
+        }
+        updated = cls.objects.filter(
+            user=user, encrypted_totp_secret=replaced_encrypted_secret
+        ).update(**values)
+        if updated:
+            invalidate_cached_user(user)
+            return True
+        if replaced_encrypted_secret:
+            return False
+        try:
+            with transaction.atomic():
+                cls.objects.create(user=user, **values)
+        except IntegrityError:
+            # Created by a concurrent request
+            return False
+        return True
+
+    @classmethod
+    def set_preferred_2fa_method_of_user(
+        cls, user: AbstractBaseUser, method: TwoFactorAuthMethod
+    ) -> bool:
+        """
+        Set the preferred 2FA method of user.
+
+        Switching to TOTP requires an active TOTP secret which can be
+        decrypted with the current key.  The UPDATE statement checks
+        that the secret is still the one that was decrypted, so that it
+        cannot be replaced in between.  Return whether the method was
+        set.
+        """
+        if method != TwoFactorAuthMethod.TOTP:
+            cls._upsert(user, preferred_2fa_auth=method)
+            return True
+        encrypted_secret = (
+            cls.objects
+            .filter(user=user)
+            .values_list("encrypted_totp_secret", flat=True)
+            .first()
+        )
+        if not encrypted_secret or not decrypt_totp_secret(encrypted_secret):
+            return False
+        updated = cls.objects.filter(
+            user=user, encrypted_totp_secret=encrypted_secret
+        ).update(preferred_2fa_auth=method)
+        if updated:
+            invalidate_cached_user(user)
+        return bool(updated)
+
+    @classmethod
+    def _upsert(cls, user: AbstractBaseUser, **values: str) -> None:
+        if cls.objects.filter(user=user).update(**values):
+            invalidate_cached_user(user)
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(user=user, **values)
+        except IntegrityError:
+            # Created by a concurrent request, so update it instead
+            cls.objects.filter(user=user).update(**values)
+            invalidate_cached_user(user)
+
     def get_totp_secret(self) -> str:
         """
         Return the decrypted TOTP secret.
@@ -133,3 +290,140 @@ class UserTwoFactorAuthData(models.Model):
             make_sure_is_valid_totp_secret(val)
         encrypted = encrypt_totp_secret(val) if val else ""
         self.encrypted_totp_secret_pending = encrypted
+
+
+class RecoveryCode(models.Model):
+    """
+    A one-time recovery code of a user.
+
+    Only a keyed HMAC digest of the code is stored (see
+    :mod:`drf_jwt_2fa.recovery_codes`).  The digest is unique, so a code
+    is verified and marked as used with a single UPDATE statement that
+    looks up the digest from the index.
+    """
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="recovery_codes",
+        verbose_name=_("user"),
+    )
+    digest = models.CharField(
+        max_length=64,
+        unique=True,
+        verbose_name=_("digest"),
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name=_("created at"),
+    )
+    used_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_("used at"),
+    )
+
+    class Meta:
+        verbose_name = _("recovery code")
+        verbose_name_plural = _("recovery codes")
+
+    def __str__(self):
+        state = "used" if self.used_at else "unused"
+        return f"{self.user} ({state})"
+
+    @classmethod
+    def replace_codes_of_user(
+        cls, user: AbstractBaseUser, codes: list[str]
+    ) -> None:
+        """
+        Replace the recovery codes of user with given codes.
+
+        The old codes are deleted and the new ones are inserted with a
+        single bulk insert.
+        """
+        user_id = str(user.pk)
+        with transaction.atomic():
+            cls.objects.filter(user=user).delete()
+            # Named explicitly, since the stubs type cls() as the model,
+            # which does not match the Self of cls.objects
+            RecoveryCode.objects.bulk_create([
+                RecoveryCode(
+                    user_id=user.pk,
+                    digest=get_recovery_code_digest(user_id, code),
+                )
+                for code in codes
+            ])
+
+    @classmethod
+    def use_code_of_user(cls, user_id: str, code: str) -> bool:
+        """
+        Mark an unused recovery code of user as used.
+
+        Return whether an unused code was found.  Of concurrent uses of
+        the same code only one succeeds.
+        """
+        digest = get_recovery_code_digest(user_id, code)
+        updated = cls.objects.filter(
+            digest=digest, user_id=user_id, used_at__isnull=True
+        ).update(used_at=timezone.now())
+        return bool(updated)
+
+    @classmethod
+    def count_unused_codes_of_user(cls, user: AbstractBaseUser) -> int:
+        """
+        Count the unused recovery codes of user.
+        """
+        return cls.objects.filter(user=user, used_at__isnull=True).count()
+
+
+class AuditEventType(models.TextChoices):
+    CODE_ISSUED = "code-issued", _("Code token issued")
+    AUTH_FAILED = "auth-failed", _("Verification failed")
+    LOCKED_OUT = "locked-out", _("Verification attempts locked out")
+    TOTP_ENROLLED = "totp-enrolled", _("TOTP enrolled")
+    METHOD_CHANGED = "method-changed", _("Preferred 2FA method changed")
+
+
+class AuditEvent(models.Model):
+    """
+    A security audit event of the 2FA flow.
+
+    The events are emitted with :mod:`drf_jwt_2fa.audit`, which buffers
+    them in memory and inserts them in batches.  The user is stored as
+    the primary key string instead of a foreign key, so that the events
+    are kept when the user is deleted and the inserts do not need to
+    check the user table.
+    """
+
+    event_type = models.CharField(
+        max_length=32,
+        choices=AuditEventType.choices,
+        verbose_name=_("event type"),
+    )
+    created_at = models.DateTimeField(
+        db_index=True,
+        verbose_name=_("created at"),
+    )
+    user_pk = models.CharField(
+        max_length=64,
+        blank=True,
+        db_index=True,
+        verbose_name=_("user"),
+    )
+    client_ident = models.CharField(
+        max_length=64,
+        blank=True,
+        verbose_name=_("client"),
+    )
+    data = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name=_("data"),
+    )
+
+    class Meta:
+        verbose_name = _("audit event")
+        verbose_name_plural = _("audit events")
+
+    def __str__(self):
+        return f"{self.created_at:%Y-%m-%d %H:%M:%S} {self.event_type}"
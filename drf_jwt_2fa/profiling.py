@@ -0,0 +1,145 @@
+"""
+Sampled profiling of the 2FA endpoints.
+
+When the ``PROFILING_SAMPLE_RATE`` setting is above zero, that fraction
+of the requests to the views with :class:`ProfilingMixin` are profiled
+with :mod:`cProfile`.  The profile of each request is written to
+``PROFILING_DIRECTORY`` with the name of the endpoint and the 2FA method
+in the file name, and the oldest files are removed when there are more
+than ``PROFILING_MAX_FILES`` of them.  The ``jwt2fa_profile_report``
+management command merges the profiles to a report per endpoint and
+method.
+
+The profiles are taken from the real traffic, so they include the costs
+of the configured password hashers, caches and code senders.  Only the
+thread handling the request is profiled, so e.g. the background code
+delivery is not included.  A failure to write a profile is logged and
+does not fail the request.
+"""
+
+import cProfile
+import logging
+import os
+import random
+import time
+from collections.abc import Iterator
+from typing import Any, NamedTuple
+
+from django.http import HttpRequest, HttpResponseBase
+
+from .settings import api_settings
+
+LOG = logging.getLogger(__name__)
+
+PROFILE_SUFFIX = ".prof"
+
+
+class ProfileFile(NamedTuple):
+    path: str
+    endpoint: str
+    method: str
+
+
+class ProfilingMixin:
+    """
+    Profile a sample of the requests to the view.
+
+    The 2FA method of the profile is given by
+    :meth:`get_profiled_2fa_method`, which the view may override.
+    """
+
+    profiled_2fa_method = "unknown"
+
+    def dispatch(
+        self, request: HttpRequest, *args: Any, **kwargs: Any
+    ) -> HttpResponseBase:
+        if not _should_profile():
+            return super().dispatch(request, *args, **kwargs)  # type: ignore
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # Another profiler is active
+            return super().dispatch(request, *args, **kwargs)  # type: ignore
+        try:
+            response = super().dispatch(request, *args, **kwargs)  # type: ignore
+        finally:
+            profiler.disable()
+        # The view may have replaced the request, e.g. with a DRF request
+        view_request = getattr(self, "request", request)
+        endpoint = self._get_endpoint_name(request)
+        try:
+            method = self.get_profiled_2fa_method(view_request, response)
+            write_profile(profiler, endpoint, method)
+        except Exception:
+            LOG.exception("Writing the profile of %s failed", endpoint)
+        return response
+
+    def get_profiled_2fa_method(
+        self, request: HttpRequest, response: HttpResponseBase
+    ) -> str:
+        """
+        Get the 2FA method of a profiled request for tagging the profile.
+        """
+        return self.profiled_2fa_method
+
+    def _get_endpoint_name(self, request: HttpRequest) -> str:
+        match = request.resolver_match
+        if match is not None and match.url_name:
+            return match.url_name
+        return type(self).__name__
+
+
+def _should_profile() -> bool:
+    rate = api_settings.PROFILING_SAMPLE_RATE
+    return rate > 0 and random.random() < rate  # noqa: S311
+
+
+def write_profile(
+    profiler: cProfile.Profile, endpoint: str, method: str
+) -> str:
+    """
+    Write a profile to PROFILING_DIRECTORY and remove the oldest ones.
+
+    Return the path of the written file.
+    """
+    directory = api_settings.PROFILING_DIRECTORY
+    if not directory:
+        raise ValueError("PROFILING_DIRECTORY is not set")
+    os.makedirs(directory, exist_ok=True)
+    name = ".".join([
+        f"{time.time_ns():020d}",
+        str(os.getpid()),
+        _sanitize(endpoint),
+        _sanitize(method),
+    ])
+    path = os.path.join(directory, name + PROFILE_SUFFIX)
+    profiler.dump_stats(path)
+    _remove_oldest_profiles(directory, api_settings.PROFILING_MAX_FILES)
+    return path
+
+
+def iter_profile_files(directory: str) -> Iterator[ProfileFile]:
+    """
+    Iterate the profile files in the directory, the oldest first.
+    """
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(PROFILE_SUFFIX):
+            continue
+        parts = name.removesuffix(PROFILE_SUFFIX).split(".")
+        if len(parts) != 4:
+            continue
+        (_time, _pid, endpoint, method) = parts
+        yield ProfileFile(os.path.join(directory, name), endpoint, method)
+
+
+def _remove_oldest_profiles(directory: str, max_files: int) -> None:
+    paths = [x.path for x in iter_profile_files(directory)]
+    for path in paths[: max(len(paths) - max_files, 0)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # Removed by another process
+
+
+def _sanitize(value: str) -> str:
+    return "".join(x if x.isalnum() or x in "-_" else "_" for x in value)
@@ -0,0 +1,78 @@
+"""
+Random material for the code tokens.
+
+Generating a code token needs a verification code, a nonce and a jti.
+Drawing them with ``get_random_string`` and ``secrets.token_urlsafe``
+makes a call to the operating system's CSPRNG per character.  The
+:class:`RandomMaterial` draws a single block of random bytes instead
+and derives all of the values from it.
+"""
+
+import base64
+import os
+
+from django.utils.crypto import RANDOM_STRING_CHARS
+
+
+class RandomMaterial:
+    """
+    Block of random bytes to derive random values from.
+
+    The bytes are drawn with ``os.urandom`` in blocks of ``block_size``
+    bytes.  Each byte is used only once and a new block is drawn when
+    the current one runs out.
+
+    :param block_size:
+      Number of random bytes to draw at a time.  The default is enough
+      for a verification code, a nonce and a jti of the default sizes.
+    """
+
+    def __init__(self, block_size: int = 64) -> None:
+        self.block_size = block_size
+        self._data = b""
+        self._position = 0
+
+    def get_bytes(self, length: int) -> bytes:
+        """
+        Get given number of random bytes.
+        """
+        end = self._position + length
+        if end > len(self._data):
+            self._data = self._data[self._position :] + os.urandom(
+                max(length, self.block_size)
+            )
+            self._position = 0
+            end = length
+        result = self._data[self._position : end]
+        self._position = end
+        return result
+
+    def get_string(
+        self, length: int, allowed_chars: str = RANDOM_STRING_CHARS
+    ) -> str:
+        """
+        Get a random string of given length from the allowed characters.
+
+        Each character is picked with the same probability.  The random
+        integers are drawn from as few bytes as possible and the ones
+        that would make the result biased are rejected and redrawn.
+        """
+        num_chars = len(allowed_chars)
+        if num_chars < 1:
+            raise ValueError("Allowed characters must not be empty")
+        num_bytes = ((num_chars - 1).bit_length() + 7) // 8 or 1
+        space = 256**num_bytes
+        limit = space - space % num_chars
+        result: list[str] = []
+        while len(result) < length:
+            value = int.from_bytes(self.get_bytes(num_bytes), "big")
+            if value < limit:
+                result.append(allowed_chars[value % num_chars])
+        return "".join(result)
+
+    def get_token_urlsafe(self, num_bytes: int) -> str:
+        """
+        Get a random URL-safe text string like ``secrets.token_urlsafe``.
+        """
+        encoded = base64.urlsafe_b64encode(self.get_bytes(num_bytes))
+        return encoded.rstrip(b"=").decode("ascii")
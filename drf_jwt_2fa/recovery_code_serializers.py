@@ -0,0 +1,30 @@
+"""
+Serializer for generating recovery codes.
+"""
+
+from rest_framework import serializers
+
+from .models import RecoveryCode
+from .recovery_codes import generate_recovery_codes
+
+
+class GenerateRecoveryCodesSerializer(serializers.Serializer):
+    """
+    Serializer for the recovery code generation endpoint.
+
+    Generates a new batch of ``RECOVERY_CODE_COUNT`` recovery codes for
+    the authenticated user.  The new codes replace any earlier ones.
+
+    Call ``save()`` to persist the digests of the codes and obtain the
+    result dict with the plaintext codes in the ``codes`` key.  The
+    plaintext codes are not stored and cannot be shown again.
+    """
+
+    def validate(self, attrs):
+        return attrs
+
+    def save(self, **kwargs):
+        user = self.context["request"].user
+        codes = generate_recovery_codes()
+        RecoveryCode.replace_codes_of_user(user, codes)
+        return {"codes": codes}
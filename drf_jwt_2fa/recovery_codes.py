@@ -0,0 +1,79 @@
+"""
+Helpers for the recovery codes.
+
+The recovery codes are one-time codes for logging in when the normal
+second factor, e.g. the phone with the authenticator app, is lost.  The
+codes are stored as keyed HMAC digests rather than slow password hashes:
+the codes are random and long enough not to need key stretching, and a
+deterministic digest can be looked up from a unique index, so verifying
+a code is a single indexed query no matter how many codes the user has.
+"""
+
+import hashlib
+import hmac
+
+from .random_material import RandomMaterial
+from .settings import api_settings
+
+_GROUP_LENGTH = 5
+
+
+def generate_recovery_codes(count: int | None = None) -> list[str]:
+    """
+    Generate a batch of new recovery codes.
+
+    The codes are formatted in dash separated groups for readability.
+    The dashes are optional when the code is entered.
+    """
+    if count is None:
+        count = api_settings.RECOVERY_CODE_COUNT
+    length = api_settings.RECOVERY_CODE_LENGTH
+    chars = api_settings.RECOVERY_CODE_CHARACTERS
+    material = RandomMaterial(block_size=count * length)
+    return [
+        format_recovery_code(material.get_string(length, chars))
+        for _ in range(count)
+    ]
+
+
+def format_recovery_code(code: str) -> str:
+    """
+    Format a recovery code in dash separated groups of 5 characters.
+    """
+    groups = range(0, len(code), _GROUP_LENGTH)
+    return "-".join(code[i : i + _GROUP_LENGTH] for i in groups)
+
+
+def normalize_recovery_code(code: str) -> str:
+    """
+    Normalize an entered recovery code.
+
+    Remove the whitespace and dashes and convert to upper case.
+    """
+    return "".join(code.split()).replace("-", "").upper()
+
+
+def looks_like_recovery_code(code: str) -> bool:
+    """
+    Check if given code has the length and characters of a recovery code.
+
+    Used to skip the database lookup for the other kinds of codes.
+    """
+    normalized = normalize_recovery_code(code)
+    chars = api_settings.RECOVERY_CODE_CHARACTERS
+    return len(normalized) == api_settings.RECOVERY_CODE_LENGTH and all(
+        x in chars for x in normalized
+    )
+
+
+def get_recovery_code_digest(user_id: str, code: str) -> str:
+    """
+    Get the digest of a recovery code of given user.
+
+    The digest is a HMAC-SHA256 of the user id and the normalized code
+    keyed with ``RECOVERY_CODE_HMAC_KEY``.  The user id is included, so
+    that the digests of different users never collide.
+    """
+    message = f"{user_id}:{normalize_recovery_code(code)}".encode()
+    key = api_settings.RECOVERY_CODE_HMAC_KEY
+    return hmac.new(key, message, hashlib.sha256).hexdigest()
@@ -0,0 +1,224 @@
+"""
+Revocation of issued tokens.
+
+The jtis of the revoked tokens are stored to Bloom filters in the token
+state cache.  The filters are bucketed by the expiration time of the
+tokens, so that a whole bucket expires from the cache when all of its
+tokens have expired.  The memory usage is thus bounded by the number of
+revocations within the token lifetime.
+
+Each process keeps a snapshot of the filters in memory and refreshes it
+every ``REVOCATION_REFRESH_INTERVAL``, so checking a token is a few bit
+lookups.  A token revoked in another process is therefore rejected
+after at most one refresh interval.
+
+Note that a Bloom filter may give false positives: a token that is not
+revoked is rejected with a probability of at most
+``REVOCATION_FILTER_ERROR_RATE``, if the capacity is not exceeded.
+"""
+
+import datetime
+import functools
+import math
+import time
+from typing import Any
+
+from django.core.cache import BaseCache
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import Token
+
+from .bloom import BloomFilter, get_optimal_size
+from .caching import (
+    CacheLockTimeoutError,
+    cache_lock,
+    get_cache_key_prefix,
+    get_token_state_cache,
+)
+from .settings import api_settings
+
+
+class RevocationList:
+    """
+    Bloom filter based list of revoked tokens.
+
+    :param capacity:
+      Expected maximum number of revoked tokens per bucket.
+    :param error_rate:
+      Maximum false positive rate when the capacity is not exceeded.
+    :param bucket_seconds:
+      Length of the expiration time buckets in seconds.
+    :param max_lifetime_seconds:
+      Maximum lifetime of the checked tokens in seconds.
+    :param leeway_seconds:
+      How long the tokens are accepted after their expiration time.
+    :param refresh_interval:
+      How often the in-memory snapshot is refreshed, in seconds.
+    """
+
+    lock_timeout = 2
+    key_template = "{prefix}:revoked:{bucket}"
+    lock_key_template = "{prefix}:revoked_lock:{bucket}"
+
+    def __init__(
+        self,
+        capacity: int,
+        error_rate: float,
+        bucket_seconds: int,
+        max_lifetime_seconds: int,
+        leeway_seconds: int,
+        refresh_interval: float,
+    ) -> None:
+        (self.num_bits, self.num_hashes) = get_optimal_size(
+            capacity, error_rate
+        )
+        self.bucket_seconds = max(bucket_seconds, 1)
+        self.max_lifetime_seconds = max_lifetime_seconds
+        self.leeway_seconds = leeway_seconds
+        self.refresh_interval = refresh_interval
+        self._snapshot: dict[int, BloomFilter] = {}
+        self._snapshot_time = -math.inf
+
+    def revoke(self, jti: str, expires_at: int) -> None:
+        """
+        Revoke the token with given jti and expiration time.
+
+        The bucket is not written if the update took so long that the
+        lock may have expired, since another process could then be
+        updating it too and one of the revocations would be lost.
+
+        :raises CacheLockTimeoutError:
+          if the bucket stays locked or the lock may have expired
+        """
+        bucket = expires_at // self.bucket_seconds
+        (cache, key) = self._get_cache_and_key(bucket)
+        names = {"prefix": get_cache_key_prefix(), "bucket": bucket}
+        lock_key = self.lock_key_template.format(**names)
+        bucket_end = (bucket + 1) * self.bucket_seconds
+        ttl = max(bucket_end + self.leeway_seconds - int(time.time()), 1)
+        with cache_lock(cache, lock_key, timeout=self.lock_timeout):
+            locked_at = time.monotonic()
+            bloom = self._load_filter(cache.get(key))
+            bloom.add(jti.encode("utf-8"))
+            if time.monotonic() - locked_at > self.lock_timeout / 2:
+                raise CacheLockTimeoutError(lock_key)
+            cache.set(key, bloom.to_bytes(), timeout=ttl)
+        # Make the revocation visible in this process immediately
+        self._snapshot_time = -math.inf
+
+    def is_revoked(self, jti: str, expires_at: int) -> bool:
+        """
+        Check if the token with given jti and expiration time is revoked.
+        """
+        bloom = self._get_snapshot().get(expires_at // self.bucket_seconds)
+        return bloom is not None and jti.encode("utf-8") in bloom
+
+    def _get_snapshot(self) -> dict[int, BloomFilter]:
+        now = time.monotonic()
+        if now - self._snapshot_time >= self.refresh_interval:
+            self._snapshot = self._load_snapshot()
+            self._snapshot_time = now
+        return self._snapshot
+
+    def _load_snapshot(self) -> dict[int, BloomFilter]:
+        now = int(time.time())
+        first_bucket = (now - self.leeway_seconds) // self.bucket_seconds
+        last_bucket = (now + self.max_lifetime_seconds) // self.bucket_seconds
+        # The buckets are read with one call per cache, since there are
+        # many of them with the refresh token lifetime
+        keys_by_cache: dict[BaseCache, dict[str, int]] = {}
+        for bucket in range(first_bucket, last_bucket + 1):
+            (cache, key) = self._get_cache_and_key(bucket)
+            keys_by_cache.setdefault(cache, {})[key] = bucket
+        snapshot = {}
+        for cache, buckets in keys_by_cache.items():
+            for key, data in cache.get_many(list(buckets)).items():
+                snapshot[buckets[key]] = self._load_filter(data)
+        return snapshot
+
+    def _get_cache_and_key(self, bucket: int) -> tuple[BaseCache, str]:
+        cache = get_token_state_cache(f"revoked:{bucket}")
+        key = self.key_template.format(
+            prefix=get_cache_key_prefix(), bucket=bucket
+        )
+        return (cache, key)
+
+    def _load_filter(self, data: bytes | None) -> BloomFilter:
+        expected_size = (self.num_bits + 7) // 8
+        if data is None or len(data) != expected_size:
+            # Nothing stored yet, or stored with different settings
+            return BloomFilter(self.num_bits, self.num_hashes)
+        return BloomFilter(self.num_bits, self.num_hashes, data)
+
+
+def get_revocation_list() -> RevocationList | None:
+    """
+    Get the revocation list of this process.
+
+    Return None if the revocation is not enabled with the
+    ``REVOCATION_FILTER_CAPACITY`` setting.
+    """
+    capacity = api_settings.REVOCATION_FILTER_CAPACITY
+    if capacity is None:
+        return None
+    return _get_revocation_list(
+        capacity,
+        api_settings.REVOCATION_FILTER_ERROR_RATE,
+        int(api_settings.REVOCATION_BUCKET_TIME.total_seconds()),
+        _get_max_lifetime_seconds(),
+        _get_leeway_seconds(),
+        api_settings.REVOCATION_REFRESH_INTERVAL.total_seconds(),
+    )
+
+
+@functools.lru_cache(maxsize=1)
+def _get_revocation_list(*args: Any) -> RevocationList:
+    # Note: Cached by the settings, so that the snapshot is kept
+    return RevocationList(*args)
+
+
+def _get_max_lifetime_seconds() -> int:
+    lifetimes = [
+        jwt_settings.ACCESS_TOKEN_LIFETIME,
+        jwt_settings.REFRESH_TOKEN_LIFETIME,
+        jwt_settings.SLIDING_TOKEN_LIFETIME,
+        api_settings.ENROLLMENT_TOKEN_EXPIRATION_TIME,
+    ]
+    return math.ceil(max(x.total_seconds() for x in lifetimes))
+
+
+def _get_leeway_seconds() -> int:
+    leeway = jwt_settings.LEEWAY
+    if isinstance(leeway, datetime.timedelta):
+        return math.ceil(leeway.total_seconds())
+    return math.ceil(leeway)
+
+
+def revoke_token(token: Token) -> None:
+    """
+    Revoke given token.
+
+    :raises CacheLockTimeoutError:
+      if the revocation list stays locked or the lock may have expired
+    :raises ImproperlyConfigured: if the revocation is not enabled
+    """
+    revocation_list = get_revocation_list()
+    if revocation_list is None:
+        raise ImproperlyConfigured("Token revocation is not enabled")
+    revocation_list.revoke(token[jwt_settings.JTI_CLAIM], token["exp"])
+
+
+def is_token_revoked(token: Token) -> bool:
+    """
+    Check if given token is revoked.
+
+    Always return False if the revocation is not enabled.
+    """
+    revocation_list = get_revocation_list()
+    if revocation_list is None:
+        return False
+    jti = token.get(jwt_settings.JTI_CLAIM)
+    expires_at = token.get("exp")
+    if jti is None or expires_at is None:
+        return False
+    return revocation_list.is_revoked(jti, expires_at)
@@ -1,14 +1,69 @@
+import http.client
+import json
+import logging
+import os
+import queue
+import select
+import threading
+from collections.abc import Callable
+from urllib.parse import urlsplit
+
 from django.contrib.auth.models import AbstractBaseUser
 from django.core.mail import send_mail
 from django.utils.translation import gettext as _
 
+from .circuit_breaker import CircuitOpenError, get_circuit_breaker
+from .deadlines import Deadline, DeadlineExceededError, call_with_deadline
 from .settings import api_settings
 
+LOG = logging.getLogger(__name__)
+
 
 class CodeSendingError(Exception):
     pass
 
 
+class CodeSendingTimeoutError(CodeSendingError):
+    """
+    Code sending that timed out, so the code may or may not be sent.
+    """
+
+
+def get_code_sending_deadline() -> Deadline | None:
+    """
+    Get a deadline for sending a code by the ``CODE_SENDING_TIMEOUT``.
+    """
+    timeout = api_settings.CODE_SENDING_TIMEOUT
+    if timeout is None:
+        return None
+    return Deadline(timeout.total_seconds())
+
+
+def call_code_sender(
+    sender: Callable[..., None],
+    user: AbstractBaseUser,
+    code: str,
+    deadline: Deadline | None,
+) -> None:
+    """
+    Call given code sender within the deadline.
+
+    See :func:`drf_jwt_2fa.deadlines.call_with_deadline`.
+
+    :raises CodeSendingTimeoutError: if the deadline is exceeded
+    """
+    try:
+        call_with_deadline(
+            sender,
+            deadline,
+            user,
+            code,
+            max_threads=api_settings.CODE_SENDING_MAX_THREADS,
+        )
+    except DeadlineExceededError as error:
+        raise CodeSendingTimeoutError(_("Code sending timed out")) from error
+
+
 def send_verification_code_via_email(
     user: AbstractBaseUser, code: str
 ) -> None:
@@ -35,3 +90,317 @@ def send_verification_code_via_email(
 
     if not messages_sent:
         raise CodeSendingError(_("Unable to send e-mail"))
+
+
+def send_verification_code_via_channels(
+    user: AbstractBaseUser, code: str, deadline: Deadline | None = None
+) -> None:
+    """
+    Send the verification code via the first working channel.
+
+    The channels are the named code senders of ``CODE_SENDER_CHANNELS``
+    and they are tried in the order returned by
+    ``CODE_SENDER_CHANNELS_GETTER`` for the user.  Each channel is called
+    through its circuit breaker (see :mod:`drf_jwt_2fa.circuit_breaker`),
+    so a channel that is known to be failing or slow is skipped without
+    waiting for it.
+
+    The channels share the deadline: the remaining channels are not
+    tried when it has expired.  If a channel timed out and none
+    succeeded, ``CodeSendingTimeoutError`` is raised, since the code may
+    still have been sent.
+    """
+    channels = api_settings.CODE_SENDER_CHANNELS
+    names = api_settings.CODE_SENDER_CHANNELS_GETTER(user)
+    results = set()
+    for name in names:
+        sender = channels.get(name)
+        if sender is None:
+            LOG.warning("Unknown code sending channel: %s", name)
+            continue
+        if deadline is not None and deadline.expired:
+            results.add("timed out")
+            break
+        result = _send_via_channel(name, sender, user, code, deadline)
+        if result == "sent":
+            return
+        results.add(result)
+    if "timed out" in results:
+        raise CodeSendingTimeoutError(_("Code sending timed out"))
+    if "failed" in results:
+        raise CodeSendingError(_("All code sending channels failed"))
+    raise CodeSendingError(_("No code sending channel available"))
+
+
+def _send_via_channel(
+    name: str,
+    sender: Callable[..., None],
+    user: AbstractBaseUser,
+    code: str,
+    deadline: Deadline | None,
+) -> str:
+    breaker = get_circuit_breaker(name)
+    try:
+        breaker.call(call_code_sender, sender, user, code, deadline)
+    except CircuitOpenError:
+        LOG.info("Skipped code sending channel %s: circuit open", name)
+        return "skipped"
+    except CodeSendingTimeoutError:
+        LOG.warning("Code sending channel %s timed out", name)
+        return "timed out"
+    except CodeSendingError as error:
+        LOG.warning("Code sending channel %s failed: %s", name, error)
+        return "failed"
+    except Exception:
+        LOG.exception("Code sending channel %s failed", name)
+        return "failed"
+    return "sent"
+
+
+def send_verification_code_via_http(
+    user: AbstractBaseUser, code: str, deadline: Deadline | None = None
+) -> None:
+    """
+    Send the verification code by posting it to an HTTP gateway.
+
+    The ``HTTP_SENDER_PAYLOAD_TEMPLATE`` is rendered with the code and
+    the recipient, which is read from the ``HTTP_SENDER_RECIPIENT_FIELD``
+    attribute of the user, and posted as JSON to ``HTTP_SENDER_URL``.
+    The connections to the gateway are kept alive and reused, see
+    :class:`HttpConnectionPool`.  Failures, timeouts and non-2xx
+    responses are raised as ``CodeSendingError``.
+
+    The connect and read timeouts are capped to the given deadline.  A
+    read timeout is raised as ``CodeSendingTimeoutError``, since the
+    gateway may have received the request.
+    """
+    url = api_settings.HTTP_SENDER_URL
+    if not url:
+        raise CodeSendingError(_("No HTTP gateway URL configured"))
+
+    recipient = getattr(user, api_settings.HTTP_SENDER_RECIPIENT_FIELD, None)
+    if not recipient:
+        raise CodeSendingError(_("No phone number known"))
+
+    payload = _render_template(
+        api_settings.HTTP_SENDER_PAYLOAD_TEMPLATE,
+        code=code,
+        recipient=str(recipient),
+    )
+    headers = {
+        "Content-Type": "application/json",
+        **api_settings.HTTP_SENDER_HEADERS,
+    }
+    parts = urlsplit(url)
+    path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+    connect_timeout = api_settings.HTTP_SENDER_CONNECT_TIMEOUT.total_seconds()
+    read_timeout = api_settings.HTTP_SENDER_READ_TIMEOUT.total_seconds()
+    if deadline is not None:
+        if deadline.expired:
+            raise CodeSendingError(_("No time left for sending"))
+        connect_timeout = deadline.get_timeout(connect_timeout)
+        read_timeout = deadline.get_timeout(read_timeout)
+    pool = get_http_connection_pool(
+        url, max_size=api_settings.HTTP_SENDER_POOL_SIZE
+    )
+    try:
+        (status, _body) = pool.request(
+            "POST",
+            path,
+            json.dumps(payload).encode("utf-8"),
+            headers,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+        )
+    except TimeoutError as error:
+        raise CodeSendingTimeoutError(_("HTTP gateway timed out")) from error
+    except (OSError, http.client.HTTPException) as error:
+        raise CodeSendingError(_("HTTP gateway connection failed")) from error
+
+    if not 200 <= status < 300:
+        raise CodeSendingError(
+            _("HTTP gateway returned status {status}").format(status=status)
+        )
+
+
+def _render_template(template: object, **values: str) -> object:
+    if isinstance(template, str):
+        return template.format(**values)
+    if isinstance(template, dict):
+        return {k: _render_template(v, **values) for k, v in template.items()}
+    if isinstance(template, list):
+        return [_render_template(x, **values) for x in template]
+    return template
+
+
+class HttpConnectionPool:
+    """
+    Pool of keep-alive HTTP connections to a single origin.
+
+    The idle connections are kept in a LIFO queue of at most
+    ``max_size`` connections, so that the most recently used connection,
+    which is the least likely to be closed by the server, is reused
+    first.
+
+    A reused connection may have been closed by the server while idle.
+    Such a connection is detected and dropped before sending, when the
+    close is already seen on the socket.  Otherwise, if sending the
+    request on it fails, the request is retried once on a new
+    connection.  A request is never retried after it was sent, even if
+    the connection is closed before the response, since the gateway may
+    have sent the code already.
+    """
+
+    _stale_connection_errors = (ConnectionResetError, BrokenPipeError)
+
+    def __init__(
+        self, scheme: str, host: str, port: int | None, max_size: int
+    ) -> None:
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.max_size = max_size
+        self._idle: queue.LifoQueue[http.client.HTTPConnection] = (
+            queue.LifoQueue(maxsize=max(max_size, 1))
+        )
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        body: bytes,
+        headers: dict[str, str],
+        connect_timeout: float,
+        read_timeout: float,
+    ) -> tuple[int, bytes]:
+        """
+        Make a request and return the response status and body.
+
+        Connecting a new connection is limited by ``connect_timeout``
+        and each read by ``read_timeout`` seconds.
+
+        :raises ConnectionError: if connecting fails or times out
+        :raises TimeoutError: if reading the response times out
+        :raises OSError: if sending fails
+        :raises http.client.HTTPException: on an invalid response
+        """
+        for attempt in range(2):
+            (connection, reused) = self._get_connection()
+            try:
+                if connection.sock is None:
+                    self._connect(connection, connect_timeout)
+                connection.sock.settimeout(read_timeout)
+                connection.request(method, path, body=body, headers=headers)
+            except self._stale_connection_errors:
+                connection.close()
+                if reused and attempt == 0:
+                    continue  # Not sent, so it is safe to retry
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            try:
+                response = connection.getresponse()
+                data = response.read()
+            except BaseException:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._put_connection(connection)
+            return (response.status, data)
+        raise AssertionError("unreachable")  # pragma: no cover
+
+    def close(self) -> None:
+        """
+        Close all idle connections.
+        """
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _connect(
+        self, connection: http.client.HTTPConnection, timeout: float
+    ) -> None:
+        connection.timeout = timeout
+        try:
+            connection.connect()
+        except TimeoutError as error:
+            # Nothing was sent, so this is a connection failure
+            raise ConnectionError("Connecting timed out") from error
+
+    def _get_connection(self) -> tuple[http.client.HTTPConnection, bool]:
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                return (self._new_connection(), False)
+            if not _is_connection_dropped(connection):
+                return (connection, True)
+            connection.close()
+
+    def _new_connection(self) -> http.client.HTTPConnection:
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(self.host, self.port)
+        return http.client.HTTPConnection(self.host, self.port)
+
+    def _put_connection(self, connection: http.client.HTTPConnection) -> None:
+        if self.max_size < 1:
+            connection.close()
+            return
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+
+def _is_connection_dropped(connection: http.client.HTTPConnection) -> bool:
+    # An idle connection has nothing to read, unless the server has
+    # closed it
+    (readable, _writable, _errors) = select.select(
+        [connection.sock], [], [], 0
+    )
+    return bool(readable)
+
+
+_pools: dict[tuple[object, ...], HttpConnectionPool] = {}
+_pools_lock = threading.Lock()
+_pools_pid = os.getpid()
+
+
+def get_http_connection_pool(url: str, max_size: int) -> HttpConnectionPool:
+    """
+    Get the connection pool of this process for given URL and size.
+
+    The pools are dropped in a forked child process, so that the
+    connections of the parent are never shared.
+    """
+    global _pools_pid
+    parts = urlsplit(url)
+    if parts.scheme not in {"http", "https"} or not parts.hostname:
+        raise CodeSendingError(_("Invalid HTTP gateway URL"))
+    key = (parts.scheme, parts.hostname, parts.port, max_size)
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            _pools.clear()
+            _pools_pid = os.getpid()
+        pool = _pools.get(key)
+        if pool is None:
+            pool = HttpConnectionPool(
+                parts.scheme, parts.hostname, parts.port, max_size=max_size
+            )
+            _pools[key] = pool
+        return pool
+
+
+def close_http_connection_pools() -> None:
+    """
+    Close the idle connections of all pools of this process.
+    """
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
@@ -5,13 +5,26 @@ from django.contrib.auth import authenticate, get_user_model
 from django.contrib.auth.models import AbstractBaseUser
 from django.contrib.auth.signals import user_logged_in
 from django.utils.module_loading import import_string
-from rest_framework import exceptions, serializers
+from django.utils.translation import gettext as _
+from rest_framework import exceptions, serializers, throttling
+from rest_framework_simplejwt import serializers as jwt_serializers
 from rest_framework_simplejwt import settings as jwt_settings
+from rest_framework_simplejwt.exceptions import TokenError
 from rest_framework_simplejwt.serializers import PasswordField
+from rest_framework_simplejwt.tokens import UntypedToken
 
 from .enrollment_token import EnrollmentToken
+from .metrics import PHASE_DURATION
+from .models import TwoFactorAuthMethod
+from .revocation import get_revocation_list, is_token_revoked
 from .settings import api_settings
 from .token_manager import CodeTokenManager, CodeVerificationResult
+from .tracing import start_span
+from .trusted_devices import (
+    check_trusted_device_token,
+    create_trusted_device_token,
+    is_trusted_device_token_enabled,
+)
 from .utils import check_user_validity
 
 
@@ -29,8 +42,10 @@ class Jwt2faSerializer(serializers.Serializer):
 
     def validate(self, attrs: dict[str, object]) -> dict[str, str]:
         validated_attrs = super().validate(attrs)
-        user_data = self._authenticate(validated_attrs)
-        return self._create_tokens(user_data)
+        with PHASE_DURATION.time(phase="authenticate"):
+            user_data = self._authenticate(validated_attrs)
+        with PHASE_DURATION.time(phase="create_tokens"):
+            return self._create_tokens(user_data)
 
     def _authenticate(
         self, attrs: dict[str, object]
@@ -42,42 +57,87 @@ class Jwt2faSerializer(serializers.Serializer):
     ) -> dict[str, str]:  # pragma: no cover
         raise NotImplementedError
 
+    def _get_client_ident(self) -> str | None:
+        request = self.context.get("request")
+        if request is None:
+            return None
+        return throttling.BaseThrottle().get_ident(request)
+
 
 class CodeTokenSerializer(Jwt2faSerializer):
     username = serializers.CharField(required=True)
     password = PasswordField(write_only=True, required=True)
+    device_token = serializers.CharField(write_only=True, required=False)
+    code = PasswordField(write_only=True, required=False)
+    remember_device = serializers.BooleanField(
+        write_only=True, required=False, default=False
+    )
+    _code = ""
+    _remember_device = False
 
     def _authenticate(self, attrs: dict[str, object]) -> UserData:
+        if api_settings.SINGLE_REQUEST_TOTP_LOGIN:
+            self._code = attrs.get("code") or ""  # type: ignore
+            self._remember_device = bool(attrs.get("remember_device"))
         credentials = {
             "username": attrs["username"],
             "password": attrs["password"],
         }
         request = self.context.get("request")
-        user = authenticate(request=request, **credentials)
+        with start_span("jwt2fa.check_password"):
+            user = authenticate(request=request, **credentials)
         if not user:
             raise exceptions.AuthenticationFailed()
         check_user_validity(user)
+        device_token: str | None = attrs.get("device_token")  # type: ignore
+        if device_token and check_trusted_device_token(device_token, user):
+            return UserData(user=user, trusted=True)
         return UserData(user=user, trusted=None)
 
     def _create_tokens(self, user_data: UserData) -> dict[str, str]:
         user = user_data.user
-        code_token = self.token_manager.create_code_token(user)
-        if code_token is None:
+        if user_data.trusted:
+            # Valid trusted device token: skip the second factor
+            return _create_auth_tokens_for_user(user, self.context)
+        if self._code and self._is_totp_user(user):
+            # Single request TOTP login: no code token is needed
+            check_result = self.token_manager.check_totp_code_of_user(
+                user, self._code, client_ident=self._get_client_ident()
+            )
+            return _create_tokens_for_verified_user(
+                UserData(user=user, trusted=check_result.trusted),
+                self._remember_device,
+                self.context,
+            )
+        issued = self.token_manager.issue_code_token(user)
+        if issued is None:
             # Method is in TRUSTED_2FA_METHODS but requires no challenge
             # (e.g. "no-2fa"): skip second factor and issue auth tokens.
             return _create_auth_tokens_for_user(user, self.context)
-        return {
-            "token": code_token,
-        }
+        result = {"token": issued.token}
+        if issued.delivery_id is not None:
+            # The code is delivered in the background and its status
+            # can be polled by the delivery id
+            result["delivery_id"] = issued.delivery_id
+        return result
+
+    def _is_totp_user(self, user: AbstractBaseUser) -> bool:
+        method = api_settings.PREFERRED_2FA_METHOD_GETTER(user)
+        return method == TwoFactorAuthMethod.TOTP
 
 
 class AuthTokenSerializer(Jwt2faSerializer):
     code_token = serializers.CharField(required=True)
     code = PasswordField(write_only=True, required=True)
+    remember_device = serializers.BooleanField(
+        write_only=True, required=False, default=False
+    )
+    _remember_device = False
 
     def _authenticate(self, attrs: dict[str, object]) -> UserData:
         code_token: str = attrs["code_token"]  # type: ignore
         code: str = attrs["code"]  # type: ignore
+        self._remember_device = bool(attrs.get("remember_device"))
         check_result = self._check_code_token_and_code(code_token, code)
         user = self._get_user(check_result.user_id)
         return UserData(user=user, trusted=check_result.trusted)
@@ -85,29 +145,64 @@ class AuthTokenSerializer(Jwt2faSerializer):
     def _check_code_token_and_code(
         self, code_token: str, code: str
     ) -> CodeVerificationResult:
-        return self.token_manager.check_code_token_and_code(code_token, code)
+        return self.token_manager.check_code_token_and_code(
+            code_token, code, client_ident=self._get_client_ident()
+        )
 
     def _get_user(self, user_id: str) -> AbstractBaseUser:
         user_model = get_user_model()
         try:
-            user = user_model.objects.get(pk=user_id)
+            with start_span("jwt2fa.user_lookup"):
+                user = user_model.objects.get(pk=user_id)
         except user_model.DoesNotExist:
             raise exceptions.AuthenticationFailed() from None
         check_user_validity(user)
         return user
 
     def _create_tokens(self, user_data: UserData) -> dict[str, str]:
-        user = user_data.user
-        if not user_data.trusted:
-            return self._create_enrollment_token_for_user(user)
-        return _create_auth_tokens_for_user(user, self.context)
-
-    @classmethod
-    def _create_enrollment_token_for_user(
-        cls, user: AbstractBaseUser
-    ) -> dict[str, str]:
-        token = EnrollmentToken.for_user(user)
-        return {api_settings.AUTH_RESULT_ENROLLMENT_TOKEN_KEY: str(token)}
+        return _create_tokens_for_verified_user(
+            user_data, self._remember_device, self.context
+        )
+
+
+class TokenVerifySerializer(jwt_serializers.TokenVerifySerializer):
+    """
+    Verify a token and check that it is not revoked.
+    """
+
+    def validate(self, attrs: dict[str, Any]) -> dict[Any, Any]:
+        data = super().validate(attrs)
+        if get_revocation_list() is not None:
+            # Already verified above, so only decode it
+            token = UntypedToken(attrs["token"], verify=False)
+            if is_token_revoked(token):
+                raise TokenError(_("Token has been revoked"))
+        return data
+
+
+def _create_tokens_for_verified_user(
+    user_data: UserData, remember_device: bool, context: Mapping[str, Any]
+) -> dict[str, str]:
+    """
+    Create the tokens for a user who has passed the second factor.
+
+    Return an enrollment token if the used 2FA method is not trusted.
+    """
+    user = user_data.user
+    if not user_data.trusted:
+        return _create_enrollment_token_for_user(user)
+    tokens = _create_auth_tokens_for_user(user, context)
+    if remember_device and is_trusted_device_token_enabled():
+        device_token_key = api_settings.AUTH_RESULT_DEVICE_TOKEN_KEY
+        tokens[device_token_key] = create_trusted_device_token(user)
+    return tokens
+
+
+def _create_enrollment_token_for_user(
+    user: AbstractBaseUser,
+) -> dict[str, str]:
+    token = EnrollmentToken.for_user(user)
+    return {api_settings.AUTH_RESULT_ENROLLMENT_TOKEN_KEY: str(token)}
 
 
 def _create_auth_tokens_for_user(
@@ -5,7 +5,8 @@ Serializer for the set-2fa-method endpoint.
 from django.utils.translation import gettext_lazy as _
 from rest_framework import exceptions, serializers
 
-from .models import TwoFactorAuthMethod, UserTwoFactorAuthData
+from .audit import emit_audit_event
+from .models import AuditEventType, TwoFactorAuthMethod, UserTwoFactorAuthData
 from .settings import api_settings
 
 
@@ -21,21 +22,25 @@ class Set2faMethodSerializer(serializers.Serializer):
       ``TRUSTED_2FA_METHODS`` setting; otherwise a ``PermissionDenied``
       error is raised.
     * ``"totp"`` is only accepted when the user already has an active
-      TOTP secret enrolled (i.e. :meth:`~.models.UserTwoFactorAuthData.\
-get_totp_secret` returns a non-empty value); otherwise a
-      ``PermissionDenied`` error is raised.
+      TOTP secret enrolled; otherwise ``save()`` raises a
+      ``PermissionDenied`` error.  The secret is checked in the same
+      UPDATE statement that sets the method, so it cannot be removed
+      in between.
 
     Call ``save()`` to persist the new preferred method.
     """
 
     method = serializers.ChoiceField(
-        choices=[(x.value, x.label) for x in TwoFactorAuthMethod if x.value],
+        choices=[
+            (x.value, x.label)
+            for x in TwoFactorAuthMethod
+            if x.value and x != TwoFactorAuthMethod.RECOVERY_CODE
+        ],
         help_text=_("Preferred 2FA method"),
     )
 
     def validate(self, attrs):
         method = attrs["method"]
-        user = self.context["request"].user
 
         no_2fa_trusted = (
             TwoFactorAuthMethod.NO_2FA in api_settings.TRUSTED_2FA_METHODS
@@ -45,20 +50,17 @@ get_totp_secret` returns a non-empty value); otherwise a
                 _("Disabling 2FA is not allowed.")
             )
 
-        if method == TwoFactorAuthMethod.TOTP:
-            data = UserTwoFactorAuthData.objects.filter(user=user).first()
-            if not (data and data.get_totp_secret()):
-                raise exceptions.PermissionDenied(
-                    _("No active TOTP secret. Complete TOTP enrollment first.")
-                )
-
         return attrs
 
     def save(self, **kwargs):
         user = self.context["request"].user
         method = self.validated_data["method"]
-        UserTwoFactorAuthData.objects.update_or_create(
-            user=user,
-            defaults={"preferred_2fa_auth": method},
+        updated = UserTwoFactorAuthData.set_preferred_2fa_method_of_user(
+            user, method
         )
+        if not updated:
+            raise exceptions.PermissionDenied(
+                _("No active TOTP secret. Complete TOTP enrollment first.")
+            )
+        emit_audit_event(AuditEventType.METHOD_CHANGED, user.pk, method=method)
         return {}
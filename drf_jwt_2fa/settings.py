@@ -1,9 +1,11 @@
 import datetime
-from collections.abc import Sequence
-from typing import Protocol, get_type_hints, runtime_checkable
+from collections.abc import Mapping, Sequence
+from contextlib import AbstractContextManager
+from typing import Any, Protocol, get_type_hints, runtime_checkable
 
 from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser
+from django.core.exceptions import ImproperlyConfigured
 from django.utils.module_loading import import_string
 
 from ._type_checking import is_instance_of_type
@@ -15,6 +17,11 @@ class CodeSender(Protocol):
     def __call__(self, user: AbstractBaseUser, code: str) -> None: ...
 
 
+@runtime_checkable
+class CodeSenderChannelsGetter(Protocol):
+    def __call__(self, user: AbstractBaseUser) -> Sequence[str]: ...
+
+
 @runtime_checkable
 class TotpSecretGetter(Protocol):
     def __call__(self, user: AbstractBaseUser) -> str | None: ...
@@ -25,6 +32,18 @@ class PreferredTwoFactorMethodGetter(Protocol):
     def __call__(self, user: AbstractBaseUser) -> str: ...
 
 
+@runtime_checkable
+class TracingHook(Protocol):
+    def __call__(
+        self, name: str, attributes: Mapping[str, Any]
+    ) -> AbstractContextManager[Any]: ...
+
+
+@runtime_checkable
+class AuditLogSink(Protocol):
+    def __call__(self, records: list[Any]) -> None: ...
+
+
 def _get_default_settings() -> dict[str, object]:
     return {
         "CODE_LENGTH": 7,
@@ -35,16 +54,88 @@ def _get_default_settings() -> dict[str, object]:
         "CODE_TOKEN_JTI_BYTES": 16,
         "CODE_TOKEN_THROTTLE_RATE": "12/3h",
         "AUTH_TOKEN_RETRY_WAIT_TIME": datetime.timedelta(seconds=2),
+        # When set, the retry wait time is doubled for each failed attempt
+        # of the code token, up to this cap
+        "AUTH_TOKEN_RETRY_BACKOFF_CAP": None,
         "MAX_AUTH_ATTEMPTS_PER_CODE_TOKEN": 5,
         "MAX_ACTIVE_CODE_TOKENS_PER_USER": 3,
+        # Maximum number of failed verification attempts per user and per
+        # client (IP address) over all code tokens within the sliding
+        # FAILED_AUTH_ATTEMPTS_WINDOW.  None disables the limit.
+        "MAX_FAILED_AUTH_ATTEMPTS_PER_USER": None,
+        "MAX_FAILED_AUTH_ATTEMPTS_PER_CLIENT": None,
+        "FAILED_AUTH_ATTEMPTS_WINDOW": datetime.timedelta(minutes=15),
+        # Number of cells per row in the count-min sketch storing the
+        # failed attempt counters.  Larger sketch overestimates less.
+        "FAILED_AUTH_ATTEMPTS_SKETCH_WIDTH": 4096,
+        # Expected maximum number of code tokens used per
+        # CODE_EXPIRATION_TIME.  When set, the used code tokens are stored
+        # to time-bucketed Bloom filters instead of a cache key per token.
+        "USED_TOKEN_FILTER_CAPACITY": None,
+        # Maximum false positive rate of the used token Bloom filters,
+        # i.e. the probability to reject a fresh code token as used
+        "USED_TOKEN_FILTER_ERROR_RATE": 1e-9,
         "AUTH_RESULT_ACCESS_TOKEN_KEY": "access",
         "AUTH_RESULT_REFRESH_TOKEN_KEY": "refresh",
         "AUTH_RESULT_OTHER_TOKEN_KEY": "token",
         "AUTH_RESULT_ENROLLMENT_TOKEN_KEY": "enrollment_token",
+        "AUTH_RESULT_DEVICE_TOKEN_KEY": "device_token",
         "CODE_SENDER": "drf_jwt_2fa.sending.send_verification_code_via_email",
         "EMAIL_SENDER_FROM_ADDRESS": settings.DEFAULT_FROM_EMAIL,
         "EMAIL_SENDER_SUBJECT_OVERRIDE": None,
         "EMAIL_SENDER_BODY_OVERRIDE": None,
+        # URL of the HTTP gateway (e.g. an SMS gateway) that the
+        # send_verification_code_via_http sender posts the codes to
+        "HTTP_SENDER_URL": None,
+        # Extra HTTP headers of the gateway requests, e.g. Authorization
+        "HTTP_SENDER_HEADERS": {},
+        # JSON payload of the gateway requests.  The "{code}" and
+        # "{recipient}" placeholders are replaced in all strings.
+        "HTTP_SENDER_PAYLOAD_TEMPLATE": {
+            "to": "{recipient}",
+            "text": "{code} is the verification code needed for the login.",
+        },
+        # Name of the user attribute holding the recipient (phone number)
+        "HTTP_SENDER_RECIPIENT_FIELD": "phone_number",
+        # Timeouts for connecting to the gateway and for each read
+        "HTTP_SENDER_CONNECT_TIMEOUT": datetime.timedelta(seconds=2),
+        "HTTP_SENDER_READ_TIMEOUT": datetime.timedelta(seconds=5),
+        # Maximum number of idle keep-alive connections to the gateway
+        # kept per process.  Zero opens a new connection for each code.
+        "HTTP_SENDER_POOL_SIZE": 4,
+        # Total time budget for sending a verification code, or None for
+        # no limit.  Code senders accepting a "deadline" keyword argument
+        # are passed the deadline, others are run in a thread pool of at
+        # most CODE_SENDING_MAX_THREADS threads and abandoned on timeout.
+        "CODE_SENDING_TIMEOUT": None,
+        "CODE_SENDING_MAX_THREADS": 8,
+        # Return the code token of get-code/ immediately with HTTP 202 and
+        # send the code in a background thread.  The delivery status can
+        # be polled from code-delivery/<jti>/.
+        "ASYNC_CODE_SENDING": False,
+        # Maximum number of background deliveries queued or running per
+        # process.  Deliveries over the limit fail at once.
+        "ASYNC_CODE_SENDING_MAX_QUEUED": 100,
+        # Named code senders (channels) for the
+        # send_verification_code_via_channels sender, which tries them in
+        # the order returned by CODE_SENDER_CHANNELS_GETTER, e.g.
+        # {"email": "drf_jwt_2fa.sending.send_verification_code_via_email"}
+        "CODE_SENDER_CHANNELS": {},
+        # Callable (user) -> Sequence[str] that returns the names of the
+        # channels to try for a user, in order of preference
+        "CODE_SENDER_CHANNELS_GETTER": (
+            "drf_jwt_2fa.getters.get_code_sender_channels_of_user"
+        ),
+        # Circuit breakers of the channels: A breaker opens when at least
+        # CIRCUIT_BREAKER_FAILURE_RATE of at least CIRCUIT_BREAKER_MIN_CALLS
+        # calls within CIRCUIT_BREAKER_WINDOW have failed or taken longer
+        # than CIRCUIT_BREAKER_SLOW_CALL_TIME.  An open channel is skipped
+        # for CIRCUIT_BREAKER_OPEN_TIME and then probed with a single call.
+        "CIRCUIT_BREAKER_FAILURE_RATE": 0.5,
+        "CIRCUIT_BREAKER_MIN_CALLS": 5,
+        "CIRCUIT_BREAKER_SLOW_CALL_TIME": datetime.timedelta(seconds=3),
+        "CIRCUIT_BREAKER_WINDOW": datetime.timedelta(minutes=1),
+        "CIRCUIT_BREAKER_OPEN_TIME": datetime.timedelta(seconds=30),
         # Callable (user) -> str | None that returns the active TOTP secret
         # for a user, or None if the user does not use TOTP.
         "TOTP_SECRET_GETTER": "drf_jwt_2fa.getters.get_totp_secret_of_user",
@@ -75,13 +166,114 @@ def _get_default_settings() -> dict[str, object]:
         "TOTP_ENCRYPTION_KEY": derive_key_bytes(
             "2fa-totp-enc", settings.SECRET_KEY
         ),
+        # When set, the TOTP setup endpoint does not store the pending
+        # secret, but returns it sealed in an encrypted ticket, which is
+        # valid for this long and is passed to the confirm endpoint.  The
+        # ticket is encrypted with a key derived from TOTP_ENCRYPTION_KEY.
+        "TOTP_ENROLLMENT_TICKET_EXPIRATION_TIME": None,
+        # Number of recovery codes generated in a batch and the length
+        # and characters of each code.  The default characters leave out
+        # the easily confused 0, 1, I and O.
+        "RECOVERY_CODE_COUNT": 10,
+        "RECOVERY_CODE_LENGTH": 10,
+        "RECOVERY_CODE_CHARACTERS": "23456789ABCDEFGHJKLMNPQRSTUVWXYZ",
+        # 32-byte key used to compute the HMAC digests of the recovery
+        # codes, which are stored instead of the codes
+        "RECOVERY_CODE_HMAC_KEY": derive_key_bytes(
+            "2fa-recovery-code", settings.SECRET_KEY
+        ),
+        # How long a trusted device token is valid.  When set, a device
+        # token can be requested on a successful second factor and then
+        # used to skip the second factor on that device.  None disables.
+        "TRUSTED_DEVICE_TOKEN_EXPIRATION_TIME": None,
+        # Secret key to use for signing the trusted device tokens
+        "TRUSTED_DEVICE_TOKEN_SECRET_KEY": derive_key(
+            "2fa-device", settings.SECRET_KEY
+        ),
+        # Cache aliases (keys of Django's CACHES setting) for storing the
+        # code token state (auth attempts, active and used tokens) and the
+        # throttle state.  Point these to a dedicated cache to keep the
+        # security-relevant state away from general cache pressure.
+        "TOKEN_STATE_CACHE": "default",
+        "THROTTLE_CACHE": "default",
+        # Cache aliases to shard the code token state over.  When set,
+        # TOKEN_STATE_CACHE is not used and the per-user state is mapped
+        # to the shards by user id and the per-token state by jti.
+        "TOKEN_STATE_CACHE_SHARDS": [],
+        # Prefix of all cache keys and an optional version which is added
+        # to the prefix.  Changing the version invalidates all 2FA state.
+        "CACHE_KEY_PREFIX": "drf_jwt_2fa",
+        "CACHE_KEY_VERSION": None,
+        # How long the 2FA adoption statistics are cached
+        "STATS_CACHE_TIMEOUT": datetime.timedelta(minutes=5),
+        # Expected maximum number of revoked tokens per
+        # REVOCATION_BUCKET_TIME of token expiration times.  When set,
+        # the tokens can be revoked and the revoked tokens are stored to
+        # time-bucketed Bloom filters.
+        "REVOCATION_FILTER_CAPACITY": None,
+        # Maximum false positive rate of the revocation Bloom filters,
+        # i.e. the probability to reject a valid token as revoked
+        "REVOCATION_FILTER_ERROR_RATE": 1e-6,
+        "REVOCATION_BUCKET_TIME": datetime.timedelta(minutes=5),
+        # How often each process refreshes its in-memory snapshot of the
+        # revoked tokens from the cache
+        "REVOCATION_REFRESH_INTERVAL": datetime.timedelta(seconds=5),
+        # How long the users of authenticated requests are cached to the
+        # token state cache.  None loads the user from the database on
+        # every request.
+        "USER_CACHE_TIMEOUT": None,
+        # Record Prometheus metrics of the 2FA flow.  The metrics of each
+        # process are stored to a memory-mapped file in METRICS_DIRECTORY
+        # and summed over the processes, or kept in the memory of the
+        # process if it is None.  The metrics endpoint is accessible only
+        # from the METRICS_ALLOWED_NETWORKS.
+        "METRICS_ENABLED": False,
+        "METRICS_DIRECTORY": None,
+        "METRICS_ALLOWED_NETWORKS": ["127.0.0.0/8", "::1/128"],
+        # Callable which starts the tracing spans of the 2FA operations,
+        # see drf_jwt_2fa.tracing
+        "TRACING_HOOK": "drf_jwt_2fa.tracing.no_op_span",
+        # Callable which writes the batches of the security audit events,
+        # e.g. "drf_jwt_2fa.audit.write_to_database" or
+        # "drf_jwt_2fa.audit.write_to_file", which appends them to
+        # AUDIT_LOG_FILE.  None disables the audit log.
+        "AUDIT_LOG_SINK": None,
+        "AUDIT_LOG_FILE": None,
+        # Maximum number of audit events buffered per process.  When the
+        # buffer is full, the oldest events are dropped with "drop-oldest"
+        # and the new events with "drop-newest".
+        "AUDIT_LOG_BUFFER_SIZE": 10000,
+        "AUDIT_LOG_DROP_POLICY": "drop-oldest",
+        # The buffered audit events are written in batches of at most
+        # this size, at least every AUDIT_LOG_FLUSH_INTERVAL
+        "AUDIT_LOG_BATCH_SIZE": 500,
+        "AUDIT_LOG_FLUSH_INTERVAL": datetime.timedelta(seconds=1),
+        # Fraction of the requests to the 2FA endpoints which are
+        # profiled with cProfile to PROFILING_DIRECTORY.  Only the
+        # newest PROFILING_MAX_FILES profiles are kept.
+        "PROFILING_SAMPLE_RATE": 0.0,
+        "PROFILING_DIRECTORY": None,
+        "PROFILING_MAX_FILES": 1000,
+        # Do the one-time work of the first 2FA request, e.g. loading the
+        # settings and importing the views, already when the app is ready
+        "WARM_UP_ON_READY": False,
+        # Accept the TOTP code of a TOTP user already with the password in
+        # the code token request and return the auth tokens directly
+        "SINGLE_REQUEST_TOTP_LOGIN": False,
     }
 
 
 _IMPORT_STRINGS = {
     "CODE_SENDER",
+    "CODE_SENDER_CHANNELS_GETTER",
     "TOTP_SECRET_GETTER",
     "PREFERRED_2FA_METHOD_GETTER",
+    "TRACING_HOOK",
+    "AUDIT_LOG_SINK",
+}
+
+_IMPORT_STRING_MAPPINGS = {
+    "CODE_SENDER_CHANNELS",
 }
 
 
@@ -94,16 +286,42 @@ class ApiSettings:
     CODE_TOKEN_JTI_BYTES: int
     CODE_TOKEN_THROTTLE_RATE: str
     AUTH_TOKEN_RETRY_WAIT_TIME: datetime.timedelta
+    AUTH_TOKEN_RETRY_BACKOFF_CAP: datetime.timedelta | None
     MAX_AUTH_ATTEMPTS_PER_CODE_TOKEN: int | None
     MAX_ACTIVE_CODE_TOKENS_PER_USER: int | None
+    MAX_FAILED_AUTH_ATTEMPTS_PER_USER: int | None
+    MAX_FAILED_AUTH_ATTEMPTS_PER_CLIENT: int | None
+    FAILED_AUTH_ATTEMPTS_WINDOW: datetime.timedelta
+    FAILED_AUTH_ATTEMPTS_SKETCH_WIDTH: int
+    USED_TOKEN_FILTER_CAPACITY: int | None
+    USED_TOKEN_FILTER_ERROR_RATE: float
     AUTH_RESULT_ACCESS_TOKEN_KEY: str
     AUTH_RESULT_REFRESH_TOKEN_KEY: str
     AUTH_RESULT_OTHER_TOKEN_KEY: str
     AUTH_RESULT_ENROLLMENT_TOKEN_KEY: str
+    AUTH_RESULT_DEVICE_TOKEN_KEY: str
     CODE_SENDER: CodeSender
     EMAIL_SENDER_FROM_ADDRESS: str
     EMAIL_SENDER_SUBJECT_OVERRIDE: str | None
     EMAIL_SENDER_BODY_OVERRIDE: str | None
+    HTTP_SENDER_URL: str | None
+    HTTP_SENDER_HEADERS: Mapping[str, str]
+    HTTP_SENDER_PAYLOAD_TEMPLATE: Mapping[str, object]
+    HTTP_SENDER_RECIPIENT_FIELD: str
+    HTTP_SENDER_CONNECT_TIMEOUT: datetime.timedelta
+    HTTP_SENDER_READ_TIMEOUT: datetime.timedelta
+    HTTP_SENDER_POOL_SIZE: int
+    CODE_SENDING_TIMEOUT: datetime.timedelta | None
+    CODE_SENDING_MAX_THREADS: int
+    ASYNC_CODE_SENDING: bool
+    ASYNC_CODE_SENDING_MAX_QUEUED: int
+    CODE_SENDER_CHANNELS: Mapping[str, CodeSender]
+    CODE_SENDER_CHANNELS_GETTER: CodeSenderChannelsGetter
+    CIRCUIT_BREAKER_FAILURE_RATE: float
+    CIRCUIT_BREAKER_MIN_CALLS: int
+    CIRCUIT_BREAKER_SLOW_CALL_TIME: datetime.timedelta
+    CIRCUIT_BREAKER_WINDOW: datetime.timedelta
+    CIRCUIT_BREAKER_OPEN_TIME: datetime.timedelta
     TOTP_SECRET_GETTER: TotpSecretGetter
     PREFERRED_2FA_METHOD_GETTER: PreferredTwoFactorMethodGetter
     FALLBACK_2FA_METHOD: str
@@ -112,6 +330,39 @@ class ApiSettings:
     TOTP_ISSUER_NAME: str
     TOTP_VALID_WINDOW: int
     TOTP_ENCRYPTION_KEY: bytes
+    TOTP_ENROLLMENT_TICKET_EXPIRATION_TIME: datetime.timedelta | None
+    RECOVERY_CODE_COUNT: int
+    RECOVERY_CODE_LENGTH: int
+    RECOVERY_CODE_CHARACTERS: str
+    RECOVERY_CODE_HMAC_KEY: bytes
+    TRUSTED_DEVICE_TOKEN_EXPIRATION_TIME: datetime.timedelta | None
+    TRUSTED_DEVICE_TOKEN_SECRET_KEY: str
+    TOKEN_STATE_CACHE: str
+    THROTTLE_CACHE: str
+    TOKEN_STATE_CACHE_SHARDS: Sequence[str]
+    CACHE_KEY_PREFIX: str
+    CACHE_KEY_VERSION: int | None
+    STATS_CACHE_TIMEOUT: datetime.timedelta
+    REVOCATION_FILTER_CAPACITY: int | None
+    REVOCATION_FILTER_ERROR_RATE: float
+    REVOCATION_BUCKET_TIME: datetime.timedelta
+    REVOCATION_REFRESH_INTERVAL: datetime.timedelta
+    USER_CACHE_TIMEOUT: datetime.timedelta | None
+    METRICS_ENABLED: bool
+    METRICS_DIRECTORY: str | None
+    METRICS_ALLOWED_NETWORKS: Sequence[str]
+    TRACING_HOOK: TracingHook
+    AUDIT_LOG_SINK: AuditLogSink | None
+    AUDIT_LOG_FILE: str | None
+    AUDIT_LOG_BUFFER_SIZE: int
+    AUDIT_LOG_DROP_POLICY: str
+    AUDIT_LOG_BATCH_SIZE: int
+    AUDIT_LOG_FLUSH_INTERVAL: datetime.timedelta
+    PROFILING_SAMPLE_RATE: float
+    PROFILING_DIRECTORY: str | None
+    PROFILING_MAX_FILES: int
+    WARM_UP_ON_READY: bool
+    SINGLE_REQUEST_TOTP_LOGIN: bool
 
     def __getattr__(self, name: str) -> object:
         if name not in type(self).__annotations__:
@@ -120,6 +371,7 @@ class ApiSettings:
         values = {**_get_default_settings(), **user_settings}
         self._resolve_imports(values)
         self._check_setting_types(values)
+        self._check_setting_values(values)
         self.__dict__.update(values)
         return self.__dict__[name]
 
@@ -128,6 +380,13 @@ class ApiSettings:
             value = values.get(key)
             if isinstance(value, str):
                 values[key] = import_string(value)
+        for key in _IMPORT_STRING_MAPPINGS:
+            mapping = values.get(key)
+            if isinstance(mapping, Mapping):
+                values[key] = {
+                    name: import_string(x) if isinstance(x, str) else x
+                    for (name, x) in mapping.items()
+                }
 
     def _check_setting_types(self, values: dict[str, object]) -> None:
         for key, tp in get_type_hints(type(self)).items():
@@ -139,8 +398,31 @@ class ApiSettings:
                     f"an instance of {tp_name}"
                 )
 
+    def _check_setting_values(self, values: dict[str, Any]) -> None:
+        rate = values["PROFILING_SAMPLE_RATE"]
+        if rate > 0 and not values["PROFILING_DIRECTORY"]:
+            raise ImproperlyConfigured(
+                "JWT2FA_AUTH setting 'PROFILING_DIRECTORY' must be set "
+                "when 'PROFILING_SAMPLE_RATE' is above zero"
+            )
+
     def reload(self) -> None:
         self.__dict__.clear()
 
 
 api_settings = ApiSettings()
+
+
+class SettingValue:
+    """
+    Class attribute which reads a setting when it is accessed.
+
+    This allows using the settings as class attributes without loading
+    them when the module of the class is imported.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __get__(self, instance: object, owner: type | None = None) -> Any:
+        return getattr(api_settings, self.name)
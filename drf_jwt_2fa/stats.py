@@ -0,0 +1,83 @@
+"""
+Aggregated 2FA adoption statistics.
+"""
+
+from typing import TypedDict
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .caching import make_cache_key
+from .models import TwoFactorAuthMethod
+from .settings import api_settings
+
+
+class TwoFactorStats(TypedDict):
+    no_2fa: int
+    code_sender: int
+    totp: int
+    unconfigured: int
+    pending_enrollment: int
+
+
+_METHOD_KEYS = {
+    TwoFactorAuthMethod.NO_2FA: "no_2fa",
+    TwoFactorAuthMethod.CODE_SENDER: "code_sender",
+    TwoFactorAuthMethod.TOTP: "totp",
+}
+
+
+def get_2fa_stats(*, use_cache: bool = True) -> TwoFactorStats:
+    """
+    Get the number of users per 2FA method.
+
+    The result is served from the cache when possible.  A fresh result
+    is computed with :func:`compute_2fa_stats` and stored to the cache
+    for ``STATS_CACHE_TIMEOUT`` when the cached one is missing or when
+    ``use_cache`` is false.
+    """
+    key = make_cache_key("stats")
+    if use_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    stats = compute_2fa_stats()
+    timeout = api_settings.STATS_CACHE_TIMEOUT.total_seconds()
+    cache.set(key, stats, timeout=timeout)
+    return stats
+
+
+def compute_2fa_stats() -> TwoFactorStats:
+    """
+    Compute the number of users per 2FA method with a single query.
+
+    The users are grouped by their ``preferred_2fa_auth`` value and the
+    users with a non-empty pending TOTP secret are counted with a
+    conditional aggregate in the same query.  Users without a
+    ``UserTwoFactorAuthData`` record are counted as unconfigured.
+    """
+    method_field = "two_factor_auth_data__preferred_2fa_auth"
+    pending_field = "two_factor_auth_data__encrypted_totp_secret_pending"
+    has_pending = Q(**{f"{pending_field}__gt": ""})
+    rows = (
+        get_user_model()
+        .objects.order_by()
+        .values(method_field)
+        .annotate(
+            count=Count("pk"),
+            pending=Count("pk", filter=has_pending),
+        )
+    )
+    stats: TwoFactorStats = {
+        "no_2fa": 0,
+        "code_sender": 0,
+        "totp": 0,
+        "unconfigured": 0,
+        "pending_enrollment": 0,
+    }
+    for row in rows:
+        key = _METHOD_KEYS.get(row[method_field], "unconfigured")
+        stats[key] += row["count"]  # type: ignore[literal-required]
+        stats["pending_enrollment"] += row["pending"]
+    return stats
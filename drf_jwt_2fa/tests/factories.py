@@ -64,11 +64,11 @@ def get_code_token(verification_code="1234567"):
     preferred-2FA-method lookup (which requires a database).
     """
     manager = CodeTokenManager()
-    manager.generate_verification_code = lambda: verification_code
+    manager.generate_verification_code = lambda *args: verification_code
     user = Mock()
     user.pk = 9876
     user.username = "testuser"
     user.email = "testuser@localhost"
     # Bypass PREFERRED_2FA_METHOD_GETTER; call the internal method directly.
     with patch.object(manager, "send_verification_code", lambda u, c: None):
-        return manager._create_code_sender_token(user)
+        return manager._create_code_sender_token(user).token
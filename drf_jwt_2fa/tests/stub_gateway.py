@@ -0,0 +1,137 @@
+"""
+Local stub of an HTTP code sending gateway.
+
+Used by the tests and the benchmarks of the HTTP code sender.
+"""
+
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Self
+
+
+class StubGateway:
+    """
+    HTTP/1.1 keep-alive server recording the posted requests.
+
+    Usable as a context manager, which starts the server in a background
+    thread on a free local port and stops it on exit.
+
+    :param status: HTTP status of the responses
+    :param delay: Seconds to wait before each response
+    :param connect_delay:
+      Seconds to wait on each new connection, to simulate the cost of
+      setting up a (TLS) connection to a remote gateway.
+    :param keep_alive: Whether to keep the connections open
+    :param respond:
+      Whether to respond to the requests, or to close the connection
+      after reading the request, like a server crashing mid-request
+    """
+
+    def __init__(
+        self,
+        status: int = 200,
+        delay: float = 0,
+        connect_delay: float = 0,
+        keep_alive: bool = True,
+        respond: bool = True,
+    ) -> None:
+        self.status = status
+        self.delay = delay
+        self.connect_delay = connect_delay
+        self.keep_alive = keep_alive
+        self.respond = respond
+        self.requests: list[dict] = []
+        self.connection_count = 0
+        self._lock = threading.Lock()
+        self._sockets: list = []
+        self._server = _QuietHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            kwargs={"poll_interval": 0.01},
+            daemon=True,
+        )
+
+    @property
+    def url(self) -> str:
+        port = self._server.server_address[1]  # Bound to 127.0.0.1
+        return f"http://127.0.0.1:{port}/send"
+
+    def __enter__(self) -> Self:
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.drop_connections()
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def drop_connections(self) -> None:
+        """
+        Close the open connections, like a server closing idle ones.
+        """
+        with self._lock:
+            (sockets, self._sockets) = (self._sockets, [])
+        for sock in sockets:
+            try:
+                sock.shutdown(2)
+            except OSError:
+                pass
+
+    def _make_handler(self) -> type[BaseHTTPRequestHandler]:
+        gateway = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self) -> None:
+                super().setup()
+                # The headers and the body are written separately, so
+                # avoid waiting for the delayed ACK of the client
+                self.connection.setsockopt(
+                    socket.IPPROTO_TCP, socket.TCP_NODELAY, 1
+                )
+                with gateway._lock:
+                    gateway.connection_count += 1
+                    gateway._sockets.append(self.connection)
+                if gateway.connect_delay:
+                    time.sleep(gateway.connect_delay)
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length)
+                with gateway._lock:
+                    gateway.requests.append({
+                        "path": self.path,
+                        "headers": dict(self.headers),
+                        "payload": json.loads(body or b"null"),
+                    })
+                if not gateway.respond:
+                    self.close_connection = True
+                    return
+                if gateway.delay:
+                    time.sleep(gateway.delay)
+                response = b'{"ok": true}'
+                self.send_response(gateway.status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(response)))
+                if not gateway.keep_alive:
+                    self.send_header("Connection", "close")
+                    self.close_connection = True
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, format: str, *args: object) -> None:
+                pass
+
+        return Handler
+
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request: object, client_address: object) -> None:
+        pass  # E.g. the connections closed by drop_connections
@@ -3,8 +3,13 @@ from django.contrib.admin import site as admin_site
 from django.contrib.admin.sites import AdminSite
 from django.contrib.auth.models import User
 
-from drf_jwt_2fa.admin import UserTwoFactorAuthDataAdmin
-from drf_jwt_2fa.models import TwoFactorAuthMethod, UserTwoFactorAuthData
+from drf_jwt_2fa.admin import RecoveryCodeAdmin, UserTwoFactorAuthDataAdmin
+from drf_jwt_2fa.models import (
+    AuditEvent,
+    RecoveryCode,
+    TwoFactorAuthMethod,
+    UserTwoFactorAuthData,
+)
 
 
 @pytest.fixture()
@@ -14,6 +19,8 @@ def admin_instance():
 
 def test_admin_registered():
     assert UserTwoFactorAuthData in admin_site._registry
+    assert RecoveryCode in admin_site._registry
+    assert AuditEvent in admin_site._registry
 
 
 def test_list_display(admin_instance):
@@ -52,3 +59,8 @@ def test_has_totp_secret(admin_instance, encrypted_totp_secret, expected):
         encrypted_totp_secret=encrypted_totp_secret,
     )
     assert admin_instance.has_totp_secret(obj) is expected
+
+
+def test_recovery_codes_cannot_be_added():
+    recovery_code_admin = RecoveryCodeAdmin(RecoveryCode, AdminSite())
+    assert recovery_code_admin.has_add_permission(None) is False
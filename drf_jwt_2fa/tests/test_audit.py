@@ -0,0 +1,383 @@
+import datetime
+import io
+import json
+import threading
+from unittest.mock import Mock, patch
+
+import pyotp
+import pytest
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework_simplejwt.tokens import AccessToken
+
+from drf_jwt_2fa import audit
+from drf_jwt_2fa.admin import AuditEventAdmin
+from drf_jwt_2fa.audit import AuditRecord, emit_audit_event, flush_audit_log
+from drf_jwt_2fa.models import AuditEvent, AuditEventType
+
+from .factories import get_user, get_user_with_code_sender_2fa
+from .utils import (
+    OverrideJwt2faSettings,
+    get_api_client,
+    get_verification_code_from_mailbox,
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_cache_and_audit_buffer():
+    cache.clear()
+    yield
+    cache.clear()
+    flush_audit_log()  # Drops the events, since the sink is not set
+
+
+@pytest.fixture
+def audit_file(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    with use_file_sink(path):
+        yield path
+
+
+def use_file_sink(path, **values):
+    return OverrideJwt2faSettings(
+        AUDIT_LOG_SINK="drf_jwt_2fa.audit.write_to_file",
+        AUDIT_LOG_FILE=str(path),
+        AUDIT_LOG_FLUSH_INTERVAL=datetime.timedelta(hours=1),
+        **values,
+    )
+
+
+def read_events(path):
+    if not path.exists():
+        return []
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file]
+
+
+def test_events_are_not_buffered_when_disabled():
+    emit_audit_event(AuditEventType.CODE_ISSUED, 1)
+    assert len(audit._buffer._records) == 0
+
+
+def test_file_sink(audit_file):
+    emit_audit_event(AuditEventType.CODE_ISSUED, 42, method="totp")
+    emit_audit_event(AuditEventType.AUTH_FAILED, 42, "10.0.0.1")
+    assert read_events(audit_file) == []  # Not flushed yet
+
+    flush_audit_log()
+
+    (first, second) = read_events(audit_file)
+    created_at = datetime.datetime.fromisoformat(first["created_at"])
+    assert abs(timezone.now() - created_at) < datetime.timedelta(minutes=1)
+    assert first == {
+        "event_type": "code-issued",
+        "created_at": first["created_at"],
+        "user_pk": "42",
+        "client_ident": "",
+        "data": {"method": "totp"},
+    }
+    assert second["event_type"] == "auth-failed"
+    assert second["client_ident"] == "10.0.0.1"
+
+
+def test_events_are_flushed_in_background_when_batch_is_full():
+    written = []
+    flushed = threading.Event()
+
+    def sink(records):
+        written.extend(records)
+        flushed.set()
+
+    with OverrideJwt2faSettings(
+        AUDIT_LOG_SINK=sink,
+        AUDIT_LOG_BATCH_SIZE=3,
+        AUDIT_LOG_FLUSH_INTERVAL=datetime.timedelta(hours=1),
+    ):
+        for user_pk in range(3):
+            emit_audit_event(AuditEventType.CODE_ISSUED, user_pk)
+        assert flushed.wait(timeout=5), "Events were not flushed"
+    assert [x.user_pk for x in written] == ["0", "1", "2"]
+
+
+def test_flusher_does_not_wait_for_full_batch():
+    buffer = audit._AuditBuffer()
+    buffer.add(AuditRecord("code-issued", timezone.now(), "1", "", {}))
+    with (
+        OverrideJwt2faSettings(AUDIT_LOG_BATCH_SIZE=1),
+        patch.object(buffer._condition, "wait") as wait,
+        patch.object(buffer, "flush", side_effect=[None, StopFlusherError]),
+        pytest.raises(StopFlusherError),
+    ):
+        buffer._run()
+    wait.assert_not_called()
+
+
+class StopFlusherError(Exception):
+    pass
+
+
+def test_flusher_is_started_once():
+    buffer = audit._AuditBuffer()
+    threading_mock = Mock(Condition=threading.Condition, Lock=threading.Lock)
+    with (
+        patch("drf_jwt_2fa.audit.threading", threading_mock),
+        patch("drf_jwt_2fa.audit.atexit.register") as register,
+    ):
+        buffer.start_flusher()
+        buffer.start_flusher()
+        buffer._reset()  # As in a forked child
+        buffer.start_flusher()
+    assert threading_mock.Thread.call_count == 2
+    register.assert_called_once_with(buffer.flush)
+
+
+def test_flusher_started_by_other_thread_is_used():
+    buffer = audit._AuditBuffer()
+    thread = Mock()
+
+    class StartingCondition:
+        # Another thread starts the flusher while this one waits
+        def __enter__(self):
+            buffer._thread = thread
+
+        def __exit__(self, *exc_info):
+            pass
+
+    buffer._condition = StartingCondition()
+    buffer.start_flusher()
+    assert buffer._thread is thread
+    thread.start.assert_not_called()
+
+
+def test_events_are_dropped_without_sink():
+    buffer = audit._AuditBuffer()
+    buffer.add(AuditRecord("code-issued", timezone.now(), "1", "", {}))
+    buffer.flush()
+    assert len(buffer._records) == 0
+
+
+def test_file_sink_requires_file(caplog):
+    with OverrideJwt2faSettings(
+        AUDIT_LOG_SINK="drf_jwt_2fa.audit.write_to_file"
+    ):
+        emit_audit_event(AuditEventType.CODE_ISSUED, 1)
+        flush_audit_log()
+    assert "Writing 1 audit events failed" in caplog.text
+    assert "AUDIT_LOG_FILE is not set" in caplog.text
+
+
+@pytest.mark.parametrize(
+    "policy, kept",
+    [("drop-oldest", ["2", "3"]), ("drop-newest", ["0", "1"])],
+)
+def test_drop_policy(tmp_path, policy, kept):
+    path = tmp_path / "audit.jsonl"
+    buffer = audit._AuditBuffer()
+    with use_file_sink(
+        path, AUDIT_LOG_BUFFER_SIZE=2, AUDIT_LOG_DROP_POLICY=policy
+    ):
+        for user_pk in range(4):
+            record = AuditRecord(
+                "code-issued", timezone.now(), str(user_pk), "", {}
+            )
+            buffer.add(record)
+        buffer.flush()
+    assert [x["user_pk"] for x in read_events(path)] == kept
+
+
+def test_sink_errors_are_logged(caplog):
+    def failing_sink(records):
+        raise OSError("disk full")
+
+    with OverrideJwt2faSettings(AUDIT_LOG_SINK=failing_sink):
+        emit_audit_event(AuditEventType.CODE_ISSUED, 1)
+        flush_audit_log()
+    assert "Writing 1 audit events failed" in caplog.text
+
+
+@pytest.mark.django_db(transaction=True)
+def test_database_sink():
+    with OverrideJwt2faSettings(
+        AUDIT_LOG_SINK="drf_jwt_2fa.audit.write_to_database"
+    ):
+        emit_audit_event(AuditEventType.METHOD_CHANGED, 5, method="totp")
+        emit_audit_event(AuditEventType.TOTP_ENROLLED, 5)
+        flush_audit_log()
+    events = list(AuditEvent.objects.order_by("pk"))
+    assert [(x.event_type, x.user_pk, x.data) for x in events] == [
+        ("method-changed", "5", {"method": "totp"}),
+        ("totp-enrolled", "5", {}),
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_database_sink_cuts_long_client_ident():
+    forwarded_for = ", ".join(f"10.0.0.{i}" for i in range(100))
+    with OverrideJwt2faSettings(
+        AUDIT_LOG_SINK="drf_jwt_2fa.audit.write_to_database"
+    ):
+        emit_audit_event(AuditEventType.AUTH_FAILED, 5, forwarded_for)
+        flush_audit_log()
+    event = AuditEvent.objects.get()
+    assert event.client_ident == forwarded_for[:64]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_database_sink_inserts_one_by_one_when_batch_fails(caplog):
+    with OverrideJwt2faSettings(
+        AUDIT_LOG_SINK="drf_jwt_2fa.audit.write_to_database"
+    ):
+        emit_audit_event(AuditEventType.CODE_ISSUED, 1)
+        emit_audit_event(AuditEventType.CODE_ISSUED, 2, data=object())
+        emit_audit_event(AuditEventType.CODE_ISSUED, 3)
+        flush_audit_log()
+    events = AuditEvent.objects.order_by("pk")
+    assert [x.user_pk for x in events] == ["1", "3"]
+    assert "Bulk insert of 3 audit events failed" in caplog.text
+    assert "Inserting audit event" in caplog.text
+    assert "code-issued failed" in caplog.text
+
+
+@pytest.mark.django_db
+def test_audit_event_str():
+    event = AuditEvent(
+        event_type=AuditEventType.CODE_ISSUED,
+        created_at=datetime.datetime(2024, 5, 6, 7, 8, 9),
+    )
+    assert str(event) == "2024-05-06 07:08:09 code-issued"
+
+
+def test_audit_event_admin_is_read_only():
+    model_admin = AuditEventAdmin(AuditEvent, admin.site)
+    assert not model_admin.has_add_permission(None)
+    assert not model_admin.has_change_permission(None)
+
+
+@pytest.mark.django_db
+def test_events_of_login(audit_file):
+    user = get_user_with_code_sender_2fa()
+    client = get_api_client()
+    code_token = client.post(
+        reverse("get-code"), data={"username": "testuser", "password": "a42"}
+    ).data["token"]
+    code = get_verification_code_from_mailbox()
+    with use_file_sink(
+        audit_file,
+        MAX_AUTH_ATTEMPTS_PER_CODE_TOKEN=1,
+        AUTH_TOKEN_RETRY_WAIT_TIME=datetime.timedelta(0),
+    ):
+        for _i in range(2):
+            result = client.post(
+                reverse("auth"), data={"code_token": code_token, "code": "0"}
+            )
+        assert result.status_code == status.HTTP_403_FORBIDDEN
+        client.post(
+            reverse("auth"), data={"code_token": code_token, "code": code}
+        )
+
+    flush_audit_log()
+    events = read_events(audit_file)
+    assert [x["event_type"] for x in events] == [
+        "code-issued",
+        "auth-failed",
+        "locked-out",
+        "locked-out",
+    ]
+    assert {x["user_pk"] for x in events} == {str(user.pk)}
+    assert events[0]["data"] == {"method": "code-sender"}
+    assert events[1]["data"] == {"method": "code-sender"}
+    assert events[1]["client_ident"] == "127.0.0.1"
+
+
+@pytest.mark.django_db
+def test_events_of_totp_enrollment_and_method_change(audit_file):
+    user = get_user()
+    client = get_api_client()
+    client.credentials(
+        HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}"
+    )
+    secret = client.post(reverse("totp-setup")).data["secret"]
+    result = client.post(
+        reverse("totp-confirm"), data={"code": pyotp.TOTP(secret).now()}
+    )
+    assert result.status_code == status.HTTP_200_OK
+    result = client.post(
+        reverse("set-2fa-method"), data={"method": "code-sender"}
+    )
+    assert result.status_code == status.HTTP_200_OK
+
+    flush_audit_log()
+    events = read_events(audit_file)
+    assert [(x["event_type"], x["data"]) for x in events] == [
+        ("totp-enrolled", {}),
+        ("method-changed", {"method": "code-sender"}),
+    ]
+
+
+@pytest.mark.django_db
+def test_export_command():
+    now = timezone.now()
+    for minutes, event_type in [
+        (3, AuditEventType.CODE_ISSUED),
+        (2, AuditEventType.AUTH_FAILED),
+        (1, AuditEventType.LOCKED_OUT),
+    ]:
+        AuditEvent.objects.create(
+            event_type=event_type,
+            created_at=now - datetime.timedelta(minutes=minutes),
+            user_pk="7",
+            data={"minutes": minutes},
+        )
+
+    def export(*args):
+        out = io.StringIO()
+        call_command("jwt2fa_export_audit_log", *args, stdout=out)
+        return [json.loads(x) for x in out.getvalue().splitlines()]
+
+    assert [x["data"]["minutes"] for x in export()] == [3, 2, 1]
+    since = (now - datetime.timedelta(minutes=2)).isoformat()
+    until = (now - datetime.timedelta(minutes=1)).isoformat()
+    assert [x["event_type"] for x in export("--since", since)] == [
+        "auth-failed",
+        "locked-out",
+    ]
+    assert export("--since", since, "--until", until) == [
+        {
+            "event_type": "auth-failed",
+            "created_at": (now - datetime.timedelta(minutes=2)).isoformat(),
+            "user_pk": "7",
+            "client_ident": "",
+            "data": {"minutes": 2},
+        }
+    ]
+    events = export(
+        "--event-type", "code-issued", "--event-type", "locked-out"
+    )
+    assert [x["data"]["minutes"] for x in events] == [3, 1]
+    with pytest.raises(CommandError):
+        export("--since", "yesterday")
+    with pytest.raises(CommandError):
+        export("--until", "2024-13-01T00:00:00")
+
+
+@pytest.mark.django_db
+def test_export_command_with_naive_time(settings):
+    settings.TIME_ZONE = "Europe/Helsinki"  # UTC+2 in January
+    AuditEvent.objects.create(
+        event_type=AuditEventType.CODE_ISSUED,
+        created_at=datetime.datetime(2024, 1, 1, 10, 30, tzinfo=datetime.UTC),
+    )
+    out = io.StringIO()
+    call_command(
+        "jwt2fa_export_audit_log", "--since", "2024-01-01T12:31", stdout=out
+    )
+    assert out.getvalue() == ""
+    call_command(
+        "jwt2fa_export_audit_log", "--until", "2024-01-01T12:31", stdout=out
+    )
+    assert json.loads(out.getvalue())["event_type"] == "code-issued"
@@ -0,0 +1,110 @@
+import datetime
+from unittest.mock import patch
+
+import pytest
+from django.test import RequestFactory
+from rest_framework.request import Request
+from rest_framework_simplejwt.backends import TokenBackend
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from drf_jwt_2fa.authentication import EnrollmentOrJwt2faAuthentication
+from drf_jwt_2fa.enrollment_token import EnrollmentToken
+
+from .factories import get_user
+
+
+def make_request(auth_header=None):
+    http_request = RequestFactory().get("/")
+    if auth_header is not None:
+        http_request.META["HTTP_AUTHORIZATION"] = auth_header
+    return Request(http_request)
+
+
+def authenticate(token):
+    auth = EnrollmentOrJwt2faAuthentication()
+    return auth.authenticate(make_request(f"Bearer {token}"))
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("token_class", [EnrollmentToken, AccessToken])
+def test_accepts_enrollment_and_access_tokens(
+    token_class, django_assert_num_queries
+):
+    user = get_user()
+    token = token_class.for_user(user)
+    with (
+        patch.object(
+            TokenBackend,
+            "decode",
+            autospec=True,
+            side_effect=TokenBackend.decode,
+        ) as decode_mock,
+        django_assert_num_queries(1),
+    ):
+        (authenticated_user, validated_token) = authenticate(token)
+    assert decode_mock.call_count == 1
+    assert authenticated_user == user
+    assert type(validated_token) is token_class
+    assert validated_token.payload == token.payload
+
+
+@pytest.mark.django_db
+def test_rejects_refresh_token():
+    token = RefreshToken.for_user(get_user())
+    with pytest.raises(InvalidToken) as exc_info:
+        authenticate(token)
+    assert "not valid for any token type" in str(exc_info.value.detail)
+
+
+@pytest.mark.django_db
+def test_rejects_expired_token():
+    token = EnrollmentToken.for_user(get_user())
+    token.set_exp(lifetime=-datetime.timedelta(seconds=1000))
+    with pytest.raises(InvalidToken) as exc_info:
+        authenticate(token)
+    assert "expired" in str(exc_info.value.detail)
+
+
+@pytest.mark.django_db
+def test_rejects_token_with_invalid_signature():
+    token = str(AccessToken.for_user(get_user()))
+    with pytest.raises(InvalidToken) as exc_info:
+        authenticate(token[:-2] + ("AA" if token[-2:] != "AA" else "BB"))
+    assert "invalid" in str(exc_info.value.detail)
+
+
+def test_rejects_malformed_token():
+    with pytest.raises(InvalidToken) as exc_info:
+        authenticate("not-a-token")
+    assert "invalid" in str(exc_info.value.detail)
+
+
+@pytest.mark.django_db
+def test_uses_token_backend_of_token_class():
+    token = str(EnrollmentToken.for_user(get_user()))
+    other_backend = TokenBackend("HS256", signing_key="other-key" * 4)
+    with patch.object(
+        EnrollmentToken, "get_token_backend", return_value=other_backend
+    ):
+        with pytest.raises(InvalidToken) as exc_info:
+            authenticate(token)
+        token_of_other_backend = EnrollmentToken.for_user(get_user())
+        (_user, validated_token) = authenticate(token_of_other_backend)
+    assert "invalid" in str(exc_info.value.detail)
+    assert type(validated_token) is EnrollmentToken
+
+
+def test_rejects_token_without_id():
+    token = EnrollmentToken()
+    token["user_id"] = 1
+    del token["jti"]
+    with pytest.raises(InvalidToken) as exc_info:
+        authenticate(token)
+    assert "no id" in str(exc_info.value.detail)
+
+
+@pytest.mark.parametrize("auth_header", [None, "Token abc", ""])
+def test_returns_none_without_bearer_token(auth_header):
+    auth = EnrollmentOrJwt2faAuthentication()
+    assert auth.authenticate(make_request(auth_header)) is None
@@ -0,0 +1,73 @@
+import pytest
+
+from drf_jwt_2fa.bloom import BloomFilter, get_optimal_size
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter.for_capacity(1000, 0.01)
+    items = [f"item-{i}".encode() for i in range(1000)]
+    for item in items:
+        bloom.add(item)
+    assert all(item in bloom for item in items)
+
+
+def test_bloom_filter_false_positive_rate_is_within_bounds():
+    bloom = BloomFilter.for_capacity(2000, 0.01)
+    for i in range(2000):
+        bloom.add(f"added-{i}".encode())
+    false_positives = sum(f"other-{i}".encode() in bloom for i in range(20000))
+    assert false_positives / 20000 < 0.02
+
+
+def test_bloom_filter_positions_of_an_item_are_spread():
+    bloom = BloomFilter(13501, 30)
+    # Plain double hashing maps all positions of this item to one bit
+    assert len(set(bloom._get_positions(b"6Yit2W_9lUeoTDItZArnCQ"))) > 20
+    for i in range(20000):
+        assert len(set(bloom._get_positions(str(i).encode()))) > 10
+
+
+def test_bloom_filter_add_tells_if_item_was_present():
+    bloom = BloomFilter.for_capacity(100, 0.001)
+    assert bloom.add(b"abc") is False
+    assert bloom.add(b"abc") is True
+    assert bloom.add(b"def") is False
+
+
+def test_bloom_filter_serialization_round_trip():
+    bloom = BloomFilter.for_capacity(100, 0.001)
+    bloom.add(b"abc")
+    data = bloom.to_bytes()
+    restored = BloomFilter(bloom.num_bits, bloom.num_hashes, data)
+    assert b"abc" in restored
+    assert b"def" not in restored
+    assert restored.to_bytes() == data
+
+
+def test_bloom_filter_rejects_data_of_wrong_size():
+    with pytest.raises(ValueError, match="wrong size"):
+        BloomFilter(64, 3, b"\0" * 7)
+
+
+@pytest.mark.parametrize("num_bits, num_hashes", [(0, 1), (8, 0)])
+def test_bloom_filter_requires_bits_and_hashes(num_bits, num_hashes):
+    with pytest.raises(ValueError, match="must have bits and hashes"):
+        BloomFilter(num_bits, num_hashes)
+
+
+@pytest.mark.parametrize(
+    "capacity, error_rate, expected",
+    [
+        (1000, 0.01, (9586, 7)),
+        (1000, 1e-9, (43133, 30)),
+        (1, 0.5, (2, 1)),
+    ],
+)
+def test_get_optimal_size(capacity, error_rate, expected):
+    assert get_optimal_size(capacity, error_rate) == expected
+
+
+@pytest.mark.parametrize("capacity, error_rate", [(0, 0.1), (10, 0), (10, 1)])
+def test_get_optimal_size_rejects_invalid_values(capacity, error_rate):
+    with pytest.raises(ValueError, match="Invalid Bloom filter"):
+        get_optimal_size(capacity, error_rate)
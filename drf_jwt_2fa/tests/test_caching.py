@@ -0,0 +1,286 @@
+import pytest
+from django.core.cache import caches
+from django.test import override_settings
+from django.test.client import RequestFactory
+from rest_framework import exceptions
+
+from drf_jwt_2fa.caching import (
+    ConsistentHashRing,
+    get_cache_key_prefix,
+    get_throttle_cache,
+    get_token_state_cache,
+    make_cache_key,
+)
+from drf_jwt_2fa.exceptions import TooManyAuthAttemptsError
+from drf_jwt_2fa.throttling import AuthTokenThrottler, CodeTokenThrottler
+from drf_jwt_2fa.token_manager import CodeTokenManager
+from drf_jwt_2fa.utils import get_code_token_hash
+
+from .factories import (
+    get_code_token,
+    get_code_token_and_its_jti,
+    get_user_with_code_sender_2fa,
+)
+from .utils import OverrideJwt2faSettings
+
+CACHES_WITH_2FA_ALIASES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "test-caching-default",
+    },
+    "2fa-tokens": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "test-caching-2fa-tokens",
+    },
+    "2fa-throttle": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "test-caching-2fa-throttle",
+    },
+}
+
+SHARD_ALIASES = ["shard-a", "shard-b", "shard-c"]
+
+CACHES_WITH_SHARDS = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "test-caching-default",
+    },
+    **{
+        alias: {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": f"test-caching-{alias}",
+        }
+        for alias in SHARD_ALIASES
+    },
+}
+
+
+@pytest.fixture()
+def separate_caches():
+    with (
+        override_settings(CACHES=CACHES_WITH_2FA_ALIASES),
+        OverrideJwt2faSettings(
+            TOKEN_STATE_CACHE="2fa-tokens",
+            THROTTLE_CACHE="2fa-throttle",
+        ),
+    ):
+        for alias in CACHES_WITH_2FA_ALIASES:
+            caches[alias].clear()
+        yield
+        for alias in CACHES_WITH_2FA_ALIASES:
+            caches[alias].clear()
+
+
+def cached_keys(alias):
+    return set(caches[alias]._cache.keys())
+
+
+def test_cache_key_prefix_defaults():
+    assert get_cache_key_prefix() == "drf_jwt_2fa"
+    assert make_cache_key("stats") == "drf_jwt_2fa:stats"
+    assert make_cache_key("a", "b") == "drf_jwt_2fa:a:b"
+
+
+@OverrideJwt2faSettings(CACHE_KEY_PREFIX="j2", CACHE_KEY_VERSION=3)
+def test_cache_key_prefix_with_version():
+    assert get_cache_key_prefix() == "j2:v3"
+    assert make_cache_key("stats") == "j2:v3:stats"
+
+
+def test_default_caches_are_the_default_alias():
+    assert get_token_state_cache("42") is caches["default"]
+    assert get_throttle_cache() is caches["default"]
+
+
+def test_caches_follow_settings(separate_caches):
+    assert get_token_state_cache("42") is caches["2fa-tokens"]
+    assert get_throttle_cache() is caches["2fa-throttle"]
+
+
+@pytest.mark.django_db
+def test_token_state_is_stored_to_token_state_cache(separate_caches):
+    manager = CodeTokenManager()
+    user = get_user_with_code_sender_2fa()
+    manager.create_code_token(user)
+
+    assert cached_keys("default") == set()
+    assert cached_keys("2fa-throttle") == set()
+    assert cached_keys("2fa-tokens") == {
+        f":1:drf_jwt_2fa:active_tokens:{user.pk}",
+    }
+
+
+@pytest.mark.django_db
+def test_used_token_marker_is_stored_to_token_state_cache(separate_caches):
+    token = get_code_token(verification_code="1234567")
+    payload = CodeTokenManager().decode_token(token)
+    CodeTokenManager().check_code_token_and_code(token, "1234567")
+
+    assert cached_keys("default") == set()
+    assert f":1:drf_jwt_2fa:used_token:{payload['jti']}" in (
+        cached_keys("2fa-tokens")
+    )
+
+
+def test_throttle_state_is_stored_to_throttle_cache(separate_caches):
+    rf = RequestFactory()
+    token = get_code_token()
+    request = rf.post("/")
+    request.data = {"code_token": token}
+    token_state_keys_before = cached_keys("2fa-tokens")
+
+    AuthTokenThrottler().allow_request(request, None)
+    CodeTokenThrottler().allow_request(rf.get("/"), None)
+
+    assert cached_keys("default") == set()
+    assert cached_keys("2fa-tokens") == token_state_keys_before
+    keys = cached_keys("2fa-throttle")
+    assert f":1:drf_jwt_2fa:throttle:auth:{get_code_token_hash(token)}" in keys
+    assert len(keys) == 2
+
+
+@OverrideJwt2faSettings(CACHE_KEY_PREFIX="j2", CACHE_KEY_VERSION=2)
+def test_throttle_cache_keys_use_prefix():
+    rf = RequestFactory()
+    token = get_code_token()
+    request = rf.post("/")
+    request.data = {"code_token": token}
+
+    auth_key = AuthTokenThrottler().get_cache_key(request, None)
+    code_key = CodeTokenThrottler().get_cache_key(rf.get("/"), None)
+
+    assert auth_key == f"j2:v2:throttle:auth:{get_code_token_hash(token)}"
+    assert code_key.startswith("j2:v2:throttle:code:")
+
+
+@pytest.mark.django_db
+def test_token_state_keys_use_prefix(separate_caches):
+    with OverrideJwt2faSettings(
+        TOKEN_STATE_CACHE="2fa-tokens", CACHE_KEY_PREFIX="j2"
+    ):
+        manager = CodeTokenManager()
+        user = get_user_with_code_sender_2fa()
+        manager.create_code_token(user)
+    assert cached_keys("2fa-tokens") == {
+        f":1:j2:active_tokens:{user.pk}",
+    }
+
+
+@pytest.mark.django_db
+def test_changing_key_version_invalidates_token_state(separate_caches):
+    token = get_code_token(verification_code="1234567")
+    manager = CodeTokenManager()
+    manager.check_code_token_and_code(token, "1234567")
+    with OverrideJwt2faSettings(
+        TOKEN_STATE_CACHE="2fa-tokens", CACHE_KEY_VERSION=2
+    ):
+        # The used token marker of the old version is not visible
+        result = manager.check_code_token_and_code(token, "1234567")
+    assert result.user_id == "9876"
+
+
+@pytest.fixture()
+def sharded_caches():
+    with (
+        override_settings(CACHES=CACHES_WITH_SHARDS),
+        OverrideJwt2faSettings(TOKEN_STATE_CACHE_SHARDS=SHARD_ALIASES),
+    ):
+        for alias in CACHES_WITH_SHARDS:
+            caches[alias].clear()
+        yield
+        for alias in CACHES_WITH_SHARDS:
+            caches[alias].clear()
+
+
+def test_hash_ring_maps_keys_deterministically():
+    ring1 = ConsistentHashRing(["a", "b", "c"])
+    ring2 = ConsistentHashRing(["c", "a", "b"])
+    keys = [f"key-{i}" for i in range(100)]
+    assert [ring1.get_node(k) for k in keys] == [
+        ring2.get_node(k) for k in keys
+    ]
+
+
+def test_hash_ring_distributes_keys_evenly():
+    nodes = ["a", "b", "c", "d"]
+    ring = ConsistentHashRing(nodes)
+    counts = dict.fromkeys(nodes, 0)
+    for i in range(20000):
+        counts[ring.get_node(str(i))] += 1
+    for count in counts.values():
+        assert 3500 < count < 6500  # 5000 +/- 30 %
+
+
+def test_hash_ring_moves_about_one_nth_of_keys_on_new_node():
+    old_ring = ConsistentHashRing(["a", "b", "c", "d"])
+    new_ring = ConsistentHashRing(["a", "b", "c", "d", "e"])
+    keys = [str(i) for i in range(20000)]
+    moved = [k for k in keys if old_ring.get_node(k) != new_ring.get_node(k)]
+    # About 1/5 of the keys should move, and only to the new node
+    assert 0.14 < len(moved) / len(keys) < 0.26
+    assert {new_ring.get_node(k) for k in moved} == {"e"}
+
+
+def test_hash_ring_requires_nodes():
+    with pytest.raises(ValueError, match="at least one node"):
+        ConsistentHashRing([])
+
+
+def test_sharded_token_state_cache_is_selected_by_routing_key(sharded_caches):
+    ring = ConsistentHashRing(SHARD_ALIASES)
+    for key in ["1", "2", "abc", "xyz"]:
+        expected_alias = ring.get_node(key)
+        assert get_token_state_cache(key) is caches[expected_alias]
+
+
+@pytest.mark.django_db
+def test_active_tokens_are_sharded_by_user_id(sharded_caches):
+    manager = CodeTokenManager()
+    users = [
+        get_user_with_code_sender_2fa(username=f"user{i}") for i in range(12)
+    ]
+    for user in users:
+        manager.create_code_token(user)
+
+    ring = ConsistentHashRing(SHARD_ALIASES)
+    for user in users:
+        alias = ring.get_node(str(user.pk))
+        key = f":1:drf_jwt_2fa:active_tokens:{user.pk}"
+        for other_alias in SHARD_ALIASES:
+            assert (key in cached_keys(other_alias)) == (other_alias == alias)
+    assert cached_keys("default") == set()
+
+
+def test_per_token_state_is_sharded_by_jti(sharded_caches):
+    manager = CodeTokenManager()
+    ring = ConsistentHashRing(SHARD_ALIASES)
+    # Note: The code tokens are for the same user, so max 3 of them
+    for _ in range(3):
+        (token, jti) = get_code_token_and_its_jti()
+        with pytest.raises(exceptions.AuthenticationFailed):
+            manager.check_code_token_and_code(token, "0000000")
+        manager.check_code_token_and_code(token, "1234567")
+
+        alias = ring.get_node(jti)
+        attempts_key = (
+            f":1:drf_jwt_2fa:auth_attempts:{get_code_token_hash(token)}"
+        )
+        used_key = f":1:drf_jwt_2fa:used_token:{jti}"
+        assert {attempts_key, used_key} <= cached_keys(alias)
+        for other_alias in set(SHARD_ALIASES) - {alias}:
+            assert attempts_key not in cached_keys(other_alias)
+            assert used_key not in cached_keys(other_alias)
+
+
+def test_attempt_limit_works_with_sharded_state(sharded_caches):
+    with OverrideJwt2faSettings(
+        TOKEN_STATE_CACHE_SHARDS=SHARD_ALIASES,
+        MAX_AUTH_ATTEMPTS_PER_CODE_TOKEN=2,
+    ):
+        manager = CodeTokenManager()
+        token = get_code_token(verification_code="1234567")
+        for _ in range(2):
+            with pytest.raises(exceptions.AuthenticationFailed):
+                manager.check_code_token_and_code(token, "0000000")
+        with pytest.raises(TooManyAuthAttemptsError):
+            manager.check_code_token_and_code(token, "1234567")
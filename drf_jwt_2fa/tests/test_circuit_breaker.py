@@ -0,0 +1,161 @@
+import datetime
+
+import freezegun
+import pytest
+from django.core.cache import cache
+
+from drf_jwt_2fa.circuit_breaker import (
+    CircuitBreaker,
+    CircuitOpenError,
+    get_circuit_breaker,
+)
+
+from .utils import OverrideJwt2faSettings
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def make_breaker(name="email", slow_call_seconds=10.0):
+    return CircuitBreaker(
+        name,
+        failure_rate=0.5,
+        min_calls=4,
+        slow_call_seconds=slow_call_seconds,
+        window_seconds=60,
+        open_seconds=30,
+    )
+
+
+def succeed():
+    return "ok"
+
+
+def fail():
+    raise RuntimeError("Down")
+
+
+def call_failing(breaker, count):
+    for _i in range(count):
+        with pytest.raises(RuntimeError):
+            breaker.call(fail)
+
+
+@freezegun.freeze_time("2026-01-01 12:00:00")
+def test_breaker_stays_closed_below_min_calls():
+    breaker = make_breaker()
+    call_failing(breaker, 3)
+    assert breaker.get_state() == "closed"
+    assert breaker.call(succeed) == "ok"
+
+
+@freezegun.freeze_time("2026-01-01 12:00:00")
+def test_breaker_stays_closed_below_failure_rate():
+    breaker = make_breaker()
+    for _i in range(3):
+        breaker.call(succeed)
+    call_failing(breaker, 2)
+    assert breaker.get_state() == "closed"
+
+
+@freezegun.freeze_time("2026-01-01 12:00:00")
+def test_breaker_opens_on_failure_rate():
+    breaker = make_breaker()
+    breaker.call(succeed)
+    breaker.call(succeed)
+    call_failing(breaker, 2)
+    assert breaker.get_state() == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.call(succeed)
+
+
+@freezegun.freeze_time("2026-01-01 12:00:00")
+def test_breaker_counts_slow_calls_as_failures():
+    breaker = make_breaker(slow_call_seconds=0)
+    for _i in range(4):
+        assert breaker.call(succeed) == "ok"
+    assert breaker.get_state() == "open"
+
+
+def test_breaker_state_is_shared():
+    call_failing(make_breaker(), 4)
+    assert make_breaker().get_state() == "open"
+    assert make_breaker("sms").get_state() == "closed"
+
+
+def test_breaker_forgets_old_windows():
+    with freezegun.freeze_time("2026-01-01 12:00:00") as frozen_time:
+        breaker = make_breaker()
+        call_failing(breaker, 3)
+        frozen_time.tick(datetime.timedelta(minutes=2))
+        call_failing(breaker, 1)
+        assert breaker.get_state() == "closed"
+
+
+def test_breaker_half_open_probe_success_closes():
+    with freezegun.freeze_time("2026-01-01 12:00:00") as frozen_time:
+        breaker = make_breaker()
+        call_failing(breaker, 4)
+        frozen_time.tick(datetime.timedelta(seconds=31))
+        assert breaker.get_state() == "half-open"
+        assert breaker.call(succeed) == "ok"
+        assert breaker.get_state() == "closed"
+        # The counted failures are forgotten
+        call_failing(breaker, 1)
+        assert breaker.get_state() == "closed"
+
+
+def test_breaker_half_open_probe_failure_reopens():
+    with freezegun.freeze_time("2026-01-01 12:00:00") as frozen_time:
+        breaker = make_breaker()
+        call_failing(breaker, 4)
+        frozen_time.tick(datetime.timedelta(seconds=31))
+        call_failing(breaker, 1)
+        assert breaker.get_state() == "open"
+        with pytest.raises(CircuitOpenError):
+            breaker.call(succeed)
+
+
+def test_breaker_half_open_lets_one_probe_through():
+    with freezegun.freeze_time("2026-01-01 12:00:00") as frozen_time:
+        breaker = make_breaker()
+        call_failing(breaker, 4)
+        frozen_time.tick(datetime.timedelta(seconds=31))
+        probes = []
+
+        def probe():
+            probes.append(1)
+            # Concurrent call while the probe is in flight is rejected
+            with pytest.raises(CircuitOpenError):
+                make_breaker().call(succeed)
+
+        breaker.call(probe)
+    assert probes == [1]
+
+
+def test_breaker_reset():
+    breaker = make_breaker()
+    call_failing(breaker, 4)
+    breaker.reset()
+    assert breaker.get_state() == "closed"
+
+
+@OverrideJwt2faSettings(
+    CIRCUIT_BREAKER_FAILURE_RATE=0.25,
+    CIRCUIT_BREAKER_MIN_CALLS=10,
+    CIRCUIT_BREAKER_SLOW_CALL_TIME=datetime.timedelta(seconds=1),
+    CIRCUIT_BREAKER_WINDOW=datetime.timedelta(minutes=5),
+    CIRCUIT_BREAKER_OPEN_TIME=datetime.timedelta(seconds=10),
+)
+def test_get_circuit_breaker_uses_settings():
+    breaker = get_circuit_breaker("sms")
+    assert breaker.name == "sms"
+    assert breaker.failure_rate == 0.25
+    assert breaker.min_calls == 10
+    assert breaker.slow_call_seconds == 1
+    assert breaker.window_seconds == 300
+    assert breaker.open_seconds == 10
@@ -0,0 +1,138 @@
+import functools
+import threading
+import time
+from unittest.mock import patch
+
+import freezegun
+import pytest
+
+from drf_jwt_2fa.deadlines import (
+    Deadline,
+    DeadlineExceededError,
+    _thread_pools,
+    accepts_deadline,
+    call_with_deadline,
+)
+
+
+def test_deadline_remaining_time():
+    with freezegun.freeze_time("2026-01-01 12:00:00") as frozen_time:
+        deadline = Deadline(2)
+        assert deadline.get_remaining() == 2
+        assert deadline.get_timeout(5) == 2
+        assert deadline.get_timeout(1) == 1
+        assert not deadline.expired
+        frozen_time.tick(3)
+        assert deadline.get_remaining() == 0
+        assert deadline.expired
+
+
+def test_accepts_deadline():
+    with_deadline = lambda user, code, deadline=None: None  # noqa: E731
+    with_kwargs = lambda user, code, **kwargs: None  # noqa: E731
+    without_deadline = lambda user, code: None  # noqa: E731
+    positional_only = lambda user, code, deadline, /: None  # noqa: E731
+
+    assert accepts_deadline(with_deadline)
+    assert not accepts_deadline(with_kwargs)
+    assert not accepts_deadline(without_deadline)
+    assert not accepts_deadline(positional_only)
+    assert not accepts_deadline(print)
+
+
+class UnhashableSender:
+    # Defining __eq__ without __hash__ makes the instances unhashable
+    __eq__ = object.__eq__
+    __call__ = lambda self, user, code, deadline=None: None  # noqa: E731
+
+
+class SenderWithoutSignature:
+    __signature__ = "invalid"
+    __call__ = lambda self, user, code, deadline=None: None  # noqa: E731
+
+
+def test_accepts_deadline_of_unhashable_callable():
+    assert accepts_deadline(UnhashableSender())
+
+
+def test_accepts_deadline_without_signature():
+    assert not accepts_deadline(SenderWithoutSignature())
+
+
+def test_call_with_deadline_without_deadline():
+    def func(a, b):
+        return (a, b, threading.current_thread())
+
+    (a, b, thread) = call_with_deadline(func, None, 1, 2, max_threads=1)
+    assert (a, b) == (1, 2)
+    assert thread is threading.current_thread()
+
+
+def test_call_with_deadline_passes_deadline():
+    deadline = Deadline(1)
+    calls = []
+
+    def func(a, deadline=None):
+        calls.append((a, deadline, threading.current_thread()))
+
+    call_with_deadline(func, deadline, 1, max_threads=1)
+    assert calls == [(1, deadline, threading.current_thread())]
+
+
+def test_call_with_deadline_runs_others_in_thread():
+    def func(a):
+        return (a, threading.current_thread())
+
+    (a, thread) = call_with_deadline(func, Deadline(1), 1, max_threads=2)
+    assert a == 1
+    assert thread is not threading.current_thread()
+    assert thread.name.startswith("jwt2fa-sender")
+
+
+def test_call_with_deadline_raises_errors_of_thread():
+    def func():
+        raise ValueError("Failed")
+
+    with pytest.raises(ValueError, match="Failed"):
+        call_with_deadline(func, Deadline(1), max_threads=1)
+
+
+def test_call_with_deadline_timeout():
+    release = threading.Event()
+
+    def func():
+        release.wait(5)
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceededError):
+        call_with_deadline(func, Deadline(0.05), max_threads=1)
+    assert time.monotonic() - start < 1
+    release.set()
+
+
+def test_call_with_deadline_queued_call_is_cancelled():
+    release = threading.Event()
+    calls = []
+
+    def blocking():
+        release.wait(5)
+
+    queued = functools.partial(calls.append, 1)
+
+    with pytest.raises(DeadlineExceededError):
+        call_with_deadline(blocking, Deadline(0.05), max_threads=1)
+    with pytest.raises(DeadlineExceededError):
+        call_with_deadline(queued, Deadline(0.05), max_threads=1)
+    release.set()
+    # The next call runs after the blocking one, but not the cancelled
+    call_with_deadline(lambda: None, Deadline(5), max_threads=1)
+    assert calls == []
+
+
+def test_thread_pool_is_created_again_in_forked_process():
+    call_with_deadline(lambda: None, Deadline(5), max_threads=1)
+    (_pid, threads, pool) = _thread_pools["sender"]
+    with patch.dict(_thread_pools, {"sender": (-1, threads, pool)}):
+        call_with_deadline(lambda: None, Deadline(5), max_threads=threads)
+        assert _thread_pools["sender"][2] is not pool
+    assert not pool._shutdown
@@ -0,0 +1,243 @@
+import datetime
+import threading
+import time
+from unittest.mock import Mock, patch
+
+import pytest
+from django.core import mail
+from django.core.cache import cache
+from django.urls import reverse
+from rest_framework import status
+
+from drf_jwt_2fa.delivery import (
+    _QueueSlots,
+    deliver_code_in_background,
+    get_delivery_status,
+)
+from drf_jwt_2fa.sending import CodeSendingError
+from drf_jwt_2fa.totp import generate_totp_secret
+
+from .factories import get_user_with_code_sender_2fa, get_user_with_totp_2fa
+from .utils import (
+    OverrideJwt2faSettings,
+    check_auth_token,
+    check_code_token,
+    get_api_client,
+    get_verification_code_from_mailbox,
+)
+
+use_async_sending = OverrideJwt2faSettings(ASYNC_CODE_SENDING=True)
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def get_code(client=None):
+    client = client or get_api_client()
+    return client.post(
+        reverse("get-code"), data={"username": "testuser", "password": "a42"}
+    )
+
+
+def get_status(client, delivery_id):
+    return client.get(reverse("code-delivery", args=[delivery_id]))
+
+
+def wait_for_delivery(delivery_id, timeout=5):
+    end = time.monotonic() + timeout
+    while get_delivery_status(delivery_id) == "queued":
+        assert time.monotonic() < end, "Delivery did not finish"
+        time.sleep(0.005)
+    return get_delivery_status(delivery_id)
+
+
+@pytest.mark.django_db
+@use_async_sending
+def test_get_code_async_returns_accepted():
+    get_user_with_code_sender_2fa()
+    result = get_code()
+    assert result.status_code == status.HTTP_202_ACCEPTED
+    assert sorted(result.data) == ["delivery_id", "token"]
+    payload = check_code_token(result.data["token"])
+    assert result.data["delivery_id"] == payload["jti"]
+
+
+@pytest.mark.django_db
+@use_async_sending
+def test_get_code_async_delivers_code_and_auth_succeeds():
+    get_user_with_code_sender_2fa()
+    client = get_api_client()
+    result = get_code(client)
+    delivery_id = result.data["delivery_id"]
+    assert wait_for_delivery(delivery_id) == "sent"
+
+    status_result = get_status(client, delivery_id)
+    assert status_result.status_code == status.HTTP_200_OK
+    assert status_result.data == {"status": "sent"}
+
+    auth_result = client.post(
+        reverse("auth"),
+        data={
+            "code_token": result.data["token"],
+            "code": get_verification_code_from_mailbox(),
+        },
+    )
+    assert auth_result.status_code == status.HTTP_200_OK
+    check_auth_token(auth_result.data["access"])
+
+
+@pytest.mark.django_db
+def test_get_code_async_status_is_queued_until_sent():
+    release = threading.Event()
+    sent = []
+
+    def slow_sender(user, code):
+        release.wait(5)
+        sent.append(code)
+
+    get_user_with_code_sender_2fa()
+    client = get_api_client()
+    with OverrideJwt2faSettings(
+        ASYNC_CODE_SENDING=True, CODE_SENDER=slow_sender
+    ):
+        result = get_code(client)
+        delivery_id = result.data["delivery_id"]
+        assert get_status(client, delivery_id).data == {"status": "queued"}
+        release.set()
+        assert wait_for_delivery(delivery_id) == "sent"
+    assert len(sent) == 1
+
+
+@pytest.mark.django_db
+def test_get_code_async_failed_delivery(caplog):
+    def failing_sender(user, code):
+        raise CodeSendingError("Gateway down")
+
+    get_user_with_code_sender_2fa()
+    with OverrideJwt2faSettings(
+        ASYNC_CODE_SENDING=True, CODE_SENDER=failing_sender
+    ):
+        result = get_code()
+        assert result.status_code == status.HTTP_202_ACCEPTED
+        assert wait_for_delivery(result.data["delivery_id"]) == "failed"
+    assert "Gateway down" in caplog.text
+
+
+@pytest.mark.django_db
+def test_get_code_async_timed_out_delivery():
+    release = threading.Event()
+
+    def hanging_sender(user, code):
+        release.wait(5)
+
+    get_user_with_code_sender_2fa()
+    with OverrideJwt2faSettings(
+        ASYNC_CODE_SENDING=True,
+        CODE_SENDER=hanging_sender,
+        CODE_SENDING_TIMEOUT=datetime.timedelta(seconds=0.05),
+    ):
+        result = get_code()
+        status = wait_for_delivery(result.data["delivery_id"])
+    release.set()
+    assert status == "timed-out"
+
+
+@pytest.mark.django_db
+@use_async_sending
+def test_get_code_async_for_totp_user_has_no_delivery():
+    get_user_with_totp_2fa(generate_totp_secret())
+    outbox_size = len(mail.outbox)
+    result = get_code()
+    assert result.status_code == status.HTTP_200_OK
+    assert sorted(result.data) == ["token"]
+    assert len(mail.outbox) == outbox_size
+
+
+def test_code_delivery_status_of_unknown_id():
+    result = get_status(get_api_client(), "unknown")
+    assert result.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+def test_get_code_sync_has_no_delivery():
+    get_user_with_code_sender_2fa()
+    result = get_code()
+    assert result.status_code == status.HTTP_200_OK
+    assert sorted(result.data) == ["token"]
+
+
+@pytest.mark.django_db
+def test_get_code_async_fails_over_queue_limit(caplog):
+    release = threading.Event()
+
+    def slow_sender(user, code):
+        release.wait(5)
+
+    get_user_with_code_sender_2fa()
+    with OverrideJwt2faSettings(
+        ASYNC_CODE_SENDING=True,
+        ASYNC_CODE_SENDING_MAX_QUEUED=1,
+        CODE_SENDER=slow_sender,
+    ):
+        first = get_code().data["delivery_id"]
+        second = get_code().data["delivery_id"]
+        assert get_delivery_status(first) == "queued"
+        assert get_delivery_status(second) == "failed"
+        release.set()
+        assert wait_for_delivery(first) == "sent"
+        # The slot is free again
+        third = get_code().data["delivery_id"]
+        assert wait_for_delivery(third) == "sent"
+    assert "Too many queued" in caplog.text
+
+
+@pytest.mark.django_db
+def test_get_code_async_expired_delivery_is_not_sent():
+    sent = []
+    sender = lambda user, code: sent.append(code)  # noqa: E731
+    get_user_with_code_sender_2fa()
+    with (
+        OverrideJwt2faSettings(ASYNC_CODE_SENDING=True, CODE_SENDER=sender),
+        # Expired by the time the delivery is run
+        patch("drf_jwt_2fa.delivery.time", Mock(time=lambda: 2**40)),
+    ):
+        delivery_id = get_code().data["delivery_id"]
+        assert wait_for_delivery(delivery_id) == "expired"
+    assert sent == []
+
+
+def test_unexpected_error_of_background_delivery(caplog):
+    def broken_sender(user, code):
+        raise RuntimeError("Bug in sender")
+
+    expires_at = int(time.time()) + 60
+    deliver_code_in_background(broken_sender, None, "1234", "x", expires_at)
+    assert wait_for_delivery("x") == "failed"
+    assert "Bug in sender" in caplog.text
+
+
+@OverrideJwt2faSettings(ASYNC_CODE_SENDING_MAX_QUEUED=1)
+def test_slot_is_released_when_submitting_fails():
+    sender = lambda user, code: None  # noqa: E731
+    expires_at = int(time.time()) + 60
+    submit = Mock(side_effect=RuntimeError("Cannot start new thread"))
+    with (
+        patch("drf_jwt_2fa.delivery.submit_to_thread_pool", submit),
+        pytest.raises(RuntimeError),
+    ):
+        deliver_code_in_background(sender, None, "1234", "x", expires_at)
+    # The slot is free again
+    deliver_code_in_background(sender, None, "1234", "y", expires_at)
+    assert wait_for_delivery("y") == "sent"
+
+
+def test_queue_slots_are_reset_in_forked_process():
+    slots = _QueueSlots()
+    assert slots.acquire(1)
+    assert not slots.acquire(1)
+    with patch.object(slots, "_pid", -1):
+        assert slots.acquire(1)
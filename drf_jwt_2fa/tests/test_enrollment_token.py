@@ -2,6 +2,8 @@
 Tests for the enrollment token feature.
 """
 
+import datetime
+
 import pyotp
 import pytest
 from django.contrib.auth.signals import user_logged_in
@@ -36,6 +38,14 @@ def test_enrollment_token_type():
     assert EnrollmentToken.token_type == "enrollment"
 
 
+def test_enrollment_token_lifetime_follows_settings():
+    lifetime = datetime.timedelta(minutes=3)
+    with OverrideJwt2faSettings(ENROLLMENT_TOKEN_EXPIRATION_TIME=lifetime):
+        token = EnrollmentToken()
+        assert EnrollmentToken.lifetime == lifetime
+    assert token["exp"] - token["iat"] == 180
+
+
 def test_enrollment_token_authentication_class_exists():
     """EnrollmentTokenAuthentication can be instantiated."""
     EnrollmentTokenAuthentication()
@@ -52,6 +62,36 @@ def test_enrollment_token_authentication_ignores_non_bearer_auth_value():
     assert result is None
 
 
+@pytest.mark.django_db
+def test_enrollment_token_authentication_ignores_missing_header():
+    auth = EnrollmentTokenAuthentication()
+    request = Request(RequestFactory().get("/"))
+    assert auth.authenticate(request) is None
+
+
+@pytest.mark.django_db
+def test_enrollment_token_authentication_ignores_access_token():
+    auth = EnrollmentTokenAuthentication()
+    http_request = RequestFactory().get("/")
+    token = AccessToken.for_user(get_user())
+    http_request.META["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+    assert auth.authenticate(Request(http_request)) is None
+
+
+@pytest.mark.django_db
+def test_enrollment_token_authentication_accepts_enrollment_token():
+    auth = EnrollmentTokenAuthentication()
+    user = get_user()
+    http_request = RequestFactory().get("/")
+    token = EnrollmentToken.for_user(user)
+    http_request.META["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+    (authenticated_user, validated_token) = auth.authenticate(
+        Request(http_request)
+    )
+    assert authenticated_user == user
+    assert validated_token.payload == token.payload
+
+
 # ---------------------------------------------------------------------------
 # POST /auth/ returns enrollment token when 2FA method not trusted
 # ---------------------------------------------------------------------------
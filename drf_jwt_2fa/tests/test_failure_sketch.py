@@ -0,0 +1,148 @@
+import datetime
+from unittest.mock import Mock, patch
+
+import freezegun
+import pytest
+from django.core.cache import cache
+from django.urls import reverse
+from rest_framework import exceptions
+
+from drf_jwt_2fa.exceptions import TooManyAuthAttemptsError
+from drf_jwt_2fa.failure_sketch import FailedAttemptSketch
+from drf_jwt_2fa.serializers import AuthTokenSerializer
+from drf_jwt_2fa.token_manager import CodeTokenManager, CodeVerificationResult
+
+from .utils import OverrideJwt2faSettings, get_api_client
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def make_code_token(user_id, code="1234567"):
+    manager = CodeTokenManager()
+    user = Mock()
+    user.pk = user_id
+    return manager.encode_token(
+        manager.get_code_sender_token_payload(user, code)
+    )
+
+
+def fail_auth(manager, token, client_ident=None):
+    with pytest.raises(exceptions.AuthenticationFailed) as exc_info:
+        manager.check_code_token_and_code(token, "0000000", client_ident)
+    assert not isinstance(exc_info.value, TooManyAuthAttemptsError)
+
+
+def test_sketch_counts_items():
+    sketch = FailedAttemptSketch(width=1024, window_seconds=60)
+    for _ in range(3):
+        sketch.add("a")
+    sketch.add("b")
+    assert sketch.estimate("a") >= 3
+    assert sketch.estimate("b") >= 1
+    assert sketch.estimate("a") < 3.5
+    assert sketch.estimate("c") < 0.5
+
+
+def test_sketch_never_underestimates_and_has_bounded_keys():
+    sketch = FailedAttemptSketch(width=16, window_seconds=60)
+    with freezegun.freeze_time("2026-01-01 12:00:00"):
+        for i in range(200):
+            for _ in range(i % 3 + 1):
+                sketch.add(f"item-{i}")
+        for i in range(200):
+            assert sketch.estimate(f"item-{i}") >= i % 3 + 1
+    assert len(cache._cache) <= sketch.depth * sketch.width
+
+
+def test_sketch_counts_decay_over_sliding_window():
+    sketch = FailedAttemptSketch(width=1024, window_seconds=60)
+    with freezegun.freeze_time("2026-01-01 12:00:00") as frozen_time:
+        for _ in range(4):
+            sketch.add("a")
+        assert sketch.estimate("a") == 4
+        frozen_time.tick(datetime.timedelta(seconds=75))
+        # A quarter of the previous window is out of the sliding window
+        assert sketch.estimate("a") == 3
+        frozen_time.tick(datetime.timedelta(seconds=45))
+        assert sketch.estimate("a") == 0
+
+
+@OverrideJwt2faSettings(
+    MAX_AUTH_ATTEMPTS_PER_CODE_TOKEN=5,
+    MAX_FAILED_AUTH_ATTEMPTS_PER_USER=4,
+)
+def test_user_is_locked_out_over_parallel_code_tokens():
+    manager = CodeTokenManager()
+    tokens = [make_code_token(42) for _ in range(3)]
+    for token in tokens:
+        fail_auth(manager, token)
+    fail_auth(manager, tokens[0])
+    for token in [*tokens, make_code_token(42)]:
+        with pytest.raises(TooManyAuthAttemptsError):
+            manager.check_code_token_and_code(token, "1234567")
+    # Other users are not affected
+    result = manager.check_code_token_and_code(make_code_token(43), "1234567")
+    assert result.user_id == "43"
+
+
+@OverrideJwt2faSettings(MAX_FAILED_AUTH_ATTEMPTS_PER_CLIENT=3)
+def test_client_is_locked_out_over_several_users():
+    manager = CodeTokenManager()
+    for user_id in [1, 2, 3]:
+        fail_auth(manager, make_code_token(user_id), "10.0.0.1")
+    with pytest.raises(TooManyAuthAttemptsError):
+        manager.check_code_token_and_code(
+            make_code_token(4), "1234567", "10.0.0.1"
+        )
+    result = manager.check_code_token_and_code(
+        make_code_token(4), "1234567", "10.0.0.2"
+    )
+    assert result.user_id == "4"
+
+
+def test_failures_are_not_counted_by_default():
+    manager = CodeTokenManager()
+    for _ in range(10):
+        fail_auth(manager, make_code_token(42), "10.0.0.1")
+    assert not any(":failures:" in key for key in cache._cache)
+
+
+def test_failure_counter_memory_does_not_grow_with_tokens():
+    manager = CodeTokenManager()
+    with OverrideJwt2faSettings(
+        MAX_AUTH_ATTEMPTS_PER_CODE_TOKEN=None,
+        MAX_FAILED_AUTH_ATTEMPTS_PER_USER=100,
+    ):
+        for _ in range(50):
+            fail_auth(manager, make_code_token(42))
+        failure_keys = [key for key in cache._cache if ":failures:" in key]
+    assert len(failure_keys) == FailedAttemptSketch.depth
+
+
+@pytest.mark.django_db
+def test_auth_endpoint_passes_client_ident():
+    check = Mock(return_value=CodeVerificationResult("0", trusted=True))
+    client = get_api_client()
+    with patch.object(CodeTokenManager, "check_code_token_and_code", check):
+        client.post(
+            reverse("auth"),
+            data={"code_token": "x", "code": "y"},
+            REMOTE_ADDR="10.1.2.3",
+        )
+    check.assert_called_once_with("x", "y", client_ident="10.1.2.3")
+
+
+def test_serializer_without_request_passes_no_client_ident():
+    check = Mock(side_effect=exceptions.AuthenticationFailed)
+    serializer = AuthTokenSerializer(data={"code_token": "x", "code": "y"})
+    with (
+        patch.object(CodeTokenManager, "check_code_token_and_code", check),
+        pytest.raises(exceptions.AuthenticationFailed),
+    ):
+        serializer.is_valid()
+    check.assert_called_once_with("x", "y", client_ident=None)
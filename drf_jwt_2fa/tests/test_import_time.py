@@ -0,0 +1,95 @@
+"""
+Tests for the import time of the package.
+
+The imports are measured in a subprocess with ``python -X importtime``,
+since the modules are already imported in the test process.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+
+# Maximum total self time of the modules of this package imported by
+# django.setup(), which is what e.g. every management command pays
+SETUP_IMPORT_TIME_BUDGET_US = 100_000
+
+# Modules which are not needed before the first 2FA operation
+DEFERRED_MODULES = [
+    "cryptography.fernet",
+    "django.test",
+    "pyotp",
+    "rest_framework_simplejwt.settings",
+]
+
+IMPORT_SCRIPT = """
+import json, sys
+import django
+django.setup()
+from drf_jwt_2fa.settings import api_settings
+setup_modules = sorted(sys.modules)
+print("--- urls ---", file=sys.stderr, flush=True)
+import drf_jwt_2fa.urls
+print(json.dumps({
+    "setup_modules": setup_modules,
+    "urls_modules": sorted(sys.modules),
+    "settings_loaded": bool(api_settings.__dict__),
+}))
+"""
+
+
+def run_import_script():
+    env = {**os.environ, "DJANGO_SETTINGS_MODULE": settings.SETTINGS_MODULE}
+    result = subprocess.run(  # noqa: S603
+        [sys.executable, "-X", "importtime", "-c", IMPORT_SCRIPT],
+        capture_output=True,
+        check=True,
+        env=env,
+        text=True,
+    )
+    (setup_log, _sep, _urls_log) = result.stderr.partition("--- urls ---")
+    return (json.loads(result.stdout), setup_log)
+
+
+def get_self_times(import_time_log):
+    times = {}
+    for line in import_time_log.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        (self_time, _cumulative, name) = line[12:].split("|")
+        if self_time.strip().isdigit():
+            times[name.strip()] = int(self_time)
+    return times
+
+
+def test_import_is_light():
+    (result, setup_log) = run_import_script()
+
+    for name in DEFERRED_MODULES:
+        assert name not in result["setup_modules"]
+    assert "pyotp" not in result["urls_modules"]
+    assert "cryptography.fernet" not in result["urls_modules"]
+    assert not result["settings_loaded"]
+
+    own_times = [
+        time
+        for (name, time) in get_self_times(setup_log).items()
+        if name.split(".")[0] == "drf_jwt_2fa"
+    ]
+    assert own_times
+    assert sum(own_times) < SETUP_IMPORT_TIME_BUDGET_US
+
+
+def test_get_self_times():
+    log = (
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       120 |        350 | drf_jwt_2fa\n"
+        "Warning: something else on stderr\n"
+        "import time:        80 |         80 |   drf_jwt_2fa.settings\n"
+    )
+    assert get_self_times(log) == {
+        "drf_jwt_2fa": 120,
+        "drf_jwt_2fa.settings": 80,
+    }
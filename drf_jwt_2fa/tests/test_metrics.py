@@ -0,0 +1,294 @@
+import os
+from unittest.mock import Mock, patch
+
+import pytest
+from django.core.cache import cache
+from django.http import Http404
+from django.urls import reverse
+from rest_framework import status
+
+from drf_jwt_2fa import metrics
+from drf_jwt_2fa.metrics import Counter, Histogram, ValueFile, read_values
+from drf_jwt_2fa.serializers import CodeTokenSerializer
+
+from .factories import get_user_with_code_sender_2fa
+from .utils import (
+    OverrideJwt2faSettings,
+    get_api_client,
+    get_verification_code_from_mailbox,
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def enable_metrics(directory, **values):
+    return OverrideJwt2faSettings(
+        METRICS_ENABLED=True, METRICS_DIRECTORY=str(directory), **values
+    )
+
+
+@pytest.fixture
+def metrics_dir(tmp_path):
+    with enable_metrics(tmp_path):
+        yield tmp_path
+
+
+@pytest.fixture
+def unregistered_metrics():
+    registry = list(metrics._registry)
+    yield
+    metrics._registry[:] = registry
+
+
+def get_samples():
+    samples = {}
+    for line in metrics.render_metrics().splitlines():
+        if line and not line.startswith("#"):
+            (name, value) = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_value_file_increment_and_read():
+    value_file = ValueFile(None)
+    value_file.increment("a")
+    value_file.increment("bb", 2.5)
+    value_file.increment("a", 3)
+    assert value_file.read_values() == {"a": 4.0, "bb": 2.5}
+
+
+@pytest.mark.parametrize("path", [None, "file"])
+def test_value_file_grows(tmp_path, path):
+    value_file = ValueFile(path and str(tmp_path / path))
+    keys = [f"key-{i:05d}-" + "x" * 50 for i in range(3000)]
+    for key in keys:
+        value_file.increment(key)
+    value_file.increment(keys[0])
+    values = value_file.read_values()
+    assert len(values) == 3000
+    assert values[keys[0]] == 2.0
+    assert values[keys[-1]] == 1.0
+    if path:
+        with open(tmp_path / path, "rb") as file:
+            assert read_values(file.read()) == values
+
+
+def test_value_file_is_continued(tmp_path):
+    path = str(tmp_path / "jwt2fa_1.db")
+    value_file = ValueFile(path)
+    value_file.increment("a", 2)
+    value_file.close()
+
+    value_file = ValueFile(path)
+    value_file.increment("a")
+    value_file.increment("b")
+    value_file.close()
+
+    with open(path, "rb") as file:
+        assert read_values(file.read()) == {"a": 3.0, "b": 1.0}
+
+
+@pytest.mark.parametrize("used", [0, 2**31])
+def test_value_file_with_invalid_header_is_reset(tmp_path, used):
+    path = tmp_path / "jwt2fa_1.db"
+    path.write_bytes(used.to_bytes(4, "little") + bytes(100))
+    value_file = ValueFile(str(path))
+    value_file.increment("a")
+    assert value_file.read_values() == {"a": 1.0}
+
+
+def test_read_values_of_empty_data():
+    assert read_values(b"") == {}
+
+
+def test_values_of_processes_are_summed(metrics_dir, unregistered_metrics):
+    counter = Counter("test_summed", "Test counter.", ["kind"])
+    other_process_file = ValueFile(str(metrics_dir / "jwt2fa_1.db"))
+    other_process_file.increment(counter._get_key("total", {"kind": "a"}), 2)
+    (metrics_dir / "unrelated.txt").write_text("ignored")
+
+    counter.inc(kind="a")
+    counter.inc(kind="b")
+
+    assert sorted(os.listdir(metrics_dir)) == [
+        "jwt2fa_1.db",
+        f"jwt2fa_{os.getpid()}.db",
+        "unrelated.txt",
+    ]
+    samples = get_samples()
+    assert samples['test_summed_total{kind="a"}'] == 3.0
+    assert samples['test_summed_total{kind="b"}'] == 1.0
+
+
+def test_render_counter_and_histogram(metrics_dir, unregistered_metrics):
+    counter = Counter("test_counter", "Test counter.", ["kind"])
+    histogram = Histogram("test_hist", "Test histogram.", [], [0.1, 1])
+    counter.inc(kind='quote"d')
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    text = metrics.render_metrics()
+
+    assert "# HELP test_counter_total Test counter.\n" in text
+    assert "# TYPE test_counter_total counter\n" in text
+    assert 'test_counter_total{kind="quote\\"d"} 1.0\n' in text
+    assert "# TYPE test_hist histogram\n" in text
+    assert (
+        'test_hist_bucket{le="0.1"} 1.0\n'
+        'test_hist_bucket{le="1.0"} 3.0\n'
+        'test_hist_bucket{le="+Inf"} 4.0\n'
+        "test_hist_sum 6.05\n"
+        "test_hist_count 4.0\n"
+    ) in text
+
+
+def test_metrics_without_directory(unregistered_metrics):
+    counter = Counter("test_anonymous", "Test counter.", [])
+    with OverrideJwt2faSettings(METRICS_ENABLED=True):
+        counter.inc()
+        counter.inc()
+        samples = get_samples()
+    assert samples["test_anonymous_total"] == 2.0
+
+
+def test_storage_is_reset_in_forked_child(metrics_dir):
+    storage = metrics._Storage()
+    value_file = storage.get_file()
+    assert storage.get_file() is value_file
+    storage._reset()
+    assert storage.get_file() is not value_file
+
+
+def test_storage_file_opened_by_other_thread_is_used(metrics_dir):
+    storage = metrics._Storage()
+    value_file = ValueFile(None)
+
+    class OpeningLock:
+        # Another thread opens the file while this one waits for the lock
+        def __enter__(self):
+            storage._file = value_file
+            storage._directory = str(metrics_dir)
+
+        def __exit__(self, *exc_info):
+            pass
+
+    storage._lock = OpeningLock()
+    assert storage.get_file() is value_file
+
+
+def test_wrong_labels_are_rejected(metrics_dir, unregistered_metrics):
+    counter = Counter("test_labels", "Test counter.", ["kind"])
+    with pytest.raises(ValueError):
+        counter.inc(other="a")
+
+
+def test_disabled_metrics_are_not_recorded(tmp_path):
+    with OverrideJwt2faSettings(METRICS_DIRECTORY=str(tmp_path)):
+        metrics.CODE_SENDS.inc(outcome="sent")
+        metrics.PHASE_DURATION.observe(1, phase="send_code")
+    assert os.listdir(tmp_path) == []
+
+
+def test_metrics_endpoint_not_found_when_disabled():
+    result = get_api_client().get(reverse("metrics"))
+    assert result.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_metrics_endpoint_forbidden_outside_allowed_networks(metrics_dir):
+    client = get_api_client()
+    result = client.get(reverse("metrics"), REMOTE_ADDR="192.0.2.1")
+    assert result.status_code == status.HTTP_403_FORBIDDEN
+    with enable_metrics(
+        metrics_dir, METRICS_ALLOWED_NETWORKS=["192.0.2.0/24"]
+    ):
+        result = client.get(reverse("metrics"), REMOTE_ADDR="192.0.2.1")
+    assert result.status_code == status.HTTP_200_OK
+
+
+def test_metrics_endpoint_forbidden_with_invalid_address(metrics_dir):
+    client = get_api_client()
+    result = client.get(reverse("metrics"), REMOTE_ADDR="unknown")
+    assert result.status_code == status.HTTP_403_FORBIDDEN
+
+
+@pytest.mark.django_db
+def test_metrics_of_successful_login(metrics_dir):
+    get_user_with_code_sender_2fa()
+    client = get_api_client()
+    code_result = client.post(
+        reverse("get-code"), data={"username": "testuser", "password": "a42"}
+    )
+    assert code_result.status_code == status.HTTP_200_OK
+    auth_result = client.post(
+        reverse("auth"),
+        data={
+            "code_token": code_result.data["token"],
+            "code": get_verification_code_from_mailbox(),
+        },
+    )
+    assert auth_result.status_code == status.HTTP_200_OK
+
+    result = client.get(reverse("metrics"))
+
+    assert result.status_code == status.HTTP_200_OK
+    assert result["Content-Type"].startswith("text/plain; version=0.0.4")
+    samples = get_samples()
+    assert (
+        samples['jwt2fa_code_tokens_issued_total{method="code-sender"}'] == 1
+    )
+    assert samples['jwt2fa_code_sends_total{outcome="sent"}'] == 1
+    phase_counts = {
+        "authenticate": 2,
+        "create_tokens": 2,
+        "send_code": 1,
+        "verify_code": 1,
+    }
+    for phase, count in phase_counts.items():
+        name = f'jwt2fa_phase_duration_seconds_count{{phase="{phase}"}}'
+        assert samples[name] == count
+    assert not any(x.startswith("jwt2fa_auth_errors") for x in samples)
+
+
+@pytest.mark.django_db
+def test_metrics_of_rejected_requests(metrics_dir):
+    get_user_with_code_sender_2fa()
+    client = get_api_client()
+    result = client.post(
+        reverse("get-code"), data={"username": "testuser", "password": "x"}
+    )
+    assert result.status_code == status.HTTP_401_UNAUTHORIZED
+    with enable_metrics(metrics_dir, CODE_TOKEN_THROTTLE_RATE="1/h"):
+        # The failed request above used the only allowed request
+        result = client.post(
+            reverse("get-code"),
+            data={"username": "testuser", "password": "a42"},
+        )
+    assert result.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+
+    samples = get_samples()
+
+    error_name = 'jwt2fa_auth_errors_total{error="authentication_failed"}'
+    throttle_name = (
+        'jwt2fa_throttled_requests_total{throttle="CodeTokenThrottler"}'
+    )
+    assert samples[error_name] == 1
+    assert samples[throttle_name] == 1
+
+
+@pytest.mark.django_db
+def test_other_errors_are_not_counted(metrics_dir):
+    not_found = Mock(side_effect=Http404)
+    with patch.object(CodeTokenSerializer, "validate", not_found):
+        result = get_api_client().post(
+            reverse("get-code"),
+            data={"username": "testuser", "password": "a42"},
+        )
+    assert result.status_code == status.HTTP_404_NOT_FOUND
+    assert not any(x.startswith("jwt2fa_auth_errors") for x in get_samples())
@@ -1,7 +1,15 @@
+from unittest.mock import patch
+
 import pytest
 from django.contrib.auth.models import User
+from django.db.models import QuerySet
+from django.utils import timezone
 
-from drf_jwt_2fa.models import TwoFactorAuthMethod, UserTwoFactorAuthData
+from drf_jwt_2fa.models import (
+    RecoveryCode,
+    TwoFactorAuthMethod,
+    UserTwoFactorAuthData,
+)
 from drf_jwt_2fa.totp import generate_totp_secret
 
 from .factories import get_user
@@ -23,6 +31,15 @@ def test_user_two_factor_auth_data_str(preferred, expected):
     assert str(data) == expected
 
 
+@pytest.mark.parametrize(
+    "used_at, expected",
+    [(None, "jane (unused)"), (timezone.now(), "jane (used)")],
+)
+def test_recovery_code_str(used_at, expected):
+    code = RecoveryCode(user=User(username="jane"), used_at=used_at)
+    assert str(code) == expected
+
+
 def test_get_totp_secret_returns_empty_string_when_not_set():
     data = UserTwoFactorAuthData()
     assert data.get_totp_secret() == ""
@@ -161,3 +178,129 @@ def test_get_preferred_2fa_method_of_user_returns_totp():
     d.save()
     result = UserTwoFactorAuthData.get_preferred_2fa_method_of_user(user)
     assert result == "totp"
+
+
+@pytest.mark.django_db
+def test_set_pending_totp_secret_of_user_creates_and_updates(
+    django_assert_num_queries,
+):
+    user = get_user()
+    first = generate_totp_secret()
+    second = generate_totp_secret()
+    UserTwoFactorAuthData.set_pending_totp_secret_of_user(user, first)
+    data = UserTwoFactorAuthData.objects.get(user=user)
+    assert data.get_pending_totp_secret() == first
+    with django_assert_num_queries(1):
+        UserTwoFactorAuthData.set_pending_totp_secret_of_user(user, second)
+    data.refresh_from_db()
+    assert data.get_pending_totp_secret() == second
+
+
+@pytest.mark.django_db
+def test_activate_pending_totp_secret_of_user_compares_pending_value():
+    user = get_user()
+    secret = generate_totp_secret()
+    UserTwoFactorAuthData.set_pending_totp_secret_of_user(user, secret)
+    get_pending = (
+        UserTwoFactorAuthData.get_encrypted_pending_totp_secret_of_user
+    )
+    activate = UserTwoFactorAuthData.activate_pending_totp_secret_of_user
+    encrypted = get_pending(user)
+    # Replaced by another setup in between
+    UserTwoFactorAuthData.set_pending_totp_secret_of_user(
+        user, generate_totp_secret()
+    )
+    assert not activate(user, encrypted)
+    encrypted = get_pending(user)
+    assert activate(user, encrypted)
+    assert not activate(user, encrypted)  # Already activated
+    assert get_pending(user) == ""
+    data = UserTwoFactorAuthData.objects.get(user=user)
+    assert data.preferred_2fa_auth == TwoFactorAuthMethod.TOTP
+    assert data.get_totp_secret() != secret
+
+
+@pytest.mark.django_db
+def test_set_preferred_2fa_method_of_user_to_totp_requires_secret():
+    user = get_user()
+    set_method = UserTwoFactorAuthData.set_preferred_2fa_method_of_user
+    assert not set_method(user, TwoFactorAuthMethod.TOTP)
+    assert set_method(user, TwoFactorAuthMethod.CODE_SENDER)
+    UserTwoFactorAuthData.set_pending_totp_secret_of_user(
+        user, generate_totp_secret()
+    )
+    assert not set_method(user, TwoFactorAuthMethod.TOTP)
+    data = UserTwoFactorAuthData.objects.get(user=user)
+    data.set_totp_secret(generate_totp_secret())
+    data.save()
+    assert set_method(user, TwoFactorAuthMethod.TOTP)
+    data.refresh_from_db()
+    assert data.preferred_2fa_auth == TwoFactorAuthMethod.TOTP
+
+
+@pytest.mark.django_db
+def test_set_preferred_2fa_method_of_user_to_totp_rejects_bad_secret():
+    user = get_user()
+    UserTwoFactorAuthData.objects.create(
+        user=user,
+        encrypted_totp_secret="encrypted-with-another-key",
+        preferred_2fa_auth=TwoFactorAuthMethod.CODE_SENDER,
+    )
+    set_method = UserTwoFactorAuthData.set_preferred_2fa_method_of_user
+    assert not set_method(user, TwoFactorAuthMethod.TOTP)
+    data = UserTwoFactorAuthData.objects.get(user=user)
+    assert data.preferred_2fa_auth == TwoFactorAuthMethod.CODE_SENDER
+
+
+@pytest.mark.django_db
+def test_set_preferred_2fa_method_of_user_to_totp_with_replaced_secret():
+    user = get_user()
+    data = UserTwoFactorAuthData(user=user)
+    data.set_totp_secret(generate_totp_secret())
+    data.save()
+    set_method = UserTwoFactorAuthData.set_preferred_2fa_method_of_user
+    replaced = patch(
+        "drf_jwt_2fa.models.decrypt_totp_secret",
+        side_effect=lambda x: replace_totp_secret(user) or "secret",
+    )
+    with replaced:
+        assert not set_method(user, TwoFactorAuthMethod.TOTP)
+
+
+def replace_totp_secret(user):
+    # Replaced by a concurrent request after the secret was read
+    data = UserTwoFactorAuthData.objects.get(user=user)
+    data.set_totp_secret(generate_totp_secret())
+    data.save()
+
+
+@pytest.mark.django_db
+def test_activate_pending_totp_secret_of_user_without_secret():
+    activate = UserTwoFactorAuthData.activate_pending_totp_secret_of_user
+    assert not activate(get_user(), "")
+
+
+@pytest.mark.django_db
+def test_upsert_updates_record_created_concurrently():
+    user = get_user()
+    secret = generate_totp_secret()
+    UserTwoFactorAuthData.objects.create(user=user)
+    update = QuerySet.update
+    # Not created yet on the first update, but created by a concurrent
+    # request before the insert
+    updates = iter([lambda *args, **kwargs: 0])
+
+    def update_mock(queryset, **values):
+        return next(updates, update)(queryset, **values)
+
+    with patch.object(QuerySet, "update", update_mock):
+        UserTwoFactorAuthData.set_pending_totp_secret_of_user(user, secret)
+    data = UserTwoFactorAuthData.objects.get(user=user)
+    assert data.get_pending_totp_secret() == secret
+
+
+def test_set_pending_totp_secret_clears_when_empty_string():
+    data = UserTwoFactorAuthData()
+    data.set_pending_totp_secret(generate_totp_secret())
+    data.set_pending_totp_secret("")
+    assert data.encrypted_totp_secret_pending == ""
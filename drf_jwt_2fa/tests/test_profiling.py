@@ -0,0 +1,280 @@
+import cProfile
+import io
+import os
+from unittest.mock import Mock, patch
+
+import pyotp
+import pytest
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import reverse
+from django.views import View
+from rest_framework import status
+from rest_framework_simplejwt.tokens import AccessToken
+
+from drf_jwt_2fa.profiling import (
+    ProfilingMixin,
+    iter_profile_files,
+    write_profile,
+)
+from drf_jwt_2fa.settings import api_settings
+from drf_jwt_2fa.totp import generate_totp_secret
+
+from .factories import (
+    get_user,
+    get_user_with_code_sender_2fa,
+    get_user_with_totp_2fa,
+)
+from .utils import (
+    OverrideJwt2faSettings,
+    get_api_client,
+    get_verification_code_from_mailbox,
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def enable_profiling(directory, sample_rate=1.0, **values):
+    return OverrideJwt2faSettings(
+        PROFILING_SAMPLE_RATE=sample_rate,
+        PROFILING_DIRECTORY=str(directory),
+        **values,
+    )
+
+
+def get_tags(directory):
+    return [(x.endpoint, x.method) for x in iter_profile_files(directory)]
+
+
+def get_code(client):
+    return client.post(
+        reverse("get-code"), data={"username": "testuser", "password": "a42"}
+    )
+
+
+@pytest.mark.django_db
+def test_login_requests_are_profiled(tmp_path):
+    get_user_with_code_sender_2fa()
+    client = get_api_client()
+    with enable_profiling(tmp_path):
+        code_token = get_code(client).data["token"]
+        result = client.post(
+            reverse("auth"),
+            data={
+                "code_token": code_token,
+                "code": get_verification_code_from_mailbox(),
+            },
+        )
+    assert result.status_code == status.HTTP_200_OK
+    assert get_tags(tmp_path) == [
+        ("get-code", "code-sender"),
+        ("auth", "code-sender"),
+    ]
+
+
+@pytest.mark.django_db
+def test_totp_requests_are_profiled(tmp_path):
+    get_user_with_totp_2fa(generate_totp_secret())
+    with enable_profiling(tmp_path):
+        result = get_code(get_api_client())
+    assert result.status_code == status.HTTP_200_OK
+    assert get_tags(tmp_path) == [("get-code", "totp")]
+
+
+@pytest.mark.django_db
+def test_totp_enrollment_is_profiled(tmp_path):
+    client = get_api_client()
+    client.credentials(
+        HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(get_user())}"
+    )
+    with enable_profiling(tmp_path):
+        secret = client.post(reverse("totp-setup")).data["secret"]
+        client.post(
+            reverse("totp-confirm"), data={"code": pyotp.TOTP(secret).now()}
+        )
+    assert get_tags(tmp_path) == [
+        ("totp-setup", "totp"),
+        ("totp-confirm", "totp"),
+    ]
+
+
+@pytest.mark.django_db
+def test_rejected_requests_are_profiled(tmp_path):
+    client = get_api_client()
+    with enable_profiling(tmp_path):
+        client.post(reverse("auth"), data={"code_token": "x", "code": "1"})
+        get_code(client)
+    assert get_tags(tmp_path) == [
+        ("auth", "unknown"),
+        ("get-code", "unknown"),
+    ]
+
+
+@pytest.mark.django_db
+def test_requests_are_not_profiled_by_default(tmp_path):
+    get_user_with_code_sender_2fa()
+    with enable_profiling(tmp_path, sample_rate=0.0):
+        get_code(get_api_client())
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.django_db
+def test_auth_request_without_code_token_is_profiled(tmp_path):
+    with enable_profiling(tmp_path):
+        result = get_api_client().post(reverse("auth"), data={})
+    assert result.status_code == status.HTTP_400_BAD_REQUEST
+    assert get_tags(tmp_path) == [("auth", "unknown")]
+
+
+@pytest.mark.django_db
+def test_profile_write_errors_do_not_fail_request(tmp_path, caplog):
+    get_user_with_code_sender_2fa()
+    not_a_directory = tmp_path / "file"
+    not_a_directory.write_text("")
+    with enable_profiling(not_a_directory):
+        result = get_code(get_api_client())
+    assert result.status_code == status.HTTP_200_OK
+    assert "Writing the profile of get-code failed" in caplog.text
+
+
+@pytest.mark.django_db
+def test_request_is_not_profiled_when_profiler_is_active(tmp_path):
+    get_user_with_code_sender_2fa()
+    # The profiler of Python 3.12+ refuses to run with another one
+    profiler = Mock(enable=Mock(side_effect=ValueError))
+    with (
+        enable_profiling(tmp_path),
+        patch(
+            "drf_jwt_2fa.profiling.cProfile", Mock(Profile=lambda: profiler)
+        ),
+    ):
+        result = get_code(get_api_client())
+    assert result.status_code == status.HTTP_200_OK
+    assert os.listdir(tmp_path) == []
+
+
+class UnnamedView(ProfilingMixin, View):
+    def get(self, request):
+        return HttpResponse("ok")
+
+
+def test_unrouted_view_is_profiled_with_class_name(tmp_path):
+    with enable_profiling(tmp_path):
+        response = UnnamedView.as_view()(RequestFactory().get("/"))
+    assert response.content == b"ok"
+    assert get_tags(tmp_path) == [("UnnamedView", "unknown")]
+
+
+@OverrideJwt2faSettings(PROFILING_SAMPLE_RATE=0.5)
+def test_profiling_requires_directory():
+    with pytest.raises(ImproperlyConfigured) as exc:
+        _ = api_settings.PROFILING_SAMPLE_RATE
+    assert exc.value.args[0] == (
+        "JWT2FA_AUTH setting 'PROFILING_DIRECTORY' must be set "
+        "when 'PROFILING_SAMPLE_RATE' is above zero"
+    )
+
+
+def test_write_profile_requires_directory():
+    with pytest.raises(ValueError, match="PROFILING_DIRECTORY is not set"):
+        write_profile(cProfile.Profile(), "get-code", "totp")
+
+
+def test_other_files_are_not_profiles(tmp_path):
+    (tmp_path / "notes.txt").write_text("")
+    (tmp_path / "old.format.prof").write_text("")
+    with enable_profiling(tmp_path):
+        path = write_profile(cProfile.Profile(), "get-code", "totp")
+    assert [x.path for x in iter_profile_files(tmp_path)] == [path]
+
+
+def test_profile_removed_by_other_process_is_skipped(tmp_path):
+    with (
+        enable_profiling(tmp_path, PROFILING_MAX_FILES=1),
+        patch(
+            "drf_jwt_2fa.profiling.os.remove", side_effect=FileNotFoundError
+        ),
+    ):
+        write_profile(cProfile.Profile(), "get-code", "a")
+        write_profile(cProfile.Profile(), "get-code", "b")
+    assert get_tags(tmp_path) == [("get-code", "a"), ("get-code", "b")]
+
+
+def test_oldest_profiles_are_removed(tmp_path):
+    with enable_profiling(tmp_path, PROFILING_MAX_FILES=2):
+        paths = [
+            write_profile(cProfile.Profile(), "get-code", method)
+            for method in ["a", "b", "c"]
+        ]
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        os.path.basename(x) for x in paths[1:]
+    )
+    assert get_tags(tmp_path) == [("get-code", "b"), ("get-code", "c")]
+
+
+def test_write_profile_sanitizes_tags(tmp_path):
+    with enable_profiling(tmp_path):
+        write_profile(cProfile.Profile(), "a.b/c", "x y")
+    assert get_tags(tmp_path) == [("a_b_c", "x_y")]
+
+
+def profile_function(directory, endpoint, method):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    sorted(range(1000), key=str)
+    profiler.disable()
+    with enable_profiling(directory):
+        write_profile(profiler, endpoint, method)
+
+
+def report(*args):
+    out = io.StringIO()
+    call_command("jwt2fa_profile_report", *args, stdout=out)
+    return out.getvalue()
+
+
+def test_report_command_merges_profiles(tmp_path):
+    profile_function(tmp_path, "get-code", "totp")
+    profile_function(tmp_path, "get-code", "totp")
+    profile_function(tmp_path, "auth", "totp")
+
+    output = report("--directory", str(tmp_path))
+
+    assert "=== auth (totp): 1 requests" in output
+    assert "=== get-code (totp): 2 requests" in output
+    assert output.index("=== auth") < output.index("=== get-code")
+    assert "{built-in method builtins.sorted}" in output
+
+    output = report("--directory", str(tmp_path), "--endpoint", "auth")
+    assert "=== auth (totp)" in output
+    assert "=== get-code" not in output
+
+    output = report("--directory", str(tmp_path), "--method", "code-sender")
+    assert output == "No profiles found\n"
+
+
+def test_report_command_dumps_merged_profiles(tmp_path):
+    profile_directory = tmp_path / "profiles"
+    dump_directory = tmp_path / "merged"
+    profile_function(profile_directory, "auth", "totp")
+    profile_function(profile_directory, "auth", "totp")
+
+    with enable_profiling(profile_directory):
+        output = report("--dump-directory", str(dump_directory))
+
+    assert f"written to {dump_directory / 'auth.totp.prof'}" in output
+    assert os.listdir(dump_directory) == ["auth.totp.prof"]
+
+
+def test_report_command_requires_directory(tmp_path):
+    with pytest.raises(CommandError):
+        report("--directory", str(tmp_path / "missing"))
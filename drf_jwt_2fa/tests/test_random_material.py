@@ -0,0 +1,85 @@
+import base64
+import collections
+import os
+from unittest.mock import patch
+
+import pytest
+
+from drf_jwt_2fa.random_material import RandomMaterial
+from drf_jwt_2fa.token_manager import CodeTokenManager
+
+from .factories import get_user
+
+
+def chi_square(counts, num_samples):
+    expected = num_samples / len(counts)
+    return sum((count - expected) ** 2 / expected for count in counts)
+
+
+@pytest.mark.parametrize(
+    "allowed_chars, critical_value",
+    [
+        # Critical values of chi-square distribution for p = 0.0001
+        ("0123456789", 33.7),
+        ("abc", 18.4),
+        ("".join(chr(0x100 + i) for i in range(200)), 292.5),
+        ("".join(chr(0x1000 + i) for i in range(300)), 405.9),
+    ],
+)
+def test_get_string_is_uniform(allowed_chars, critical_value):
+    num_samples = 200 * len(allowed_chars)
+    material = RandomMaterial()
+    counter = collections.Counter(
+        material.get_string(num_samples, allowed_chars)
+    )
+    assert set(counter) == set(allowed_chars)
+    assert chi_square(counter.values(), num_samples) < critical_value
+
+
+def test_get_string_rejects_biasing_bytes():
+    # 256 % 10 == 6, so the bytes 250-255 must be rejected
+    random_bytes = bytes([250, 255, 0, 249, 12, 253, 9]) + bytes(57)
+    with patch("os.urandom", return_value=random_bytes) as urandom_mock:
+        material = RandomMaterial()
+        assert material.get_string(4, "0123456789") == "0929"
+    urandom_mock.assert_called_once_with(64)
+
+
+def test_get_string_requires_allowed_chars():
+    with pytest.raises(ValueError, match="must not be empty"):
+        RandomMaterial().get_string(3, "")
+
+
+def test_get_bytes_uses_each_byte_once_and_refills():
+    blocks = [bytes(range(8)), bytes(range(8, 16)), bytes(range(16, 36))]
+    with patch("os.urandom", side_effect=blocks) as urandom_mock:
+        material = RandomMaterial(block_size=8)
+        assert material.get_bytes(5) == bytes(range(5))
+        assert material.get_bytes(5) == bytes(range(5, 10))
+        assert material.get_bytes(20) == bytes(range(10, 30))
+    assert [call.args for call in urandom_mock.call_args_list] == [
+        (8,),
+        (8,),
+        (20,),
+    ]
+
+
+def test_get_token_urlsafe():
+    with patch("os.urandom", return_value=b"\xfb\xff" + bytes(62)):
+        token = RandomMaterial().get_token_urlsafe(16)
+    assert len(token) == 22
+    assert base64.urlsafe_b64decode(token + "==") == b"\xfb\xff" + bytes(14)
+    assert "-" in token or "_" in token
+
+
+@pytest.mark.django_db
+def test_code_token_creation_draws_random_bytes_once():
+    user = get_user()
+    manager = CodeTokenManager()
+    with (
+        patch("os.urandom", wraps=os.urandom) as urandom_mock,
+        patch.object(manager, "send_verification_code"),
+        patch("django.contrib.auth.hashers.make_password", return_value="x"),
+    ):
+        manager._create_code_sender_token(user)
+    assert urandom_mock.call_count == 1
@@ -0,0 +1,172 @@
+import pytest
+from django.urls import reverse
+from rest_framework import status
+from rest_framework_simplejwt.tokens import AccessToken
+
+from drf_jwt_2fa.models import RecoveryCode
+from drf_jwt_2fa.recovery_codes import (
+    format_recovery_code,
+    generate_recovery_codes,
+    get_recovery_code_digest,
+    looks_like_recovery_code,
+    normalize_recovery_code,
+)
+from drf_jwt_2fa.totp import generate_totp_secret
+
+from .factories import get_user, get_user_with_totp_2fa
+from .utils import OverrideJwt2faSettings, check_auth_token, get_api_client
+
+
+def _auth_client(user):
+    token = AccessToken.for_user(user)
+    client = get_api_client()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+    return client
+
+
+def test_generate_recovery_codes():
+    codes = generate_recovery_codes()
+    assert len(codes) == 10
+    assert len(set(codes)) == 10
+    for code in codes:
+        assert len(code) == 11
+        assert code[5] == "-"
+        assert looks_like_recovery_code(code)
+
+
+def test_recovery_code_formatting_and_normalization():
+    assert format_recovery_code("ABCDEFGHJK") == "ABCDE-FGHJK"
+    assert normalize_recovery_code(" abcde-fghjk\n") == "ABCDEFGHJK"
+    assert normalize_recovery_code("ABCDE FGHJK") == "ABCDEFGHJK"
+
+
+@pytest.mark.parametrize(
+    "code, expected",
+    [
+        ("ABCDE-FGHJK", True),
+        ("abcdefghjk", True),
+        ("1234567", False),
+        ("123456", False),
+        ("ABCDE-FGHJ0", False),
+        ("ABCDE-FGHJKL", False),
+    ],
+)
+def test_looks_like_recovery_code(code, expected):
+    assert looks_like_recovery_code(code) is expected
+
+
+def test_recovery_code_digest_depends_on_user_and_key():
+    digest = get_recovery_code_digest("1", "ABCDE-FGHJK")
+    assert len(digest) == 64
+    assert get_recovery_code_digest("1", "abcdefghjk") == digest
+    assert get_recovery_code_digest("2", "ABCDE-FGHJK") != digest
+    with OverrideJwt2faSettings(RECOVERY_CODE_HMAC_KEY=b"x" * 32):
+        assert get_recovery_code_digest("1", "ABCDE-FGHJK") != digest
+
+
+@pytest.mark.django_db
+def test_recovery_code_is_used_once(django_assert_num_queries):
+    user = get_user()
+    codes = generate_recovery_codes(count=100)
+    RecoveryCode.replace_codes_of_user(user, codes)
+    # A single indexed UPDATE, regardless of the number of codes
+    with django_assert_num_queries(1):
+        assert RecoveryCode.use_code_of_user(str(user.pk), codes[42])
+    assert not RecoveryCode.use_code_of_user(str(user.pk), codes[42])
+    assert RecoveryCode.count_unused_codes_of_user(user) == 99
+
+
+@pytest.mark.django_db
+def test_recovery_code_of_other_user_is_not_accepted():
+    user = get_user()
+    other_user = get_user(username="other")
+    codes = generate_recovery_codes()
+    RecoveryCode.replace_codes_of_user(other_user, codes)
+    assert not RecoveryCode.use_code_of_user(str(user.pk), codes[0])
+
+
+@pytest.mark.django_db
+def test_new_recovery_codes_replace_old_ones():
+    user = get_user()
+    old_codes = generate_recovery_codes()
+    RecoveryCode.replace_codes_of_user(user, old_codes)
+    new_codes = generate_recovery_codes()
+    RecoveryCode.replace_codes_of_user(user, new_codes)
+    assert RecoveryCode.objects.filter(user=user).count() == 10
+    assert not RecoveryCode.use_code_of_user(str(user.pk), old_codes[0])
+    assert RecoveryCode.use_code_of_user(str(user.pk), new_codes[0])
+
+
+@pytest.mark.django_db
+def test_recovery_codes_endpoint():
+    user = get_user()
+    client = _auth_client(user)
+    result = client.get(reverse("recovery-codes"))
+    assert result.status_code == status.HTTP_200_OK
+    assert result.data == {"unused": 0}
+    result = client.post(reverse("recovery-codes"))
+    assert result.status_code == status.HTTP_200_OK
+    codes = result.data["codes"]
+    assert len(codes) == 10
+    assert client.get(reverse("recovery-codes")).data == {"unused": 10}
+    assert RecoveryCode.use_code_of_user(str(user.pk), codes[0])
+    assert client.get(reverse("recovery-codes")).data == {"unused": 9}
+
+
+@pytest.mark.django_db
+def test_recovery_codes_endpoint_requires_authentication():
+    client = get_api_client()
+    result = client.post(reverse("recovery-codes"))
+    assert result.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def _log_in_with_recovery_code(code):
+    client = get_api_client()
+    result = client.post(
+        reverse("get-code"), data={"username": "testuser", "password": "a42"}
+    )
+    return client.post(
+        reverse("auth"),
+        data={"code_token": result.data["token"], "code": code},
+    )
+
+
+@pytest.mark.django_db
+def test_recovery_code_gives_enrollment_token_by_default():
+    user = get_user_with_totp_2fa(generate_totp_secret())
+    codes = generate_recovery_codes()
+    RecoveryCode.replace_codes_of_user(user, codes)
+    result = _log_in_with_recovery_code(codes[0])
+    assert result.status_code == status.HTTP_200_OK
+    assert list(result.data) == ["enrollment_token"]
+
+
+@pytest.mark.django_db
+@OverrideJwt2faSettings(TRUSTED_2FA_METHODS=["totp", "recovery-code"])
+def test_trusted_recovery_code_gives_auth_token():
+    user = get_user_with_totp_2fa(generate_totp_secret())
+    codes = generate_recovery_codes()
+    RecoveryCode.replace_codes_of_user(user, codes)
+    result = _log_in_with_recovery_code(codes[0].lower())
+    assert result.status_code == status.HTTP_200_OK
+    check_auth_token(result.data["access"])
+    # Each code can be used only once
+    result = _log_in_with_recovery_code(codes[0])
+    assert result.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.django_db
+def test_wrong_recovery_code_is_rejected():
+    user = get_user_with_totp_2fa(generate_totp_secret())
+    RecoveryCode.replace_codes_of_user(user, generate_recovery_codes())
+    result = _log_in_with_recovery_code("ABCDE-FGHJK")
+    assert result.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.django_db
+def test_recovery_code_cannot_be_set_as_preferred_method():
+    client = _auth_client(get_user())
+    result = client.post(
+        reverse("set-2fa-method"), data={"method": "recovery-code"}
+    )
+    assert result.status_code == status.HTTP_400_BAD_REQUEST
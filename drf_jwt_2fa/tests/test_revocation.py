@@ -0,0 +1,299 @@
+import datetime
+import time
+from unittest.mock import patch
+
+import freezegun
+import pytest
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.test import RequestFactory
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from drf_jwt_2fa.authentication import (
+    EnrollmentOrJwt2faAuthentication,
+    Jwt2faAuthentication,
+)
+from drf_jwt_2fa.caching import CacheLockTimeoutError
+from drf_jwt_2fa.enrollment_token import EnrollmentToken
+from drf_jwt_2fa.revocation import (
+    RevocationList,
+    _get_revocation_list,
+    get_revocation_list,
+    is_token_revoked,
+    jwt_settings,
+    revoke_token,
+)
+
+from .factories import get_user
+from .utils import OverrideJwt2faSettings, get_api_client
+
+use_revocation = OverrideJwt2faSettings(REVOCATION_FILTER_CAPACITY=1000)
+
+
+@pytest.fixture(autouse=True)
+def clear_state():
+    cache.clear()
+    _get_revocation_list.cache_clear()
+    yield
+    cache.clear()
+    _get_revocation_list.cache_clear()
+
+
+def make_revocation_list(refresh_interval=5):
+    return RevocationList(
+        capacity=1000,
+        error_rate=1e-6,
+        bucket_seconds=300,
+        max_lifetime_seconds=900,
+        leeway_seconds=0,
+        refresh_interval=refresh_interval,
+    )
+
+
+def authenticate(token, auth_class=Jwt2faAuthentication):
+    http_request = RequestFactory().get("/")
+    http_request.META["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+    return auth_class().authenticate(Request(http_request))
+
+
+def test_revoked_tokens_are_found():
+    revocation_list = make_revocation_list()
+    expires_at = int(time.time()) + 300
+    revocation_list.revoke("jti-1", expires_at)
+    assert revocation_list.is_revoked("jti-1", expires_at)
+    assert not revocation_list.is_revoked("jti-2", expires_at)
+    # Stored to the bucket of the expiration time
+    assert not revocation_list.is_revoked("jti-1", expires_at + 300)
+
+
+def test_revocations_of_others_are_seen_after_refresh_interval():
+    with freezegun.freeze_time("2026-01-01 12:00:00") as frozen_time:
+        expires_at = int(time.time()) + 300
+        this_process = make_revocation_list()
+        other_process = make_revocation_list()
+        assert not other_process.is_revoked("jti-1", expires_at)
+        this_process.revoke("jti-1", expires_at)
+        assert this_process.is_revoked("jti-1", expires_at)
+        # The snapshot of the other process is not refreshed yet
+        assert not other_process.is_revoked("jti-1", expires_at)
+        frozen_time.tick(datetime.timedelta(seconds=5))
+        assert other_process.is_revoked("jti-1", expires_at)
+
+
+def test_checks_use_the_snapshot():
+    revocation_list = make_revocation_list()
+    expires_at = int(time.time()) + 300
+    revocation_list.revoke("jti-1", expires_at)
+    revocation_list.is_revoked("jti-1", expires_at)
+    with patch.object(LocMemCache, "get") as get_mock:
+        for _ in range(10):
+            assert revocation_list.is_revoked("jti-1", expires_at)
+    assert get_mock.call_count == 0
+
+
+def test_buckets_expire_after_their_tokens():
+    with freezegun.freeze_time("2026-01-01 12:00:00"):
+        revocation_list = make_revocation_list()
+        now = int(time.time())
+        for i in range(100):
+            revocation_list.revoke(f"jti-{i}", now + 60 + i)
+        [key] = [k for k in cache._cache if ":revoked:" in k]
+        bucket_end = ((now + 60) // 300 + 1) * 300
+        assert cache._expire_info[key] == bucket_end
+
+
+@use_revocation
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "auth_class", [Jwt2faAuthentication, EnrollmentOrJwt2faAuthentication]
+)
+def test_revoked_token_is_rejected(auth_class):
+    user = get_user()
+    token = AccessToken.for_user(user)
+    other_token = AccessToken.for_user(user)
+    assert authenticate(token, auth_class)[0] == user
+    revoke_token(token)
+    with pytest.raises(InvalidToken) as exc_info:
+        authenticate(token, auth_class)
+    assert "revoked" in str(exc_info.value.detail)
+    assert authenticate(other_token, auth_class)[0] == user
+
+
+@use_revocation
+@pytest.mark.django_db
+def test_revoked_enrollment_token_is_rejected():
+    token = EnrollmentToken.for_user(get_user())
+    revoke_token(token)
+    with pytest.raises(InvalidToken):
+        authenticate(token, EnrollmentOrJwt2faAuthentication)
+
+
+def test_revocation_is_disabled_by_default():
+    token = AccessToken()
+    assert get_revocation_list() is None
+    assert is_token_revoked(token) is False
+    with pytest.raises(ImproperlyConfigured):
+        revoke_token(token)
+
+
+@use_revocation
+def test_revocation_list_is_kept_while_settings_stay():
+    assert get_revocation_list() is get_revocation_list()
+    with OverrideJwt2faSettings(REVOCATION_FILTER_CAPACITY=2000):
+        assert get_revocation_list().num_bits > 2 * 28000
+
+
+@use_revocation
+@pytest.mark.django_db
+def test_revoke_endpoint():
+    token = AccessToken.for_user(get_user())
+    client = get_api_client()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+    result = client.post(reverse("revoke"))
+    assert result.status_code == status.HTTP_200_OK
+    assert result.data == {}
+    result = client.post(reverse("revoke"))
+    assert result.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.django_db
+def test_revoke_endpoint_when_revocation_is_disabled():
+    token = AccessToken.for_user(get_user())
+    client = get_api_client()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+    result = client.post(reverse("revoke"))
+    assert result.status_code == status.HTTP_501_NOT_IMPLEMENTED
+    assert result.data["detail"].code == "token_revocation_not_enabled"
+
+
+@use_revocation
+@pytest.mark.django_db
+def test_revoke_endpoint_when_revocation_list_is_locked():
+    token = AccessToken.for_user(get_user())
+    client = get_api_client()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+    with (
+        patch.object(RevocationList, "lock_timeout", 0.01),
+        patch.object(cache, "add", return_value=False),
+    ):
+        result = client.post(reverse("revoke"))
+    assert result.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert result.data["detail"].code == "token_state_busy"
+
+
+def test_slow_revocation_is_not_written():
+    revocation_list = make_revocation_list()
+    original_load_filter = revocation_list._load_filter
+
+    def slow_load_filter(data):
+        time.sleep(0.02)  # The lock may expire meanwhile
+        return original_load_filter(data)
+
+    with (
+        patch.object(revocation_list, "lock_timeout", 0.02),
+        patch.object(revocation_list, "_load_filter", slow_load_filter),
+        pytest.raises(CacheLockTimeoutError),
+    ):
+        revocation_list.revoke("jti-1", int(time.time()) + 60)
+    assert not any(":revoked:" in key for key in cache._cache)
+
+
+@use_revocation
+@pytest.mark.django_db
+def test_revoke_endpoint_revokes_refresh_token():
+    user = get_user()
+    refresh_token = RefreshToken.for_user(user)
+    client = get_api_client()
+    client.credentials(
+        HTTP_AUTHORIZATION=f"Bearer {refresh_token.access_token}"
+    )
+    result = client.post(reverse("refresh"), {"refresh": str(refresh_token)})
+    assert result.status_code == status.HTTP_200_OK
+    result = client.post(reverse("revoke"), {"refresh": str(refresh_token)})
+    assert result.status_code == status.HTTP_200_OK
+    assert is_token_revoked(refresh_token)
+    result = client.post(reverse("refresh"), {"refresh": str(refresh_token)})
+    assert result.status_code == status.HTTP_401_UNAUTHORIZED
+    assert "revoked" in str(result.data["detail"])
+
+
+@use_revocation
+@pytest.mark.django_db
+@pytest.mark.parametrize("refresh", ["invalid", "other-user", "access"])
+def test_revoke_endpoint_rejects_invalid_refresh_token(refresh):
+    user = get_user()
+    token = AccessToken.for_user(user)
+    raw_refresh = {
+        "invalid": "x",
+        "other-user": str(RefreshToken.for_user(get_user("other"))),
+        "access": str(AccessToken.for_user(user)),
+    }[refresh]
+    client = get_api_client()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+    result = client.post(reverse("revoke"), {"refresh": raw_refresh})
+    assert result.status_code == status.HTTP_400_BAD_REQUEST
+    assert "refresh" in result.data
+    assert not is_token_revoked(token)
+
+
+@use_revocation
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    ("data", "status_code"),
+    [
+        ({}, status.HTTP_400_BAD_REQUEST),
+        ({"refresh": "x"}, status.HTTP_401_UNAUTHORIZED),
+    ],
+)
+def test_refresh_endpoint_rejects_invalid_token_with_revocation(
+    data, status_code
+):
+    result = get_api_client().post(reverse("refresh"), data)
+    assert result.status_code == status_code
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("enabled", [True, False])
+def test_verify_endpoint_rejects_revoked_token(enabled):
+    token = AccessToken.for_user(get_user())
+    client = get_api_client()
+    with use_revocation:
+        result = client.post(reverse("verify"), {"token": str(token)})
+        assert result.status_code == status.HTTP_200_OK
+        revoke_token(token)
+    with use_revocation if enabled else OverrideJwt2faSettings():
+        result = client.post(reverse("verify"), {"token": str(token)})
+    if enabled:
+        assert result.status_code == status.HTTP_401_UNAUTHORIZED
+        assert result.data["detail"] == "Token has been revoked"
+    else:
+        assert result.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.django_db
+def test_refresh_endpoint_when_revocation_is_disabled():
+    refresh_token = RefreshToken.for_user(get_user())
+    result = get_api_client().post(
+        reverse("refresh"), {"refresh": str(refresh_token)}
+    )
+    assert result.status_code == status.HTTP_200_OK
+    assert "access" in result.data
+
+
+@use_revocation
+def test_leeway_can_be_a_timedelta():
+    leeway = datetime.timedelta(seconds=1.5)
+    with patch.object(jwt_settings, "LEEWAY", leeway):
+        assert get_revocation_list().leeway_seconds == 2
+
+
+@use_revocation
+def test_token_without_expiration_time_is_not_revoked():
+    token = AccessToken()
+    del token["exp"]
+    assert is_token_revoked(token) is False
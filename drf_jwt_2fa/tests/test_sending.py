@@ -0,0 +1,405 @@
+import datetime
+import http.client
+import socket
+import threading
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+
+import pytest
+from django.core.cache import cache
+
+from drf_jwt_2fa.circuit_breaker import get_circuit_breaker
+from drf_jwt_2fa.deadlines import Deadline
+from drf_jwt_2fa.sending import (
+    CodeSendingError,
+    CodeSendingTimeoutError,
+    HttpConnectionPool,
+    close_http_connection_pools,
+    get_http_connection_pool,
+    send_verification_code_via_channels,
+    send_verification_code_via_http,
+)
+
+from .stub_gateway import StubGateway
+from .utils import OverrideJwt2faSettings
+
+USER = SimpleNamespace(phone_number="+358401234567")
+
+
+@pytest.fixture(autouse=True)
+def clean_up():
+    cache.clear()
+    yield
+    close_http_connection_pools()
+    cache.clear()
+
+
+def send_via(gateway, user=USER, code="1234567", deadline=None, **settings):
+    with OverrideJwt2faSettings(HTTP_SENDER_URL=gateway.url, **settings):
+        send_verification_code_via_http(user, code, deadline=deadline)
+
+
+def test_send_via_http_posts_payload_and_headers():
+    with StubGateway() as gateway:
+        send_via(
+            gateway,
+            HTTP_SENDER_HEADERS={"Authorization": "Bearer xyz"},
+            HTTP_SENDER_PAYLOAD_TEMPLATE={
+                "to": ["{recipient}"],
+                "body": {"text": "Code: {code}"},
+                "priority": 1,
+            },
+        )
+    [request] = gateway.requests
+    assert request["path"] == "/send"
+    assert request["headers"]["Authorization"] == "Bearer xyz"
+    assert request["headers"]["Content-Type"] == "application/json"
+    assert request["payload"] == {
+        "to": ["+358401234567"],
+        "body": {"text": "Code: 1234567"},
+        "priority": 1,
+    }
+
+
+def test_send_via_http_default_payload():
+    with StubGateway() as gateway:
+        send_via(gateway)
+    assert gateway.requests[0]["payload"] == {
+        "to": "+358401234567",
+        "text": "1234567 is the verification code needed for the login.",
+    }
+
+
+def test_send_via_http_reuses_connection():
+    with StubGateway(connect_delay=0.01) as gateway:
+        for _i in range(3):
+            send_via(gateway)
+    assert len(gateway.requests) == 3
+    assert gateway.connection_count == 1
+
+
+def test_send_via_http_without_pool_opens_new_connections():
+    with StubGateway() as gateway:
+        for _i in range(3):
+            send_via(gateway, HTTP_SENDER_POOL_SIZE=0)
+    assert len(gateway.requests) == 3
+    assert gateway.connection_count == 3
+
+
+def test_send_via_http_server_closing_connection():
+    with StubGateway(keep_alive=False) as gateway:
+        for _i in range(2):
+            send_via(gateway)
+    assert len(gateway.requests) == 2
+    assert gateway.connection_count == 2
+
+
+def test_send_via_http_retries_on_stale_connection():
+    with StubGateway() as gateway:
+        send_via(gateway)
+        gateway.drop_connections()
+        send_via(gateway)
+    assert len(gateway.requests) == 2
+    assert gateway.connection_count == 2
+
+
+def test_send_via_http_retries_when_sending_fails():
+    request = http.client.HTTPConnection.request
+    errors = iter([BrokenPipeError()])
+
+    def request_mock(connection, *args, **kwargs):
+        error = next(errors, None)
+        if error:
+            raise error
+        return request(connection, *args, **kwargs)
+
+    with StubGateway() as gateway:
+        send_via(gateway)
+        with patch.object(http.client.HTTPConnection, "request", request_mock):
+            send_via(gateway)
+    assert len(gateway.requests) == 2
+    assert gateway.connection_count == 2
+
+
+def test_send_via_http_does_not_retry_sent_request():
+    with StubGateway() as gateway:
+        send_via(gateway)
+        gateway.respond = False
+        with pytest.raises(CodeSendingError) as excinfo:
+            send_via(gateway)
+    assert str(excinfo.value) == "HTTP gateway connection failed"
+    assert len(gateway.requests) == 2
+
+
+def test_send_via_http_does_not_retry_on_new_connection():
+    with (
+        StubGateway() as gateway,
+        patch.object(
+            http.client.HTTPConnection, "request", side_effect=BrokenPipeError
+        ),
+        pytest.raises(CodeSendingError),
+    ):
+        send_via(gateway)
+    assert gateway.requests == []
+
+
+def test_http_connection_pool_closes_connections_over_size():
+    pool = HttpConnectionPool("http", "localhost", None, max_size=1)
+    connections = [Mock(), Mock()]
+    for connection in connections:
+        pool._put_connection(connection)
+    connections[0].close.assert_not_called()
+    connections[1].close.assert_called_once()
+
+
+def test_http_connection_pools_are_dropped_in_forked_process():
+    pool = get_http_connection_pool("http://localhost/", max_size=1)
+    assert get_http_connection_pool("http://localhost/", max_size=1) is pool
+    with patch("drf_jwt_2fa.sending._pools_pid", -1):
+        other_pool = get_http_connection_pool("http://localhost/", 1)
+    assert other_pool is not pool
+
+
+def test_stub_gateway_drops_already_closed_connections():
+    with StubGateway(keep_alive=False) as gateway:
+        send_via(gateway)
+        closed_socket = socket.socket()
+        closed_socket.close()
+        gateway._sockets.append(closed_socket)
+        gateway.drop_connections()
+
+
+def test_send_via_http_error_status():
+    with (
+        StubGateway(status=500) as gateway,
+        pytest.raises(CodeSendingError) as excinfo,
+    ):
+        send_via(gateway)
+    assert str(excinfo.value) == "HTTP gateway returned status 500"
+
+
+def test_send_via_http_read_timeout():
+    with (
+        StubGateway(delay=0.5) as gateway,
+        pytest.raises(CodeSendingTimeoutError) as excinfo,
+    ):
+        send_via(
+            gateway,
+            HTTP_SENDER_READ_TIMEOUT=datetime.timedelta(seconds=0.05),
+        )
+    assert str(excinfo.value) == "HTTP gateway timed out"
+
+
+def test_send_via_http_read_timeout_capped_by_deadline():
+    with (
+        StubGateway(delay=0.5) as gateway,
+        pytest.raises(CodeSendingTimeoutError),
+    ):
+        send_via(gateway, deadline=Deadline(0.05))
+
+
+def test_send_via_http_with_expired_deadline():
+    with (
+        StubGateway() as gateway,
+        pytest.raises(CodeSendingError) as excinfo,
+    ):
+        send_via(gateway, deadline=Deadline(0))
+    assert not isinstance(excinfo.value, CodeSendingTimeoutError)
+    assert str(excinfo.value) == "No time left for sending"
+    assert gateway.requests == []
+
+
+def test_send_via_http_connect_timeout():
+    with (
+        StubGateway() as gateway,
+        patch.object(
+            http.client.HTTPConnection, "connect", side_effect=TimeoutError
+        ),
+        pytest.raises(CodeSendingError) as excinfo,
+    ):
+        send_via(gateway)
+    # Nothing was sent, so it is a failure, not an unknown outcome
+    assert not isinstance(excinfo.value, CodeSendingTimeoutError)
+    assert str(excinfo.value) == "HTTP gateway connection failed"
+
+
+def test_http_connection_pool_uses_tls_for_https():
+    pool = HttpConnectionPool("https", "localhost", 8443, max_size=1)
+    (connection, reused) = pool._get_connection()
+    assert isinstance(connection, http.client.HTTPSConnection)
+    assert (connection.host, connection.port) == ("localhost", 8443)
+    assert not reused
+
+
+def test_send_via_http_connection_refused():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    with (
+        OverrideJwt2faSettings(HTTP_SENDER_URL=f"http://127.0.0.1:{port}/"),
+        pytest.raises(CodeSendingError) as excinfo,
+    ):
+        send_verification_code_via_http(USER, "1234567")
+    assert str(excinfo.value) == "HTTP gateway connection failed"
+
+
+def test_send_via_http_without_recipient():
+    with (
+        StubGateway() as gateway,
+        pytest.raises(CodeSendingError) as excinfo,
+    ):
+        send_via(gateway, user=SimpleNamespace(phone_number=""))
+    assert str(excinfo.value) == "No phone number known"
+    assert gateway.requests == []
+
+
+def test_send_via_http_without_url():
+    with pytest.raises(CodeSendingError) as excinfo:
+        send_verification_code_via_http(USER, "1234567")
+    assert str(excinfo.value) == "No HTTP gateway URL configured"
+
+
+def test_send_via_http_invalid_url():
+    with (
+        OverrideJwt2faSettings(HTTP_SENDER_URL="ftp://example.com/"),
+        pytest.raises(CodeSendingError) as excinfo,
+    ):
+        send_verification_code_via_http(USER, "1234567")
+    assert str(excinfo.value) == "Invalid HTTP gateway URL"
+
+
+class Channel:
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = []
+
+    def __call__(self, user, code):
+        self.calls.append((user, code))
+        if self.error:
+            raise self.error
+
+
+def send_via_channels(channels, user=USER, deadline=None, **settings):
+    with OverrideJwt2faSettings(CODE_SENDER_CHANNELS=channels, **settings):
+        send_verification_code_via_channels(user, "1234567", deadline)
+
+
+def test_send_via_channels_uses_first_channel():
+    (email, sms) = (Channel(), Channel())
+    send_via_channels({"email": email, "sms": sms})
+    assert email.calls == [(USER, "1234567")]
+    assert sms.calls == []
+
+
+def test_send_via_channels_fails_over():
+    email = Channel(CodeSendingError("Relay down"))
+    sms = Channel()
+    send_via_channels({"email": email, "sms": sms})
+    assert len(email.calls) == 1
+    assert len(sms.calls) == 1
+
+
+def test_send_via_channels_fails_over_on_unexpected_error():
+    email = Channel(RuntimeError("Oops"))
+    sms = Channel()
+    send_via_channels({"email": email, "sms": sms})
+    assert len(sms.calls) == 1
+
+
+def test_send_via_channels_uses_channel_order_of_user():
+    (email, sms) = (Channel(), Channel())
+    send_via_channels(
+        {"email": email, "sms": sms},
+        CODE_SENDER_CHANNELS_GETTER=lambda user: ["push", "sms", "email"],
+    )
+    assert email.calls == []
+    assert len(sms.calls) == 1
+
+
+def test_send_via_channels_skips_open_circuit():
+    email = Channel(CodeSendingError("Relay down"))
+    sms = Channel()
+    channels = {"email": email, "sms": sms}
+    for _i in range(5):
+        send_via_channels(channels)
+    assert len(email.calls) == 5
+    assert get_circuit_breaker("email").get_state() == "open"
+    send_via_channels(channels)
+    assert len(email.calls) == 5  # Skipped without calling
+    assert len(sms.calls) == 6
+
+
+def test_send_via_channels_stops_at_deadline():
+    release = threading.Event()
+
+    def hanging(user, code):
+        release.wait(5)
+
+    sms = Channel()
+    with pytest.raises(CodeSendingTimeoutError):
+        send_via_channels(
+            {"email": hanging, "sms": sms}, deadline=Deadline(0.05)
+        )
+    release.set()
+    assert sms.calls == []
+
+
+def test_send_via_channels_fails_over_on_timeout():
+    email = Channel(CodeSendingTimeoutError("Timed out"))
+    sms = Channel()
+    send_via_channels({"email": email, "sms": sms}, deadline=Deadline(5))
+    assert len(sms.calls) == 1
+
+
+def test_send_via_channels_timed_out():
+    email = Channel(CodeSendingTimeoutError("Timed out"))
+    sms = Channel(CodeSendingError("Failed"))
+    with pytest.raises(CodeSendingTimeoutError):
+        send_via_channels({"email": email, "sms": sms})
+    assert len(sms.calls) == 1
+
+
+def test_send_via_channels_with_expired_deadline():
+    email = Channel()
+    with pytest.raises(CodeSendingTimeoutError):
+        send_via_channels({"email": email}, deadline=Deadline(0))
+    assert email.calls == []
+
+
+def test_send_via_channels_passes_deadline():
+    deadlines = []
+
+    def sender(user, code, deadline=None):
+        deadlines.append(deadline)
+
+    deadline = Deadline(5)
+    send_via_channels({"sms": sender}, deadline=deadline)
+    assert deadlines == [deadline]
+
+
+def test_send_via_channels_all_failed():
+    channels = {"email": Channel(CodeSendingError("Relay down"))}
+    with pytest.raises(CodeSendingError) as excinfo:
+        send_via_channels(channels)
+    assert str(excinfo.value) == "All code sending channels failed"
+
+
+def test_send_via_channels_without_channels():
+    with pytest.raises(CodeSendingError) as excinfo:
+        send_via_channels({})
+    assert str(excinfo.value) == "No code sending channel available"
+
+
+def test_send_via_channels_resolves_import_strings():
+    with (
+        OverrideJwt2faSettings(
+            CODE_SENDER_CHANNELS={
+                "email": "drf_jwt_2fa.sending.send_verification_code_via_email"
+            }
+        ),
+        patch("drf_jwt_2fa.sending.send_mail", return_value=1) as send_mail,
+    ):
+        send_verification_code_via_channels(
+            SimpleNamespace(email="user@example.com"), "1234567"
+        )
+    assert send_mail.call_args.kwargs["recipient_list"] == ["user@example.com"]
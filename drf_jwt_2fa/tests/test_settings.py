@@ -73,6 +73,16 @@ def test_wrong_sequence_setting_type_raises_type_error():
     )
 
 
+@OverrideJwt2faSettings(CODE_SENDER_CHANNELS=42)
+def test_wrong_mapping_setting_type_raises_type_error():
+    with pytest.raises(TypeError) as exc:
+        _ = api_settings.CODE_SENDER_CHANNELS
+    assert exc.value.args[0] == (
+        "JWT2FA_AUTH setting 'CODE_SENDER_CHANNELS' must be an instance of "
+        "collections.abc.Mapping[str, drf_jwt_2fa.settings.CodeSender]"
+    )
+
+
 def test_unknown_setting_is_ignored():
     """An unrecognised key in JWT2FA_AUTH is silently ignored."""
     with OverrideJwt2faSettings(NONEXISTENT_SETTING=True):
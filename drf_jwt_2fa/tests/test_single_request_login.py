@@ -0,0 +1,172 @@
+import datetime
+
+import pyotp
+import pytest
+from django.core import mail
+from django.core.cache import cache
+from django.urls import reverse
+from rest_framework import status
+
+from drf_jwt_2fa.token_manager import CodeTokenManager
+from drf_jwt_2fa.totp import generate_totp_secret, get_totp_code_lifetime
+from drf_jwt_2fa.tracing import SpanRecorder
+
+from .factories import get_user_with_code_sender_2fa, get_user_with_totp_2fa
+from .utils import OverrideJwt2faSettings, check_auth_token, get_api_client
+
+
+def use_single_request_login(**values):
+    return OverrideJwt2faSettings(SINGLE_REQUEST_TOTP_LOGIN=True, **values)
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.fixture
+def secret():
+    secret = generate_totp_secret()
+    get_user_with_totp_2fa(secret)
+    return secret
+
+
+def log_in(code, **data):
+    return get_api_client().post(
+        reverse("get-code"),
+        data={"username": "testuser", "password": "a42", "code": code, **data},
+    )
+
+
+def get_wrong_code(secret):
+    return "000000" if pyotp.TOTP(secret).now() != "000000" else "111111"
+
+
+@pytest.mark.django_db
+def test_code_is_ignored_by_default(secret):
+    result = log_in(pyotp.TOTP(secret).now())
+    assert result.status_code == status.HTTP_200_OK
+    assert list(result.data) == ["token"]
+
+
+@pytest.mark.django_db
+def test_totp_login_in_single_request(secret):
+    recorder = SpanRecorder()
+    with use_single_request_login(TRACING_HOOK=recorder):
+        result = log_in(pyotp.TOTP(secret).now())
+
+    assert result.status_code == status.HTTP_200_OK
+    assert set(result.data) == {"access", "refresh"}
+    check_auth_token(result.data["access"])
+    (span,) = recorder.get_spans("jwt2fa.check_totp_code_of_user")
+    assert span.attributes["jwt2fa.outcome"] == "ok"
+    # The user of the password check is used for the TOTP check
+    assert len(recorder.get_spans("jwt2fa.user_lookup")) == 0
+    assert len(recorder.get_spans("jwt2fa.create_code_token")) == 0
+
+
+@pytest.mark.django_db
+def test_wrong_code_is_rejected(secret):
+    with use_single_request_login():
+        result = log_in(get_wrong_code(secret))
+    assert result.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.django_db
+def test_code_cannot_be_replayed(secret):
+    code = pyotp.TOTP(secret).now()
+    with use_single_request_login():
+        assert log_in(code).status_code == status.HTTP_200_OK
+        result = log_in(code)
+    assert result.status_code == status.HTTP_401_UNAUTHORIZED
+    assert result.data["detail"].code == "token_already_used"
+
+
+@pytest.mark.django_db
+def test_failed_attempts_are_limited_per_user(secret):
+    with use_single_request_login(MAX_FAILED_AUTH_ATTEMPTS_PER_USER=1):
+        assert log_in(get_wrong_code(secret)).status_code == 401
+        result = log_in(pyotp.TOTP(secret).now())
+    assert result.status_code == status.HTTP_403_FORBIDDEN
+    assert result.data["detail"].code == "too_many_auth_attempts"
+
+
+@pytest.mark.django_db
+def test_failed_attempts_are_limited_per_user_by_default(secret):
+    def log_in_from(ip, code):
+        return get_api_client().post(
+            reverse("get-code"),
+            data={"username": "testuser", "password": "a42", "code": code},
+            REMOTE_ADDR=ip,
+        )
+
+    with use_single_request_login(
+        MAX_ACTIVE_CODE_TOKENS_PER_USER=2,
+        MAX_AUTH_ATTEMPTS_PER_CODE_TOKEN=2,
+        MAX_FAILED_AUTH_ATTEMPTS_PER_CLIENT=2,
+    ):
+        for i in range(4):
+            result = log_in_from(f"10.0.0.{i}", get_wrong_code(secret))
+            assert result.status_code == status.HTTP_401_UNAUTHORIZED
+        result = log_in_from("10.0.0.99", pyotp.TOTP(secret).now())
+    assert result.status_code == status.HTTP_403_FORBIDDEN
+    assert result.data["detail"].code == "too_many_auth_attempts"
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "setting",
+    ["MAX_ACTIVE_CODE_TOKENS_PER_USER", "MAX_AUTH_ATTEMPTS_PER_CODE_TOKEN"],
+)
+def test_failed_attempts_are_not_limited_without_two_step_limit(
+    secret, setting
+):
+    with use_single_request_login(**{setting: None}):
+        for _i in range(5):
+            result = log_in(get_wrong_code(secret))
+            assert result.status_code == status.HTTP_401_UNAUTHORIZED
+        result = log_in(pyotp.TOTP(secret).now())
+    assert result.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.django_db
+def test_code_sender_users_fall_back_to_two_steps():
+    get_user_with_code_sender_2fa()
+    with use_single_request_login():
+        result = log_in("123456")
+    assert result.status_code == status.HTTP_200_OK
+    assert list(result.data) == ["token"]
+    assert len(mail.outbox) == 1
+
+
+@pytest.mark.django_db
+def test_untrusted_totp_gives_enrollment_token(secret):
+    with use_single_request_login(TRUSTED_2FA_METHODS=["code-sender"]):
+        result = log_in(pyotp.TOTP(secret).now())
+    assert result.status_code == status.HTTP_200_OK
+    assert list(result.data) == ["enrollment_token"]
+
+
+@pytest.mark.django_db
+def test_device_can_be_remembered(secret):
+    with use_single_request_login(
+        TRUSTED_DEVICE_TOKEN_EXPIRATION_TIME=datetime.timedelta(days=1)
+    ):
+        result = log_in(pyotp.TOTP(secret).now(), remember_device=True)
+    assert result.status_code == status.HTTP_200_OK
+    assert set(result.data) == {"access", "refresh", "device_token"}
+
+
+@pytest.mark.django_db
+def test_totp_login_payload_expires_with_code():
+    user = get_user_with_totp_2fa(generate_totp_secret())
+    manager = CodeTokenManager()
+    payload = manager.get_totp_login_payload(user, "123456")
+    assert payload["exp"] - payload["iat"] == get_totp_code_lifetime(1)
+    assert payload["exp"] - payload["iat"] == 90
+    same_code_payload = manager.get_totp_login_payload(user, "123456")
+    other_code_payload = manager.get_totp_login_payload(user, "654321")
+    assert payload["jti"] == same_code_payload["jti"]
+    assert payload["jti"] != other_code_payload["jti"]
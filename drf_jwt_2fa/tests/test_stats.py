@@ -0,0 +1,129 @@
+import io
+import json
+
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+from rest_framework import status
+from rest_framework_simplejwt.tokens import AccessToken
+
+from drf_jwt_2fa.models import TwoFactorAuthMethod, UserTwoFactorAuthData
+from drf_jwt_2fa.stats import compute_2fa_stats, get_2fa_stats
+from drf_jwt_2fa.totp import generate_totp_secret
+
+from .factories import get_user, get_user_with_2fa_method
+from .utils import get_api_client
+
+
+def _auth_client(user):
+    """Return an APIClient authenticated with a fresh JWT access token."""
+    token = AccessToken.for_user(user)
+    client = get_api_client()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+    return client
+
+
+def _create_users():
+    get_user(username="plain1")
+    get_user(username="plain2")
+    get_user_with_2fa_method("", username="empty")
+    get_user_with_2fa_method(TwoFactorAuthMethod.NO_2FA, username="no2fa")
+    get_user_with_2fa_method(TwoFactorAuthMethod.CODE_SENDER, username="cs1")
+    get_user_with_2fa_method(TwoFactorAuthMethod.CODE_SENDER, username="cs2")
+    get_user_with_2fa_method(
+        TwoFactorAuthMethod.TOTP,
+        username="totp",
+        totp_secret=generate_totp_secret(),
+    )
+    pending_user = get_user_with_2fa_method(
+        TwoFactorAuthMethod.CODE_SENDER, username="pending"
+    )
+    data = UserTwoFactorAuthData.objects.get(user=pending_user)
+    data.set_pending_totp_secret(generate_totp_secret())
+    data.save()
+
+
+@pytest.mark.django_db
+def test_compute_2fa_stats():
+    _create_users()
+    assert compute_2fa_stats() == {
+        "no_2fa": 1,
+        "code_sender": 3,
+        "totp": 1,
+        "unconfigured": 3,
+        "pending_enrollment": 1,
+    }
+
+
+@pytest.mark.django_db
+def test_compute_2fa_stats_uses_single_query(django_assert_num_queries):
+    _create_users()
+    with django_assert_num_queries(1):
+        compute_2fa_stats()
+
+
+@pytest.mark.django_db
+def test_compute_2fa_stats_without_users():
+    assert compute_2fa_stats() == {
+        "no_2fa": 0,
+        "code_sender": 0,
+        "totp": 0,
+        "unconfigured": 0,
+        "pending_enrollment": 0,
+    }
+
+
+@pytest.mark.django_db
+def test_get_2fa_stats_is_cached(django_assert_num_queries):
+    _create_users()
+    first = get_2fa_stats()
+    get_user(username="newcomer")
+    with django_assert_num_queries(0):
+        assert get_2fa_stats() == first
+    fresh = get_2fa_stats(use_cache=False)
+    assert fresh["unconfigured"] == first["unconfigured"] + 1
+    # The fresh result replaces the cached one
+    with django_assert_num_queries(0):
+        assert get_2fa_stats() == fresh
+
+
+@pytest.mark.django_db
+def test_stats_endpoint_requires_staff():
+    client = get_api_client()
+    result = client.get(reverse("stats"))
+    assert result.status_code == status.HTTP_401_UNAUTHORIZED
+
+    result = _auth_client(get_user()).get(reverse("stats"))
+    assert result.status_code == status.HTTP_403_FORBIDDEN
+
+
+@pytest.mark.django_db
+def test_stats_endpoint_returns_stats_for_staff():
+    _create_users()
+    staff_user = get_user(username="staff")
+    staff_user.is_staff = True
+    staff_user.save()
+    result = _auth_client(staff_user).get(reverse("stats"))
+    assert result.status_code == status.HTTP_200_OK
+    assert result.data == {
+        "no_2fa": 1,
+        "code_sender": 3,
+        "totp": 1,
+        "unconfigured": 4,
+        "pending_enrollment": 1,
+    }
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("args", [[], ["--no-cache"]])
+def test_stats_command_outputs_json(args):
+    _create_users()
+    out = io.StringIO()
+    call_command("jwt2fa_stats", *args, stdout=out)
+    assert json.loads(out.getvalue()) == {
+        "code_sender": 3,
+        "no_2fa": 1,
+        "pending_enrollment": 1,
+        "totp": 1,
+        "unconfigured": 3,
+    }
@@ -248,3 +248,155 @@ def test_auth_token_throttler_cache_key_stored_in_cache():
         # Note: 1577970002.0 = unix time of now + 2 seconds (retry wait time)
         f":1:drf_jwt_2fa:throttle:auth:{token_hash}": 1577970002.0,
     }
+
+
+@pytest.mark.parametrize(
+    "failures, expected_wait",
+    [(0, 2), (1, 4), (2, 8), (4, 32), (5, 60), (1000, 60)],
+)
+@OverrideJwt2faSettings(
+    AUTH_TOKEN_RETRY_BACKOFF_CAP=datetime.timedelta(seconds=60)
+)
+def test_auth_token_throttler_backoff_schedule(failures, expected_wait):
+    throttler = AuthTokenThrottler()
+    assert throttler.get_retry_wait_seconds(failures) == expected_wait
+
+
+@pytest.mark.parametrize("failures", [0, 1, 10])
+def test_auth_token_throttler_wait_is_fixed_without_cap(failures):
+    throttler = AuthTokenThrottler()
+    assert throttler.get_retry_wait_seconds(failures) == 2
+
+
+@OverrideJwt2faSettings(
+    AUTH_TOKEN_RETRY_BACKOFF_CAP=datetime.timedelta(seconds=10)
+)
+def test_adaptive_auth_token_throttling():
+    with freeze_time("2020-01-02 13:00:00") as frozen_datetime:
+        code_token = get_code_token(verification_code="1111111")
+        client = get_api_client()
+
+        def attempt(code="1234567"):
+            return client.post(
+                reverse("auth"), data={"code_token": code_token, "code": code}
+            ).status_code
+
+        def wait(seconds):
+            frozen_datetime.tick(delta=datetime.timedelta(seconds=seconds))
+
+        # A single typo costs only the base wait time
+        assert attempt() == status.HTTP_401_UNAUTHORIZED
+        wait(1.9)
+        assert attempt() == status.HTTP_429_TOO_MANY_REQUESTS
+        wait(0.2)
+        # The wait time grows with the failures: 4s, 8s, then capped 10s
+        for wait_time in [4, 8, 10, 10]:
+            assert attempt() == status.HTTP_401_UNAUTHORIZED
+            wait(wait_time - 0.1)
+            assert attempt() == status.HTTP_429_TOO_MANY_REQUESTS
+            wait(0.2)
+
+
+@OverrideJwt2faSettings(
+    AUTH_TOKEN_RETRY_BACKOFF_CAP=datetime.timedelta(seconds=10)
+)
+def test_adaptive_auth_token_throttler_reads_state_in_one_call():
+    rf = RequestFactory()
+    token = get_code_token()
+    request = rf.post("/")
+    request.data = {"code_token": token}
+    throttler = AuthTokenThrottler()
+    with (
+        patch.object(LocMemCache, "get", autospec=True) as get_mock,
+        patch.object(
+            LocMemCache, "get_many", autospec=True, return_value={}
+        ) as get_many_mock,
+    ):
+        assert throttler.allow_request(request, None) is True
+    assert get_mock.call_count == 0
+    [(_cache, keys)] = [call.args for call in get_many_mock.call_args_list]
+    token_hash = get_code_token_hash(token)
+    assert keys == [
+        f"drf_jwt_2fa:throttle:auth:{token_hash}",
+        f"drf_jwt_2fa:auth_attempts:{token_hash}",
+    ]
+
+
+def test_auth_token_throttler_lets_only_one_concurrent_attempt_through():
+    rf = RequestFactory()
+    token = get_code_token()
+    request = rf.post("/")
+    request.data = {"code_token": token}
+    throttlers = [AuthTokenThrottler() for _ in range(2)]
+    # Both throttlers read the state before either of them writes it
+    with patch.object(
+        AuthTokenThrottler, "_get_state", return_value=(None, 0)
+    ):
+        results = [t.allow_request(request, None) for t in throttlers]
+    assert results == [True, False]
+    assert throttlers[1].wait() == 2
+
+
+@OverrideJwt2faSettings(
+    AUTH_TOKEN_RETRY_BACKOFF_CAP=datetime.timedelta(seconds=60)
+)
+def test_adaptive_auth_token_throttler_does_not_verify_token():
+    rf = RequestFactory()
+    request = rf.post("/")
+    request.data = {"code_token": get_code_token()}
+    throttler = AuthTokenThrottler()
+    with patch.object(
+        AuthTokenThrottler.token_manager_class, "decode_token"
+    ) as decode_mock:
+        assert throttler.allow_request(request, None) is True
+    decode_mock.assert_not_called()
+
+
+@OverrideJwt2faSettings(
+    AUTH_TOKEN_RETRY_BACKOFF_CAP=datetime.timedelta(seconds=60)
+)
+def test_adaptive_auth_token_throttler_with_unparsable_token():
+    rf = RequestFactory()
+    request = rf.post("/")
+    request.data = {"code_token": "not-a-token"}
+    throttler = AuthTokenThrottler()
+    assert throttler.allow_request(request, None) is True
+    assert throttler.allow_request(request, None) is False
+    assert throttler.wait() == pytest.approx(2, abs=0.5)
+
+
+@OverrideJwt2faSettings(
+    AUTH_TOKEN_RETRY_BACKOFF_CAP=datetime.timedelta(seconds=60)
+)
+def test_adaptive_auth_token_throttler_with_separate_throttle_cache():
+    rf = RequestFactory()
+    token = get_code_token()
+    request = rf.post("/")
+    request.data = {"code_token": token}
+    throttler = AuthTokenThrottler()
+    throttler.cache = LocMemCache("test_auth_throttle_cache", {})
+    throttler.cache.clear()
+    (attempts_cache, attempts_key) = (
+        throttler.token_manager_class().get_auth_attempts_cache_and_key(token)
+    )
+    attempts_cache.set(attempts_key, 3)
+
+    assert throttler.allow_request(request, None) is True
+    assert throttler.allow_request(request, None) is False
+    assert throttler.wait() == pytest.approx(16, abs=0.5)
+
+
+@freeze_time("2020-01-02 13:00:00")
+def test_auth_token_throttler_overwrites_passed_state():
+    rf = RequestFactory()
+    request = rf.post("/")
+    request.data = {"code_token": get_code_token()}
+    throttler = AuthTokenThrottler()
+    throttler.cache = LocMemCache("test_auth_passed_cache", {})
+    throttler.cache.clear()
+    key = throttler.get_cache_key(request, None)
+    # Passed, but not yet expired from the cache
+    throttler.cache.set(key, time.time() - 1, timeout=60)
+
+    assert throttler.allow_request(request, None) is True
+    assert throttler.cache.get(key) == time.time() + 2
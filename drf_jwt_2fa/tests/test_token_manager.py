@@ -156,6 +156,42 @@ def test_create_code_token_with_custom_sender_raising_code_sending_error():
         assert exc_info.value.status_code == status.HTTP_501_NOT_IMPLEMENTED
 
 
+@pytest.mark.django_db
+def test_create_code_token_with_sending_timeout(caplog):
+    release = threading.Event()
+
+    def hanging_code_sender(user, code):
+        release.wait(5)
+
+    with OverrideJwt2faSettings(
+        CODE_SENDER=hanging_code_sender,
+        CODE_SENDING_TIMEOUT=datetime.timedelta(seconds=0.05),
+    ):
+        manager = CodeTokenManager()
+        with caplog.at_level("WARNING", logger="drf_jwt_2fa.token_manager"):
+            token = manager.create_code_token(get_user_with_code_sender_2fa())
+    release.set()
+
+    # The code may still arrive, so the token is returned
+    assert manager.decode_token(token)["typ"] == "code-sender"
+    assert caplog.records[0].message == "Verification code sending timed out"
+
+
+@pytest.mark.django_db
+def test_create_code_token_with_sending_timeout_and_failing_sender():
+    def failing_code_sender(user, code):
+        raise CodeSendingError("Custom code sending error")
+
+    with OverrideJwt2faSettings(
+        CODE_SENDER=failing_code_sender,
+        CODE_SENDING_TIMEOUT=datetime.timedelta(seconds=1),
+    ):
+        manager = CodeTokenManager()
+        with pytest.raises(VerificationCodeSendingError) as exc_info:
+            manager.create_code_token(get_user_with_code_sender_2fa())
+        assert "Custom code sending error" in str(exc_info.value)
+
+
 @pytest.mark.django_db
 def test_check_code_token_and_code_success():
     manager = CodeTokenManager()
@@ -2,12 +2,20 @@
 Tests for drf_jwt_2fa.totp_encryption.
 """
 
+import datetime
+
+import freezegun
+
 from drf_jwt_2fa.totp import generate_totp_secret
 from drf_jwt_2fa.totp_encryption import (
     decrypt_totp_secret,
     encrypt_totp_secret,
+    open_totp_enrollment_ticket,
+    seal_totp_enrollment_ticket,
 )
 
+TEN_MINUTES = datetime.timedelta(minutes=10)
+
 
 def test_encrypt_decrypt_roundtrip():
     secret = generate_totp_secret()
@@ -28,3 +36,44 @@ def test_decrypt_returns_empty_string_for_empty_string():
 
 def test_decrypt_returns_empty_string_for_invalid_ciphertext():
     assert decrypt_totp_secret("not-valid-fernet-token") == ""
+
+
+def test_enrollment_ticket_roundtrip():
+    secret = generate_totp_secret()
+    ticket = seal_totp_enrollment_ticket(secret, "42")
+    assert secret not in ticket
+    assert open_totp_enrollment_ticket(ticket, "42", TEN_MINUTES) == secret
+
+
+def test_enrollment_ticket_is_bound_to_user():
+    ticket = seal_totp_enrollment_ticket(generate_totp_secret(), "42")
+    assert open_totp_enrollment_ticket(ticket, "4", TEN_MINUTES) == ""
+    assert open_totp_enrollment_ticket(ticket, "142", TEN_MINUTES) == ""
+
+
+def test_enrollment_ticket_is_bound_to_active_secret():
+    secret = generate_totp_secret()
+    ticket = seal_totp_enrollment_ticket(secret, "42", "active")
+    assert open_totp_enrollment_ticket(ticket, "42", TEN_MINUTES) == ""
+    opened = open_totp_enrollment_ticket(ticket, "42", TEN_MINUTES, "active")
+    assert opened == secret
+    opened = open_totp_enrollment_ticket(ticket, "42", TEN_MINUTES, "other")
+    assert opened == ""
+
+
+def test_enrollment_ticket_expires():
+    secret = generate_totp_secret()
+    with freezegun.freeze_time("2026-01-01 12:00:00") as frozen_time:
+        ticket = seal_totp_enrollment_ticket(secret, "42")
+        frozen_time.tick(datetime.timedelta(minutes=9))
+        assert open_totp_enrollment_ticket(ticket, "42", TEN_MINUTES) == secret
+        frozen_time.tick(datetime.timedelta(minutes=2))
+        assert open_totp_enrollment_ticket(ticket, "42", TEN_MINUTES) == ""
+
+
+def test_enrollment_ticket_is_not_a_stored_secret():
+    ticket = seal_totp_enrollment_ticket(generate_totp_secret(), "42")
+    assert decrypt_totp_secret(ticket) == ""
+    stored = encrypt_totp_secret(generate_totp_secret())
+    assert open_totp_enrollment_ticket(stored, "42", TEN_MINUTES) == ""
+    assert open_totp_enrollment_ticket("garbage", "42", TEN_MINUTES) == ""
@@ -1,13 +1,18 @@
+import datetime
+from unittest.mock import Mock
+
 import pyotp
 import pytest
 from django.urls import reverse
 from rest_framework import status
 from rest_framework_simplejwt.tokens import AccessToken
 
+from drf_jwt_2fa.exceptions import TotpEnrollmentConflictError
 from drf_jwt_2fa.models import TwoFactorAuthMethod, UserTwoFactorAuthData
+from drf_jwt_2fa.totp_serializers import ConfirmTotpSerializer
 
 from .factories import get_user
-from .utils import check_auth_token, get_api_client
+from .utils import OverrideJwt2faSettings, check_auth_token, get_api_client
 
 
 def _auth_client(user):
@@ -143,6 +148,187 @@ def test_totp_confirm_fails_when_pending_secret_is_empty():
     assert result.status_code == status.HTTP_403_FORBIDDEN
 
 
+@pytest.mark.django_db
+def test_totp_confirm_succeeds_only_once():
+    user = get_user()
+    client = _auth_client(user)
+    secret = client.post(reverse("totp-setup")).data["secret"]
+    code = pyotp.TOTP(secret).now()
+    serializers = [
+        ConfirmTotpSerializer(
+            data={"code": code}, context={"request": Mock(user=user)}
+        )
+        for _ in range(2)
+    ]
+    # Both are validated before either of them is saved
+    assert all(serializer.is_valid() for serializer in serializers)
+    serializers[0].save()
+    with pytest.raises(TotpEnrollmentConflictError):
+        serializers[1].save()
+    result = client.post(reverse("totp-confirm"), data={"code": code})
+    assert result.status_code == status.HTTP_403_FORBIDDEN
+
+
+@pytest.mark.django_db
+def test_totp_confirm_fails_when_setup_is_redone_concurrently():
+    user = get_user()
+    client = _auth_client(user)
+    secret = client.post(reverse("totp-setup")).data["secret"]
+    serializer = ConfirmTotpSerializer(
+        data={"code": pyotp.TOTP(secret).now()},
+        context={"request": Mock(user=user)},
+    )
+    assert serializer.is_valid()
+    new_secret = client.post(reverse("totp-setup")).data["secret"]
+    with pytest.raises(TotpEnrollmentConflictError):
+        serializer.save()
+    data = UserTwoFactorAuthData.objects.get(user=user)
+    assert data.get_pending_totp_secret() == new_secret
+    assert data.preferred_2fa_auth != TwoFactorAuthMethod.TOTP
+
+
+# ---------------------------------------------------------------------------
+# Stateless enrollment with a ticket
+# ---------------------------------------------------------------------------
+
+use_ticket = OverrideJwt2faSettings(
+    TOTP_ENROLLMENT_TICKET_EXPIRATION_TIME=datetime.timedelta(minutes=10)
+)
+
+
+@pytest.mark.django_db
+@use_ticket
+def test_totp_setup_with_ticket_does_not_write(django_assert_num_queries):
+    user = get_user()
+    client = _auth_client(user)
+    # Loading of the user and of the active secret
+    with django_assert_num_queries(2):
+        result = client.post(reverse("totp-setup"))
+    assert result.status_code == status.HTTP_200_OK
+    assert result.data["ticket"]
+    assert result.data["secret"] not in result.data["ticket"]
+    assert not UserTwoFactorAuthData.objects.filter(user=user).exists()
+
+
+@pytest.mark.django_db
+@use_ticket
+def test_totp_confirm_with_ticket_activates_totp():
+    user = get_user()
+    client = _auth_client(user)
+    client.post(reverse("totp-setup"))  # Abandoned setup
+    setup_result = client.post(reverse("totp-setup"))
+    secret = setup_result.data["secret"]
+    result = client.post(
+        reverse("totp-confirm"),
+        data={
+            "code": pyotp.TOTP(secret).now(),
+            "ticket": setup_result.data["ticket"],
+        },
+    )
+    assert result.status_code == status.HTTP_200_OK
+    data = UserTwoFactorAuthData.objects.get(user=user)
+    assert data.preferred_2fa_auth == TwoFactorAuthMethod.TOTP
+    assert data.get_totp_secret() == secret
+    assert data.get_pending_totp_secret() == ""
+
+
+@pytest.mark.django_db
+@use_ticket
+def test_totp_confirm_with_ticket_fails_with_wrong_code():
+    user = get_user()
+    client = _auth_client(user)
+    setup_result = client.post(reverse("totp-setup"))
+    correct_code = pyotp.TOTP(setup_result.data["secret"]).now()
+    wrong_code = "000000" if correct_code != "000000" else "111111"
+    result = client.post(
+        reverse("totp-confirm"),
+        data={"code": wrong_code, "ticket": setup_result.data["ticket"]},
+    )
+    assert result.status_code == status.HTTP_401_UNAUTHORIZED
+    assert not UserTwoFactorAuthData.objects.filter(user=user).exists()
+
+
+@pytest.mark.django_db
+@use_ticket
+def test_totp_confirm_with_ticket_of_other_user_fails():
+    other_client = _auth_client(get_user(username="other"))
+    setup_result = other_client.post(reverse("totp-setup"))
+    code = pyotp.TOTP(setup_result.data["secret"]).now()
+    client = _auth_client(get_user())
+    result = client.post(
+        reverse("totp-confirm"),
+        data={"code": code, "ticket": setup_result.data["ticket"]},
+    )
+    assert result.status_code == status.HTTP_403_FORBIDDEN
+
+
+def _confirm_with_ticket(client, setup_result):
+    return client.post(
+        reverse("totp-confirm"),
+        data={
+            "code": pyotp.TOTP(setup_result.data["secret"]).now(),
+            "ticket": setup_result.data["ticket"],
+        },
+    )
+
+
+@pytest.mark.django_db
+@use_ticket
+@pytest.mark.parametrize("enrolled", [False, True])
+def test_totp_confirm_with_ticket_succeeds_only_once(enrolled):
+    user = get_user()
+    client = _auth_client(user)
+    if enrolled:
+        _confirm_with_ticket(client, client.post(reverse("totp-setup")))
+    setup_result = client.post(reverse("totp-setup"))
+    code = pyotp.TOTP(setup_result.data["secret"]).now()
+    serializers = [
+        ConfirmTotpSerializer(
+            data={"code": code, "ticket": setup_result.data["ticket"]},
+            context={"request": Mock(user=user)},
+        )
+        for _ in range(2)
+    ]
+    # Both are validated before either of them is saved
+    assert all(serializer.is_valid() for serializer in serializers)
+    serializers[0].save()
+    with pytest.raises(TotpEnrollmentConflictError):
+        serializers[1].save()
+    result = _confirm_with_ticket(client, setup_result)
+    assert result.status_code == status.HTTP_403_FORBIDDEN
+    data = UserTwoFactorAuthData.objects.get(user=user)
+    assert data.get_totp_secret() == setup_result.data["secret"]
+
+
+@pytest.mark.django_db
+@use_ticket
+def test_totp_confirm_with_older_ticket_does_not_replace_active_secret():
+    user = get_user()
+    client = _auth_client(user)
+    older_setup_result = client.post(reverse("totp-setup"))
+    setup_result = client.post(reverse("totp-setup"))
+    result = _confirm_with_ticket(client, setup_result)
+    assert result.status_code == status.HTTP_200_OK
+    result = _confirm_with_ticket(client, older_setup_result)
+    assert result.status_code == status.HTTP_403_FORBIDDEN
+    data = UserTwoFactorAuthData.objects.get(user=user)
+    assert data.get_totp_secret() == setup_result.data["secret"]
+
+
+@pytest.mark.django_db
+def test_totp_confirm_with_ticket_fails_when_tickets_are_disabled():
+    user = get_user()
+    client = _auth_client(user)
+    with use_ticket:
+        setup_result = client.post(reverse("totp-setup"))
+    code = pyotp.TOTP(setup_result.data["secret"]).now()
+    result = client.post(
+        reverse("totp-confirm"),
+        data={"code": code, "ticket": setup_result.data["ticket"]},
+    )
+    assert result.status_code == status.HTTP_403_FORBIDDEN
+
+
 # ---------------------------------------------------------------------------
 # Full enrollment + login round-trip
 # ---------------------------------------------------------------------------
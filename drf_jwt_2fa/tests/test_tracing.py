@@ -0,0 +1,199 @@
+import sys
+import types
+from unittest.mock import patch
+
+import pytest
+from django.core.cache import cache
+from django.urls import reverse
+from rest_framework import status
+
+from drf_jwt_2fa import tracing
+from drf_jwt_2fa.settings import api_settings
+from drf_jwt_2fa.tracing import SpanRecorder, no_op_span, start_span
+
+from .factories import get_user_with_code_sender_2fa
+from .utils import (
+    OverrideJwt2faSettings,
+    get_api_client,
+    get_verification_code_from_mailbox,
+)
+
+recorder = SpanRecorder()
+
+
+@pytest.fixture(autouse=True)
+def clear_cache_and_recorder():
+    cache.clear()
+    recorder.clear()
+    yield
+    cache.clear()
+
+
+@pytest.fixture
+def recording():
+    hook = "drf_jwt_2fa.tests.test_tracing.recorder"
+    with OverrideJwt2faSettings(TRACING_HOOK=hook):
+        yield recorder
+
+
+def test_default_hook_is_no_op():
+    assert api_settings.TRACING_HOOK is no_op_span
+    with start_span("test", a=1) as span:
+        span.set_attribute("jwt2fa.b", 2)
+    assert no_op_span("other", {}) is no_op_span("test", {})
+
+
+def test_span_recorder_records_nesting_and_errors(recording):
+    with start_span("outer", kind="a") as outer:
+        outer.set_attribute("jwt2fa.outcome", "ok")
+        with pytest.raises(KeyError), start_span("inner"):
+            raise KeyError("x")
+
+    (inner_span, outer_span) = recording.spans
+    assert outer_span.name == "outer"
+    assert outer_span.attributes == {
+        "jwt2fa.kind": "a",
+        "jwt2fa.outcome": "ok",
+    }
+    assert outer_span.parent is None
+    assert outer_span.error is None
+    assert outer_span.duration >= inner_span.duration >= 0
+    assert inner_span.parent is outer_span
+    assert inner_span.error == "KeyError"
+    assert recording.get_spans("inner") == [inner_span]
+
+
+def login(client, code=None):
+    code_result = client.post(
+        reverse("get-code"), data={"username": "testuser", "password": "a42"}
+    )
+    assert code_result.status_code == status.HTTP_200_OK
+    return client.post(
+        reverse("auth"),
+        data={
+            "code_token": code_result.data["token"],
+            "code": code or get_verification_code_from_mailbox(),
+        },
+    )
+
+
+@pytest.mark.django_db
+def test_spans_of_login(recording):
+    get_user_with_code_sender_2fa()
+    result = login(get_api_client())
+    assert result.status_code == status.HTTP_200_OK
+
+    (create_span,) = recording.get_spans("jwt2fa.create_code_token")
+    assert create_span.attributes == {
+        "jwt2fa.method": "code-sender",
+        "jwt2fa.outcome": "issued",
+    }
+    (check_span,) = recording.get_spans("jwt2fa.check_code_token_and_code")
+    assert check_span.attributes == {
+        "jwt2fa.method": "code-sender",
+        "jwt2fa.outcome": "ok",
+        "jwt2fa.trusted": True,
+    }
+    (send_span,) = recording.get_spans("jwt2fa.send_code")
+    assert send_span.parent is create_span
+    assert send_span.attributes == {"jwt2fa.outcome": "sent"}
+    (hash_span,) = recording.get_spans("jwt2fa.hash_code")
+    assert hash_span.parent is create_span
+    (check_hash_span,) = recording.get_spans("jwt2fa.check_code_hash")
+    assert check_hash_span.parent is check_span
+    cache_families = {
+        (x.parent.name, x.attributes["jwt2fa.cache_key_family"])
+        for x in recording.get_spans("jwt2fa.cache")
+    }
+    assert cache_families == {
+        ("jwt2fa.create_code_token", "active_tokens"),
+        ("jwt2fa.check_code_token_and_code", "auth_attempts"),
+        ("jwt2fa.check_code_token_and_code", "used_tokens"),
+    }
+    assert len(recording.get_spans("jwt2fa.check_password")) == 1
+    assert len(recording.get_spans("jwt2fa.user_lookup")) == 1
+
+
+@pytest.mark.django_db
+def test_spans_of_wrong_code(recording):
+    get_user_with_code_sender_2fa()
+    result = login(get_api_client(), code="wrong")
+    assert result.status_code == status.HTTP_401_UNAUTHORIZED
+
+    (check_span,) = recording.get_spans("jwt2fa.check_code_token_and_code")
+    assert check_span.attributes == {
+        "jwt2fa.method": "code-sender",
+        "jwt2fa.outcome": "wrong_code",
+    }
+    assert check_span.error == "AuthenticationFailed"
+
+
+@pytest.mark.django_db
+def test_spans_have_no_codes_or_tokens(recording):
+    get_user_with_code_sender_2fa()
+    client = get_api_client()
+    code_result = client.post(
+        reverse("get-code"), data={"username": "testuser", "password": "a42"}
+    )
+    code = get_verification_code_from_mailbox()
+    client.post(
+        reverse("auth"),
+        data={"code_token": code_result.data["token"], "code": code},
+    )
+
+    secrets = {code, code_result.data["token"], "a42"}
+    assert recording.spans
+    for span in recording.spans:
+        for value in span.attributes.values():
+            assert not any(x in str(value) for x in secrets)
+
+
+class StubTracer:
+    def __init__(self, name):
+        self.name = name
+        self.spans = []
+
+    def start_as_current_span(self, name, attributes):
+        recorded = SpanRecorder()
+        self.spans.append(recorded)
+        return recorded(name, attributes)
+
+
+@pytest.fixture
+def opentelemetry_trace():
+    # Stub of the opentelemetry.trace module of the opentelemetry-api
+    trace = types.ModuleType("opentelemetry.trace")
+    trace.get_tracer = StubTracer
+    package = types.ModuleType("opentelemetry")
+    package.trace = trace
+    modules = {"opentelemetry": package, "opentelemetry.trace": trace}
+    with patch.dict(sys.modules, modules):
+        yield trace
+    tracing._opentelemetry_tracer = None
+
+
+def test_opentelemetry_span(opentelemetry_trace):
+    hook = "drf_jwt_2fa.tracing.opentelemetry_span"
+    with (
+        OverrideJwt2faSettings(TRACING_HOOK=hook),
+        start_span("outer", kind="a") as span,
+        start_span("inner"),
+    ):
+        span.set_attribute("jwt2fa.outcome", "ok")
+
+    tracer = tracing._opentelemetry_tracer
+    assert tracer.name == "drf_jwt_2fa"
+    (outer, inner) = [x.spans[0] for x in tracer.spans]
+    assert (outer.name, inner.name) == ("outer", "inner")
+    assert outer.attributes == {"jwt2fa.kind": "a", "jwt2fa.outcome": "ok"}
+    assert inner.attributes == {}
+
+
+def test_opentelemetry_tracer_is_created_once(opentelemetry_trace):
+    tracer = tracing._get_opentelemetry_tracer()
+    assert tracing._get_opentelemetry_tracer() is tracer
+
+
+def test_recorded_span_repr():
+    span = tracing.RecordedSpan("test", {"jwt2fa.kind": "a"}, None)
+    assert repr(span) == "<RecordedSpan test {'jwt2fa.kind': 'a'}>"
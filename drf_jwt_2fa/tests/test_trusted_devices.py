@@ -0,0 +1,226 @@
+import datetime
+
+import freezegun
+import jwt
+import pytest
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.urls import reverse
+from rest_framework import status
+from rest_framework_simplejwt.tokens import AccessToken
+
+from drf_jwt_2fa.settings import api_settings
+from drf_jwt_2fa.trusted_devices import (
+    check_trusted_device_token,
+    create_trusted_device_token,
+    forget_trusted_devices,
+    revoke_trusted_device_token,
+)
+
+from .factories import get_user, get_user_with_code_sender_2fa
+from .utils import (
+    OverrideJwt2faSettings,
+    check_auth_token,
+    get_api_client,
+    get_verification_code_from_mailbox,
+)
+
+use_device_tokens = OverrideJwt2faSettings(
+    TRUSTED_DEVICE_TOKEN_EXPIRATION_TIME=datetime.timedelta(days=30)
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def log_in(device_token=None, remember_device=False):
+    client = get_api_client()
+    data = {"username": "testuser", "password": "a42"}
+    if device_token:
+        data["device_token"] = device_token
+    result = client.post(reverse("get-code"), data=data)
+    assert result.status_code == status.HTTP_200_OK
+    if "token" not in result.data:
+        return result.data  # Second factor skipped
+    result = client.post(
+        reverse("auth"),
+        data={
+            "code_token": result.data["token"],
+            "code": get_verification_code_from_mailbox(),
+            "remember_device": remember_device,
+        },
+    )
+    assert result.status_code == status.HTTP_200_OK
+    return result.data
+
+
+@pytest.mark.django_db
+@use_device_tokens
+def test_device_token_skips_second_factor():
+    get_user_with_code_sender_2fa()
+    device_token = log_in(remember_device=True)["device_token"]
+    assert len(mail.outbox) == 1
+    result = log_in(device_token=device_token)
+    assert len(mail.outbox) == 1  # No code was sent
+    assert "device_token" not in result
+    check_auth_token(result["access"])
+
+
+@pytest.mark.django_db
+@use_device_tokens
+def test_device_token_is_issued_only_on_request():
+    get_user_with_code_sender_2fa()
+    assert "device_token" not in log_in()
+
+
+@pytest.mark.django_db
+def test_device_token_is_not_issued_when_disabled():
+    get_user_with_code_sender_2fa()
+    assert "device_token" not in log_in(remember_device=True)
+
+
+@pytest.mark.django_db
+@use_device_tokens
+def test_device_token_is_not_issued_for_untrusted_method():
+    get_user_with_code_sender_2fa()
+    with OverrideJwt2faSettings(
+        TRUSTED_DEVICE_TOKEN_EXPIRATION_TIME=datetime.timedelta(days=30),
+        TRUSTED_2FA_METHODS=["totp"],
+    ):
+        result = log_in(remember_device=True)
+    assert list(result) == ["enrollment_token"]
+
+
+@pytest.mark.django_db
+@use_device_tokens
+def test_invalid_device_token_falls_back_to_second_factor():
+    get_user_with_code_sender_2fa()
+    result = log_in(device_token="invalid", remember_device=True)
+    assert len(mail.outbox) == 1
+    assert "device_token" in result
+
+
+@pytest.mark.django_db
+@use_device_tokens
+def test_device_token_is_bound_to_user():
+    user = get_user()
+    other_user = get_user(username="other")
+    device_token = create_trusted_device_token(other_user)
+    assert check_trusted_device_token(device_token, other_user)
+    assert not check_trusted_device_token(device_token, user)
+
+
+@pytest.mark.django_db
+@use_device_tokens
+def test_device_token_is_invalidated_by_password_change():
+    user = get_user()
+    device_token = create_trusted_device_token(user)
+    user.set_password("new password")
+    user.save()
+    assert not check_trusted_device_token(device_token, user)
+    assert check_trusted_device_token(create_trusted_device_token(user), user)
+
+
+@pytest.mark.django_db
+@use_device_tokens
+def test_device_token_is_rejected_when_auth_version_is_lost():
+    user = get_user()
+    device_token = create_trusted_device_token(user)
+    cache.clear()
+    assert not check_trusted_device_token(device_token, user)
+    # Recreating the counter does not make the old token valid again
+    create_trusted_device_token(user)
+    assert not check_trusted_device_token(device_token, user)
+
+
+@pytest.mark.django_db
+@use_device_tokens
+def test_device_token_expires():
+    user = get_user()
+    with freezegun.freeze_time("2026-01-01 12:00:00") as frozen_time:
+        device_token = create_trusted_device_token(user)
+        frozen_time.tick(datetime.timedelta(days=29))
+        assert check_trusted_device_token(device_token, user)
+        frozen_time.tick(datetime.timedelta(days=2))
+        assert not check_trusted_device_token(device_token, user)
+
+
+@pytest.mark.django_db
+@use_device_tokens
+def test_device_tokens_are_revoked_individually():
+    user = get_user()
+    device_token1 = create_trusted_device_token(user)
+    device_token2 = create_trusted_device_token(user)
+    assert revoke_trusted_device_token(device_token1)
+    assert not check_trusted_device_token(device_token1, user)
+    assert check_trusted_device_token(device_token2, user)
+    assert not revoke_trusted_device_token("invalid")
+
+
+@pytest.mark.django_db
+@use_device_tokens
+def test_forget_trusted_devices():
+    user = get_user()
+    device_token = create_trusted_device_token(user)
+    forget_trusted_devices(user)
+    assert not check_trusted_device_token(device_token, user)
+
+
+def test_create_device_token_when_disabled():
+    with pytest.raises(ImproperlyConfigured):
+        create_trusted_device_token(None)
+
+
+@pytest.mark.django_db
+def test_device_token_is_rejected_when_disabled():
+    user = get_user()
+    with use_device_tokens:
+        device_token = create_trusted_device_token(user)
+    assert not check_trusted_device_token(device_token, user)
+
+
+@pytest.mark.django_db
+@use_device_tokens
+def test_token_of_other_type_is_rejected():
+    user = get_user()
+    key = api_settings.TRUSTED_DEVICE_TOKEN_SECRET_KEY
+    payload = jwt.decode(
+        create_trusted_device_token(user), key, algorithms=["HS256"]
+    )
+    other_token = jwt.encode({**payload, "typ": "other"}, key, "HS256")
+    assert not check_trusted_device_token(other_token, user)
+    assert not revoke_trusted_device_token(other_token)
+
+
+@pytest.mark.django_db
+@use_device_tokens
+def test_revoke_endpoint():
+    user = get_user()
+    device_token = create_trusted_device_token(user)
+    client = get_api_client()
+    url = reverse("trusted-device-revoke")
+    result = client.post(url, data={"device_token": device_token})
+    assert result.status_code == status.HTTP_200_OK
+    assert not check_trusted_device_token(device_token, user)
+    result = client.post(url, data={"device_token": "invalid"})
+    assert result.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+@use_device_tokens
+def test_forget_all_endpoint():
+    user = get_user()
+    device_token = create_trusted_device_token(user)
+    client = get_api_client()
+    url = reverse("trusted-device-forget-all")
+    assert client.post(url).status_code == status.HTTP_401_UNAUTHORIZED
+    client.credentials(
+        HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}"
+    )
+    assert client.post(url).status_code == status.HTTP_200_OK
+    assert not check_trusted_device_token(device_token, user)
@@ -0,0 +1,154 @@
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+
+from drf_jwt_2fa.caching import CacheLockTimeoutError
+from drf_jwt_2fa.exceptions import TokenAlreadyUsedError, TokenStateBusyError
+from drf_jwt_2fa.token_manager import CodeTokenManager
+from drf_jwt_2fa.used_tokens import UsedTokenFilter
+
+from .factories import get_code_token, get_code_token_and_its_jti
+from .utils import OverrideJwt2faSettings
+
+use_filter = OverrideJwt2faSettings(USED_TOKEN_FILTER_CAPACITY=1000)
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def cached_keys():
+    return list(cache._cache.keys())
+
+
+def test_reserve_rejects_reuse():
+    used_token_filter = UsedTokenFilter(1000, 1e-9, 300)
+    expires_at = int(time.time()) + 300
+    assert used_token_filter.reserve("jti-1", expires_at) is True
+    assert used_token_filter.reserve("jti-2", expires_at) is True
+    assert used_token_filter.reserve("jti-1", expires_at) is False
+    assert used_token_filter.reserve("jti-2", expires_at) is False
+
+
+def test_reserve_stores_filter_segments_per_bucket():
+    used_token_filter = UsedTokenFilter(1000, 1e-9, 300)
+    now = int(time.time())
+    for i in range(200):
+        used_token_filter.reserve(f"jti-{i}", now + 300)
+    keys = cached_keys()
+    assert len(keys) <= used_token_filter.num_segments
+    bucket = (now + 300) // 300
+    assert all(f":drf_jwt_2fa:used_filter:{bucket}:" in k for k in keys)
+
+
+def test_segments_are_small():
+    used_token_filter = UsedTokenFilter(1_000_000, 1e-9, 300)
+    segment_bytes = (used_token_filter.num_bits + 7) // 8
+    assert segment_bytes <= UsedTokenFilter.max_segment_bytes
+    assert used_token_filter.num_segments > 1000
+
+
+def test_slow_update_is_not_written():
+    used_token_filter = UsedTokenFilter(1000, 1e-9, 300)
+    original_load_filter = used_token_filter._load_filter
+
+    def slow_load_filter(data):
+        time.sleep(0.02)  # The lock may expire meanwhile
+        return original_load_filter(data)
+
+    with (
+        patch.object(used_token_filter, "lock_timeout", 0.02),
+        patch.object(used_token_filter, "_load_filter", slow_load_filter),
+        pytest.raises(CacheLockTimeoutError),
+    ):
+        used_token_filter.reserve("jti-1", int(time.time()) + 300)
+    assert cached_keys() == []
+
+
+def test_bucket_expires_at_the_end_of_the_bucket():
+    used_token_filter = UsedTokenFilter(1000, 1e-9, 300)
+    expires_at = int(time.time()) + 300
+    used_token_filter.reserve("jti-1", expires_at)
+    bucket_end = (expires_at // 300 + 1) * 300
+    [key] = cached_keys()
+    assert cache._expire_info[key] == pytest.approx(bucket_end, abs=2)
+
+
+def test_reserve_ignores_filter_stored_with_other_size():
+    expires_at = int(time.time()) + 300
+    UsedTokenFilter(1000, 0.01, 300).reserve("jti-1", expires_at)
+    # Different settings, so the stored data is not interpreted
+    assert UsedTokenFilter(1000, 1e-9, 300).reserve("jti-1", expires_at)
+
+
+@use_filter
+def test_used_token_is_rejected():
+    token = get_code_token(verification_code="1234567")
+    manager = CodeTokenManager()
+    manager.check_code_token_and_code(token, "1234567")
+    with pytest.raises(TokenAlreadyUsedError):
+        manager.check_code_token_and_code(token, "1234567")
+
+
+@use_filter
+def test_no_per_token_used_markers_are_stored():
+    manager = CodeTokenManager()
+    for _ in range(3):
+        (token, _jti) = get_code_token_and_its_jti()
+        manager.check_code_token_and_code(token, "1234567")
+    assert not any(":used_token:" in key for key in cached_keys())
+    assert any(":used_filter:" in key for key in cached_keys())
+
+
+@use_filter
+def test_locked_segment_raises_busy_error():
+    token = get_code_token(verification_code="1234567")
+    manager = CodeTokenManager()
+    with (
+        patch.object(UsedTokenFilter, "lock_timeout", 0.01),
+        patch.object(cache, "add", return_value=False),
+        pytest.raises(TokenStateBusyError) as exc_info,
+    ):
+        manager.check_code_token_and_code(token, "1234567")
+    assert exc_info.value.status_code == 429
+    assert exc_info.value.get_codes() == "token_state_busy"
+
+
+@use_filter
+def test_concurrent_use_is_accepted_only_once():
+    token = get_code_token(verification_code="1234567")
+    manager = CodeTokenManager()
+    results = []
+    lock = threading.Lock()
+    original_get = LocMemCache.get
+
+    def slow_get(self, *args, **kwargs):
+        # Widen the window between reading and writing the filter
+        value = original_get(self, *args, **kwargs)
+        time.sleep(0.02)
+        return value
+
+    def attempt():
+        try:
+            manager.check_code_token_and_code(token, "1234567")
+            result = "ok"
+        except TokenAlreadyUsedError:
+            result = "used"
+        with lock:
+            results.append(result)
+
+    with patch.object(LocMemCache, "get", slow_get):
+        threads = [threading.Thread(target=attempt) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert sorted(results) == ["ok", "used", "used"]
@@ -0,0 +1,228 @@
+import datetime
+from unittest.mock import patch
+
+import pytest
+from django.contrib.auth.models import User, update_last_login
+from django.core.cache import cache
+from django.db import transaction
+from django.test import RequestFactory
+from rest_framework.request import Request
+from rest_framework_simplejwt.exceptions import (
+    AuthenticationFailed,
+    InvalidToken,
+)
+from rest_framework_simplejwt.tokens import AccessToken
+
+from drf_jwt_2fa.authentication import Jwt2faAuthentication, jwt_settings
+from drf_jwt_2fa.models import UserTwoFactorAuthData
+from drf_jwt_2fa.user_cache import (
+    bump_auth_version,
+    get_auth_version,
+    get_cached_user,
+)
+
+from .factories import get_user
+from .utils import OverrideJwt2faSettings
+
+use_user_cache = OverrideJwt2faSettings(
+    USER_CACHE_TIMEOUT=datetime.timedelta(seconds=30)
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def authenticate(token):
+    http_request = RequestFactory().get("/")
+    http_request.META["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+    return Jwt2faAuthentication().authenticate(Request(http_request))
+
+
+@pytest.mark.django_db
+@use_user_cache
+def test_user_is_served_from_cache(django_assert_num_queries):
+    user = get_user()
+    token = AccessToken.for_user(user)
+    with django_assert_num_queries(1):
+        (user1, _token) = authenticate(token)
+    with django_assert_num_queries(0):
+        (user2, _token) = authenticate(token)
+    assert user1 == user2 == user
+    assert user2.username == "testuser"
+
+
+@pytest.mark.django_db
+def test_user_is_loaded_every_time_by_default(django_assert_num_queries):
+    token = AccessToken.for_user(get_user())
+    for _ in range(2):
+        with django_assert_num_queries(1):
+            authenticate(token)
+
+
+@pytest.mark.django_db
+@use_user_cache
+def test_deactivated_user_is_rejected_immediately():
+    user = get_user()
+    token = AccessToken.for_user(user)
+    authenticate(token)
+    user.is_active = False
+    user.save()
+    with pytest.raises(AuthenticationFailed) as exc_info:
+        authenticate(token)
+    assert exc_info.value.detail["code"] == "user_inactive"
+
+
+@pytest.mark.django_db(transaction=True)
+@use_user_cache
+def test_change_in_autocommit_mode_bumps_version_once():
+    user = get_user()
+    version = get_auth_version(str(user.pk), create=True)
+    user.is_active = False
+    user.save()
+    assert get_auth_version(str(user.pk)) == version + 1
+
+
+@pytest.mark.django_db
+@use_user_cache
+def test_user_cached_before_commit_is_dropped_on_commit(
+    django_capture_on_commit_callbacks,
+):
+    user = get_user()
+    token = AccessToken.for_user(user)
+    old_row = User.objects.get(pk=user.pk)
+    with (
+        django_capture_on_commit_callbacks(execute=True),
+        transaction.atomic(),
+    ):
+        user.is_active = False
+        user.save()
+        # Another request, which does not see the change yet, caches
+        # the old row at the bumped version
+        get_cached_user(str(user.pk), lambda user_id: old_row)
+        assert get_cached_user(str(user.pk), None).is_active
+    with pytest.raises(AuthenticationFailed) as exc_info:
+        authenticate(token)
+    assert exc_info.value.detail["code"] == "user_inactive"
+
+
+@pytest.mark.django_db
+@use_user_cache
+@patch.object(jwt_settings, "CHECK_REVOKE_TOKEN", True)
+def test_password_change_is_detected_immediately():
+    user = get_user()
+    token = AccessToken.for_user(user)
+    authenticate(token)
+    user.set_password("new password")
+    user.save()
+    with pytest.raises(AuthenticationFailed) as exc_info:
+        authenticate(token)
+    assert exc_info.value.detail["code"] == "password_changed"
+
+
+@pytest.mark.django_db
+@use_user_cache
+def test_deleted_user_is_rejected_immediately():
+    user = get_user()
+    token = AccessToken.for_user(user)
+    authenticate(token)
+    user.delete()
+    with pytest.raises(AuthenticationFailed) as exc_info:
+        authenticate(token)
+    assert exc_info.value.detail["code"] == "user_not_found"
+
+
+@pytest.mark.django_db
+@use_user_cache
+def test_2fa_data_change_invalidates_cached_user(django_assert_num_queries):
+    user = get_user()
+    token = AccessToken.for_user(user)
+    authenticate(token)
+    data = UserTwoFactorAuthData.objects.create(user=user)
+    with django_assert_num_queries(1):
+        authenticate(token)
+    data.preferred_2fa_auth = "totp"
+    data.save()
+    with django_assert_num_queries(1):
+        authenticate(token)
+    data.delete()
+    with django_assert_num_queries(1):
+        authenticate(token)
+
+
+@pytest.mark.django_db
+@use_user_cache
+def test_2fa_data_update_invalidates_cached_user(django_assert_num_queries):
+    user = get_user()
+    token = AccessToken.for_user(user)
+    UserTwoFactorAuthData.objects.create(user=user)
+    authenticate(token)
+    UserTwoFactorAuthData.set_preferred_2fa_method_of_user(user, "no-2fa")
+    with django_assert_num_queries(1):
+        authenticate(token)
+
+
+@pytest.mark.django_db
+@use_user_cache
+def test_last_login_update_keeps_cached_user(django_assert_num_queries):
+    user = get_user()
+    token = AccessToken.for_user(user)
+    authenticate(token)
+    update_last_login(None, user)
+    with django_assert_num_queries(0):
+        authenticate(token)
+
+
+@use_user_cache
+def test_user_changed_while_loading_is_not_served_from_cache():
+    users = iter(User(id=1, username=x) for x in ["old", "new", "unused"])
+
+    def load_user(user_id):
+        user = next(users)
+        if user.username == "old":
+            bump_auth_version("1")  # Changed by another request
+        return user
+
+    assert get_cached_user("1", load_user).username == "old"
+    assert get_cached_user("1", load_user).username == "new"
+    assert get_cached_user("1", load_user).username == "new"
+
+
+@pytest.mark.django_db
+@use_user_cache
+@patch.object(jwt_settings, "CHECK_REVOKE_TOKEN", True)
+def test_password_hash_is_not_cached(django_assert_num_queries):
+    user = get_user()
+    token = AccessToken.for_user(user)
+    authenticate(token)
+    cached_values = [str(x) for x in cache._cache.values()]
+    assert not any(user.password in x for x in cached_values)
+    with django_assert_num_queries(0):
+        (cached_user, _token) = authenticate(token)
+    assert cached_user.get_deferred_fields() == {"password"}
+
+
+@pytest.mark.django_db
+@use_user_cache
+def test_token_without_user_id_is_rejected():
+    token = AccessToken.for_user(get_user())
+    del token[jwt_settings.USER_ID_CLAIM]
+    with pytest.raises(InvalidToken):
+        authenticate(token)
+
+
+@pytest.mark.django_db
+@use_user_cache
+# Patched by name, since the settings object of Simple JWT is replaced
+# when the settings are reloaded
+@patch(
+    "rest_framework_simplejwt.settings.api_settings.USER_ID_FIELD", "username"
+)
+def test_2fa_data_change_with_custom_user_id_field():
+    user = get_user()
+    version = get_auth_version("testuser")
+    UserTwoFactorAuthData.objects.create(user=user)
+    assert get_auth_version("testuser") == version + 1
@@ -0,0 +1,39 @@
+import logging
+from unittest.mock import patch
+
+from django.apps import apps
+
+from drf_jwt_2fa import totp_encryption
+from drf_jwt_2fa.settings import api_settings
+from drf_jwt_2fa.warmup import warm_up
+
+from .utils import OverrideJwt2faSettings
+
+
+def test_warm_up_loads_settings_and_fernets(caplog):
+    api_settings.reload()
+    totp_encryption._make_fernet.cache_clear()
+    caplog.set_level(logging.INFO, logger="drf_jwt_2fa.warmup")
+
+    warm_up()
+
+    assert "CODE_TOKEN_SECRET_KEY" in api_settings.__dict__
+    assert totp_encryption._make_fernet.cache_info().currsize == 2
+    assert "2FA warm-up done in" in caplog.text
+
+
+def test_fernets_are_shared():
+    assert totp_encryption._get_fernet() is totp_encryption._get_fernet()
+
+
+@patch("drf_jwt_2fa.warmup.warm_up")
+def test_warm_up_is_not_done_on_ready_by_default(warm_up_mock):
+    apps.get_app_config("drf_jwt_2fa").ready()
+    warm_up_mock.assert_not_called()
+
+
+@patch("drf_jwt_2fa.warmup.warm_up")
+def test_warm_up_on_ready(warm_up_mock):
+    with OverrideJwt2faSettings(WARM_UP_ON_READY=True):
+        apps.get_app_config("drf_jwt_2fa").ready()
+    warm_up_mock.assert_called_once_with()
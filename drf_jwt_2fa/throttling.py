@@ -1,17 +1,22 @@
 import time
 from hashlib import sha256 as ident_hasher
 
-from django.core.cache import cache as default_cache
 from rest_framework import throttling
 from rest_framework.request import Request
 from rest_framework.views import APIView
 
+from .caching import get_cache_key_prefix, get_throttle_cache
 from .settings import api_settings
+from .token_manager import CodeTokenManager
 from .utils import get_code_token_hash
 
 
 class CodeTokenThrottler(throttling.SimpleRateThrottle):
-    cache_key_template = "drf_jwt_2fa:throttle:code:{ident_hash}"
+    cache_key_template = "{prefix}:throttle:code:{ident_hash}"
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.cache = get_throttle_cache()
 
     def get_rate(self) -> str:
         return api_settings.CODE_TOKEN_THROTTLE_RATE
@@ -27,26 +32,76 @@ class CodeTokenThrottler(throttling.SimpleRateThrottle):
     def get_cache_key(self, request: Request, view: APIView) -> str:
         ident_bytes = self.get_ident(request).encode("utf-8")
         ident_hash = ident_hasher(ident_bytes).hexdigest()[:20]
-        return self.cache_key_template.format(ident_hash=ident_hash)
+        return self.cache_key_template.format(
+            prefix=get_cache_key_prefix(), ident_hash=ident_hash
+        )
 
 
 class AuthTokenThrottler(throttling.BaseThrottle):
-    cache = default_cache
-    cache_key_template = "drf_jwt_2fa:throttle:auth:{code_token_hash}"
+    """
+    Throttle the verification attempts of a code token.
+
+    After each attempt the next attempt with the same code token is
+    allowed only after a wait time.  The wait time is fixed to
+    AUTH_TOKEN_RETRY_WAIT_TIME by default.  When
+    AUTH_TOKEN_RETRY_BACKOFF_CAP is set, the wait time is doubled for
+    each failed attempt already recorded for the code token, up to the
+    cap.
+    """
+
+    cache_key_template = "{prefix}:throttle:auth:{code_token_hash}"
+    token_manager_class = CodeTokenManager
+
+    def __init__(self) -> None:
+        self.cache = get_throttle_cache()
 
     def allow_request(self, request: Request, view: APIView) -> bool:
         key = self.get_cache_key(request, view)
         if not key:
             return True
         now = time.time()
-        next_allowed = self.cache.get(key)
+        (next_allowed, failures) = self._get_state(request, key)
         if next_allowed and next_allowed > now:
             self.wait_time = next_allowed - now
             return False
-        next_allowed = now + self.retry_wait_seconds
-        self.cache.set(key, next_allowed, timeout=self.retry_wait_seconds)
+        wait_seconds = self.get_retry_wait_seconds(failures)
+        next_allowed_new = now + wait_seconds
+        if next_allowed is None:
+            # Add the key atomically so that only one of concurrent
+            # attempts gets through
+            if not self.cache.add(key, next_allowed_new, timeout=wait_seconds):
+                self.wait_time = wait_seconds
+                return False
+        else:  # Passed, but not yet expired from the cache
+            self.cache.set(key, next_allowed_new, timeout=wait_seconds)
         return True
 
+    def _get_state(
+        self, request: Request, key: str
+    ) -> tuple[float | None, int]:
+        """
+        Get the next allowed time and the number of failed attempts.
+
+        The number of failed attempts is read only in the adaptive mode.
+        It is read with the same cache call as the next allowed time
+        when the throttle state and the code token state are stored to
+        the same cache.
+        """
+        if api_settings.AUTH_TOKEN_RETRY_BACKOFF_CAP is None:
+            return (self.cache.get(key), 0)
+        token_manager = self.token_manager_class()
+        # The token is non-empty here, since the cache key was found
+        token = str(request.data.get("code_token"))
+        location = token_manager.get_auth_attempts_cache_and_key(token)
+        if location is None:
+            return (self.cache.get(key), 0)
+        (attempts_cache, attempts_key) = location
+        if attempts_cache is not self.cache:
+            failures = attempts_cache.get(attempts_key) or 0
+            return (self.cache.get(key), failures)
+        values = self.cache.get_many([key, attempts_key])
+        return (values.get(key), values.get(attempts_key) or 0)
+
     def wait(self) -> float:
         return self.wait_time
 
@@ -55,7 +110,24 @@ class AuthTokenThrottler(throttling.BaseThrottle):
         if not token:
             return None
         token_hash = get_code_token_hash(token)
-        return self.cache_key_template.format(code_token_hash=token_hash)
+        return self.cache_key_template.format(
+            prefix=get_cache_key_prefix(), code_token_hash=token_hash
+        )
+
+    def get_retry_wait_seconds(self, failures: int) -> float:
+        """
+        Get the wait time after an attempt with given earlier failures.
+
+        The wait time is AUTH_TOKEN_RETRY_WAIT_TIME multiplied by two to
+        the power of the number of earlier failed attempts and capped to
+        AUTH_TOKEN_RETRY_BACKOFF_CAP.  The wait time is fixed to
+        AUTH_TOKEN_RETRY_WAIT_TIME when the cap is not set.
+        """
+        cap = api_settings.AUTH_TOKEN_RETRY_BACKOFF_CAP
+        if cap is None:
+            return self.retry_wait_seconds
+        backoff = self.retry_wait_seconds * 2 ** min(failures, 32)
+        return min(backoff, cap.total_seconds())
 
     @property
     def retry_wait_seconds(self) -> float:
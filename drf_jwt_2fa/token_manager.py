@@ -1,5 +1,6 @@
+import hashlib
+import hmac
 import logging
-import secrets
 import time
 from typing import NamedTuple, NotRequired, TypedDict
 
@@ -7,23 +8,41 @@ import jwt
 from django.contrib.auth import get_user_model
 from django.contrib.auth import hashers as django_hashers
 from django.contrib.auth.models import AbstractBaseUser
-from django.core.cache import cache
-from django.utils.crypto import get_random_string
+from django.core.cache import BaseCache
 from django.utils.translation import gettext as _
 from rest_framework import exceptions
 
+from .audit import emit_audit_event
+from .caching import (
+    CacheLockTimeoutError,
+    get_cache_key_prefix,
+    get_token_state_cache,
+)
+from .delivery import deliver_code_in_background
 from .exceptions import (
     TokenAlreadyUsedError,
+    TokenStateBusyError,
     TooManyAuthAttemptsError,
     TooManyCodeTokensError,
     TwoFactorAuthNotConfiguredError,
     Unknown2faMethodError,
     VerificationCodeSendingError,
 )
-from .models import TwoFactorAuthMethod
-from .sending import CodeSendingError
+from .failure_sketch import FailedAttemptSketch
+from .metrics import CODE_SENDS, CODE_TOKENS_ISSUED, PHASE_DURATION
+from .models import AuditEventType, RecoveryCode, TwoFactorAuthMethod
+from .random_material import RandomMaterial
+from .recovery_codes import looks_like_recovery_code
+from .sending import (
+    CodeSendingError,
+    CodeSendingTimeoutError,
+    call_code_sender,
+    get_code_sending_deadline,
+)
 from .settings import api_settings
-from .totp import verify_totp_code
+from .totp import get_totp_code_lifetime, verify_totp_code
+from .tracing import Span, start_span
+from .used_tokens import UsedTokenFilter
 from .utils import get_code_token_hash
 
 
@@ -42,16 +61,22 @@ class CodeVerificationResult(NamedTuple):
     trusted: bool
 
 
+class IssuedCodeToken(NamedTuple):
+    token: str
+    delivery_id: str | None  # Set if the code is sent in the background
+
+
 LOG = logging.getLogger(__name__)
 
 
 class CodeTokenManager:
     jwt_algorithm = "HS256"
-    _auth_attempts_cache_key_template = (
-        "drf_jwt_2fa:auth_attempts:{token_hash}"
-    )
-    _active_tokens_cache_key_template = "drf_jwt_2fa:active_tokens:{user_id}"
-    _used_tokens_cache_key_template = "drf_jwt_2fa:used_token:{jti}"
+    _auth_attempts_cache_key_template = "{prefix}:auth_attempts:{token_hash}"
+    _active_tokens_cache_key_template = "{prefix}:active_tokens:{user_id}"
+    _used_tokens_cache_key_template = "{prefix}:used_token:{jti}"
+
+    def _get_cache(self, routing_key: str) -> BaseCache:
+        return get_token_state_cache(routing_key)
 
     @property
     def code_length(self) -> int:
@@ -61,10 +86,30 @@ class CodeTokenManager:
     def code_chars(self) -> str:
         return api_settings.CODE_CHARACTERS
 
+    @property
+    def jti_bytes(self) -> int:
+        return api_settings.CODE_TOKEN_JTI_BYTES
+
     def create_code_token(self, user: AbstractBaseUser) -> str | None:
         """
         Create a code token and, when applicable, send a verification code.
 
+        Return the code token or None, as described in
+        :meth:`issue_code_token`.
+        """
+        issued = self.issue_code_token(user)
+        return issued.token if issued is not None else None
+
+    def issue_code_token(
+        self, user: AbstractBaseUser
+    ) -> IssuedCodeToken | None:
+        """
+        Create a code token and, when applicable, send a verification code.
+
+        Return the code token together with its delivery id, which is
+        the jti of the token when the code is sent in the background
+        (see ``ASYNC_CODE_SENDING``) and None otherwise.
+
         The behaviour depends on the user's preferred 2FA method and the
         TRUSTED_2FA_METHODS setting:
 
@@ -86,27 +131,62 @@ class CodeTokenManager:
         Raises TooManyCodeTokensError, if the user already has
         MAX_ACTIVE_CODE_TOKENS_PER_USER unexpired code tokens.
         """
-        method = api_settings.PREFERRED_2FA_METHOD_GETTER(user)
+        with start_span("jwt2fa.create_code_token") as span:
+            method = api_settings.PREFERRED_2FA_METHOD_GETTER(user)
+            span.set_attribute("jwt2fa.method", str(method))
+            issued = self._create_code_token(user, method)
+            outcome = "skipped" if issued is None else "issued"
+            span.set_attribute("jwt2fa.outcome", outcome)
+        if issued is not None:
+            emit_audit_event(
+                AuditEventType.CODE_ISSUED, user.pk, method=str(method)
+            )
+        return issued
 
+    def _create_code_token(
+        self, user: AbstractBaseUser, method: str
+    ) -> IssuedCodeToken | None:
         if method == TwoFactorAuthMethod.CODE_SENDER:
-            return self._create_code_sender_token(user)
+            issued = self._create_code_sender_token(user)
+            CODE_TOKENS_ISSUED.inc(method=method)
+            return issued
         elif method == TwoFactorAuthMethod.TOTP:
-            return self._create_totp_code_token(user)
+            token = self._create_totp_code_token(user)
+            CODE_TOKENS_ISSUED.inc(method=method)
+            return IssuedCodeToken(token, delivery_id=None)
         elif method == TwoFactorAuthMethod.NO_2FA:
             if method in api_settings.TRUSTED_2FA_METHODS:
                 return None
             raise TwoFactorAuthNotConfiguredError()
         raise Unknown2faMethodError()
 
-    def _create_code_sender_token(self, user: AbstractBaseUser) -> str:
-        code = self.generate_verification_code()
-        payload = self.get_code_sender_token_payload(user, code)
+    def _create_code_sender_token(
+        self, user: AbstractBaseUser
+    ) -> IssuedCodeToken:
+        material = RandomMaterial()
+        code = self.generate_verification_code(material)
+        payload = self.get_code_sender_token_payload(user, code, material)
         self._check_and_register_active_token(str(user.pk), payload["exp"])
+        if api_settings.ASYNC_CODE_SENDING:
+            deliver_code_in_background(
+                self.send_verification_code,
+                user,
+                code,
+                payload["jti"],
+                payload["exp"],
+            )
+            # The status of the delivery is stored by the jti
+            return IssuedCodeToken(
+                self.encode_token(payload), delivery_id=payload["jti"]
+            )
         try:
             self.send_verification_code(user, code)
+        except CodeSendingTimeoutError:
+            # The code may still be delivered, so let the user try it
+            LOG.warning("Verification code sending timed out")
         except CodeSendingError as error:
             raise VerificationCodeSendingError(error) from error
-        return self.encode_token(payload)
+        return IssuedCodeToken(self.encode_token(payload), delivery_id=None)
 
     def _create_totp_code_token(self, user: AbstractBaseUser) -> str:
         payload = self.get_totp_token_payload(user)
@@ -114,7 +194,7 @@ class CodeTokenManager:
         return self.encode_token(payload)
 
     def check_code_token_and_code(
-        self, token: str, code: str
+        self, token: str, code: str, client_ident: str | None = None
     ) -> CodeVerificationResult:
         """
         Check code token and related verification code.
@@ -129,22 +209,111 @@ class CodeTokenManager:
         trusted field tells whether the token type is listed in
         TRUSTED_2FA_METHODS.
 
+        An unused recovery code of the user is accepted in place of the
+        verification code of any token type.  It is then marked as used
+        and the trusted field tells whether "recovery-code" is listed
+        in TRUSTED_2FA_METHODS.
+
         Raises TooManyAuthAttemptsError if the token has already
-        exceeded MAX_AUTH_ATTEMPTS_PER_CODE_TOKEN failed attempts.
+        exceeded MAX_AUTH_ATTEMPTS_PER_CODE_TOKEN failed attempts, or if
+        the user or the client, identified by ``client_ident``, has
+        exceeded MAX_FAILED_AUTH_ATTEMPTS_PER_USER or
+        MAX_FAILED_AUTH_ATTEMPTS_PER_CLIENT failed attempts over all
+        code tokens.
+        """
+        with (
+            PHASE_DURATION.time(phase="verify_code"),
+            start_span("jwt2fa.check_code_token_and_code") as span,
+        ):
+            payload = self.decode_token(token)
+            result = self._check_code(payload, code, client_ident, span, token)
+            span.set_attribute("jwt2fa.outcome", "ok")
+            span.set_attribute("jwt2fa.trusted", result.trusted)
+            return result
+
+    def check_totp_code_of_user(
+        self,
+        user: AbstractBaseUser,
+        code: str,
+        client_ident: str | None = None,
+    ) -> CodeVerificationResult:
         """
-        payload = self.decode_token(token)
-        self._check_auth_attempts_not_exceeded(token, payload)
+        Check the TOTP code of a user without a code token.
+
+        This is used by the single request TOTP login (see the
+        SINGLE_REQUEST_TOTP_LOGIN setting), after the password of the
+        user has been checked.  The code is checked like by
+        check_code_token_and_code with a TOTP code token, including
+        the recovery codes and the MAX_FAILED_AUTH_ATTEMPTS_PER_USER
+        and MAX_FAILED_AUTH_ATTEMPTS_PER_CLIENT limits, but there is no
+        per-token attempt limit.  Therefore the failed attempts of the
+        user are limited even if MAX_FAILED_AUTH_ATTEMPTS_PER_USER is
+        None, to the attempts which the code tokens of the user allow at
+        a time: MAX_ACTIVE_CODE_TOKENS_PER_USER times
+        MAX_AUTH_ATTEMPTS_PER_CODE_TOKEN.
+
+        A code is accepted only once per user: it is reserved like a
+        used code token until it cannot be valid anymore, so that a
+        replayed request is rejected with TokenAlreadyUsedError.
+        """
+        with (
+            PHASE_DURATION.time(phase="verify_code"),
+            start_span("jwt2fa.check_totp_code_of_user") as span,
+        ):
+            payload = self.get_totp_login_payload(user, code)
+            result = self._check_code(
+                payload, code, client_ident, span, user=user
+            )
+            span.set_attribute("jwt2fa.outcome", "ok")
+            span.set_attribute("jwt2fa.trusted", result.trusted)
+            return result
+
+    def _check_code(
+        self,
+        payload: CodeTokenPayload,
+        code: str,
+        client_ident: str | None,
+        span: Span,
+        token: str | None = None,
+        user: AbstractBaseUser | None = None,
+    ) -> CodeVerificationResult:
+        failure_items = self._get_failure_items(
+            payload, client_ident, with_token=token is not None
+        )
+        try:
+            if token is not None:
+                self._check_auth_attempts_not_exceeded(token, payload)
+            self._check_failures_not_exceeded(failure_items)
+        except TooManyAuthAttemptsError:
+            emit_audit_event(
+                AuditEventType.LOCKED_OUT, payload.get("uid"), client_ident
+            )
+            raise
         token_type = payload.get("typ", TwoFactorAuthMethod.CODE_SENDER)
 
         if token_type == TwoFactorAuthMethod.TOTP:
-            code_ok = self._verify_totp_code(payload, code)
+            code_ok = self._verify_totp_code(payload, code, user)
         else:
             hashed_code = payload["vch"]
             nonce = payload["vcn"]
             code_ok = self.is_verification_code_ok(code, nonce, hashed_code)
 
+        if not code_ok and self._use_recovery_code(payload, code):
+            token_type = TwoFactorAuthMethod.RECOVERY_CODE
+            code_ok = True
+
+        span.set_attribute("jwt2fa.method", str(token_type))
         if not code_ok:
-            self._record_failed_auth_attempt(token, payload)
+            span.set_attribute("jwt2fa.outcome", "wrong_code")
+            emit_audit_event(
+                AuditEventType.AUTH_FAILED,
+                payload.get("uid"),
+                client_ident,
+                method=str(token_type),
+            )
+            if token is not None:
+                self._record_failed_auth_attempt(token, payload)
+            self._record_failures(failure_items)
             raise exceptions.AuthenticationFailed()
         self._reserve_token(payload)
         return CodeVerificationResult(
@@ -152,18 +321,31 @@ class CodeTokenManager:
             trusted=(token_type in api_settings.TRUSTED_2FA_METHODS),
         )
 
-    def _verify_totp_code(self, payload: CodeTokenPayload, code: str) -> bool:
-        user_id = payload.get("uid")
-        user_model = get_user_model()
-        try:
-            user = user_model.objects.get(pk=user_id)
-        except user_model.DoesNotExist:
-            return False
+    def _verify_totp_code(
+        self,
+        payload: CodeTokenPayload,
+        code: str,
+        user: AbstractBaseUser | None = None,
+    ) -> bool:
+        if user is None:
+            user_model = get_user_model()
+            try:
+                with start_span("jwt2fa.user_lookup"):
+                    user = user_model.objects.get(pk=payload.get("uid"))
+            except user_model.DoesNotExist:
+                return False
         secret = api_settings.TOTP_SECRET_GETTER(user)
         if not secret:
             return False
         valid_window = api_settings.TOTP_VALID_WINDOW
-        return verify_totp_code(secret, code, valid_window=valid_window)
+        with start_span("jwt2fa.verify_totp_code"):
+            return verify_totp_code(secret, code, valid_window=valid_window)
+
+    def _use_recovery_code(self, payload: CodeTokenPayload, code: str) -> bool:
+        if not looks_like_recovery_code(code):
+            return False  # Skip the database lookup
+        with start_span("jwt2fa.use_recovery_code"):
+            return RecoveryCode.use_code_of_user(payload.get("uid"), code)
 
     def _check_and_register_active_token(
         self, user_id: str, expiry: int
@@ -176,14 +358,19 @@ class CodeTokenManager:
         max_tokens = api_settings.MAX_ACTIVE_CODE_TOKENS_PER_USER
         if max_tokens is None:
             return
-        key = self._active_tokens_cache_key_template.format(user_id=user_id)
+        key = self._active_tokens_cache_key_template.format(
+            prefix=get_cache_key_prefix(), user_id=user_id
+        )
         now = time.time()
-        active_expiries = [exp for exp in (cache.get(key) or []) if exp > now]
-        if len(active_expiries) >= max_tokens:
-            raise TooManyCodeTokensError()
-        active_expiries.append(expiry)
-        ttl = int(max(exp - now for exp in active_expiries)) + 1
-        cache.set(key, active_expiries, timeout=ttl)
+        cache = self._get_cache(user_id)
+        with start_span("jwt2fa.cache", cache_key_family="active_tokens"):
+            stored_expiries = cache.get(key) or []
+            active_expiries = [exp for exp in stored_expiries if exp > now]
+            if len(active_expiries) >= max_tokens:
+                raise TooManyCodeTokensError()
+            active_expiries.append(expiry)
+            ttl = int(max(exp - now for exp in active_expiries)) + 1
+            cache.set(key, active_expiries, timeout=ttl)
 
     def _check_auth_attempts_not_exceeded(
         self, token: str, payload: CodeTokenPayload
@@ -191,13 +378,37 @@ class CodeTokenManager:
         max_attempts = api_settings.MAX_AUTH_ATTEMPTS_PER_CODE_TOKEN
         if max_attempts is None:
             return
-        attempts = cache.get(self._auth_attempts_cache_key(token)) or 0
+        cache = self._get_cache(payload.get("jti", ""))
+        with start_span("jwt2fa.cache", cache_key_family="auth_attempts"):
+            attempts = cache.get(self._auth_attempts_cache_key(token)) or 0
         if attempts >= max_attempts:
             raise TooManyAuthAttemptsError()
 
+    def get_auth_attempts_cache_and_key(
+        self, token: str
+    ) -> tuple[BaseCache, str] | None:
+        """
+        Get the cache and the key of the failed attempts of a code token.
+
+        The token is not verified, since the attempts are only read for
+        the wait time of the throttle.  The key is derived from the
+        prefix of the token which contains the jti, see
+        :func:`get_code_token_hash`, so a forged token with the jti of a
+        real token finds the attempts of the real token, but it only
+        gets the same wait time as the real token and cannot change the
+        attempts.  Return None if the token cannot be parsed.
+        """
+        try:
+            payload = jwt.decode(token, options={"verify_signature": False})
+        except jwt.InvalidTokenError:
+            return None
+        cache = self._get_cache(str(payload.get("jti", "")))
+        return (cache, self._auth_attempts_cache_key(token))
+
     def _auth_attempts_cache_key(self, token: str) -> str:
         return self._auth_attempts_cache_key_template.format(
-            token_hash=get_code_token_hash(token)
+            prefix=get_cache_key_prefix(),
+            token_hash=get_code_token_hash(token),
         )
 
     def _record_failed_auth_attempt(
@@ -206,33 +417,126 @@ class CodeTokenManager:
         max_attempts = api_settings.MAX_AUTH_ATTEMPTS_PER_CODE_TOKEN
         if max_attempts is None:
             return
+        cache = self._get_cache(payload.get("jti", ""))
         key = self._auth_attempts_cache_key(token)
         ttl = max(int(payload.get("exp", time.time()) - time.time()), 1)
-        if not cache.add(key, 1, timeout=ttl):
-            cache.incr(key)
+        with start_span("jwt2fa.cache", cache_key_family="auth_attempts"):
+            if not cache.add(key, 1, timeout=ttl):
+                cache.incr(key)
+
+    def _get_failure_items(
+        self,
+        payload: CodeTokenPayload,
+        client_ident: str | None,
+        with_token: bool = True,
+    ) -> dict[str, int]:
+        """
+        Get the failure sketch items to check and record.
+
+        Return a dictionary mapping the sketch items of the user and the
+        client to their failed attempt limits.  Without a code token the
+        user has a default limit, see :meth:`check_totp_code_of_user`.
+        """
+        items = {}
+        max_user_failures = api_settings.MAX_FAILED_AUTH_ATTEMPTS_PER_USER
+        if max_user_failures is None and not with_token:
+            max_user_failures = self._get_default_max_user_failures()
+        if max_user_failures is not None:
+            items[f"u:{payload.get('uid')}"] = max_user_failures
+        max_client_failures = api_settings.MAX_FAILED_AUTH_ATTEMPTS_PER_CLIENT
+        if max_client_failures is not None and client_ident:
+            items[f"c:{client_ident}"] = max_client_failures
+        return items
+
+    def _get_default_max_user_failures(self) -> int | None:
+        max_tokens = api_settings.MAX_ACTIVE_CODE_TOKENS_PER_USER
+        max_attempts = api_settings.MAX_AUTH_ATTEMPTS_PER_CODE_TOKEN
+        if max_tokens is None or max_attempts is None:
+            return None  # Not limited in the two step login either
+        return max_tokens * max_attempts
+
+    def _check_failures_not_exceeded(self, items: dict[str, int]) -> None:
+        if not items:
+            return
+        sketch = self._get_failure_sketch()
+        with start_span("jwt2fa.cache", cache_key_family="failure_sketch"):
+            for item, max_failures in items.items():
+                if sketch.estimate(item) >= max_failures:
+                    raise TooManyAuthAttemptsError()
+
+    def _record_failures(self, items: dict[str, int]) -> None:
+        if not items:
+            return
+        sketch = self._get_failure_sketch()
+        with start_span("jwt2fa.cache", cache_key_family="failure_sketch"):
+            for item in items:
+                sketch.add(item)
+
+    def _get_failure_sketch(self) -> FailedAttemptSketch:
+        window = api_settings.FAILED_AUTH_ATTEMPTS_WINDOW
+        return FailedAttemptSketch(
+            width=api_settings.FAILED_AUTH_ATTEMPTS_SKETCH_WIDTH,
+            window_seconds=int(window.total_seconds()),
+        )
 
     def _reserve_token(self, payload: CodeTokenPayload) -> None:
+        if api_settings.USED_TOKEN_FILTER_CAPACITY is not None:
+            self._reserve_token_in_filter(payload)
+            return
+        cache = self._get_cache(payload.get("jti", ""))
         key = self._used_tokens_cache_key(payload)
         ttl = max(int(payload.get("exp", time.time()) - time.time()), 1)
-        if not cache.add(key, True, timeout=ttl):
+        with start_span("jwt2fa.cache", cache_key_family="used_tokens"):
+            if not cache.add(key, True, timeout=ttl):
+                raise TokenAlreadyUsedError()
+
+    def _reserve_token_in_filter(self, payload: CodeTokenPayload) -> None:
+        used_token_filter = self._get_used_token_filter()
+        jti = payload.get("jti", "")
+        expires_at = payload.get("exp", int(time.time()))
+        try:
+            with start_span(
+                "jwt2fa.cache", cache_key_family="used_token_filter"
+            ):
+                reserved = used_token_filter.reserve(jti, expires_at)
+        except CacheLockTimeoutError:
+            raise TokenStateBusyError() from None
+        if not reserved:
             raise TokenAlreadyUsedError()
 
+    def _get_used_token_filter(self) -> UsedTokenFilter:
+        expiration_time = api_settings.CODE_EXPIRATION_TIME
+        return UsedTokenFilter(
+            capacity=api_settings.USED_TOKEN_FILTER_CAPACITY or 1,
+            error_rate=api_settings.USED_TOKEN_FILTER_ERROR_RATE,
+            bucket_seconds=int(expiration_time.total_seconds()),
+        )
+
     def _used_tokens_cache_key(self, payload: CodeTokenPayload) -> str:
         jti = payload.get("jti", "")
-        return self._used_tokens_cache_key_template.format(jti=jti)
+        return self._used_tokens_cache_key_template.format(
+            prefix=get_cache_key_prefix(), jti=jti
+        )
 
-    def generate_verification_code(self) -> str:
-        return get_random_string(self.code_length, self.code_chars)
+    def generate_verification_code(
+        self, material: RandomMaterial | None = None
+    ) -> str:
+        material = material or RandomMaterial()
+        return material.get_string(self.code_length, self.code_chars)
 
     def get_code_sender_token_payload(
-        self, user: AbstractBaseUser, code: str
+        self,
+        user: AbstractBaseUser,
+        code: str,
+        material: RandomMaterial | None = None,
     ) -> CodeTokenPayload:
+        material = material or RandomMaterial()
         now = int(time.time())
         expiration_time = api_settings.CODE_EXPIRATION_TIME
         expiration_seconds = int(expiration_time.total_seconds())
-        (hashed_code, nonce) = self.hash_verification_code(code)
+        (hashed_code, nonce) = self.hash_verification_code(code, material)
         return {
-            "jti": secrets.token_urlsafe(api_settings.CODE_TOKEN_JTI_BYTES),
+            "jti": material.get_token_urlsafe(self.jti_bytes),
             "typ": str(TwoFactorAuthMethod.CODE_SENDER),
             "uid": str(user.pk),
             "vch": hashed_code,  # Verification Code Hash
@@ -248,23 +552,68 @@ class CodeTokenManager:
         expiration_time = api_settings.CODE_EXPIRATION_TIME
         expiration_seconds = int(expiration_time.total_seconds())
         return {
-            "jti": secrets.token_urlsafe(api_settings.CODE_TOKEN_JTI_BYTES),
+            "jti": RandomMaterial().get_token_urlsafe(self.jti_bytes),
             "typ": str(TwoFactorAuthMethod.TOTP),
             "uid": str(user.pk),
             "iat": now,
             "exp": now + expiration_seconds,
         }
 
+    def get_totp_login_payload(
+        self, user: AbstractBaseUser, code: str
+    ) -> CodeTokenPayload:
+        """
+        Get the payload of a single request TOTP login.
+
+        The payload is not encoded to a token, but its jti is derived
+        from the user and the code, so that reserving it as a used
+        token reserves the code.  It expires when the code cannot be
+        valid anymore.
+        """
+        now = int(time.time())
+        user_id = str(user.pk)
+        key = api_settings.CODE_EXTENSION_SECRET.encode()
+        message = f"{user_id}:{code}".encode()
+        digest = hmac.new(key, message, hashlib.sha256).hexdigest()
+        lifetime = get_totp_code_lifetime(api_settings.TOTP_VALID_WINDOW)
+        return {
+            "jti": f"totp-{digest[:32]}",
+            "typ": str(TwoFactorAuthMethod.TOTP),
+            "uid": user_id,
+            "iat": now,
+            "exp": now + lifetime,
+        }
+
     def send_verification_code(
         self, user: AbstractBaseUser, code: str
     ) -> None:
-        try:
-            api_settings.CODE_SENDER(user, code)
-        except CodeSendingError:
-            raise
-        except Exception as error:
-            LOG.exception("Verification code sending failed")
-            raise CodeSendingError(_("Unknown error")) from error
+        """
+        Send the verification code with the configured CODE_SENDER.
+
+        The sending is limited by the CODE_SENDING_TIMEOUT setting, see
+        :mod:`drf_jwt_2fa.deadlines`.  Raise CodeSendingTimeoutError if
+        the code may or may not have been sent in time, and
+        CodeSendingError if sending it failed.
+        """
+        deadline = get_code_sending_deadline()
+        sender = api_settings.CODE_SENDER
+        outcome = "failed"
+        with start_span("jwt2fa.send_code") as span:
+            try:
+                with PHASE_DURATION.time(phase="send_code"):
+                    call_code_sender(sender, user, code, deadline)
+                outcome = "sent"
+            except CodeSendingTimeoutError:
+                outcome = "timed-out"
+                raise
+            except CodeSendingError:
+                raise
+            except Exception as error:
+                LOG.exception("Verification code sending failed")
+                raise CodeSendingError(_("Unknown error")) from error
+            finally:
+                span.set_attribute("jwt2fa.outcome", outcome)
+                CODE_SENDS.inc(outcome=outcome)
 
     def encode_token(self, payload: CodeTokenPayload) -> str:
         key = api_settings.CODE_TOKEN_SECRET_KEY
@@ -285,17 +634,21 @@ class CodeTokenManager:
             raise exceptions.AuthenticationFailed() from None
         return payload  # type: ignore
 
-    def hash_verification_code(self, code: str) -> tuple[str, str]:
-        nonce = get_random_string(length=10)
+    def hash_verification_code(
+        self, code: str, material: RandomMaterial | None = None
+    ) -> tuple[str, str]:
+        nonce = (material or RandomMaterial()).get_string(10)
         extended_code = self.extend_code(code, nonce)
-        hashed_code = django_hashers.make_password(extended_code)
+        with start_span("jwt2fa.hash_code"):
+            hashed_code = django_hashers.make_password(extended_code)
         return (hashed_code, nonce)
 
     def is_verification_code_ok(
         self, code: str, nonce: str, hashed_code: str
     ) -> bool:
         extended_code = self.extend_code(code, nonce)
-        return django_hashers.check_password(extended_code, hashed_code)
+        with start_span("jwt2fa.check_code_hash"):
+            return django_hashers.check_password(extended_code, hashed_code)
 
     def extend_code(self, code: str, nonce: str) -> str:
         extension = api_settings.CODE_EXTENSION_SECRET
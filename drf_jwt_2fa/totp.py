@@ -1,14 +1,19 @@
 """
 TOTP (Time-based One-Time Password) utilities.
+
+The pyotp module is imported only when it is first used, so that
+importing the models does not import it.
 """
 
 import re
 
-import pyotp
 from django.contrib.auth.base_user import AbstractBaseUser
 
 from .settings import api_settings
 
+# Length of the TOTP time step in seconds, which is the default of pyotp
+TOTP_INTERVAL_SECONDS = 30
+
 
 def make_sure_is_valid_totp_secret(secret: str, /) -> None:
     """
@@ -22,16 +27,30 @@ _TOTP_SECRET_RE = re.compile(r"^[A-Z2-7]{32}$")
 
 
 def generate_totp_secret() -> str:
+    import pyotp
+
     return pyotp.random_base32()
 
 
 def verify_totp_code(secret: str, code: str, valid_window: int = 1) -> bool:
+    import pyotp
+
     try:
         return pyotp.TOTP(secret).verify(code, valid_window=valid_window)
     except ValueError:
         return False
 
 
+def get_totp_code_lifetime(valid_window: int = 1) -> int:
+    """
+    Get the maximum time in seconds that a TOTP code is accepted.
+
+    A code is accepted from ``valid_window`` time steps before its own
+    time step until ``valid_window`` time steps after it.
+    """
+    return (2 * valid_window + 1) * TOTP_INTERVAL_SECONDS
+
+
 def get_totp_provisioning_uri(secret: str, user: AbstractBaseUser) -> str:
     """
     Return a provisioning URI for the given user and TOTP secret.
@@ -43,6 +62,8 @@ def get_totp_provisioning_uri(secret: str, user: AbstractBaseUser) -> str:
     :type user: django.contrib.auth.models.AbstractBaseUser
     :rtype: str
     """
+    import pyotp
+
     issuer = api_settings.TOTP_ISSUER_NAME
     account_name = user.get_username()
     totp = pyotp.TOTP(secret)
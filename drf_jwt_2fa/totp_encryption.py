@@ -1,13 +1,22 @@
 """
 Fernet-based encryption helpers for TOTP secrets.
+
+The cryptography module is imported only when it is first used, so
+that importing the models does not import it.
 """
 
 import base64
-
-from cryptography.fernet import Fernet, InvalidToken
+import datetime
+import functools
+import hashlib
+import hmac
+from typing import TYPE_CHECKING
 
 from .settings import api_settings
 
+if TYPE_CHECKING:
+    from cryptography.fernet import Fernet
+
 
 def encrypt_totp_secret(secret: str) -> str:
     """
@@ -30,6 +39,8 @@ def decrypt_totp_secret(ciphertext: str) -> str:
     Return the decrypted secret value or empty string if ciphertext is
     empty, invalid, or was encrypted with a different key.
     """
+    from cryptography.fernet import InvalidToken
+
     if not ciphertext:
         return ""
     try:
@@ -39,7 +50,68 @@ def decrypt_totp_secret(ciphertext: str) -> str:
         return ""
 
 
-def _get_fernet() -> Fernet:
+def seal_totp_enrollment_ticket(
+    secret: str, user_id: str, active_ciphertext: str = ""
+) -> str:
+    """
+    Seal a pending TOTP secret of a user to an enrollment ticket.
+
+    The ticket is the secret, the user id and a digest of the user's
+    active TOTP secret ciphertext encrypted with Fernet using a key
+    derived from ``TOTP_ENCRYPTION_KEY``, so it cannot be mixed up with
+    the secrets stored in the database.
+
+    Use :func:`open_totp_enrollment_ticket` to get the secret back.
+    """
+    fernet = _get_fernet(purpose=b"2fa-totp-ticket")
+    marker = _get_enrollment_marker(active_ciphertext)
+    return fernet.encrypt(f"{user_id}:{marker}:{secret}".encode()).decode()
+
+
+def open_totp_enrollment_ticket(
+    ticket: str,
+    user_id: str,
+    max_age: datetime.timedelta,
+    active_ciphertext: str = "",
+) -> str:
+    """
+    Open an enrollment ticket and return the pending TOTP secret.
+
+    Return empty string if the ticket is invalid, older than
+    ``max_age``, was sealed for another user, or the active TOTP secret
+    ciphertext of the user has changed since the ticket was sealed.
+    """
+    from cryptography.fernet import InvalidToken
+
+    try:
+        fernet = _get_fernet(purpose=b"2fa-totp-ticket")
+        ttl = int(max_age.total_seconds())
+        plaintext = fernet.decrypt(ticket.encode(), ttl=ttl).decode()
+    except (InvalidToken, UnicodeError):
+        return ""
+    (rest, _sep, secret) = plaintext.rpartition(":")
+    (ticket_user_id, _sep, marker) = rest.rpartition(":")
+    expected_marker = _get_enrollment_marker(active_ciphertext)
+    if not hmac.compare_digest(ticket_user_id, user_id):
+        return ""
+    if not hmac.compare_digest(marker, expected_marker):
+        return ""
+    return secret
+
+
+def _get_enrollment_marker(active_ciphertext: str) -> str:
+    return hashlib.sha256(active_ciphertext.encode()).hexdigest()[:32]
+
+
+def _get_fernet(purpose: bytes | None = None) -> "Fernet":
     raw_key: bytes = api_settings.TOTP_ENCRYPTION_KEY
-    key = base64.urlsafe_b64encode(raw_key)
-    return Fernet(key)
+    if purpose is not None:
+        raw_key = hmac.new(raw_key, purpose, hashlib.sha256).digest()
+    return _make_fernet(raw_key)
+
+
+@functools.lru_cache(maxsize=8)
+def _make_fernet(raw_key: bytes) -> "Fernet":
+    from cryptography.fernet import Fernet
+
+    return Fernet(base64.urlsafe_b64encode(raw_key))
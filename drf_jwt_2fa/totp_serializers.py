@@ -5,13 +5,20 @@ Serializers for TOTP enrollment (setup and confirm).
 from django.utils.translation import gettext_lazy as _
 from rest_framework import exceptions, serializers
 
-from .models import TwoFactorAuthMethod, UserTwoFactorAuthData
+from .audit import emit_audit_event
+from .exceptions import TotpEnrollmentConflictError
+from .models import AuditEventType, UserTwoFactorAuthData
 from .settings import api_settings
 from .totp import (
     generate_totp_secret,
     get_totp_provisioning_uri,
     verify_totp_code,
 )
+from .totp_encryption import (
+    decrypt_totp_secret,
+    open_totp_enrollment_ticket,
+    seal_totp_enrollment_ticket,
+)
 
 
 class SetupTotpSerializer(serializers.Serializer):
@@ -24,6 +31,10 @@ class SetupTotpSerializer(serializers.Serializer):
 
     Call ``save()`` to persist the pending secret and obtain the result
     dict with ``secret`` and ``provisioning_uri`` keys.
+
+    When the ``TOTP_ENROLLMENT_TICKET_EXPIRATION_TIME`` setting is set,
+    the pending secret is not persisted, but returned sealed in an
+    encrypted enrollment ticket in the ``ticket`` key instead.
     """
 
     def validate(self, attrs):
@@ -32,14 +43,20 @@ class SetupTotpSerializer(serializers.Serializer):
     def save(self, **kwargs):
         user = self.context["request"].user
         secret = generate_totp_secret()
-        data, _created = UserTwoFactorAuthData.objects.get_or_create(user=user)
-        data.set_pending_totp_secret(secret)
-        data.save(update_fields=["encrypted_totp_secret_pending"])
-        provisioning_uri = get_totp_provisioning_uri(secret, user)
-        return {
+        result = {
             "secret": secret,
-            "provisioning_uri": provisioning_uri,
+            "provisioning_uri": get_totp_provisioning_uri(secret, user),
         }
+        if api_settings.TOTP_ENROLLMENT_TICKET_EXPIRATION_TIME is None:
+            UserTwoFactorAuthData.set_pending_totp_secret_of_user(user, secret)
+        else:
+            active = UserTwoFactorAuthData.get_encrypted_totp_secret_of_user(
+                user
+            )
+            result["ticket"] = seal_totp_enrollment_ticket(
+                secret, str(user.pk), active
+            )
+        return result
 
 
 class ConfirmTotpSerializer(serializers.Serializer):
@@ -50,7 +67,15 @@ class ConfirmTotpSerializer(serializers.Serializer):
     success, activates TOTP as the user's preferred 2FA method.
 
     ``validate()`` checks the code and raises on failure.  Call
-    ``save()`` to commit the activation to the database.
+    ``save()`` to commit the activation to the database.  The activation
+    is done only if the pending secret is still the one the code was
+    checked against, so of concurrent confirmations only one succeeds.
+
+    If a ``ticket`` from the setup endpoint is given, the pending secret
+    is taken from the ticket instead, and the database is written only
+    on ``save()``.  The ticket is accepted only if the active secret is
+    still the one it was issued on, so it can be used only once and an
+    older ticket cannot replace a secret activated after it was issued.
     """
 
     code = serializers.CharField(
@@ -58,11 +83,22 @@ class ConfirmTotpSerializer(serializers.Serializer):
         required=True,
         help_text=_("TOTP code from your authenticator app"),
     )
+    ticket = serializers.CharField(
+        write_only=True,
+        required=False,
+        help_text=_("Enrollment ticket returned by the setup endpoint"),
+    )
 
     def validate(self, attrs):
+        if "ticket" in attrs:
+            return self._validate_ticket(attrs)
         user = self.context["request"].user
-        data = UserTwoFactorAuthData.objects.filter(user=user).first()
-        pending_secret = data.get_pending_totp_secret() if data else None
+        encrypted = (
+            UserTwoFactorAuthData.get_encrypted_pending_totp_secret_of_user(
+                user
+            )
+        )
+        pending_secret = decrypt_totp_secret(encrypted)
         if not pending_secret:
             raise exceptions.PermissionDenied(
                 _("No pending TOTP setup. Call the setup endpoint first.")
@@ -72,22 +108,50 @@ class ConfirmTotpSerializer(serializers.Serializer):
         if not verify_totp_code(pending_secret, attrs["code"], valid_window):
             raise exceptions.AuthenticationFailed(_("Invalid TOTP code."))
 
-        # Stash for save(); avoids a second DB query.
-        attrs["_data"] = data
+        # Stash for save(); the activation is conditional on this value
+        attrs["_encrypted_pending_secret"] = encrypted
+        return attrs
+
+    def _validate_ticket(self, attrs):
+        user = self.context["request"].user
+        max_age = api_settings.TOTP_ENROLLMENT_TICKET_EXPIRATION_TIME
+        active = UserTwoFactorAuthData.get_encrypted_totp_secret_of_user(user)
+        pending_secret = ""
+        if max_age is not None:
+            pending_secret = open_totp_enrollment_ticket(
+                attrs["ticket"], str(user.pk), max_age, active
+            )
+        if not pending_secret:
+            raise exceptions.PermissionDenied(
+                _("Invalid or expired TOTP setup ticket.")
+            )
+
+        valid_window = api_settings.TOTP_VALID_WINDOW
+        if not verify_totp_code(pending_secret, attrs["code"], valid_window):
+            raise exceptions.AuthenticationFailed(_("Invalid TOTP code."))
+
+        # Stash for save(); the activation is conditional on the active
+        # secret which the ticket was checked against
         attrs["_pending_secret"] = pending_secret
+        attrs["_encrypted_active_secret"] = active
         return attrs
 
     def save(self, **kwargs):
-        data = self.validated_data["_data"]
-        pending_secret = self.validated_data["_pending_secret"]
-        data.set_totp_secret(pending_secret)
-        data.set_pending_totp_secret("")
-        data.preferred_2fa_auth = TwoFactorAuthMethod.TOTP
-        data.save(
-            update_fields=[
-                "encrypted_totp_secret",
-                "encrypted_totp_secret_pending",
-                "preferred_2fa_auth",
-            ]
-        )
+        user = self.context["request"].user
+        if "_pending_secret" in self.validated_data:
+            activated = UserTwoFactorAuthData.activate_totp_secret_of_user(
+                user,
+                self.validated_data["_pending_secret"],
+                self.validated_data["_encrypted_active_secret"],
+            )
+        else:
+            encrypted = self.validated_data["_encrypted_pending_secret"]
+            activated = (
+                UserTwoFactorAuthData.activate_pending_totp_secret_of_user(
+                    user, encrypted
+                )
+            )
+        if not activated:
+            raise TotpEnrollmentConflictError()
+        emit_audit_event(AuditEventType.TOTP_ENROLLED, user.pk)
         return {}
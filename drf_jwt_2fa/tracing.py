@@ -0,0 +1,177 @@
+"""
+Tracing hooks of the 2FA flow.
+
+The operations of the 2FA flow, e.g. creating and checking the code
+tokens, the cache operations, the user lookups, the code hashing and
+the code sending, are wrapped in *spans* by :func:`start_span`.  Each
+span is started by calling the ``TRACING_HOOK`` setting with the name
+and the attributes of the span.  The hook returns a context manager,
+which is entered for the duration of the operation and gives a span
+with a ``set_attribute`` method for adding attributes on the way, e.g.
+the outcome of the operation.  Exceptions raised by the operation are
+propagated through the context manager, so the hook can record them.
+
+The attributes are prefixed with ``jwt2fa.`` and describe the operation,
+e.g. the 2FA method, the outcome or the family of the cache keys.  The
+verification codes, the tokens and the secrets are never passed to the
+hook.
+
+The default hook :func:`no_op_span` does nothing, :class:`SpanRecorder`
+records the spans in memory, e.g. for tests, and
+:func:`opentelemetry_span` starts OpenTelemetry spans.  Another tracing
+system can be integrated with a callable of the same signature.
+"""
+
+import contextvars
+import time
+from collections.abc import Iterator, Mapping
+from contextlib import AbstractContextManager, contextmanager
+from typing import Any, Protocol, Self
+
+from .settings import api_settings
+
+AttributeValue = str | bool | int | float
+
+
+class Span(Protocol):
+    def set_attribute(self, key: str, value: AttributeValue) -> None: ...
+
+
+def start_span(
+    name: str, **attributes: AttributeValue
+) -> AbstractContextManager[Span]:
+    """
+    Start a span with the configured TRACING_HOOK.
+
+    The keyword arguments are passed as attributes with the ``jwt2fa.``
+    prefix added to their names.
+    """
+    prefixed = {f"jwt2fa.{k}": v for (k, v) in attributes.items()}
+    return api_settings.TRACING_HOOK(name, prefixed)
+
+
+class _NoOpSpan:
+    def set_attribute(self, key: str, value: AttributeValue) -> None:
+        pass
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        pass
+
+
+_no_op_span = _NoOpSpan()
+
+
+def no_op_span(
+    name: str, attributes: Mapping[str, AttributeValue]
+) -> AbstractContextManager[Span]:
+    """
+    Tracing hook which does nothing.
+    """
+    return _no_op_span
+
+
+class RecordedSpan:
+    """
+    Span recorded by :class:`SpanRecorder`.
+
+    :param name: Name of the span
+    :param attributes: Attributes of the span
+    :param parent: The enclosing span, or None for a root span
+    """
+
+    def __init__(
+        self,
+        name: str,
+        attributes: Mapping[str, AttributeValue],
+        parent: "RecordedSpan | None",
+    ) -> None:
+        self.name = name
+        self.attributes = dict(attributes)
+        self.parent = parent
+        self.duration: float | None = None
+        self.error: str | None = None
+
+    def set_attribute(self, key: str, value: AttributeValue) -> None:
+        self.attributes[key] = value
+
+    def __repr__(self) -> str:
+        return f"<RecordedSpan {self.name} {self.attributes!r}>"
+
+
+class SpanRecorder:
+    """
+    Tracing hook which records the spans in memory.
+
+    The spans are appended to :attr:`spans` when they end.  The parent
+    of a span is the enclosing span of the same recorder in the current
+    context, which is also propagated to the thread pools of
+    :mod:`drf_jwt_2fa.deadlines`.  The error of a span is the class name
+    of the exception raised from it, if any.
+    """
+
+    def __init__(self) -> None:
+        self.spans: list[RecordedSpan] = []
+        self._current: contextvars.ContextVar[RecordedSpan | None] = (
+            contextvars.ContextVar(f"jwt2fa_span_{id(self)}", default=None)
+        )
+
+    def __call__(
+        self, name: str, attributes: Mapping[str, AttributeValue]
+    ) -> AbstractContextManager[Span]:
+        return self._record(name, attributes)
+
+    def get_spans(self, name: str | None = None) -> list[RecordedSpan]:
+        """
+        Get the recorded spans, optionally only those with given name.
+        """
+        return [x for x in self.spans if name is None or x.name == name]
+
+    def clear(self) -> None:
+        self.spans.clear()
+
+    @contextmanager
+    def _record(
+        self, name: str, attributes: Mapping[str, AttributeValue]
+    ) -> Iterator[RecordedSpan]:
+        span = RecordedSpan(name, attributes, self._current.get())
+        reset_token = self._current.set(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as error:
+            span.error = type(error).__name__
+            raise
+        finally:
+            span.duration = time.perf_counter() - start
+            self._current.reset(reset_token)
+            self.spans.append(span)
+
+
+def opentelemetry_span(
+    name: str, attributes: Mapping[str, AttributeValue]
+) -> AbstractContextManager[Span]:
+    """
+    Tracing hook which starts OpenTelemetry spans.
+
+    The spans are started with the ``drf_jwt_2fa`` tracer of the global
+    tracer provider as children of the current span, e.g. the span of
+    the request.  Requires the ``opentelemetry-api`` package.
+    """
+    tracer = _get_opentelemetry_tracer()
+    return tracer.start_as_current_span(name, attributes=dict(attributes))
+
+
+_opentelemetry_tracer: Any = None
+
+
+def _get_opentelemetry_tracer() -> Any:
+    global _opentelemetry_tracer
+    if _opentelemetry_tracer is None:
+        # Imported here, since OpenTelemetry is an optional dependency
+        from opentelemetry import trace
+
+        _opentelemetry_tracer = trace.get_tracer("drf_jwt_2fa")
+    return _opentelemetry_tracer
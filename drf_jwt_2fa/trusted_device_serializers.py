@@ -0,0 +1,35 @@
+"""
+Serializer for revoking trusted device tokens.
+"""
+
+from django.utils.translation import gettext_lazy as _
+from rest_framework import serializers
+
+from .trusted_devices import revoke_trusted_device_token
+
+
+class RevokeTrustedDeviceSerializer(serializers.Serializer):
+    """
+    Serializer for the trusted device token revocation endpoint.
+
+    Call ``save()`` to revoke the given ``device_token``.  It raises a
+    validation error if the token is invalid or already expired.
+    """
+
+    device_token = serializers.CharField(
+        write_only=True,
+        required=True,
+        help_text=_("Trusted device token to revoke"),
+    )
+
+    def validate(self, attrs):
+        return attrs
+
+    def save(self, **kwargs):
+        if not revoke_trusted_device_token(
+            self.validated_data["device_token"]
+        ):
+            raise serializers.ValidationError({
+                "device_token": _("Invalid or expired device token.")
+            })
+        return {}
@@ -0,0 +1,144 @@
+"""
+Trusted device tokens.
+
+A trusted device token can be requested with a successful second factor
+and passed to the code token endpoint on later logins from the same
+device, so that the second factor is skipped and no verification code
+is sent.  The token is a JWT signed with
+``TRUSTED_DEVICE_TOKEN_SECRET_KEY``, which expires after
+``TRUSTED_DEVICE_TOKEN_EXPIRATION_TIME`` and is bound to the user and
+their auth version of :mod:`drf_jwt_2fa.user_cache`.
+
+Saving the user or their 2FA data, e.g. changing the password, bumps the
+auth version and thereby invalidates all device tokens of the user.  A
+single token is revoked by storing a marker of its jti to the token
+state cache until the token expires.  If the auth version counter is
+lost from the cache, the tokens are rejected and the users just go
+through the second factor again.
+"""
+
+import time
+from typing import TypedDict
+
+import jwt
+from django.contrib.auth.models import AbstractBaseUser
+from django.core.exceptions import ImproperlyConfigured
+
+from .caching import get_cache_key_prefix, get_token_state_cache
+from .random_material import RandomMaterial
+from .settings import api_settings
+from .user_cache import (
+    bump_auth_version,
+    get_auth_version,
+    get_auth_version_cache_key,
+    get_user_id_claim,
+)
+
+_TOKEN_TYPE = "trusted-device"  # noqa: S105
+_JWT_ALGORITHM = "HS256"
+_revoked_cache_key_template = "{prefix}:revoked_device:{jti}"
+
+
+class TrustedDeviceTokenPayload(TypedDict):
+    jti: str  # JWT ID
+    typ: str  # Token type
+    uid: str  # User ID claim
+    ver: int  # Auth version of the user
+    iat: int  # Issued at
+    exp: int  # Expires at
+
+
+def is_trusted_device_token_enabled() -> bool:
+    return api_settings.TRUSTED_DEVICE_TOKEN_EXPIRATION_TIME is not None
+
+
+def create_trusted_device_token(user: AbstractBaseUser) -> str:
+    """
+    Create a trusted device token for user.
+
+    :raises ImproperlyConfigured: if the device tokens are not enabled
+    """
+    lifetime = api_settings.TRUSTED_DEVICE_TOKEN_EXPIRATION_TIME
+    if lifetime is None:
+        raise ImproperlyConfigured("Trusted device tokens are not enabled")
+    user_id = get_user_id_claim(user)
+    version = get_auth_version(user_id, create=True)
+    now = int(time.time())
+    payload: TrustedDeviceTokenPayload = {
+        "jti": RandomMaterial().get_token_urlsafe(16),
+        "typ": _TOKEN_TYPE,
+        "uid": user_id,
+        "ver": version or 0,
+        "iat": now,
+        "exp": now + int(lifetime.total_seconds()),
+    }
+    key = api_settings.TRUSTED_DEVICE_TOKEN_SECRET_KEY
+    return jwt.encode(payload, key, _JWT_ALGORITHM)  # type: ignore
+
+
+def check_trusted_device_token(token: str, user: AbstractBaseUser) -> bool:
+    """
+    Check if given trusted device token is valid for user.
+
+    The token must be signed, unexpired, issued for the user at their
+    current auth version and not revoked.  The auth version and the
+    revocation marker are read with a single cache call.
+    """
+    if not is_trusted_device_token_enabled():
+        return False
+    payload = _decode_token(token)
+    user_id = get_user_id_claim(user)
+    if payload is None or payload.get("uid") != user_id:
+        return False
+    cache = get_token_state_cache(user_id)
+    version_key = get_auth_version_cache_key(user_id)
+    revoked_key = _get_revoked_cache_key(payload)
+    values = cache.get_many([version_key, revoked_key])
+    version = values.get(version_key)
+    if version is None or payload.get("ver") != version:
+        return False
+    return revoked_key not in values
+
+
+def revoke_trusted_device_token(token: str) -> bool:
+    """
+    Revoke given trusted device token.
+
+    Return False if the token is invalid or already expired.
+    """
+    payload = _decode_token(token)
+    if payload is None:
+        return False
+    # Note: Routed by the user id claim like the auth version, so that
+    # both can be read with a single call in check_trusted_device_token
+    cache = get_token_state_cache(payload.get("uid", ""))
+    ttl = max(int(payload.get("exp", 0) - time.time()), 1)
+    cache.set(_get_revoked_cache_key(payload), True, timeout=ttl)
+    return True
+
+
+def forget_trusted_devices(user: AbstractBaseUser) -> None:
+    """
+    Invalidate all trusted device tokens of user.
+    """
+    bump_auth_version(get_user_id_claim(user))
+
+
+def _get_revoked_cache_key(payload: TrustedDeviceTokenPayload) -> str:
+    return _revoked_cache_key_template.format(
+        prefix=get_cache_key_prefix(), jti=payload.get("jti")
+    )
+
+
+def _decode_token(token: str) -> TrustedDeviceTokenPayload | None:
+    try:
+        payload = jwt.decode(
+            jwt=token,
+            key=api_settings.TRUSTED_DEVICE_TOKEN_SECRET_KEY,
+            algorithms=[_JWT_ALGORITHM],
+        )
+    except jwt.InvalidTokenError:
+        return None
+    if payload.get("typ") != _TOKEN_TYPE:
+        return None
+    return payload  # type: ignore
@@ -5,9 +5,28 @@ from . import views
 urlpatterns = [
     path("get-code/", views.obtain_code_token, name="get-code"),
     path("auth/", views.obtain_auth_token, name="auth"),
+    path(
+        "code-delivery/<str:jti>/",
+        views.code_delivery_status,
+        name="code-delivery",
+    ),
     path("refresh/", views.refresh_auth_token, name="refresh"),
     path("verify/", views.verify_auth_token, name="verify"),
     path("totp/setup/", views.setup_totp, name="totp-setup"),
     path("totp/confirm/", views.confirm_totp, name="totp-confirm"),
     path("2fa-method/", views.set_2fa_method, name="set-2fa-method"),
+    path("recovery-codes/", views.recovery_codes, name="recovery-codes"),
+    path(
+        "trusted-device/revoke/",
+        views.revoke_trusted_device,
+        name="trusted-device-revoke",
+    ),
+    path(
+        "trusted-device/forget-all/",
+        views.forget_trusted_devices,
+        name="trusted-device-forget-all",
+    ),
+    path("stats/", views.two_factor_stats, name="stats"),
+    path("revoke/", views.revoke_auth_token, name="revoke"),
+    path("metrics/", views.metrics, name="metrics"),
 ]
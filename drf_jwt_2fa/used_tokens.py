@@ -0,0 +1,111 @@
+"""
+Compact store for the used code tokens.
+
+By default every used code token is marked as used with its own cache
+key, which is kept until the code token expires.  At high login rates
+that is a lot of tiny keys, each with a per-key overhead in the cache.
+
+The :class:`UsedTokenFilter` packs the used markers into Bloom filters
+instead.  The filters are bucketed by the expiration time of the code
+tokens, so that a whole bucket can be dropped when all of its tokens
+have expired.  Each bucket is further split into segments of at most
+``max_segment_bytes`` to keep the values small and to spread the writes
+over several keys and locks.
+
+The filter trades latency for memory: reserving a token takes four
+cache round trips (lock, get, set and unlock) and transfers the segment
+twice, while the per-token keys take a single ``cache.add``.  Use it
+only when the number of keys in the cache is the bottleneck.
+
+Note that a Bloom filter may give false positives: a fresh code token
+is rejected as used with a probability of at most the configured error
+rate.  The user can just request a new code token in that case.
+"""
+
+import hashlib
+import math
+import time
+
+from .bloom import BloomFilter, get_optimal_size
+from .caching import (
+    CacheLockTimeoutError,
+    cache_lock,
+    get_cache_key_prefix,
+    get_token_state_cache,
+)
+
+
+class UsedTokenFilter:
+    """
+    Bloom filter based store of used code tokens.
+
+    :param capacity:
+      Expected maximum number of tokens used per bucket.
+    :param error_rate:
+      Maximum false positive rate when the capacity is not exceeded.
+    :param bucket_seconds:
+      Length of the expiration time buckets in seconds.
+    """
+
+    max_segment_bytes = 4096
+    lock_timeout = 2
+    segment_key_template = "{prefix}:used_filter:{bucket}:{segment}"
+    lock_key_template = "{prefix}:used_filter_lock:{bucket}:{segment}"
+
+    def __init__(
+        self, capacity: int, error_rate: float, bucket_seconds: int
+    ) -> None:
+        (total_bits, _num_hashes) = get_optimal_size(capacity, error_rate)
+        max_segment_bits = 8 * self.max_segment_bytes
+        segment_capacity = min(
+            max(capacity * max_segment_bits // total_bits, 1), capacity
+        )
+        self.num_segments = math.ceil(capacity / segment_capacity)
+        (self.num_bits, self.num_hashes) = get_optimal_size(
+            segment_capacity, error_rate
+        )
+        self.bucket_seconds = max(bucket_seconds, 1)
+
+    def reserve(self, jti: str, expires_at: int) -> bool:
+        """
+        Mark a token as used.
+
+        Return False if the token was (possibly) already marked as used.
+        The check and the marking is atomic, since the segment is locked
+        while it is updated.  The segment is not written if the update
+        took so long that the lock may have expired, since another
+        process could then be updating it too and one of the marks
+        would be lost.
+
+        :raises CacheLockTimeoutError:
+          if the segment stays locked or the lock may have expired
+        """
+        item = jti.encode("utf-8")
+        bucket = expires_at // self.bucket_seconds
+        segment = self._get_segment(item)
+        cache = get_token_state_cache(f"{bucket}:{segment}")
+        names = {"prefix": get_cache_key_prefix(), "bucket": bucket}
+        key = self.segment_key_template.format(segment=segment, **names)
+        lock_key = self.lock_key_template.format(segment=segment, **names)
+        bucket_end = (bucket + 1) * self.bucket_seconds
+        ttl = max(bucket_end - int(time.time()), 1)
+        with cache_lock(cache, lock_key, timeout=self.lock_timeout):
+            locked_at = time.monotonic()
+            bloom = self._load_filter(cache.get(key))
+            if bloom.add(item):
+                return False
+            if time.monotonic() - locked_at > self.lock_timeout / 2:
+                raise CacheLockTimeoutError(lock_key)
+            cache.set(key, bloom.to_bytes(), timeout=ttl)
+        return True
+
+    def _load_filter(self, data: bytes | None) -> BloomFilter:
+        expected_size = (self.num_bits + 7) // 8
+        if data is None or len(data) != expected_size:
+            # Nothing stored yet, or stored with different settings
+            return BloomFilter(self.num_bits, self.num_hashes)
+        return BloomFilter(self.num_bits, self.num_hashes, data)
+
+    def _get_segment(self, item: bytes) -> int:
+        digest = hashlib.blake2b(item, digest_size=4, person=b"segment")
+        return int.from_bytes(digest.digest(), "little") % self.num_segments
@@ -0,0 +1,231 @@
+"""
+Cache of the authenticated users.
+
+When the ``USER_CACHE_TIMEOUT`` setting is set, the users of the
+authenticated requests are served from the token state cache instead of
+being loaded from the database on every request.
+
+Each user has an *auth version* counter in the cache, which is bumped
+whenever the user or their 2FA data is saved or deleted, e.g. when the
+password is changed or the user is deactivated.  A cached user is used
+only if it was loaded at the current auth version, so the changes take
+effect on the next request.  The cached user and the counter are read
+with a single cache call.
+
+When the change is made in a transaction, the counter is bumped again
+when the transaction is committed, since a request made before the
+commit may have cached the old row of the user at the bumped version.
+
+Only the field values of the user are cached, without the password
+hash: the cached user has the password field deferred, and the check
+for a changed password uses the digest of the password hash stored
+with the field values.  See :func:`get_password_hash_digest`.
+
+The same counter invalidates the trusted device tokens of
+:mod:`drf_jwt_2fa.trusted_devices`, so it is maintained also when only
+``TRUSTED_DEVICE_TOKEN_EXPIRATION_TIME`` is set.  A new counter starts
+from a random value, so that a counter which is lost from the cache and
+created again does not repeat the earlier versions.
+
+Note that changes made without saving a model instance, e.g. with
+``QuerySet.update``, do not bump the counter.  Call
+:func:`invalidate_cached_user` or :func:`bump_auth_version` after such
+changes.
+"""
+
+import secrets
+from collections.abc import Callable
+from typing import TYPE_CHECKING
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AbstractBaseUser
+from django.db import router, transaction
+from django.db.models.signals import post_delete, post_save
+
+from .caching import get_cache_key_prefix, get_token_state_cache
+from .settings import api_settings
+
+if TYPE_CHECKING:
+    from .models import UserTwoFactorAuthData
+
+_user_cache_key_template = "{prefix}:user:{user_id}"
+_auth_version_cache_key_template = "{prefix}:auth_version:{user_id}"
+
+
+def get_cached_user(
+    user_id: str, load_user: Callable[[str], AbstractBaseUser | None]
+) -> AbstractBaseUser | None:
+    """
+    Get user by the user id claim of a token from the cache.
+
+    Call ``load_user`` to load the user from the database if the user is
+    not in the cache or was cached at an older auth version.
+    """
+    cache = get_token_state_cache(str(user_id))
+    names = {"prefix": get_cache_key_prefix(), "user_id": user_id}
+    user_key = _user_cache_key_template.format(**names)
+    version_key = _auth_version_cache_key_template.format(**names)
+    values = cache.get_many([user_key, version_key])
+    version = values.get(version_key, 0)
+    (cached_version, fields, digest) = values.get(user_key, (None,) * 3)
+    if cached_version == version and fields is not None:
+        return _make_user(fields, digest)
+    # Note: The version is read before loading the user, so that a user
+    # changed in between is cached with the older version
+    user = load_user(user_id)
+    if user is not None:
+        timeout = api_settings.USER_CACHE_TIMEOUT
+        seconds = timeout.total_seconds() if timeout else 0
+        entry = (version, _get_fields(user), get_password_hash_digest(user))
+        cache.set(user_key, entry, timeout=seconds)
+    return user
+
+
+def get_password_hash_digest(user: AbstractBaseUser) -> str:
+    """
+    Get the digest of the password hash of the user.
+
+    This is the value of the revoke token claim of Simple JWT.  For a
+    user served from the cache, the digest stored in the cache is
+    returned, so that the deferred password hash is not loaded.
+    """
+    digest = getattr(user, "_jwt2fa_password_digest", None)
+    if digest is not None:
+        return digest
+    # Imported here for the same reason as in _get_user_id_field
+    from rest_framework_simplejwt.utils import get_md5_hash_password
+
+    return get_md5_hash_password(user.password)
+
+
+def _get_fields(user: AbstractBaseUser) -> dict[str, object]:
+    return {
+        field.attname: getattr(user, field.attname)
+        for field in user._meta.concrete_fields
+        if field.attname != "password"
+    }
+
+
+def _make_user(fields: dict[str, object], digest: str) -> AbstractBaseUser:
+    user_model = get_user_model()
+    db = router.db_for_read(user_model)
+    user = user_model.from_db(db, list(fields), list(fields.values()))
+    user._jwt2fa_password_digest = digest  # type: ignore[attr-defined]
+    return user
+
+
+def bump_auth_version(user_id: str) -> None:
+    """
+    Invalidate the cached user of the given user id claim.
+    """
+    cache = get_token_state_cache(str(user_id))
+    names = {"prefix": get_cache_key_prefix(), "user_id": user_id}
+    version_key = _auth_version_cache_key_template.format(**names)
+    if not cache.add(version_key, _get_initial_version(), timeout=None):
+        cache.incr(version_key)
+    cache.delete(_user_cache_key_template.format(**names))
+
+
+def get_auth_version(user_id: str, create: bool = False) -> int | None:
+    """
+    Get the current auth version of the given user id claim.
+
+    Return None if there is no counter in the cache, or create one if
+    ``create`` is true.
+    """
+    cache = get_token_state_cache(str(user_id))
+    names = {"prefix": get_cache_key_prefix(), "user_id": user_id}
+    version_key = _auth_version_cache_key_template.format(**names)
+    if create:
+        cache.add(version_key, _get_initial_version(), timeout=None)
+    return cache.get(version_key)
+
+
+def get_auth_version_cache_key(user_id: str) -> str:
+    """
+    Get the cache key of the auth version of the given user id claim.
+
+    The key is stored to ``get_token_state_cache(user_id)``.
+    """
+    return _auth_version_cache_key_template.format(
+        prefix=get_cache_key_prefix(), user_id=user_id
+    )
+
+
+def _get_initial_version() -> int:
+    return secrets.randbelow(2**31) + 1
+
+
+def invalidate_cached_user(user: AbstractBaseUser) -> None:
+    """
+    Invalidate the cached user, if the auth versions are used.
+    """
+    if not _is_auth_version_used():
+        return
+    _bump_auth_version_of_change(get_user_id_claim(user), user._state.db)
+
+
+def _bump_auth_version_of_change(user_id: str, using: str | None) -> None:
+    bump_auth_version(user_id)
+    if transaction.get_connection(using).in_atomic_block:
+        # Requests before the commit still see the old row, so drop
+        # the users which they cache at the bumped version
+        transaction.on_commit(lambda: bump_auth_version(user_id), using)
+
+
+def _is_auth_version_used() -> bool:
+    return (
+        api_settings.USER_CACHE_TIMEOUT is not None
+        or api_settings.TRUSTED_DEVICE_TOKEN_EXPIRATION_TIME is not None
+    )
+
+
+def get_user_id_claim(user: AbstractBaseUser) -> str:
+    return str(getattr(user, _get_user_id_field()))
+
+
+def _get_user_id_field() -> str:
+    # Imported here, since the settings module of simplejwt imports
+    # django.test, which would slow down the import of the models
+    from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+    return jwt_settings.USER_ID_FIELD
+
+
+def connect_signals() -> None:
+    from .models import UserTwoFactorAuthData
+
+    user_model = get_user_model()
+    post_save.connect(_user_saved, sender=user_model)
+    post_delete.connect(_user_deleted, sender=user_model)
+    post_save.connect(_2fa_data_changed, sender=UserTwoFactorAuthData)
+    post_delete.connect(_2fa_data_changed, sender=UserTwoFactorAuthData)
+
+
+def _user_saved(
+    instance: AbstractBaseUser,
+    using: str,
+    update_fields: frozenset[str] | None = None,
+    **kwargs: object,
+) -> None:
+    if not _is_auth_version_used():
+        return
+    if update_fields is not None and update_fields <= {"last_login"}:
+        return  # Saved like this on every login, no need to invalidate
+    _bump_auth_version_of_change(get_user_id_claim(instance), using)
+
+
+def _user_deleted(instance: AbstractBaseUser, **kwargs: object) -> None:
+    invalidate_cached_user(instance)
+
+
+def _2fa_data_changed(
+    instance: "UserTwoFactorAuthData", using: str, **kwargs: object
+) -> None:
+    if not _is_auth_version_used():
+        return
+    if _get_user_id_field() in {"id", "pk"}:
+        user_id = str(instance.user_id)  # Avoid loading the user
+    else:
+        user_id = get_user_id_claim(instance.user)
+    _bump_auth_version_of_change(user_id, using)
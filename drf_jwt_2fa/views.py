@@ -1,35 +1,139 @@
-from rest_framework import status
-from rest_framework.permissions import IsAuthenticated
+import ipaddress
+from typing import cast
+
+from django.http import HttpResponse
+from django.utils.translation import gettext as _
+from rest_framework import exceptions, status
+from rest_framework.exceptions import NotFound
+from rest_framework.permissions import (
+    AllowAny,
+    IsAdminUser,
+    IsAuthenticated,
+)
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt import views as jwt_views
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken, Token
 
-from . import serializers, totp_serializers
-from .authentication import Jwt2faAuthentication
-from .enrollment_token import EnrollmentTokenAuthentication
+from . import (
+    recovery_code_serializers,
+    serializers,
+    totp_serializers,
+    trusted_device_serializers,
+    trusted_devices,
+)
+from .authentication import (
+    EnrollmentOrJwt2faAuthentication,
+    Jwt2faAuthentication,
+)
+from .caching import CacheLockTimeoutError
+from .delivery import get_delivery_status
+from .exceptions import TokenRevocationNotEnabledError, TokenStateBusyError
+from .metrics import AUTH_ERRORS, THROTTLED_REQUESTS, render_metrics
+from .models import RecoveryCode, TwoFactorAuthMethod
+from .profiling import ProfilingMixin
+from .revocation import get_revocation_list, is_token_revoked, revoke_token
 from .serializers_2fa_method import Set2faMethodSerializer
+from .settings import api_settings
+from .stats import get_2fa_stats
 from .throttling import AuthTokenThrottler, CodeTokenThrottler
 
 
-class ObtainCodeToken(jwt_views.TokenObtainPairView):
+class _CountErrorsMixin:
+    """
+    Count the rejected requests of a view to the metrics.
+    """
+
+    def handle_exception(self, exc):
+        if type(exc) is exceptions.Throttled:  # Not e.g. too many tokens
+            throttles = ",".join(x.__name__ for x in self.throttle_classes)
+            THROTTLED_REQUESTS.inc(throttle=throttles)
+        elif isinstance(exc, exceptions.APIException):
+            AUTH_ERRORS.inc(error=exc.default_code)
+        return super().handle_exception(exc)
+
+
+class ObtainCodeToken(
+    _CountErrorsMixin, ProfilingMixin, jwt_views.TokenObtainPairView
+):
     serializer_class = serializers.CodeTokenSerializer
     throttle_classes = (CodeTokenThrottler,)
 
+    def get_profiled_2fa_method(self, request, response):
+        data = getattr(response, "data", None) or {}
+        if "token" in data:
+            return _get_code_token_type(data["token"])
+        return super().get_profiled_2fa_method(request, response)
+
+    def post(self, request, *args, **kwargs):
+        response = super().post(request, *args, **kwargs)
+        if "delivery_id" in response.data:
+            # The code is still being delivered, see ASYNC_CODE_SENDING
+            response.status_code = status.HTTP_202_ACCEPTED
+        return response
+
 
-class ObtainAuthToken(jwt_views.TokenObtainPairView):
+class ObtainAuthToken(
+    _CountErrorsMixin, ProfilingMixin, jwt_views.TokenObtainPairView
+):
     serializer_class = serializers.AuthTokenSerializer
     throttle_classes = (AuthTokenThrottler,)
 
+    def get_profiled_2fa_method(self, request, response):
+        code_token = request.data.get("code_token")
+        if isinstance(code_token, str):
+            return _get_code_token_type(code_token)
+        return super().get_profiled_2fa_method(request, response)
+
+
+def _get_code_token_type(code_token: str) -> str:
+    token_manager = serializers.Jwt2faSerializer.token_manager_class()
+    try:
+        payload = token_manager.decode_token(code_token)
+    except exceptions.APIException:
+        return ProfilingMixin.profiled_2fa_method
+    return payload.get("typ", TwoFactorAuthMethod.CODE_SENDER)
+
 
 class RefreshAuthToken(jwt_views.TokenRefreshView):
-    pass
+    """
+    Refresh the auth token.
+
+    Works like ``TokenRefreshView`` of Simple JWT, but rejects the
+    refresh tokens revoked with ``POST /revoke/``, when the revocation
+    is enabled.
+    """
+
+    def post(self, request, *args, **kwargs):
+        if get_revocation_list() is not None:
+            self._check_not_revoked(request.data.get("refresh"))
+        return super().post(request, *args, **kwargs)
+
+    def _check_not_revoked(self, raw_token: object) -> None:
+        if not isinstance(raw_token, str):
+            return  # Rejected by the serializer
+        try:
+            token = RefreshToken(raw_token)  # type: ignore[arg-type]
+        except TokenError:
+            return  # Rejected by the serializer
+        if is_token_revoked(token):
+            raise InvalidToken(_("Token has been revoked"))
 
 
 class VerifyAuthToken(jwt_views.TokenVerifyView):
-    pass
+    """
+    Verify a token.
+
+    Works like ``TokenVerifyView`` of Simple JWT, but rejects the tokens
+    revoked with ``POST /revoke/``, when the revocation is enabled.
+    """
 
+    serializer_class = serializers.TokenVerifySerializer
 
-class SetupTotpView(APIView):
+
+class SetupTotpView(ProfilingMixin, APIView):
     """
     Start TOTP enrollment for the authenticated user.
 
@@ -45,11 +149,9 @@ class SetupTotpView(APIView):
     first code shown by the authenticator app to activate TOTP.
     """
 
-    authentication_classes = (
-        EnrollmentTokenAuthentication,
-        Jwt2faAuthentication,
-    )
+    authentication_classes = (EnrollmentOrJwt2faAuthentication,)
     permission_classes = (IsAuthenticated,)
+    profiled_2fa_method = TwoFactorAuthMethod.TOTP
 
     def post(self, request, *args, **kwargs):
         serializer = totp_serializers.SetupTotpSerializer(
@@ -59,7 +161,7 @@ class SetupTotpView(APIView):
         return Response(serializer.save(), status=status.HTTP_200_OK)
 
 
-class ConfirmTotpView(APIView):
+class ConfirmTotpView(ProfilingMixin, APIView):
     """
     Confirm TOTP enrollment for the authenticated user.
 
@@ -73,11 +175,9 @@ class ConfirmTotpView(APIView):
     2FA method is not yet in ``TRUSTED_2FA_METHODS``.
     """
 
-    authentication_classes = (
-        EnrollmentTokenAuthentication,
-        Jwt2faAuthentication,
-    )
+    authentication_classes = (EnrollmentOrJwt2faAuthentication,)
     permission_classes = (IsAuthenticated,)
+    profiled_2fa_method = TwoFactorAuthMethod.TOTP
 
     def post(self, request, *args, **kwargs):
         serializer = totp_serializers.ConfirmTotpSerializer(
@@ -117,10 +217,211 @@ class Set2faMethodView(APIView):
         return Response({}, status=status.HTTP_200_OK)
 
 
+class RecoveryCodesView(APIView):
+    """
+    Generate recovery codes or count the unused ones.
+
+    ``POST`` generates a new batch of one-time recovery codes, which
+    replace the earlier codes of the user, and returns them in the
+    ``codes`` key.  A recovery code can be entered in place of the
+    verification code in ``POST /auth/``.
+
+    ``GET`` returns the number of unused recovery codes in the
+    ``unused`` key.
+
+    Requires a valid JWT access token (``Authorization: Bearer <token>``).
+    """
+
+    authentication_classes = (Jwt2faAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, *args, **kwargs):
+        unused = RecoveryCode.count_unused_codes_of_user(request.user)
+        return Response({"unused": unused}, status=status.HTTP_200_OK)
+
+    def post(self, request, *args, **kwargs):
+        serializer = recovery_code_serializers.GenerateRecoveryCodesSerializer(
+            data={}, context={"request": request}
+        )
+        serializer.is_valid(raise_exception=True)
+        return Response(serializer.save(), status=status.HTTP_200_OK)
+
+
+class RevokeTrustedDeviceView(APIView):
+    """
+    Revoke a trusted device token.
+
+    Accepts the ``device_token`` returned by ``POST /auth/`` with
+    ``remember_device``.  The token is not accepted by
+    ``POST /get-code/`` anymore.  Possession of the token is enough, so
+    that a device can forget itself without a valid access token.
+    """
+
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+
+    def post(self, request, *args, **kwargs):
+        serializer = trusted_device_serializers.RevokeTrustedDeviceSerializer(
+            data=request.data, context={"request": request}
+        )
+        serializer.is_valid(raise_exception=True)
+        return Response(serializer.save(), status=status.HTTP_200_OK)
+
+
+class ForgetTrustedDevicesView(APIView):
+    """
+    Revoke all trusted device tokens of the authenticated user.
+
+    Requires a valid JWT access token (``Authorization: Bearer <token>``).
+    """
+
+    authentication_classes = (Jwt2faAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, *args, **kwargs):
+        trusted_devices.forget_trusted_devices(request.user)
+        return Response({}, status=status.HTTP_200_OK)
+
+
+class CodeDeliveryStatusView(APIView):
+    """
+    Return the delivery status of a verification code.
+
+    The code is identified by the ``delivery_id`` returned by
+    ``POST /get-code/`` when ``ASYNC_CODE_SENDING`` is enabled.  The
+    ``status`` is one of ``"queued"``, ``"sent"``, ``"failed"``,
+    ``"timed-out"`` and ``"expired"``.  Returns ``HTTP 404`` for an
+    unknown or expired id.
+
+    The ids are unguessable, so no authentication is needed.
+    """
+
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+
+    def get(self, request, jti, *args, **kwargs):
+        delivery_status = get_delivery_status(jti)
+        if delivery_status is None:
+            raise NotFound()
+        return Response({"status": delivery_status}, status=status.HTTP_200_OK)
+
+
+class TwoFactorStatsView(APIView):
+    """
+    Return the number of users per 2FA method.
+
+    The counts are computed with a single aggregate query and cached for
+    ``STATS_CACHE_TIMEOUT``, so the endpoint is cheap enough to be
+    polled by monitoring.
+
+    Requires a valid JWT access token of a staff user.
+    """
+
+    authentication_classes = (Jwt2faAuthentication,)
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request, *args, **kwargs):
+        return Response(get_2fa_stats(), status=status.HTTP_200_OK)
+
+
+class MetricsView(APIView):
+    """
+    Return the metrics in the Prometheus text exposition format.
+
+    Returns ``HTTP 404`` unless ``METRICS_ENABLED`` is set, and
+    ``HTTP 403`` for the clients outside of
+    ``METRICS_ALLOWED_NETWORKS``.
+    """
+
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+
+    def get(self, request, *args, **kwargs):
+        if not api_settings.METRICS_ENABLED:
+            raise NotFound()
+        if not _is_in_allowed_networks(request.META.get("REMOTE_ADDR")):
+            raise exceptions.PermissionDenied()
+        return HttpResponse(
+            render_metrics(),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
+
+
+def _is_in_allowed_networks(address: str | None) -> bool:
+    try:
+        ip = ipaddress.ip_address(address or "")
+    except ValueError:
+        return False
+    return any(
+        ip in ipaddress.ip_network(x)
+        for x in api_settings.METRICS_ALLOWED_NETWORKS
+    )
+
+
+class RevokeTokenView(APIView):
+    """
+    Revoke the token used for authenticating the request.
+
+    Can be used for logging out.  The refresh token of the same user
+    can be given in the ``refresh`` field, and is then revoked too, so
+    that it cannot be used for getting new access tokens.  The tokens
+    are rejected by this process immediately and by the other processes
+    within ``REVOCATION_REFRESH_INTERVAL``.  Requires that the
+    revocation is enabled with the ``REVOCATION_FILTER_CAPACITY``
+    setting.
+
+    Requires a valid JWT access token (``Authorization: Bearer <token>``).
+    """
+
+    authentication_classes = (Jwt2faAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, *args, **kwargs):
+        if get_revocation_list() is None:
+            raise TokenRevocationNotEnabledError()
+        access_token = cast(Token, request.auth)  # Of Jwt2faAuthentication
+        tokens = [access_token]
+        raw_refresh_token = request.data.get("refresh")
+        if raw_refresh_token is not None:
+            refresh_token = self._get_refresh_token(
+                raw_refresh_token, access_token
+            )
+            tokens.insert(0, refresh_token)
+        try:
+            for token in tokens:
+                revoke_token(token)
+        except CacheLockTimeoutError:
+            raise TokenStateBusyError() from None
+        return Response({}, status=status.HTTP_200_OK)
+
+    def _get_refresh_token(
+        self, raw_token: object, access_token: Token
+    ) -> RefreshToken:
+        try:
+            token = RefreshToken(raw_token)  # type: ignore[arg-type]
+        except TokenError as error:
+            raise exceptions.ValidationError({
+                "refresh": [error.args[0]]
+            }) from None
+        user_id_claim = jwt_settings.USER_ID_CLAIM
+        if token.get(user_id_claim) != access_token.get(user_id_claim):
+            raise exceptions.ValidationError({
+                "refresh": [_("Token belongs to another user")]
+            })
+        return token
+
+
 obtain_code_token = ObtainCodeToken.as_view()
 obtain_auth_token = ObtainAuthToken.as_view()
+code_delivery_status = CodeDeliveryStatusView.as_view()
 refresh_auth_token = RefreshAuthToken.as_view()
 verify_auth_token = VerifyAuthToken.as_view()
 setup_totp = SetupTotpView.as_view()
 confirm_totp = ConfirmTotpView.as_view()
 set_2fa_method = Set2faMethodView.as_view()
+recovery_codes = RecoveryCodesView.as_view()
+revoke_trusted_device = RevokeTrustedDeviceView.as_view()
+forget_trusted_devices = ForgetTrustedDevicesView.as_view()
+two_factor_stats = TwoFactorStatsView.as_view()
+revoke_auth_token = RevokeTokenView.as_view()
+metrics = MetricsView.as_view()
@@ -0,0 +1,85 @@
+"""
+Warm-up of the 2FA flow at process start.
+
+The first 2FA request of a process pays for one-time work: loading the
+settings (which derives the keys, imports the configured callables and
+checks the types), importing the views and their dependencies, loading
+the password hashers, setting up the JWT algorithms and the Fernet
+instances, and importing pyotp.  :func:`warm_up` does that work in
+advance.
+
+When the ``WARM_UP_ON_READY`` setting is set, :func:`warm_up` is called
+from the ``ready()`` method of the app config.  With a pre-forking
+server which loads the application before forking the workers, e.g.
+Gunicorn with ``preload_app``, the work is then done once in the master
+process and shared by the workers.  Otherwise it is done by each worker
+before it serves its first request.
+
+Only work that survives a fork is done: e.g. the cache connections are
+per-thread and are still opened on the first request.
+"""
+
+import datetime
+import logging
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import get_hashers
+
+from .settings import api_settings
+
+LOG = logging.getLogger(__name__)
+
+
+def warm_up() -> None:
+    """
+    Do the one-time work of the first 2FA request of the process.
+
+    Errors are not caught, so that e.g. invalid settings are noticed
+    when the process starts instead of on the first login.
+    """
+    started = time.perf_counter()
+    api_settings.CODE_LENGTH  # noqa: B018 - Loads all the settings
+    from . import views  # noqa: F401
+
+    get_hashers()
+    _warm_up_jwt()
+    _warm_up_totp()
+    duration = time.perf_counter() - started
+    LOG.info("2FA warm-up done in %.1f ms", duration * 1000)
+
+
+def is_warm_up_on_ready_enabled() -> bool:
+    # Read directly from the Django settings, since loading the 2FA
+    # settings is part of the warm-up
+    user_settings: dict = getattr(settings, "JWT2FA_AUTH", None) or {}
+    return bool(user_settings.get("WARM_UP_ON_READY", False))
+
+
+def _warm_up_jwt() -> None:
+    from rest_framework_simplejwt.state import token_backend
+
+    from .serializers import Jwt2faSerializer
+
+    manager = Jwt2faSerializer.token_manager_class()
+    now = int(time.time())
+    payload = {"jti": "", "uid": "", "iat": now, "exp": now + 60}
+    manager.decode_token(manager.encode_token(payload))  # type: ignore
+    # Simple JWT annotates the encoded token as a Token
+    token_backend.decode(token_backend.encode({}))  # type: ignore[arg-type]
+
+
+def _warm_up_totp() -> None:
+    from .totp import generate_totp_secret, verify_totp_code
+    from .totp_encryption import (
+        decrypt_totp_secret,
+        encrypt_totp_secret,
+        open_totp_enrollment_ticket,
+        seal_totp_enrollment_ticket,
+    )
+
+    secret = generate_totp_secret()
+    decrypt_totp_secret(encrypt_totp_secret(secret))
+    ticket = seal_totp_enrollment_ticket(secret, "")
+    open_totp_enrollment_ticket(ticket, "", datetime.timedelta(minutes=1))
+    verify_totp_code(secret, "")